@@ -4,3 +4,6 @@ apart since they're in different regions.
 """
 
 from .main import BaseStack
+from .start_router import StartRouterStack
+from .shared_lambdas import SharedLambda
+from .host_group import HostGroup
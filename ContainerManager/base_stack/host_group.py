@@ -0,0 +1,292 @@
+"""
+This module contains the HostGroup construct.
+
+One instance, shared by every leaf that names the group in it's 'HostGroup'
+config. Each member still has it's own service, Watchdog, and DNS record.
+"""
+
+from constructs import Construct
+from aws_cdk import (
+    Stack,
+    Tags,
+    Duration,
+    aws_ec2 as ec2,
+    aws_ecs as ecs,
+    aws_iam as iam,
+    aws_sns as sns,
+    aws_ssm as ssm,
+    aws_autoscaling as autoscaling,
+    aws_cloudwatch as cloudwatch,
+    aws_cloudwatch_actions as cloudwatch_actions,
+)
+
+from cdk_nag import NagSuppressions
+
+from ContainerManager.utils.instance_user_data import boot_service_commands, ecs_optimized_image, ECS_AGENT_CONFIG_COMMANDS
+from .shared_lambdas import SharedLambda
+
+class HostGroup(Construct):
+    """
+    The cluster and ASG every member runs on. The first member someone connects to
+    spins it up (starting every member's task with it), and it only spins back down
+    once EVERY member has been empty for 'MinutesWithoutConnections'.
+    """
+    def __init__(
+        self,
+        scope: Construct,
+        group_name: str,
+        application_id: str,
+        group_config: dict,
+        vpc: ec2.Vpc,
+        ssh_key_pair: ec2.KeyPair,
+        sns_notify_topic: sns.Topic,
+        shared_break_crash_loop: SharedLambda | None,
+        **kwargs,
+    ) -> None:
+        super().__init__(scope, f"HostGroup{group_name}", **kwargs)
+        stack = Stack.of(self)
+        self.group_name = group_name
+        self.instance_type = group_config["InstanceType"]
+
+        ## Each member saves what the instance needs to run it here, under it's container id:
+        #   (See 'instance_scripts/host_group.sh')
+        self.member_parameter_prefix = f"/{application_id}/HostGroups/{group_name}"
+        ## The members' StartSystem lambdas put their DNS hits here, and the instance the
+        # total connections. Any member being asked for keeps the instance up:
+        self.metric_namespace = f"{application_id}-HostGroups"
+        self.metric_dimension_map = {"HostGroup": group_name}
+
+        ## Every member adds it's ports to this:
+        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_ec2.SecurityGroup.html
+        self.sg_ec2_instance_traffic = ec2.SecurityGroup(
+            self,
+            "SgEc2InstanceTraffic",
+            vpc=vpc,
+            description=f"(HostGroup {group_name}): Traffic for the EC2 Instance",
+            allow_all_outbound=True,
+        )
+        Tags.of(self.sg_ec2_instance_traffic).add("Name", f"{stack.stack_name}/{group_name}/sg-ec2-instance-traffic")
+        self.sg_ec2_instance_traffic.connections.allow_from(
+            ec2.Peer.any_ipv4(),
+            ec2.Port.SSH,
+            description="Allow SSH traffic IN",
+        )
+
+        ## Every member's service runs in this one cluster:
+        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_ecs.Cluster.html
+        self.ecs_cluster = ecs.Cluster(
+            self,
+            "EcsCluster",
+            cluster_name=f"{application_id}-{group_name}-ecs-cluster",
+            vpc=vpc,
+        )
+
+        ## Permissions for the host. Each member adds it's own EFS and metric permissions to it:
+        self.ec2_role = iam.Role(
+            self,
+            "Ec2ExecutionRole",
+            assumed_by=iam.ServicePrincipal("ec2.amazonaws.com"),
+            description=f"The instance's permissions (HOST of every container in {group_name})",
+        )
+        self.ec2_role.add_managed_policy(iam.ManagedPolicy.from_aws_managed_policy_name("service-role/AmazonEC2ContainerServiceforEC2Role"))
+        self.ec2_role.add_to_policy(iam.PolicyStatement(
+            effect=iam.Effect.ALLOW,
+            actions=["ssm:GetParametersByPath"],
+            resources=[stack.format_arn(
+                service="ssm",
+                resource="parameter",
+                # The prefix already starts with a '/':
+                resource_name=self.member_parameter_prefix.lstrip("/"),
+            )],
+        ))
+        self.ec2_role.add_to_policy(iam.PolicyStatement(
+            effect=iam.Effect.ALLOW,
+            actions=["cloudwatch:PutMetricData"],
+            resources=["*"],
+            conditions={"StringEquals": {"cloudwatch:namespace": self.metric_namespace}},
+        ))
+
+        ## Only what every member can share. (No BakedAmi, WarmPool, LocalCopy, etc):
+        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_ec2.UserData.html
+        self.ec2_user_data = ec2.UserData.for_linux()
+        self.ec2_user_data.add_commands(*ECS_AGENT_CONFIG_COMMANDS)
+        self.ec2_user_data.add_commands(*boot_service_commands(
+            name="host-group",
+            description="Mount every member's EFS volumes, and count each member's connections",
+            script_path="./ContainerManager/leaf_stack_group/instance_scripts/host_group.sh",
+            environment={
+                "NAMESPACE": self.metric_namespace,
+                "HOST_GROUP": group_name,
+                "AWS_REGION": stack.region,
+                "MEMBER_PARAMETER_PREFIX": self.member_parameter_prefix,
+            },
+            # No member's task can start until it's EFS is mounted:
+            ecs_waits_for_ready=True,
+        ))
+
+        root_volume_config = group_config["RootVolume"]
+        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_ec2.LaunchTemplate.html
+        asg_launch_template = ec2.LaunchTemplate(
+            self,
+            "AsgLaunchTemplate",
+            instance_type=ec2.InstanceType(group_config["InstanceType"]),
+            machine_image=ecs_optimized_image(group_config),
+            security_group=self.sg_ec2_instance_traffic,
+            user_data=self.ec2_user_data,
+            role=self.ec2_role,
+            key_pair=ssh_key_pair,
+            http_tokens=ec2.LaunchTemplateHttpTokens.REQUIRED,
+            require_imdsv2=True,
+            detailed_monitoring=True,
+            block_devices=[
+                ec2.BlockDevice(
+                    device_name="/dev/xvda",
+                    volume=ec2.BlockDeviceVolume.ebs(
+                        root_volume_config["SizeGiB"],
+                        encrypted=True,
+                        volume_type=root_volume_config["Type"],
+                        iops=root_volume_config["Iops"],
+                        throughput=root_volume_config["ThroughputMiBps"],
+                    ),
+                ),
+            ],
+        )
+
+        ## Same as a leaf's, 0 or 1 instances:
+        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_autoscaling.AutoScalingGroup.html
+        self.auto_scaling_group = autoscaling.AutoScalingGroup(
+            self,
+            "Asg",
+            vpc=vpc,
+            launch_template=asg_launch_template,
+            min_capacity=0,
+            max_capacity=1,
+            new_instances_protected_from_scale_in=False,
+            notifications=[
+                autoscaling.NotificationConfiguration(topic=sns_notify_topic, scaling_events=autoscaling.ScalingEvents.ERRORS),
+            ],
+        )
+
+        ## Ties the ASG to the cluster. (Same settings as the leaf's, see EcsAsg):
+        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_ecs.AsgCapacityProvider.html
+        self.capacity_provider = ecs.AsgCapacityProvider(
+            self,
+            "AsgCapacityProvider",
+            auto_scaling_group=self.auto_scaling_group,
+            enable_managed_termination_protection=False,
+            enable_managed_draining=True,
+            enable_managed_scaling=False,
+        )
+        self.ecs_cluster.add_asg_capacity_provider(self.capacity_provider)
+
+        ##########################
+        ## Group Watchdog Logic ##
+        ##########################
+        ## Each member's Watchdog only watches it's own container. This one spins the
+        # instance down, once nobody is connected to (or asking for) any of them:
+        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_autoscaling.StepScalingAction.html
+        self.scale_down_asg_action = autoscaling.StepScalingAction(self,
+            "ScaleDownAsgAction",
+            auto_scaling_group=self.auto_scaling_group,
+            adjustment_type=autoscaling.AdjustmentType.EXACT_CAPACITY,
+        )
+        # (Same bug as the leaf's Watchdog, it needs both bounds):
+        self.scale_down_asg_action.add_adjustment(adjustment=0, upper_bound=0)
+        self.scale_down_asg_action.add_adjustment(adjustment=0, lower_bound=0)
+
+        ## The members' StartSystem lambdas put their DNS hits here. (See the member's Watchdog):
+        self.traffic_dns_metric = cloudwatch.Metric(
+            label="DNS Traffic",
+            metric_name="DNSTraffic",
+            namespace=self.metric_namespace,
+            dimensions_map=self.metric_dimension_map,
+            period=Duration.minutes(1),
+            statistic="Maximum",
+            unit=cloudwatch.Unit.COUNT,
+        )
+        ## Every member's connections added together, by the instance:
+        self.connections_metric = cloudwatch.Metric(
+            label="Active Connections",
+            metric_name="ActiveConnections",
+            namespace=self.metric_namespace,
+            dimensions_map=self.metric_dimension_map,
+            period=Duration.minutes(1),
+            statistic="Maximum",
+            unit=cloudwatch.Unit.COUNT,
+        )
+        self.watchdog_traffic_metric = cloudwatch.MathExpression(
+            label="Watchdog Group Connections",
+            # Same as a leaf's 'Connections' Mode:
+            expression="connections + FILL(dns_hit, 0)",
+            using_metrics={
+                "connections": self.connections_metric,
+                "dns_hit": self.traffic_dns_metric,
+            },
+            period=Duration.minutes(1),
+        )
+        self.alarm_group_activity = self.watchdog_traffic_metric.create_alarm(
+            self,
+            "AlarmGroupActivity",
+            alarm_name=f"Group Activity - [{stack.stack_name}/{group_name}]",
+            alarm_description="Trigger if 0 people are connected to any member for too long",
+            evaluation_periods=int(group_config["MinutesWithoutConnections"].to_minutes()),
+            threshold=0,
+            comparison_operator=cloudwatch.ComparisonOperator.LESS_THAN_OR_EQUAL_TO_THRESHOLD,
+            treat_missing_data=cloudwatch.TreatMissingData.MISSING,
+        )
+        self.alarm_group_activity.add_alarm_action(
+            cloudwatch_actions.AutoScalingAction(self.scale_down_asg_action)
+        )
+
+        ## The shared BreakCrashLoop looks leaves up by cluster, and every member has the same
+        # one. Save it here once, instead of each member fighting over it:
+        if shared_break_crash_loop is not None:
+            # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_ssm.StringParameter.html
+            ssm.StringParameter(
+                self,
+                "SharedBreakCrashLoopParameter",
+                # The name isn't known until deploy, and starts with a '/':
+                simple_name=False,
+                parameter_name=f"{shared_break_crash_loop.leaf_parameter_prefix}/{self.ecs_cluster.cluster_name}",
+                description=f"Which ASG the shared BreakCrashLoop lambda spins down for HostGroup '{group_name}'.",
+                string_value=stack.to_json_string({
+                    "ASG_NAME": self.auto_scaling_group.auto_scaling_group_name,
+                }),
+            )
+
+        ## So deploying the base stack alone doesn't try to delete exports
+        # the members are still using:
+        stack.export_value(self.auto_scaling_group.auto_scaling_group_name)
+        stack.export_value(self.ecs_cluster.cluster_name)
+        stack.export_value(self.ecs_cluster.cluster_arn)
+        stack.export_value(self.sg_ec2_instance_traffic.security_group_id)
+        stack.export_value(self.ec2_role.role_arn)
+
+        #####################
+        ### cdk_nag stuff ###
+        #####################
+        NagSuppressions.add_resource_suppressions(
+            self,
+            [
+                # Instance Role Permissions:
+                {
+                    "id": "AwsSolutions-IAM5",
+                    "reason": "\n".join([
+                        "The cluster gives the instance role the ECS agent's 'ecs:Submit*' permissions. The only",
+                        "other '*' is 'cloudwatch:PutMetricData', since metrics don't have ARN's. It's locked down by namespace.",
+                    ]),
+                    "appliesTo": ["Action::ecs:Submit*", "Resource::*"],
+                },
+                # ASG Notifications:
+                {
+                    "id": "AwsSolutions-AS3",
+                    "reason": "Same as a leaf's ASG, the group's sns topic only gets the errors. That's all we care about.",
+                },
+            ],
+            apply_to_children=True,
+        )
+
+    @staticmethod
+    def efs_root_host(container_id: str) -> str:
+        """ Where a member's EFS's are mounted on the group's instance, so they don't collide. """
+        return f"/mnt/efs/{container_id}"
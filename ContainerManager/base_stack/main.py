@@ -8,16 +8,24 @@ from aws_cdk import (
     Stack,
     Tags,
     CfnOutput,
+    Duration,
     aws_ec2 as ec2,
     aws_sns as sns,
     aws_iam as iam,
     aws_route53 as route53,
+    aws_sqs as sqs,
+    aws_events as events,
+    aws_events_targets as events_targets,
+    aws_lambda_event_sources as lambda_event_sources,
 )
 
 from cdk_nag import NagSuppressions
 
 # from .utils.get_param import get_param
 from ContainerManager.utils.sns_subscriptions import add_sns_subscriptions
+from ContainerManager.utils.ecr_pull_through_cache import add_pull_through_cache_rules
+from .shared_lambdas import SharedLambda
+from .host_group import HostGroup
 
 class BaseStack(Stack):
     """
@@ -55,6 +63,15 @@ class BaseStack(Stack):
             restrict_default_security_group=True,
         )
 
+        ## Gateway Endpoints are free. ECR serves image layers out of S3, so this keeps
+        # pulls on the AWS network instead of going out the Internet Gateway:
+        # https://docs.aws.amazon.com/AmazonECR/latest/userguide/vpc-endpoints.html#ecr-setting-up-s3-gateway
+        if config["Vpc"]["S3GatewayEndpoint"]:
+            self.vpc.add_gateway_endpoint(
+                "S3GatewayEndpoint",
+                service=ec2.GatewayVpcEndpointAwsService.S3,
+            )
+
         ## For enabling SSH access:
         # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_ec2.KeyPair.html
         self.ssh_key_pair = ec2.KeyPair(
@@ -100,6 +117,14 @@ class BaseStack(Stack):
         )
         add_sns_subscriptions(self, self.sns_notify_topic, config["AlertSubscription"])
 
+        #################
+        ### ECR STUFF ###
+        #################
+        ## Cache images in-region, so every leaf stack's pull is fast and isn't rate-limited.
+        # Leaf stacks point their image at the cache if it's registry is in here:
+        # https://docs.aws.amazon.com/AmazonECR/latest/userguide/pull-through-cache.html
+        self.cached_registries = add_pull_through_cache_rules(self, config["PullThroughCache"])
+
         #####################
         ### Route53 STUFF ###
         #####################
@@ -115,6 +140,132 @@ class BaseStack(Stack):
             zone_name=self.domain_name,
         )
 
+        ###########################
+        ### Shared Lambda STUFF ###
+        ###########################
+        # Each leaf points it's rules at these, instead of deploying it's own. (The
+        # StartSystem one is in us-east-1, so it's it's own stack. See app.py)
+
+        ## Keeps every leaf's DNS record in sync with it's instance:
+        self.shared_asg_state_change_hook = None
+        if config["SharedLambdas"]["AsgStateChangeHook"]:
+            self.shared_asg_state_change_hook = SharedLambda(
+                self,
+                "AsgStateChangeHook",
+                application_id=application_id_tag_value,
+                lambda_directory="instance_StateChange_hook",
+                description="Triggered by any leaf's ec2 state changes. Updates that leaf's DNS.",
+            )
+            self.shared_asg_state_change_hook.role.add_to_policy(
+                iam.PolicyStatement(
+                    # NOTE: these are on the list of actions that CANNOT be locked down
+                    #   in ANY way. You *must* use a wild card, and conditions *don't* work
+                    effect=iam.Effect.ALLOW,
+                    actions=[
+                        # To get the IP of a new instance:
+                        "ec2:DescribeInstances",
+                        # To make sure no other instances are starting up:
+                        "autoscaling:DescribeAutoScalingGroups",
+                        # To find which leaf a EC2 state-change event is for:
+                        "autoscaling:DescribeAutoScalingInstances",
+                    ],
+                    resources=["*"],
+                )
+            )
+            ## Each leaf is under it's ASG. (A HostGroup's ASG has every member under it):
+            self.shared_asg_state_change_hook.role.add_to_policy(
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=["ssm:GetParametersByPath"],
+                    resources=[self.format_arn(
+                        service="ssm",
+                        resource="parameter",
+                        resource_name=f"{self.shared_asg_state_change_hook.leaf_parameter_prefix.lstrip('/')}/*",
+                    )],
+                )
+            )
+            ## The leaves' rules send their events here. The lambda gets whatever came in
+            # close together as one batch, so it's Route53 changes can go out together:
+            # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_sqs.Queue.html
+            self.asg_state_change_queue = sqs.Queue(
+                self,
+                "AsgStateChangeQueue",
+                # Has to be at least the lambda's timeout:
+                visibility_timeout=Duration.minutes(3),
+                retention_period=Duration.hours(1),
+                enforce_ssl=True,
+            )
+            # Any rule in this account. (The leaves can't add themselves, it'd make this stack depend on theirs):
+            self.asg_state_change_queue.add_to_resource_policy(
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=["sqs:SendMessage"],
+                    resources=[self.asg_state_change_queue.queue_arn],
+                    principals=[iam.ServicePrincipal("events.amazonaws.com")],
+                    conditions={"StringEquals": {"aws:SourceAccount": self.account}},
+                )
+            )
+            # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_lambda_event_sources.SqsEventSource.html
+            self.shared_asg_state_change_hook.function.add_event_source(
+                lambda_event_sources.SqsEventSource(
+                    self.asg_state_change_queue,
+                    batch_size=10,
+                    # Kept short, a player is waiting on the 'up' events:
+                    max_batching_window=Duration.seconds(2),
+                )
+            )
+            ## EC2 state-change events can't be filtered by ASG, so one rule here instead of
+            # one per leaf. The lambda skips instances that aren't a leaf's with Dns.EarlyUpdate:
+            # https://docs.aws.amazon.com/AWSEC2/latest/UserGuide/monitoring-instance-state-changes.html
+            self.rule_instance_running = events.Rule(
+                self,
+                "InstanceRunningTrigger",
+                rule_name=f"{construct_id}-rule-EC2-running",
+                description="Send every instance that's running to the shared AsgStateChangeHook, to update DNS early",
+                event_pattern=events.EventPattern(
+                    source=["aws.ec2"],
+                    detail_type=["EC2 Instance State-change Notification"],
+                    detail={"state": ["running"]},
+                ),
+                targets=[events_targets.SqsQueue(self.asg_state_change_queue)],
+            )
+            self.export_value(self.asg_state_change_queue.queue_arn)
+
+        ## Spins down any leaf whose container keeps crashing:
+        self.shared_break_crash_loop = None
+        if config["SharedLambdas"]["BreakCrashLoop"]:
+            self.shared_break_crash_loop = SharedLambda(
+                self,
+                "BreakCrashLoop",
+                application_id=application_id_tag_value,
+                lambda_directory="spin_down_asg_on_error",
+                description="Triggered if any leaf's container throws, to spin down it's ASG.",
+            )
+            # Any rule in this account can invoke it. (Same reason as the queue above):
+            self.shared_break_crash_loop.function.add_permission(
+                "EventsInvoke",
+                principal=iam.ServicePrincipal("events.amazonaws.com"),
+                source_account=self.account,
+            )
+
+        ########################
+        ### Host Group STUFF ###
+        ########################
+        ## One instance shared by every leaf in the group, instead of one each.
+        # (Each member adds it's own service to the cluster, see EcsAsg):
+        self.host_groups = {
+            group_name: HostGroup(
+                self,
+                group_name,
+                application_id=application_id_tag_value,
+                group_config=group_config,
+                vpc=self.vpc,
+                ssh_key_pair=self.ssh_key_pair,
+                sns_notify_topic=self.sns_notify_topic,
+                shared_break_crash_loop=self.shared_break_crash_loop,
+            ) for group_name, group_config in config["HostGroups"].items()
+        }
+
         ####################
         ### Output Stuff ###
         ####################
@@ -146,6 +297,25 @@ class BaseStack(Stack):
             },
         ])
 
+        if self.shared_asg_state_change_hook is not None:
+            NagSuppressions.add_resource_suppressions(
+                self.shared_asg_state_change_hook.role,
+                [
+                    {
+                        "id": "AwsSolutions-IAM5",
+                        "reason": "These actions require the wildcard resource, since they're 'Describe'.",
+                        "appliesTo": ["Resource::*"]
+                    }
+                ],
+                apply_to_children=True,
+            )
+            NagSuppressions.add_resource_suppressions(self.asg_state_change_queue, [
+                {
+                    "id": "AwsSolutions-SQS3",
+                    "reason": "The events are only useful for a few seconds. A retry later would set DNS to a stale IP.",
+                },
+            ])
+
         NagSuppressions.add_resource_suppressions(
             self.vpc,
             [
@@ -0,0 +1,96 @@
+"""
+This module contains the SharedLambda construct.
+
+The base stack's copy of a leaf lambda. Every leaf stack registers itself
+in the lookup table, instead of deploying the lambda itself.
+"""
+
+from constructs import Construct
+from aws_cdk import (
+    Stack,
+    Duration,
+    RemovalPolicy,
+    aws_iam as iam,
+    aws_logs as logs,
+    aws_lambda as aws_lambda,
+)
+
+from ContainerManager.utils.lambda_profile import lambda_code_kwargs, lambda_profile_kwargs
+from ContainerManager.utils.leaf_config_parser import leaf_lambdaProfile_defaults
+
+class SharedLambda(Construct):
+    """
+    One lambda, shared by every leaf stack. It looks up which leaf each event is
+    for in SSM, under '<leaf_parameter_prefix>/<key>'. The leaf stacks save their
+    settings there, and add their own permissions to this lambda's role.
+    """
+    def __init__(
+        self,
+        scope: Construct,
+        construct_id: str,
+        application_id: str,
+        lambda_directory: str,
+        description: str,
+        **kwargs,
+    ) -> None:
+        super().__init__(scope, construct_id, **kwargs)
+        stack = Stack.of(self)
+
+        ## Each leaf saves what the lambda needs here, under it's key:
+        self.leaf_parameter_prefix = f"/{application_id}/{construct_id}"
+
+        ## Log group for the lambda function:
+        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_logs.LogGroup.html
+        self.log_group = logs.LogGroup(
+            self,
+            "LogGroup",
+            retention=logs.RetentionDays.ONE_WEEK,
+            removal_policy=RemovalPolicy.DESTROY,
+            log_group_name=f"/aws/lambda/{application_id}-{construct_id}",
+        )
+
+        ## Role for the lambda function. Each leaf adds it's own permissions to it:
+        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_iam.Role.html
+        self.role = iam.Role(
+            self,
+            "Role",
+            assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"),
+            description=f"Role for the shared {construct_id} lambda function.",
+        )
+        self.role.add_to_policy(
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=["ssm:GetParameter"],
+                resources=[stack.format_arn(
+                    service="ssm",
+                    resource="parameter",
+                    # The prefix already starts with a '/':
+                    resource_name=f"{self.leaf_parameter_prefix.lstrip('/')}/*",
+                )],
+            )
+        )
+
+        ## Same code as the per-leaf lambda, just a different handler:
+        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_lambda.Function.html
+        self.function = aws_lambda.Function(
+            self,
+            "Function",
+            description=f"{application_id}-{construct_id}: {description}",
+            **lambda_code_kwargs(lambda_directory, handler="router_handler"),
+            runtime=aws_lambda.Runtime.PYTHON_3_12,
+            timeout=Duration.seconds(30),
+            **lambda_profile_kwargs(leaf_lambdaProfile_defaults),
+            log_group=self.log_group,
+            role=self.role,
+            environment={
+                "LEAF_PARAMETER_PREFIX": self.leaf_parameter_prefix,
+                # A new leaf is found right away. This is only how long a changed one takes:
+                "LEAF_CACHE_SECONDS": str(int(Duration.minutes(5).to_seconds())),
+            },
+        )
+        self.log_group.grant_write(self.function)
+
+        ## So deploying the base stack alone doesn't try to delete exports
+        # the leaf stacks are still using:
+        stack.export_value(self.function.function_arn)
+        stack.export_value(self.role.role_arn)
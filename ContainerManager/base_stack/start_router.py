@@ -0,0 +1,107 @@
+"""
+This module contains the StartRouterStack class.
+
+Needs to be in us-east-1, since the Route53 query logs are there (and a
+subscription filter can only invoke a lambda in the same region).
+"""
+
+from constructs import Construct
+from aws_cdk import (
+    Stack,
+    Duration,
+    RemovalPolicy,
+    aws_iam as iam,
+    aws_logs as logs,
+    aws_lambda as aws_lambda,
+)
+
+from ContainerManager.utils.lambda_profile import lambda_code_kwargs, lambda_profile_kwargs
+from ContainerManager.utils.leaf_config_parser import leaf_lambdaProfile_defaults
+
+class StartRouterStack(Stack):
+    """
+    One StartSystem lambda, shared by every leaf stack. Each leaf's subscription
+    filter points here instead of at it's own lambda, so this one stays warm.
+    """
+    def __init__(
+        self,
+        scope: Construct,
+        construct_id: str,
+        application_id: str,
+        **kwargs,
+    ) -> None:
+        super().__init__(scope, construct_id, **kwargs)
+
+        ## Each leaf saves what the router needs to start it here, under it's domain:
+        #   (See StartSystemStack, and 'router_handler' in the lambda)
+        self.leaf_parameter_prefix = f"/{application_id}/StartRouter"
+
+        ## Log group for the lambda function:
+        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_logs.LogGroup.html
+        self.log_group_start_router = logs.LogGroup(
+            self,
+            "LogGroupStartRouter",
+            retention=logs.RetentionDays.ONE_WEEK,
+            removal_policy=RemovalPolicy.DESTROY,
+            log_group_name=f"/aws/lambda/{construct_id}-lambda-start-router",
+        )
+
+        ## Role for the lambda function. Each leaf adds it's own permissions to it:
+        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_iam.Role.html
+        self.start_router_role = iam.Role(
+            self,
+            "StartRouterRole",
+            assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"),
+            description="Role for the shared StartSystem router lambda function.",
+        )
+        self.start_router_role.add_to_policy(
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=["ssm:GetParameter"],
+                resources=[self.format_arn(
+                    service="ssm",
+                    resource="parameter",
+                    # The prefix already starts with a '/':
+                    resource_name=f"{self.leaf_parameter_prefix.lstrip('/')}/*",
+                )],
+            )
+        )
+
+        ## Lambda that turns every leaf on. Same code as the per-leaf one:
+        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_lambda.Function.html
+        self.lambda_start_router = aws_lambda.Function(
+            self,
+            "StartRouter",
+            description=f"{construct_id}-lambda-start-router: Spin up the leaf's ASG when someone connects.",
+            **lambda_code_kwargs("trigger_start_system", handler="router_handler"),
+            runtime=aws_lambda.Runtime.PYTHON_3_12,
+            timeout=Duration.seconds(30),
+            **lambda_profile_kwargs(leaf_lambdaProfile_defaults),
+            log_group=self.log_group_start_router,
+            role=self.start_router_role,
+            environment={
+                "LEAF_PARAMETER_PREFIX": self.leaf_parameter_prefix,
+                # A new leaf is found right away. This is only how long a changed one takes:
+                "LEAF_CACHE_SECONDS": str(int(Duration.minutes(5).to_seconds())),
+            },
+        )
+        self.log_group_start_router.grant_write(self.lambda_start_router)
+
+        ## Every leaf's query logs can invoke it. The leaves can't add this themselves,
+        # it'd make this stack depend on theirs:
+        # https://docs.aws.amazon.com/AmazonCloudWatch/latest/logs/SubscriptionFilters.html#LambdaFunctionExample
+        self.lambda_start_router.add_permission(
+            "QueryLogsInvoke",
+            principal=iam.ServicePrincipal("logs.amazonaws.com"),
+            source_account=self.account,
+            # The DomainStack's log group, for every leaf of this application:
+            source_arn=f"arn:{self.partition}:logs:{self.region}:{self.account}:log-group:/aws/route53/{application_id}-*",
+        )
+
+        #####################
+        ### Export Values ###
+        #####################
+        ## Same as the BaseStack, so deploying this alone doesn't try to delete
+        # exports the leaf stacks are still using:
+        self.export_value(self.lambda_start_router.function_arn)
+        self.export_value(self.start_router_role.role_arn)
@@ -3,6 +3,8 @@
 This module contains the AsgStateChangeHook NestedStack class.
 """
 
+import json
+
 from aws_cdk import (
     NestedStack,
     Duration,
@@ -14,11 +16,16 @@ from aws_cdk import (
     aws_events as events,
     aws_events_targets as events_targets,
     aws_autoscaling as autoscaling,
+    aws_cloudwatch as cloudwatch,
+    aws_sqs as sqs,
+    aws_ssm as ssm,
 )
 from constructs import Construct
 from cdk_nag import NagSuppressions
 
+from ContainerManager.base_stack import SharedLambda
 from ContainerManager.leaf_stack_group.domain_stack import DomainStack
+from ContainerManager.utils.lambda_profile import lambda_code_kwargs, lambda_profile_kwargs, lambda_profile_target
 
 class AsgStateChangeHook(NestedStack):
     """
@@ -30,88 +37,171 @@ class AsgStateChangeHook(NestedStack):
         scope: Construct,
         container_id: str,
         domain_stack: DomainStack,
+        ec2_config: dict,
         auto_scaling_group: autoscaling.AutoScalingGroup,
         base_stack_sns_topic: sns.Topic,
         leaf_stack_sns_topic: sns.Topic,
+        cold_start_metric: cloudwatch.Metric,
+        cold_start_parameter_name: str,
+        lambda_profile: dict,
+        dns_config: dict,
+        shared_lambda: SharedLambda | None = None,
+        shared_queue: sqs.IQueue | None = None,
         **kwargs,
     ) -> None:
         super().__init__(scope, "AsgStateChangeHook", **kwargs)
         container_id_alpha = "".join(e for e in container_id.title() if e.isalnum())
 
 
-        ## Log group for the lambda function:
-        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_logs.LogGroup.html
-        self.log_group_asg_statechange_hook = logs.LogGroup(
-            self,
-            "LogGroupStartSystem",
-            retention=logs.RetentionDays.ONE_WEEK,
-            removal_policy=RemovalPolicy.DESTROY,
-            log_group_name=f"/aws/lambda/{container_id}-asg-state-change-hook",
-        )
+        ## Everything the lambda needs to keep this leaf's DNS in sync. Either it's own
+        # lambda's env vars, or what the base stack's shared lambda looks up by ASG name:
+        self.asg_state_change_env_vars = {
+            "HOSTED_ZONE_ID": domain_stack.sub_hosted_zone.hosted_zone_id,
+            "DOMAIN_NAME": domain_stack.sub_domain_name,
+            "UNAVAILABLE_IP": domain_stack.unavailable_ip,
+            "DNS_TTL": str(domain_stack.dns_ttl),
+            "RECORD_TYPE": domain_stack.record_type.value,
+            "ASG_NAME": auto_scaling_group.auto_scaling_group_name,
+            "EARLY_DNS_UPDATE": str(dns_config["EarlyUpdate"]).lower(),
+            ## For publishing how long it took from the first DNS query, to DNS pointing here:
+            "COLD_START_PARAMETER": cold_start_parameter_name,
+            "METRIC_NAMESPACE": cold_start_metric.namespace,
+            "METRIC_NAME": cold_start_metric.metric_name,
+            "METRIC_DIMENSIONS": json.dumps(cold_start_metric.dimensions),
+        }
+
+        ## What the lambda is allowed to do to this leaf:
+        asg_state_change_statements = [
+            ## Let it update the DNS record of the domain stack:
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=["route53:ChangeResourceRecordSets"],
+                resources=[domain_stack.sub_hosted_zone.hosted_zone_arn],
+            ),
+            ## Let it read/clear when the first DNS query came in:
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=["ssm:GetParameter", "ssm:DeleteParameter"],
+                resources=[self.format_arn(
+                    service="ssm",
+                    resource="parameter",
+                    # The name already starts with a '/':
+                    resource_name=cold_start_parameter_name.lstrip("/"),
+                )],
+            ),
+            ## And publish the cold start metric:
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=["cloudwatch:PutMetricData"],
+                resources=["*"],
+                conditions={
+                    "StringEquals": {
+                        "cloudwatch:namespace": cold_start_metric.namespace,
+                    }
+                }
+            ),
+        ]
+
+        if shared_lambda is None:
+            ## Log group for the lambda function:
+            # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_logs.LogGroup.html
+            self.log_group_asg_statechange_hook = logs.LogGroup(
+                self,
+                "LogGroupStartSystem",
+                retention=logs.RetentionDays.ONE_WEEK,
+                removal_policy=RemovalPolicy.DESTROY,
+                log_group_name=f"/aws/lambda/{container_id}-asg-state-change-hook",
+            )
+
+            ## Policy/Role for lambda function:
+            # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_iam.Role.html
+            self.asg_state_change_role = iam.Role(
+                self,
+                "AsgStateChangeHookRole",
+                assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"),
+                description="Role for the AsgStateChangeHook lambda function.",
+            )
+
+            ## Lambda function to update the DNS record:
+            # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_lambda.Function.html
+            self.lambda_asg_state_change_hook = aws_lambda.Function(
+                self,
+                "AsgStateChangeHook",
+                description=f"{container_id_alpha}-ASG-StateChange: Triggered by ec2 state changes. Updates DNS with the EC2 IP, or '{domain_stack.unavailable_ip}'.",
+                **lambda_code_kwargs("instance_StateChange_hook"),
+                runtime=aws_lambda.Runtime.PYTHON_3_12,
+                timeout=Duration.seconds(30),
+                **lambda_profile_kwargs(lambda_profile),
+                log_group=self.log_group_asg_statechange_hook,
+                role=self.asg_state_change_role,
+                environment=self.asg_state_change_env_vars,
+            )
+            # If SnapStart/ProvisionedConcurrency is on, the rules have to invoke a published version:
+            self.lambda_asg_state_change_hook_target = lambda_profile_target(self, self.lambda_asg_state_change_hook, lambda_profile)
+            self.asg_state_change_target = events_targets.LambdaFunction(self.lambda_asg_state_change_hook_target)
+            ### Lambda Permissions:
+            # Give it write to it's own log group:
+            self.log_group_asg_statechange_hook.grant_write(self.lambda_asg_state_change_hook)
+            # Give it permission to describe the stuff it needs to know about::
+            asg_state_change_statements.insert(
+                0,
+                iam.PolicyStatement(
+                    # NOTE: these are on the list of actions that CANNOT be locked down
+                    #   in ANY way. You *must* use a wild card, and conditions *don't* work 🙄
+                    effect=iam.Effect.ALLOW,
+                    actions=[
+                        # To get the IP of a new instance:
+                        "ec2:DescribeInstances",
+                        # To make sure no other instances are starting up:
+                        "autoscaling:DescribeAutoScalingGroups",
+                        # To make sure EC2 state-change events are from this ASG:
+                        "autoscaling:DescribeAutoScalingInstances",
+                    ],
+                    resources=["*"],
+                )
+            )
+        else:
+            ## Shared lambda: Save what it needs to keep this leaf in sync, under this leaf's ASG:
+            #   (Every member of a HostGroup has the same ASG, so each one is under it by container)
+            # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_ssm.StringParameter.html
+            self.shared_lambda_parameter = ssm.StringParameter(
+                self,
+                "SharedLambdaParameter",
+                # The name isn't known until deploy, and starts with a '/':
+                simple_name=False,
+                parameter_name=f"{shared_lambda.leaf_parameter_prefix}/{auto_scaling_group.auto_scaling_group_name}/{container_id}",
+                description=f"What the shared AsgStateChangeHook lambda needs to keep '{container_id}' in sync.",
+                string_value=self.to_json_string(self.asg_state_change_env_vars),
+            )
+            # The shared lambda's role, so this leaf can add it's own permissions to it:
+            self.asg_state_change_role = iam.Role.from_role_arn(
+                self,
+                "SharedAsgStateChangeHookRole",
+                role_arn=shared_lambda.role.role_arn,
+                mutable=True,
+            )
+            ## The rules go to the base stack's queue, so the lambda gets them in batches.
+            #   (The queue already lets every rule in the account send to it):
+            # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_events_targets.SqsQueue.html
+            self.asg_state_change_target = events_targets.SqsQueue(
+                sqs.Queue.from_queue_arn(self, "SharedAsgStateChangeQueue", shared_queue.queue_arn),
+            )
 
-        ## Policy/Role for lambda function:
-        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_iam.Role.html
-        self.asg_state_change_role = iam.Role(
-            self,
-            "AsgStateChangeHookRole",
-            assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"),
-            description="Role for the AsgStateChangeHook lambda function.",
-        )
         # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_iam.Policy.html
         self.asg_state_change_policy = iam.Policy(
             self,
             "AsgStateChangeHookPolicy",
             roles=[self.asg_state_change_role],
-            # Statements added at the end of this file:
-            statements=[],
+            statements=asg_state_change_statements,
         )
 
-        ## Lambda function to update the DNS record:
-        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_lambda.Function.html
-        self.lambda_asg_state_change_hook = aws_lambda.Function(
-            self,
-            "AsgStateChangeHook",
-            description=f"{container_id_alpha}-ASG-StateChange: Triggered by ec2 state changes. Updates DNS with the EC2 IP, or '{domain_stack.unavailable_ip}'.",
-            code=aws_lambda.Code.from_asset("./ContainerManager/leaf_stack_group/lambda_functions/instance_StateChange_hook/"),
-            handler="main.lambda_handler",
-            runtime=aws_lambda.Runtime.PYTHON_3_12,
-            timeout=Duration.seconds(30),
-            log_group=self.log_group_asg_statechange_hook,
-            role=self.asg_state_change_role,
-            environment={
-                "HOSTED_ZONE_ID": domain_stack.sub_hosted_zone.hosted_zone_id,
-                "DOMAIN_NAME": domain_stack.sub_domain_name,
-                "UNAVAILABLE_IP": domain_stack.unavailable_ip,
-                "DNS_TTL": str(domain_stack.dns_ttl),
-                "RECORD_TYPE": domain_stack.record_type.value,
-            },
-        )
-        ### Lambda Permissions:
-        # Give it write to it's own log group:
-        self.log_group_asg_statechange_hook.grant_write(self.lambda_asg_state_change_hook)
-        # Give it permission to describe the stuff it needs to know about::
-        self.asg_state_change_policy.add_statements(
-            iam.PolicyStatement(
-                # NOTE: these are on the list of actions that CANNOT be locked down
-                #   in ANY way. You *must* use a wild card, and conditions *don't* work 🙄
-                effect=iam.Effect.ALLOW,
-                actions=[
-                    # To get the IP of a new instance:
-                    "ec2:DescribeInstances",
-                    # To make sure no other instances are starting up:
-                    "autoscaling:DescribeAutoScalingGroups",
-                ],
-                resources=["*"],
-            )
-        )
-        ## Let it update the DNS record of the domain stack:
-        self.asg_state_change_policy.add_statements(
-            iam.PolicyStatement(
-                effect=iam.Effect.ALLOW,
-                actions=["route53:ChangeResourceRecordSets"],
-                resources=[domain_stack.sub_hosted_zone.hosted_zone_arn],
-            )
-        )
+        ## With a warm pool, instances also launch INTO the pool (and terminate out of it).
+        # Only care about the ones moving in/out of the ASG itself, the rest never get an IP:
+        # https://docs.aws.amazon.com/autoscaling/ec2/userguide/warm-pools-eventbridge-events.html
+        warm_pool_filter_up, warm_pool_filter_down = {}, {}
+        if ec2_config["WarmPool"]["Enabled"]:
+            warm_pool_filter_up = {"Destination": ["AutoScalingGroup"]}
+            warm_pool_filter_down = {"Origin": ["AutoScalingGroup"]}
 
         ## EventBridge Rule: This is actually what hooks the Lambda to the ASG/Instance.
         #    Needed to keep the management in sync with if a container is running.
@@ -131,16 +221,39 @@ class AsgStateChangeHook(NestedStack):
                 detail_type=["EC2 Instance Launch Successful"],
                 detail={
                     "AutoScalingGroupName": [auto_scaling_group.auto_scaling_group_name],
+                    **warm_pool_filter_up,
                 },
             ),
             targets=[
                 # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_events_targets.LambdaFunction.html
-                events_targets.LambdaFunction(self.lambda_asg_state_change_hook),
+                self.asg_state_change_target,
                 # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_events_targets.SnsTopic.html
                 events_targets.SnsTopic(base_stack_sns_topic, message=message_up),
                 events_targets.SnsTopic(leaf_stack_sns_topic, message=message_up),
             ],
         )
+        ## EC2 says the instance is 'running' (and has it's public IP) well before the ASG says the
+        # launch was successful. Update DNS then, and the rule above just confirms it:
+        #   (The shared lambda already gets these from the base stack's rule)
+        if dns_config["EarlyUpdate"] and shared_lambda is None:
+            self.rule_instance_running = events.Rule(
+                self,
+                "InstanceRunningTrigger",
+                rule_name=f"{container_id_alpha}-rule-EC2-running",
+                description="Trigger Lambda as soon as a instance is running, to update DNS early",
+                # https://docs.aws.amazon.com/AWSEC2/latest/UserGuide/monitoring-instance-state-changes.html
+                event_pattern=events.EventPattern(
+                    source=["aws.ec2"],
+                    detail_type=["EC2 Instance State-change Notification"],
+                    # Can't filter by ASG here, the lambda checks that:
+                    detail={"state": ["running"]},
+                ),
+                targets=[
+                    # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_events_targets.LambdaFunction.html
+                    self.asg_state_change_target,
+                ],
+            )
+
         message_down = events.RuleTargetInput.from_text(f"Container for '{container_id}' has stopped.")
         self.rule_asg_state_change_trigger_down = events.Rule(
             self,
@@ -155,17 +268,43 @@ class AsgStateChangeHook(NestedStack):
                 detail_type=["EC2 Instance-terminate Lifecycle Action"],
                 detail={
                     "AutoScalingGroupName": [auto_scaling_group.auto_scaling_group_name],
+                    **warm_pool_filter_down,
                 },
             ),
             targets=[
                 # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_events_targets.LambdaFunction.html
-                events_targets.LambdaFunction(self.lambda_asg_state_change_hook),
+                self.asg_state_change_target,
                 # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_events_targets.SnsTopic.html
                 events_targets.SnsTopic(base_stack_sns_topic, message=message_down),
                 events_targets.SnsTopic(leaf_stack_sns_topic, message=message_down),
             ],
         )
 
+        ## How often the lambda ran for this leaf. The shared one runs for every
+        # leaf, so count this leaf's rules triggering instead:
+        # https://docs.aws.amazon.com/eventbridge/latest/userguide/eb-monitoring.html
+        if shared_lambda is None:
+            self.invocation_metrics = [self.lambda_asg_state_change_hook.metric_invocations(
+                unit=cloudwatch.Unit.COUNT,
+                statistic="Maximum",
+                period=Duration.minutes(1),
+            )]
+        else:
+            self.invocation_metrics = [
+                cloudwatch.Metric(
+                    namespace="AWS/Events",
+                    metric_name="TriggeredRules",
+                    dimensions_map={"RuleName": rule.rule_name},
+                    label=label,
+                    unit=cloudwatch.Unit.COUNT,
+                    statistic="Maximum",
+                    period=Duration.minutes(1),
+                ) for rule, label in [
+                    (self.rule_asg_state_change_trigger_up, "Spin Up"),
+                    (self.rule_asg_state_change_trigger_down, "Spin Down"),
+                ]
+            ]
+
         #####################
         ### cdk_nag stuff ###
         #####################
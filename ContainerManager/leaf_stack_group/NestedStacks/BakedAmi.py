@@ -0,0 +1,259 @@
+"""
+This module contains the BakedAmi NestedStack class.
+"""
+
+import hashlib
+import json
+
+from aws_cdk import (
+    NestedStack,
+    Fn,
+    aws_ec2 as ec2,
+    aws_iam as iam,
+    aws_ssm as ssm,
+    aws_imagebuilder as imagebuilder,
+    custom_resources as cr,
+)
+from constructs import Construct
+
+from cdk_nag import NagSuppressions
+
+from ContainerManager.utils.instance_user_data import ECS_AGENT_CONFIG_COMMANDS, ecs_optimized_image
+
+
+### Nested Stack info:
+# https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.NestedStack.html
+class BakedAmi(NestedStack):
+    """
+    This builds an ECS-Optimized AMI, with the container's image
+    already pulled, for the EcsAsg to launch from.
+    """
+    def __init__(
+        self,
+        scope: Construct,
+        leaf_construct_id: str,
+        vpc: ec2.Vpc,
+        ec2_config: dict,
+        container_config: dict,
+        image_uri: str,
+        **kwargs,
+    ) -> None:
+        super().__init__(scope, "BakedAmiNestedStack", **kwargs)
+
+        ## Only a digest always means the same image. A tag (like ':latest') can move after
+        # the AMI's baked, so the agent still has to ask the registry for those:
+        image_pinned = "@sha256:" in container_config["Image"]
+
+        ## What Image Builder runs on the build instance. (JSON is valid YAML):
+        # https://docs.aws.amazon.com/imagebuilder/latest/userguide/toe-use-documents.html
+        component_data = json.dumps({
+            "schemaVersion": 1.0,
+            "phases": [{
+                "name": "build",
+                "steps": [
+                    {
+                        ## Same host setup the EcsAsg user data would do on every boot:
+                        "name": "EcsAgentConfig",
+                        "action": "ExecuteBash",
+                        "inputs": {"commands": [
+                            "dnf install -y amazon-efs-utils",
+                            *ECS_AGENT_CONFIG_COMMANDS,
+                            # Don't check the registry on every task start, the image can't have changed:
+                            *(['echo "ECS_IMAGE_PULL_BEHAVIOR=prefer-cached" >> /etc/ecs/ecs.config'] if image_pinned else []),
+                        ]},
+                    },
+                    {
+                        ## The whole point of this stack. Big images take minutes to pull:
+                        "name": "PullContainerImage",
+                        "action": "ExecuteBash",
+                        "inputs": {"commands": [
+                            "systemctl start docker",
+                            f"docker pull {container_config['Image']}",
+                            ## If it's pulled through the ECR cache, the task asks for the cached name.
+                            # Tag it so the agent finds it, without needing ECR access here:
+                            *([f"docker tag {container_config['Image']} {image_uri}"] if image_uri != container_config["Image"] else []),
+                        ]},
+                    },
+                    {
+                        ## Otherwise instances launched from the AMI try to reuse THIS instance's ECS identity:
+                        # https://docs.aws.amazon.com/AmazonECS/latest/developerguide/ecs-agent-install.html
+                        "name": "CleanEcsAgent",
+                        "action": "ExecuteBash",
+                        "inputs": {"commands": [
+                            "systemctl stop ecs",
+                            "rm -rf /var/lib/ecs/data/*",
+                        ]},
+                    },
+                ],
+            }],
+        })
+        ## Components and Recipes are immutable. Changing the image string changes the hash,
+        # which creates a new one (and rebuilds the AMI), instead of failing to update in place:
+        #   (Only the string. A new push to the same tag doesn't rebuild, ECS pulls the difference)
+        bake_hash = hashlib.md5(component_data.encode()).hexdigest()[:8]
+
+        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_imagebuilder.CfnComponent.html
+        bake_component = imagebuilder.CfnComponent(
+            self,
+            "BakeComponent",
+            name=f"{leaf_construct_id}-bake-{bake_hash}",
+            platform="Linux",
+            version="1.0.0",
+            data=component_data,
+        )
+
+        ## Same AMI the EcsAsg would use without this stack. It's resolved when deploying, so
+        # add it to the recipe name too. A new ECS AMI release will also trigger a rebuild:
+        parent_image_id = ecs_optimized_image(ec2_config).get_image(self).image_id
+        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_imagebuilder.CfnImageRecipe.html
+        bake_recipe = imagebuilder.CfnImageRecipe(
+            self,
+            "BakeRecipe",
+            name=Fn.join("-", [
+                f"{leaf_construct_id}-bake-{bake_hash}",
+                # "ami-0123abcd" -> "0123abcd":
+                Fn.select(1, Fn.split("-", parent_image_id)),
+            ]),
+            version="1.0.0",
+            parent_image=parent_image_id,
+            components=[
+                imagebuilder.CfnImageRecipe.ComponentConfigurationProperty(
+                    component_arn=bake_component.attr_arn,
+                ),
+            ],
+        )
+
+        ## Permissions for the build instance. Only needs to talk to Image Builder & SSM:
+        # https://docs.aws.amazon.com/imagebuilder/latest/userguide/image-builder-setting-up.html#image-builder-IAM-prereq
+        self.build_role = iam.Role(
+            self,
+            "BuildInstanceRole",
+            assumed_by=iam.ServicePrincipal("ec2.amazonaws.com"),
+            description="The Image Builder instance's permissions, while baking the AMI",
+            managed_policies=[
+                iam.ManagedPolicy.from_aws_managed_policy_name("AmazonSSMManagedInstanceCore"),
+                iam.ManagedPolicy.from_aws_managed_policy_name("EC2InstanceProfileForImageBuilder"),
+            ],
+        )
+        build_instance_profile = iam.InstanceProfile(
+            self,
+            "BuildInstanceProfile",
+            role=self.build_role,
+        )
+        ## The build instance only needs to reach out, to pull the image and talk to SSM:
+        self.sg_build_instance = ec2.SecurityGroup(
+            self,
+            "SgBuildInstance",
+            vpc=vpc,
+            description="Outbound only, for the instance baking the AMI",
+            allow_all_outbound=True,
+        )
+
+        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_imagebuilder.CfnInfrastructureConfiguration.html
+        bake_infrastructure = imagebuilder.CfnInfrastructureConfiguration(
+            self,
+            "BakeInfrastructure",
+            name=f"{leaf_construct_id}-bake-infrastructure",
+            instance_profile_name=build_instance_profile.instance_profile_name,
+            # Build on the same hardware we'll run on:
+            instance_types=ec2_config["InstanceTypes"],
+            # No NAT in the base VPC, it needs the public subnet to pull the image:
+            subnet_id=vpc.public_subnets[0].subnet_id,
+            security_group_ids=[self.sg_build_instance.security_group_id],
+            terminate_instance_on_failure=True,
+        )
+
+        ## This builds the AMI when the stack deploys, and again whenever the recipe changes:
+        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_imagebuilder.CfnImage.html
+        self.baked_image = imagebuilder.CfnImage(
+            self,
+            "BakedImage",
+            image_recipe_arn=bake_recipe.attr_arn,
+            infrastructure_configuration_arn=bake_infrastructure.attr_arn,
+            # We don't have any tests, don't waste time launching an instance for them:
+            image_tests_configuration=imagebuilder.CfnImage.ImageTestsConfigurationProperty(
+                image_tests_enabled=False,
+            ),
+        )
+
+        ## The EcsAsg launch template resolves this on every launch:
+        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_ssm.StringParameter.html
+        self.ami_parameter = ssm.StringParameter(
+            self,
+            "BakedAmiId",
+            parameter_name=f"/{leaf_construct_id}/BakedAmiId",
+            description="The AMI with the container image already pulled",
+            string_value=self.baked_image.attr_image_id,
+        )
+
+        ## Without this, EBS lazy-loads every block from S3 the first time it's read.
+        # (Costs per AZ-hour while enabled, that's why it's optional):
+        # https://docs.aws.amazon.com/ebs/latest/userguide/ebs-fast-snapshot-restore.html
+        if ec2_config["BakedAmi"]["FastSnapshotRestore"]:
+            # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.custom_resources.AwsCustomResource.html
+            describe_image = cr.AwsCustomResource(
+                self,
+                "DescribeBakedImage",
+                on_update=cr.AwsSdkCall(
+                    service="EC2",
+                    action="describeImages",
+                    parameters={"ImageIds": [self.baked_image.attr_image_id]},
+                    physical_resource_id=cr.PhysicalResourceId.of(self.baked_image.attr_image_id),
+                    output_paths=["Images.0.BlockDeviceMappings.0.Ebs.SnapshotId"],
+                ),
+                policy=cr.AwsCustomResourcePolicy.from_sdk_calls(
+                    resources=cr.AwsCustomResourcePolicy.ANY_RESOURCE,
+                ),
+                install_latest_aws_sdk=False,
+            )
+            snapshot_id = describe_image.get_response_field("Images.0.BlockDeviceMappings.0.Ebs.SnapshotId")
+            fast_snapshot_restore_call = {
+                "service": "EC2",
+                "parameters": {
+                    "AvailabilityZones": vpc.availability_zones,
+                    "SourceSnapshotIds": [snapshot_id],
+                },
+                "physical_resource_id": cr.PhysicalResourceId.of(snapshot_id),
+            }
+            self.fast_snapshot_restore = cr.AwsCustomResource(
+                self,
+                "FastSnapshotRestore",
+                on_update=cr.AwsSdkCall(action="enableFastSnapshotRestores", **fast_snapshot_restore_call),
+                on_delete=cr.AwsSdkCall(action="disableFastSnapshotRestores", **fast_snapshot_restore_call),
+                policy=cr.AwsCustomResourcePolicy.from_sdk_calls(
+                    resources=cr.AwsCustomResourcePolicy.ANY_RESOURCE,
+                ),
+                install_latest_aws_sdk=False,
+            )
+
+        #####################
+        ### cdk_nag stuff ###
+        #####################
+        # Do at very end, they have to "suppress" after everything's created to work.
+        NagSuppressions.add_resource_suppressions(
+            self.build_role,
+            [
+                {
+                    "id": "AwsSolutions-IAM4",
+                    "reason": "These are the managed policies Image Builder documents for the build instance.",
+                    "appliesTo": [
+                        "Policy::arn:<AWS::Partition>:iam::aws:policy/AmazonSSMManagedInstanceCore",
+                        "Policy::arn:<AWS::Partition>:iam::aws:policy/EC2InstanceProfileForImageBuilder",
+                    ],
+                },
+            ],
+        )
+        NagSuppressions.add_stack_suppressions(
+            self,
+            [
+                {
+                    "id": "AwsSolutions-IAM5",
+                    "reason": "The Describe/FastSnapshotRestore calls act on a snapshot that doesn't exist until the image is built.",
+                    "appliesTo": ["Resource::*"],
+                },
+                {
+                    "id": "AwsSolutions-L1",
+                    "reason": "The AwsCustomResource lambda is controlled by cdk, can't update to latest version.",
+                },
+            ],
+        )
@@ -9,10 +9,13 @@ from aws_cdk import (
     RemovalPolicy,
     CfnOutput,
     aws_ecs as ecs,
+    aws_iam as iam,
     aws_logs as logs,
 )
 from constructs import Construct
 
+from ContainerManager.utils.ecr_pull_through_cache import cached_image_uri
+
 
 ### Nested Stack info:
 # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.NestedStack.html
@@ -28,6 +31,8 @@ class Container(NestedStack):
         container_id: str,
         ec2_config: dict,
         container_config: dict,
+        cached_registries: dict,
+        host_group_config: dict | None = None,
         **kwargs
     ) -> None:
         super().__init__(scope, "ContainerNestedStack", **kwargs)
@@ -57,21 +62,57 @@ class Container(NestedStack):
         ### Give the task write logging permissions:
         self.container_log_group.grant_write(self.task_definition.task_role)
 
+        ## If the base stack caches this image's registry, pull from there instead:
+        # (The BakedAmi stack uses this too, so the name matches what's already pulled)
+        self.image_uri = cached_image_uri(
+            container_config["Image"],
+            cached_registries=cached_registries,
+            account=self.account,
+            region=self.region,
+        )
+        if self.image_uri != container_config["Image"]:
+            ## The first pull of a image creates the cached repo, and imports it from upstream:
+            # https://docs.aws.amazon.com/AmazonECR/latest/userguide/pull-through-cache-iam.html
+            self.task_definition.add_to_execution_role_policy(iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=[
+                    "ecr:BatchGetImage",
+                    "ecr:GetDownloadUrlForLayer",
+                    "ecr:BatchImportUpstreamImage",
+                    "ecr:CreateRepository",
+                ],
+                resources=[
+                    self.format_arn(service="ecr", resource="repository", resource_name=f"{repository_prefix}/*")
+                    for repository_prefix in cached_registries.values()
+                ],
+            ))
+            self.task_definition.add_to_execution_role_policy(iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=["ecr:GetAuthorizationToken"],
+                resources=["*"],
+            ))
+
+        ## The "Soft limit". However since there'll only ever be this one task, it can grow as much as it wants.
+        # Reserve 2GB for the host. Use the SOFT LIMIT, so it won't get killed if it maxes out.
+        #   (Tried 1GB, but palworld couldn't place on the instance from time to time).
+        memory_reservation_mib = ec2_config['MemoryInfo']['SizeInMiB'] - 2*1024
+        ## Sharing the instance with the rest of the HostGroup, only reserve this one's share.
+        # (ECS won't place it if every member's doesn't fit together):
+        if host_group_config is not None:
+            memory_reservation_mib = host_group_config["MemoryReservationMiB"]
+
         ## Details for task_definition.add_container:
         # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_ecs.TaskDefinition.html#addwbrcontainerid-props
         ## And the container object itself:
         # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_ecs.ContainerDefinition.html
         self.container = self.task_definition.add_container(
             container_id_alpha,
-            image=ecs.ContainerImage.from_registry(container_config["Image"]),
+            image=ecs.ContainerImage.from_registry(self.image_uri),
             port_mappings=container_config["Ports"],
             essential=True,
             ## Hard limit. Will get killed if it exceeds this.
             # memory_limit_mib=999999999,
-            ## The "Soft limit". However since there'll only ever be this one task, it can grow as much as it wants.
-            # Reserve 2GB for the host. Use the SOFT LIMIT, so it won't get killed if it maxes out.
-            #   (Tried 1GB, but palworld couldn't place on the instance from time to time).
-            memory_reservation_mib=ec2_config['MemoryInfo']['SizeInMiB'] - 2*1024,
+            memory_reservation_mib=memory_reservation_mib,
             ## Add environment variables into the container here:
             environment=container_config["Environment"],
             ## Logging, straight from:
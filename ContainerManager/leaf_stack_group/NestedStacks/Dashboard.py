@@ -15,6 +15,7 @@ from ContainerManager.leaf_stack_group.domain_stack import DomainStack
 from . import Container, Volumes, EcsAsg, Watchdog, AsgStateChangeHook
 
 TRAFFIC_IN_LABEL = "Traffic In (Bytes/Sec)"
+CONNECTIONS_LABEL = "Connections"
 
 ### Nested Stack info:
 # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.NestedStack.html
@@ -51,12 +52,8 @@ class Dashboard(NestedStack):
         ############
         ### Metrics used in the Widgets below:
 
-        ## ASG State Change Invocation Count:
-        metric_asg_lambda_invocation_count = asg_state_change_hook_nested_stack.lambda_asg_state_change_hook.metric_invocations(
-            unit=cloudwatch.Unit.COUNT,
-            statistic="Maximum",
-            period=Duration.minutes(1),
-        )
+        ## ASG State Change Invocation Count: (Or it's rules, if the lambda is shared)
+        metrics_asg_lambda_invocation_count = asg_state_change_hook_nested_stack.invocation_metrics
 
         ## EC2 Service Metrics:
         # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_ecs.Ec2Service.html#metricwbrcpuwbrutilizationprops
@@ -90,11 +87,11 @@ class Dashboard(NestedStack):
                 # Only show up to an hour ago:
                 height=6,
                 width=12,
-                right=[metric_asg_lambda_invocation_count],
+                right=metrics_asg_lambda_invocation_count,
                 legend_position=cloudwatch.LegendPosition.RIGHT,
                 ## Only shows units when graph has data. This changes that:
                 # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_cloudwatch.YAxisProps.html
-                right_y_axis=cloudwatch.YAxisProps(label=metric_asg_lambda_invocation_count.unit.value.title(), show_units=False),
+                right_y_axis=cloudwatch.YAxisProps(label=metrics_asg_lambda_invocation_count[0].unit.value.title(), show_units=False),
             ),
 
             ### Show the number of instances, to see when it starts/stops:
@@ -125,6 +122,8 @@ class Dashboard(NestedStack):
                     watchdog_nested_stack.alarm_asg_instance_left_up,
                     watchdog_nested_stack.alarm_container_activity,
                     watchdog_nested_stack.alarm_break_crash_loop_count,
+                    # Optional, only if 'Watchdog.ColdStartAlarmSeconds' is set:
+                    *([watchdog_nested_stack.alarm_cold_start] if watchdog_nested_stack.alarm_cold_start else []),
                 ],
             ),
 
@@ -166,7 +165,10 @@ class Dashboard(NestedStack):
                 alarm=watchdog_nested_stack.alarm_container_activity,
                 ## Doesn't show the units anyways:
                 # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_cloudwatch.YAxisProps.html
-                left_y_axis=cloudwatch.YAxisProps(label=TRAFFIC_IN_LABEL, show_units=False),
+                left_y_axis=cloudwatch.YAxisProps(
+                    label=CONNECTIONS_LABEL if main_config["Watchdog"]["Mode"] == "CONNECTIONS" else TRAFFIC_IN_LABEL,
+                    show_units=False,
+                ),
             ),
 
             ## Instance Left Up Alarm:
@@ -195,11 +197,111 @@ class Dashboard(NestedStack):
                 ],
             ),
 
+            ## How long each phase of the last spin-up took:
+            # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_cloudwatch.GraphWidget.html
+            cloudwatch.GraphWidget(
+                title="(EC2) Spin-up Time by Phase (Seconds since OS started)",
+                height=6,
+                width=12,
+                left=list(watchdog_nested_stack.boot_phase_metrics.values()),
+                # Each bar is when that phase finished, so they read left-to-right like a timeline:
+                view=cloudwatch.GraphWidgetView.BAR,
+                legend_position=cloudwatch.LegendPosition.RIGHT,
+                statistic="Maximum",
+                left_y_axis=cloudwatch.YAxisProps(label="Seconds", show_units=False, min=0),
+            ),
+
+            ## If the root volume is what's slow. High latency or a deep queue while
+            # spinning up means it's worth bumping 'Ec2.RootVolume':
+            # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_cloudwatch.GraphWidget.html
+            cloudwatch.GraphWidget(
+                title=" ".join([
+                    "(EBS) Root Volume Latency and Queue Depth",
+                    f"[{main_config['Ec2']['RootVolume']['Type'].value.lower()}]",
+                    f"[IOPS: {main_config['Ec2']['RootVolume']['Iops'] or 'Default'}]",
+                    f"[Throughput: {main_config['Ec2']['RootVolume']['ThroughputMiBps'] or 'Default'}]",
+                ]),
+                height=6,
+                width=12,
+                left=list(watchdog_nested_stack.ebs_latency_metrics.values()),
+                right=[watchdog_nested_stack.ebs_queue_depth_metric],
+                legend_position=cloudwatch.LegendPosition.RIGHT,
+                left_y_axis=cloudwatch.YAxisProps(label="Milliseconds", show_units=False, min=0),
+                right_y_axis=cloudwatch.YAxisProps(label="Requests In Flight", show_units=False, min=0),
+            ),
+
+            ## Only if there's volumes. Bursting EFS's run out of credits with big worlds, and
+            # then every spin-up is slower than the last:
+            # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_cloudwatch.GraphWidget.html
+            *([
+                cloudwatch.GraphWidget(
+                    title="(EFS) Burst Credits and Permitted Throughput",
+                    height=6,
+                    width=12,
+                    left=volumes_nested_stack.burst_credit_balance_metrics,
+                    right=volumes_nested_stack.permitted_throughput_metrics,
+                    legend_position=cloudwatch.LegendPosition.RIGHT,
+                    left_y_axis=cloudwatch.YAxisProps(label="Credits (Bytes)", show_units=False, min=0),
+                    right_y_axis=cloudwatch.YAxisProps(label="Bytes/Sec", show_units=False, min=0),
+                ),
+                cloudwatch.GraphWidget(
+                    title="(EFS) Percent of IO Limit (General Purpose only)",
+                    height=6,
+                    width=12,
+                    left=volumes_nested_stack.percent_io_limit_metrics,
+                    legend_position=cloudwatch.LegendPosition.RIGHT,
+                    left_y_axis=cloudwatch.YAxisProps(label="Percent", show_units=False, min=0, max=100),
+                ),
+            ] if volumes_nested_stack.burst_credit_balance_metrics else []),
+
+            ## Only if a volume has 'LocalCopy', or is S3. How long syncing with the EFS/S3 takes:
+            # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_cloudwatch.GraphWidget.html
+            *([
+                cloudwatch.GraphWidget(
+                    title="(Volumes) Local Copy Sync Time and Size",
+                    height=6,
+                    width=12,
+                    left=list(watchdog_nested_stack.local_copy_sync_seconds_metrics.values()),
+                    right=list(watchdog_nested_stack.local_copy_sync_bytes_metrics.values()),
+                    legend_position=cloudwatch.LegendPosition.RIGHT,
+                    left_y_axis=cloudwatch.YAxisProps(label="Seconds", show_units=False, min=0),
+                    right_y_axis=cloudwatch.YAxisProps(label="Bytes", show_units=False, min=0),
+                ),
+                cloudwatch.GraphWidget(
+                    title="(Volumes) Local Copy Sync Throughput",
+                    height=6,
+                    width=12,
+                    left=list(watchdog_nested_stack.local_copy_sync_throughput_metrics.values()),
+                    legend_position=cloudwatch.LegendPosition.RIGHT,
+                    left_y_axis=cloudwatch.YAxisProps(label="Bytes/Sec", show_units=False, min=0),
+                ),
+            ] if volumes_nested_stack.local_copies else []),
+
+            ## How long people waited, from their first DNS query to DNS pointing at the instance:
+            # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_cloudwatch.GraphWidget.html
+            cloudwatch.GraphWidget(
+                title="(DNS) Cold Start Time (First query to DNS updated)",
+                height=6,
+                width=12,
+                left=[
+                    watchdog_nested_stack.cold_start_metric.with_(label=f"Cold Start ({statistic})", statistic=statistic)
+                    for statistic in ["p50", "p90", "Maximum"]
+                ],
+                left_annotations=[
+                    cloudwatch.HorizontalAnnotation(
+                        value=main_config["Watchdog"]["ColdStartAlarmSeconds"],
+                        label="Alarm Threshold",
+                    ),
+                ] if main_config["Watchdog"]["ColdStartAlarmSeconds"] is not None else None,
+                legend_position=cloudwatch.LegendPosition.RIGHT,
+                left_y_axis=cloudwatch.YAxisProps(label="Seconds", show_units=False, min=0),
+            ),
+
             ## ECS Container Utilization:
             # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_cloudwatch.GraphWidget.html
             cloudwatch.GraphWidget(
                 title=" ".join([
-                    f"(ECS) Container Utilization - [{main_config['Ec2']['InstanceType']}]",
+                    f"(ECS) Container Utilization - [{', '.join(main_config['Ec2']['InstanceTypes'])}]",
                     f"[vCPU's: {main_config['Ec2']['VCpuInfo']['DefaultVCpus']}]",
                     # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_ecs.CfnTaskDefinition.ContainerDefinitionProperty.html#memoryreservation
                     f"[Memory: {container_nested_stack.container.render_container_definition().memory_reservation / 1024} GB]"
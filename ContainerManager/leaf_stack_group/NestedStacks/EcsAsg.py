@@ -3,19 +3,34 @@
 This module contains the EcsAsg NestedStack class.
 """
 
+import math
+
 from aws_cdk import (
     NestedStack,
+    Duration,
     aws_ec2 as ec2,
     aws_ecs as ecs,
     aws_iam as iam,
     aws_sns as sns,
     aws_efs as efs,
+    aws_s3 as s3,
+    aws_ssm as ssm,
     aws_autoscaling as autoscaling,
 )
 from constructs import Construct
 
 from cdk_nag import NagSuppressions
 
+from ContainerManager.base_stack import HostGroup
+from ContainerManager.leaf_stack_group.domain_stack import DomainStack
+from ContainerManager.utils.instance_user_data import boot_service_commands, ecs_optimized_image, ECS_AGENT_CONFIG_COMMANDS
+
+from .Volumes import Volumes
+
+## Where each EFS is mounted on the instance, under it's node id:
+EFS_ROOT_HOST = "/mnt/efs"
+## Every EBS volume and snapshot is tagged with which leaf it's for, so the instance can only touch it's own:
+EBS_TAG_KEY = "ContainerManager:Volume"
 
 
 class EcsAsg(NestedStack):
@@ -27,18 +42,38 @@ class EcsAsg(NestedStack):
         self,
         scope: Construct,
         leaf_construct_id: str,
+        container_id: str,
         vpc: ec2.Vpc,
         ssh_key_pair: ec2.KeyPair,
         base_stack_sns_topic: sns.Topic,
         leaf_stack_sns_topic: sns.Topic,
         task_definition: ecs.Ec2TaskDefinition,
         ec2_config: dict,
+        watchdog_config: dict,
         sg_ec2_instance_traffic: ec2.SecurityGroup,
-        efs_file_systems: dict[efs.FileSystem, efs.AccessPoint],
+        volumes_nested_stack: Volumes,
+        baked_ami_parameter: ssm.StringParameter | None,
+        domain_stack: DomainStack,
+        dns_config: dict,
+        host_group: HostGroup | None = None,
         **kwargs,
     ) -> None:
         super().__init__(scope, "EcsAsgNestedStack", **kwargs)
 
+        ## Members of a HostGroup run on the group's instance. They only add their service to it:
+        if host_group is not None:
+            self._join_host_group(
+                leaf_construct_id=leaf_construct_id,
+                container_id=container_id,
+                task_definition=task_definition,
+                watchdog_config=watchdog_config,
+                efs_file_systems=volumes_nested_stack.efs_file_systems,
+                efs_mount_options=volumes_nested_stack.efs_mount_options,
+                host_group=host_group,
+            )
+            self._add_ec2_service(task_definition)
+            return
+
         ## Cluster for the the container
         # This has to stay in this stack. A cluster represents a single "instance type"
         # sort of. This is the only way to tie the ASG to the ECS Service, one-to-one.
@@ -66,75 +101,47 @@ class EcsAsg(NestedStack):
         # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_ec2.UserData.html
         self.ec2_user_data = ec2.UserData.for_linux() # (Can also set to python, etc. Default bash)
 
-        efs_root_host = "/mnt/efs"
-        ### Tie all the EFS's to the host:
-        for efs_file_system, mount_paths in efs_file_systems.items():
-            ### Give EC2 access to the EFS:
-            efs_file_system.grant_read_write(self.ec2_role)
-
-            # Mount on host, each has to be unique. (/mnt/efs/Efs-1, /mnt/efs/Efs-2, etc.)
-            efs_mount_point = f"{efs_root_host}/{efs_file_system.node.id}"
+        self._mount_efs_volumes(volumes_nested_stack.efs_file_systems, volumes_nested_stack.efs_mount_options)
 
-            # NOTE: The docs didn't have 'iam', but you get permission denied without it:
-            #      (You can also mount efs directly by removing the access-point flag)
-            # https://docs.aws.amazon.com/efs/latest/ug/mounting-access-points.html
-            # https://docs.aws.amazon.com/efs/latest/ug/mount-fs-auto-mount-update-fstab.html
-            # https://docs.aws.amazon.com/efs/latest/ug/mount-helper-setting.html
+        ## A baked AMI already has these applied:
+        if baked_ami_parameter is None:
+            self.ec2_user_data.add_commands(*ECS_AGENT_CONFIG_COMMANDS)
+        if ec2_config["WarmPool"]["Enabled"]:
+            ## Don't register to the cluster while the instance is being pre-initialized in the
+            # warm pool. Otherwise the Daemon would start the task, right before it gets stopped:
+            # https://docs.aws.amazon.com/AmazonECS/latest/developerguide/using-warm-pool.html
             self.ec2_user_data.add_commands(
-                # Make sure the EFS Mount Point exists:
-                f'mkdir -p "{efs_mount_point}"',
-                ## Add the entry to fstab, so it mounts on boot:
-                f'echo "{efs_file_system.file_system_id} {efs_mount_point} efs _netdev,tls,iam 0 0" >> /etc/fstab',
-                ## Mount that specific entry:
-                f'mount {efs_mount_point}',
+                'echo "ECS_WARM_POOLS_CHECK=true" >> /etc/ecs/ecs.config',
             )
-            for mount_path in mount_paths:
-                # Make sure each specific mount path exists INSIDE the EFS, now that it's mounted:
-                full_mount_path = f"{efs_mount_point}/{mount_path.lstrip('/')}"
-                self.ec2_user_data.add_commands(
-                    ### I tried everything possible to avoid the 777 here. The problem is:
-                    #     - We need to support ANY container, and they have different UID:GID's.
-                    #     - Some container's don't support overriding UID:GID's.
-                    #     - This is only the *last* directory in the path, and not any files too.
-                    f'mkdir -p -m 777 "{full_mount_path}"',
-                )
-
-        ## Add ECS Agent Config Variables:
-        # (Full list at: https://github.com/aws/amazon-ecs-agent/blob/master/README.md#environment-variables)
-        # (ECS Agent config information: https://docs.aws.amazon.com/AmazonECS/latest/developerguide/ecs-agent-config.html)
-        self.ec2_user_data.add_commands(
-            ### Security Flags:
-            'echo "ECS_DISABLE_PRIVILEGED=true" >> /etc/ecs/ecs.config',
-            # Enable SELinux Enforcing mode (It's passive on Amazon 2023??)
-            'sudo setenforce 1',
-            # Make SELinux enforcing on reboot (Userdata only runs on first boot):
-            'sudo sed -i "s/^SELINUX=.*/SELINUX=enforcing/" /etc/selinux/config',
-            'echo "ECS_SELINUX_CAPABLE=true" >> /etc/ecs/ecs.config',
-            ### Instance isn't ever on long enough to worry about cleanup anyways:
-            'echo "ECS_DISABLE_IMAGE_CLEANUP=true" >> /etc/ecs/ecs.config',
+
+        self._add_instance_metrics(
+            leaf_construct_id=leaf_construct_id,
+            container_id=container_id,
+            task_definition=task_definition,
+            watchdog_config=watchdog_config,
+            efs_file_systems=volumes_nested_stack.efs_file_systems,
         )
 
+        ## Don't let the instance go, until it's written the local copies back to EFS/S3, and
+        # snapshotted the EBS volumes. (None if the leaf doesn't have any):
+        lifecycle_hook_names = {
+            "LocalCopyHook": self._add_local_copies(
+                leaf_construct_id=leaf_construct_id,
+                container_id=container_id,
+                local_copies=volumes_nested_stack.local_copies,
+                s3_buckets=volumes_nested_stack.s3_buckets,
+            ),
+            "EbsVolumesHook": self._add_ebs_volumes(
+                leaf_construct_id=leaf_construct_id,
+                vpc=vpc,
+                ebs_volumes=volumes_nested_stack.ebs_volumes,
+            ),
+        }
 
-        ## Contains the configuration information to launch an instance, and stores launch parameters
-        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_ec2.LaunchTemplate.html
-        asg_launch_template = ec2.LaunchTemplate(
-            self,
-            "AsgLaunchTemplate",
-            instance_type=ec2.InstanceType(ec2_config["InstanceType"]),
-            ## Needs to be an "EcsOptimized" image to register to the cluster
-            # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_ecs.EcsOptimizedImage.html
-            machine_image=ecs.EcsOptimizedImage.amazon_linux2023(), # DON'T set hardware type here, not sure if it switches to ARM automatically.
-            # Lets Specific traffic to/from the instance:
-            security_group=sg_ec2_instance_traffic,
-            user_data=self.ec2_user_data,
-            role=self.ec2_role,
-            key_pair=ssh_key_pair,
-            ## Console recommends to enable IMDSv2:
-            http_tokens=ec2.LaunchTemplateHttpTokens.REQUIRED,
-            require_imdsv2=True,
-            ## Needed so traffic metric is updated every minute (instead of 5)
-            detailed_monitoring=True,
-        )
+        ## Point DNS at this instance as soon as it has a public IP, instead of waiting on the
+        # ASG event and the AsgStateChangeHook lambda. (It still runs, as a fallback):
+        if dns_config["SelfRegister"]:
+            self._add_dns_self_register(domain_stack)
 
         ## A Fleet represents a managed set of EC2 instances:
         # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_autoscaling.AutoScalingGroup.html
@@ -142,7 +149,12 @@ class EcsAsg(NestedStack):
             self,
             "Asg",
             vpc=vpc,
-            launch_template=asg_launch_template,
+            **self._asg_launch_kwargs(ec2_config, self._create_launch_template(
+                ec2_config=ec2_config,
+                sg_ec2_instance_traffic=sg_ec2_instance_traffic,
+                ssh_key_pair=ssh_key_pair,
+                baked_ami_parameter=baked_ami_parameter,
+            )),
             # desired_capacity=0,
             min_capacity=0,
             max_capacity=1,
@@ -155,8 +167,31 @@ class EcsAsg(NestedStack):
                 # Let users of this specific stack know the same thing:
                 autoscaling.NotificationConfiguration(topic=leaf_stack_sns_topic, scaling_events=autoscaling.ScalingEvents.ERRORS),
             ],
+            ## The Watchdog uses this to know if an instance is *really* up, since
+            # warm pool instances also report traffic while they're being initialized:
+            group_metrics=[
+                autoscaling.GroupMetrics(autoscaling.GroupMetric.IN_SERVICE_INSTANCES),
+            ] if ec2_config["WarmPool"]["Enabled"] else None,
         )
 
+        ## The parameter has to exist before anything launches. (The warm pool launches right away):
+        if baked_ami_parameter is not None:
+            self.auto_scaling_group.node.add_dependency(baked_ami_parameter)
+
+        ## Keep a pre-initialized instance (Booted, User Data ran, EFS in fstab) stopped
+        # next to the ASG. Setting DesiredCapacity to 1 just starts it back up.
+        # https://docs.aws.amazon.com/autoscaling/ec2/userguide/ec2-auto-scaling-warm-pools.html
+        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_autoscaling.AutoScalingGroup.html#addwbrwarmwbrpooloptions
+        if ec2_config["WarmPool"]["Enabled"]:
+            self.warm_pool = self.auto_scaling_group.add_warm_pool(
+                pool_state=ec2_config["WarmPool"]["PoolState"],
+                # When the system spins down, put the instance back in the pool instead
+                # of terminating it. Otherwise we'd pay the full boot again to re-warm it:
+                reuse_on_scale_in=True,
+            )
+
+        self._add_lifecycle_hooks(lifecycle_hook_names)
+
         ## This allows an ECS cluster to target a specific EC2 Auto Scaling Group for the placement of tasks.
         # Can ensure that instances are not prematurely terminated while there are still tasks running on them.
         # (Still needed in ECS Daemon mode, since this ties the ASG to the ECS cluster)
@@ -178,28 +213,7 @@ class EcsAsg(NestedStack):
         )
         self.ecs_cluster.add_asg_capacity_provider(self.capacity_provider)
 
-        ## This creates a service using the EC2 launch type on an ECS cluster
-        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_ecs.Ec2Service.html
-        self.ec2_service = ecs.Ec2Service(
-            self,
-            "Ec2Service",
-            cluster=self.ecs_cluster,
-            task_definition=task_definition,
-            # Uses pre-defined ECS Tags on the resource:
-            enable_ecs_managed_tags=True,
-            ## Daemon let me rip out SOOO much code. It will start the task for you whenever the instance
-            # starts automatically, so you don't need task management logic in the AsgStateChangeHook lambda.
-            # https://docs.aws.amazon.com/AmazonECS/latest/developerguide/ecs_services.html#service_scheduler_daemon
-            daemon=True,
-            min_healthy_percent=0,
-            max_healthy_percent=100,
-            ## We use the 'spin-down-asg-on-error' lambda to take care of circuit breaker-like
-            ## logic. If we *just* spun down the task, the instance would still be running.
-            ## That'd both charge money, and not let the system "spin back up/reset".
-            # circuit_breaker={
-            #     "rollback": False # Don't keep trying to restart the container if it fails
-            # },
-        )
+        self._add_ec2_service(task_definition)
 
         #####################
         ### cdk_nag stuff ###
@@ -249,17 +263,524 @@ class EcsAsg(NestedStack):
                     ]),
                     # "appliesTo": "N/A (Does not exist)"
                 },
-                # ASG EBS Encryption:
-                {
-                    "id": "AwsSolutions-EC26",
-                    "reason": "\n".join([
-                        "This is the default EBS storage cdk creates and attaches to the ASG EC2 Instances.",
-                        "We can create one ourselves so the default is overidden with one with encryption,",
-                        "but I don't want to maintain those settings, just use the one the cdk team supports.",
-                        "(This Issue will add support anyways: https://github.com/aws/aws-cdk/issues/6459)"
-                    ]),
-                    # "appliesTo": "N/A (Does not exist)"
-                }
             ],
             apply_to_children=True,
         )
+
+    def _mount_efs_volumes(
+        self,
+        efs_file_systems: dict[efs.FileSystem, list],
+        efs_mount_options: dict[efs.FileSystem, str],
+    ) -> None:
+        """
+        Mount every EFS on the instance, at '/mnt/efs/<Id>'. Each one mounts in the background,
+        so they don't wait on each other. Every mount gets timed, and logged to the journal
+        (`journalctl -t efs-mount`).
+        """
+        self.ec2_user_data.add_commands(
+            "MOUNT_PIDS=()",
+            "time_mount() {",
+            '    local mount_point="$1"; shift',
+            "    local start_ms; start_ms=$(date +%s%3N)",
+            '    mount "$mount_point" || { logger -s -t efs-mount "FAILED to mount $mount_point"; return 1; }',
+            '    logger -s -t efs-mount "Mounted $mount_point in $(( $(date +%s%3N) - start_ms ))ms"',
+            "    # Make sure each specific mount path exists INSIDE the EFS, now that it's mounted:",
+            '    for mount_path in "$@"; do mkdir -p -m 777 "$mount_path"; done',
+            "}",
+        )
+        ### Tie all the EFS's to the host:
+        for efs_file_system, mount_paths in efs_file_systems.items():
+            ### Give EC2 access to the EFS:
+            efs_file_system.grant_read_write(self.ec2_role)
+
+            # Mount on host, each has to be unique. (/mnt/efs/Efs-1, /mnt/efs/Efs-2, etc.)
+            efs_mount_point = f"{EFS_ROOT_HOST}/{efs_file_system.node.id}"
+
+            ### I tried everything possible to avoid the 777 on these. The problem is:
+            #     - We need to support ANY container, and they have different UID:GID's.
+            #     - Some container's don't support overriding UID:GID's.
+            #     - This is only the *last* directory in the path, and not any files too.
+            full_mount_paths = " ".join(
+                f'"{efs_mount_point}/{mount_path.lstrip("/")}"' for mount_path in mount_paths
+            )
+
+            # NOTE: The options come from the Volumes stack (Volumes.<Id>.MountOptions).
+            #      (You can also mount efs directly by removing the access-point flag)
+            # https://docs.aws.amazon.com/efs/latest/ug/mounting-access-points.html
+            # https://docs.aws.amazon.com/efs/latest/ug/mount-fs-auto-mount-update-fstab.html
+            # https://docs.aws.amazon.com/efs/latest/ug/mount-helper-setting.html
+            self.ec2_user_data.add_commands(
+                # Make sure the EFS Mount Point exists:
+                f'mkdir -p "{efs_mount_point}"',
+                ## Add the entry to fstab, so it mounts on boot:
+                f'echo "{efs_file_system.file_system_id} {efs_mount_point} efs {efs_mount_options[efs_file_system]} 0 0" >> /etc/fstab',
+                ## Mount that specific entry, without waiting on it:
+                f'time_mount "{efs_mount_point}" {full_mount_paths} &',
+                'MOUNT_PIDS+=($!)',
+            )
+        ## Everything has to be mounted before the ECS agent starts the task:
+        self.ec2_user_data.add_commands(
+            'for pid in "${MOUNT_PIDS[@]}"; do wait "$pid"; done',
+        )
+
+    def _add_instance_metrics(
+        self,
+        leaf_construct_id: str,
+        container_id: str,
+        task_definition: ecs.Ec2TaskDefinition,
+        watchdog_config: dict,
+        efs_file_systems: dict[efs.FileSystem, list],
+    ) -> None:
+        """
+        The services that publish metrics from the instance. They're all in the same namespace
+        as the Watchdog's, and show up in the Dashboard.
+        """
+        self.ec2_role.add_to_policy(iam.PolicyStatement(
+            effect=iam.Effect.ALLOW,
+            actions=["cloudwatch:PutMetricData"],
+            resources=["*"],
+            conditions={"StringEquals": {"cloudwatch:namespace": leaf_construct_id}},
+        ))
+
+        ## Time each phase of spinning up, to see what's worth optimizing. It's a service, so it
+        # runs every boot. (Warm pool instances only run the user data once, while warming):
+        efs_mount_points = " ".join(f"{EFS_ROOT_HOST}/{efs_file_system.node.id}" for efs_file_system in efs_file_systems)
+        listen_ports = " ".join(str(port_mapping.container_port) for port_mapping in task_definition.default_container.port_mappings)
+        self.ec2_user_data.add_commands(*boot_service_commands(
+            name="boot-timing",
+            description="Publish how long each phase of spinning up took",
+            script_path="./ContainerManager/leaf_stack_group/instance_scripts/boot_timing.sh",
+            environment={
+                "NAMESPACE": leaf_construct_id,
+                "CONTAINER_ID": container_id,
+                "AWS_REGION": self.region,
+                "IMAGE": task_definition.default_container.image_name,
+                "EFS_MOUNT_POINTS": efs_mount_points,
+                "LISTEN_PORTS": listen_ports,
+            },
+        ))
+
+        ## Count the connected clients directly, for the Watchdog to use instead of traffic:
+        # (The Watchdog's alarm reads it)
+        if watchdog_config["Mode"] == "CONNECTIONS":
+            self.ec2_user_data.add_commands(*boot_service_commands(
+                name="connection-count",
+                description="Publish how many clients are connected to the container",
+                script_path="./ContainerManager/leaf_stack_group/instance_scripts/connection_count.sh",
+                environment={
+                    "NAMESPACE": leaf_construct_id,
+                    "CONTAINER_ID": container_id,
+                    "AWS_REGION": self.region,
+                    # i.e "tcp:25565 udp:19132":
+                    "LISTEN_PORTS": " ".join(
+                        f"{port_mapping.protocol.value.lower()}:{port_mapping.container_port}"
+                        for port_mapping in task_definition.default_container.port_mappings
+                    ),
+                    "PERIOD_SECONDS": watchdog_config["PeriodSeconds"],
+                },
+            ))
+
+        ## Root volume latency and queue depth, to see if the disk is the bottleneck:
+        self.ec2_user_data.add_commands(*boot_service_commands(
+            name="ebs-stats",
+            description="Publish the root volume's latency and queue depth",
+            script_path="./ContainerManager/leaf_stack_group/instance_scripts/ebs_stats.sh",
+            environment={
+                "NAMESPACE": leaf_construct_id,
+                "CONTAINER_ID": container_id,
+                "AWS_REGION": self.region,
+            },
+        ))
+
+    def _add_local_copies(
+        self,
+        leaf_construct_id: str,
+        container_id: str,
+        local_copies: dict[str, dict],
+        s3_buckets: list[s3.Bucket],
+    ) -> str | None:
+        """
+        Give the container a local copy of these volumes (EFS's on the instance store, and
+        S3's wherever there's room), and keep writing it back. Returns the name of the
+        lifecycle hook that holds the instance until the last write finishes. (None if
+        there aren't any)
+
+        (The Volumes stack already pointed the container's mounts at the copies)
+        """
+        ## S3 volumes only ever get used through their local copy:
+        for s3_bucket in s3_buckets:
+            s3_bucket.grant_read_write(self.ec2_role)
+        if not local_copies:
+            return None
+
+        local_copy_hook_name = f"{leaf_construct_id}-local-copy"
+        self.ec2_user_data.add_commands(*boot_service_commands(
+            name="local-copy",
+            description="Keep a local copy of the EFS/S3 volumes, and write it back",
+            script_path="./ContainerManager/leaf_stack_group/instance_scripts/local_copy.sh",
+            environment={
+                "NAMESPACE": leaf_construct_id,
+                "CONTAINER_ID": container_id,
+                "AWS_REGION": self.region,
+                "LIFECYCLE_HOOK_NAME": local_copy_hook_name,
+                "LOCAL_ROOT": "/mnt/local",
+                "LOCAL_COPIES": " ".join(
+                    f"{name}:{local_copy['SyncMinutes']}:{local_copy['Source']}"
+                    for name, local_copy in local_copies.items()
+                ),
+            },
+            # The task can't start until the copy's there:
+            ecs_waits_for_ready=True,
+        ))
+        return local_copy_hook_name
+
+    def _add_ebs_volumes(
+        self,
+        leaf_construct_id: str,
+        vpc: ec2.Vpc,
+        ebs_volumes: dict[str, dict],
+    ) -> str | None:
+        """
+        Give the container a real block device for these, created from their last snapshot.
+        Returns the name of the lifecycle hook that holds the instance until the new snapshots
+        are started. (None if there aren't any)
+
+        (The Volumes stack already pointed the container's mounts at /mnt/ebs)
+        """
+        if not ebs_volumes:
+            return None
+
+        ebs_volumes_hook_name = f"{leaf_construct_id}-ebs-volumes"
+        self.ec2_user_data.add_commands(*boot_service_commands(
+            name="ebs-volumes",
+            description="Restore the EBS volumes from their last snapshot, and snapshot them again",
+            script_path="./ContainerManager/leaf_stack_group/instance_scripts/ebs_volumes.sh",
+            environment={
+                "AWS_REGION": self.region,
+                "LIFECYCLE_HOOK_NAME": ebs_volumes_hook_name,
+                "EBS_ROOT": "/mnt/ebs",
+                "TAG_KEY": EBS_TAG_KEY,
+                "TAG_PREFIX": leaf_construct_id,
+                # Fast Snapshot Restore is per-AZ, turn it on everywhere the ASG can launch:
+                "AVAILABILITY_ZONES": " ".join(vpc.availability_zones),
+                "EBS_VOLUMES": " ".join(
+                    ":".join([
+                        name,
+                        str(ebs_volume["SizeGiB"]),
+                        # (The cdk enum is upper-case, the cli wants "gp3"):
+                        ebs_volume["Type"].value.lower(),
+                        str(ebs_volume["Iops"] or ""),
+                        str(ebs_volume["ThroughputMiBps"] or ""),
+                        str(ebs_volume["FastSnapshotRestore"]).lower(),
+                        str(ebs_volume["KeepSnapshots"]),
+                        ",".join(ebs_volume["Paths"]),
+                    ]) for name, ebs_volume in ebs_volumes.items()
+                ),
+            },
+            # The task can't start until they're mounted:
+            ecs_waits_for_ready=True,
+        ))
+        ## Only volumes and snapshots tagged as this leaf's. (The instance itself is in the
+        # EbsVolumesPolicy, since it needs the ASG. See _add_lifecycle_hooks):
+        # https://docs.aws.amazon.com/ebs/latest/userguide/ebs-iam-policies.html
+        ebs_resources = [
+            f"arn:{self.partition}:ec2:{self.region}:{self.account}:volume/*",
+            f"arn:{self.partition}:ec2:{self.region}::snapshot/*",
+        ]
+        self.ec2_role.add_to_policy(iam.PolicyStatement(
+            effect=iam.Effect.ALLOW,
+            actions=["ec2:DescribeVolumes", "ec2:DescribeSnapshots"],
+            resources=["*"],
+        ))
+        self.ec2_role.add_to_policy(iam.PolicyStatement(
+            effect=iam.Effect.ALLOW,
+            actions=["ec2:CreateVolume", "ec2:CreateSnapshot"],
+            resources=ebs_resources,
+            conditions={"StringLike": {f"aws:RequestTag/{EBS_TAG_KEY}": f"{leaf_construct_id}/*"}},
+        ))
+        self.ec2_role.add_to_policy(iam.PolicyStatement(
+            effect=iam.Effect.ALLOW,
+            actions=["ec2:CreateTags"],
+            resources=ebs_resources,
+            conditions={"StringEquals": {"ec2:CreateAction": ["CreateVolume", "CreateSnapshot"]}},
+        ))
+        self.ec2_role.add_to_policy(iam.PolicyStatement(
+            effect=iam.Effect.ALLOW,
+            actions=[
+                "ec2:AttachVolume",
+                "ec2:DeleteSnapshot",
+                "ec2:EnableFastSnapshotRestores",
+                "ec2:DisableFastSnapshotRestores",
+            ],
+            resources=ebs_resources,
+            conditions={"StringLike": {f"aws:ResourceTag/{EBS_TAG_KEY}": f"{leaf_construct_id}/*"}},
+        ))
+        return ebs_volumes_hook_name
+
+    def _add_dns_self_register(self, domain_stack: DomainStack) -> None:
+        """ Let the instance point this leaf's DNS record at itself, when it boots """
+        self.ec2_role.add_to_policy(iam.PolicyStatement(
+            effect=iam.Effect.ALLOW,
+            actions=["route53:ChangeResourceRecordSets"],
+            resources=[domain_stack.sub_hosted_zone.hosted_zone_arn],
+            # ONLY allowed to UPSERT this leaf's one record:
+            # https://docs.aws.amazon.com/Route53/latest/DeveloperGuide/specifying-rrset-conditions.html
+            conditions={"ForAllValues:StringEquals": {
+                "route53:ChangeResourceRecordSetsNormalizedRecordNames": [domain_stack.sub_domain_name],
+                "route53:ChangeResourceRecordSetsRecordTypes": [domain_stack.record_type.value],
+                "route53:ChangeResourceRecordSetsActions": ["UPSERT"],
+            }},
+        ))
+        self.ec2_user_data.add_commands(*boot_service_commands(
+            name="dns-self-register",
+            description="Point this leaf's DNS record at the instance",
+            script_path="./ContainerManager/leaf_stack_group/instance_scripts/dns_self_register.sh",
+            environment={
+                "HOSTED_ZONE_ID": domain_stack.sub_hosted_zone.hosted_zone_id,
+                "DOMAIN_NAME": domain_stack.sub_domain_name,
+                "RECORD_TYPE": domain_stack.record_type.value,
+                "DNS_TTL": domain_stack.dns_ttl,
+            },
+        ))
+
+    def _create_launch_template(
+        self,
+        ec2_config: dict,
+        sg_ec2_instance_traffic: ec2.SecurityGroup,
+        ssh_key_pair: ec2.KeyPair,
+        baked_ami_parameter: ssm.StringParameter | None,
+    ) -> ec2.LaunchTemplate:
+        """ What the ASG launches. (Minus the instance type, if it's a Mixed Instances Policy) """
+        ## The root volume holds the image layers (and anything not on EFS). Set it explicitly, so
+        # extracting a big image isn't stuck at whatever the AMI's default volume does:
+        # https://docs.aws.amazon.com/ebs/latest/userguide/ebs-volume-types.html
+        root_volume_config = ec2_config["RootVolume"]
+        root_volume_size = root_volume_config["SizeGiB"]
+        ## Hibernating saves the RAM to the root volume. It has to be encrypted, and big
+        # enough to hold both the RAM and the AMI:
+        # https://docs.aws.amazon.com/AWSEC2/latest/UserGuide/hibernating-prerequisites.html
+        hibernation_configured = ec2_config["WarmPool"]["Enabled"] and \
+            ec2_config["WarmPool"]["PoolState"] == autoscaling.PoolState.HIBERNATED
+        if hibernation_configured:
+            root_volume_size += math.ceil(ec2_config["MemoryInfo"]["SizeInMiB"] / 1024)
+        block_devices = [
+            ec2.BlockDevice(
+                device_name="/dev/xvda",
+                # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_ec2.BlockDeviceVolume.html#static-ebsvolumesize-options
+                volume=ec2.BlockDeviceVolume.ebs(
+                    root_volume_size,
+                    encrypted=True,
+                    volume_type=root_volume_config["Type"],
+                    iops=root_volume_config["Iops"],
+                    throughput=root_volume_config["ThroughputMiBps"],
+                ),
+            ),
+        ]
+
+        if baked_ami_parameter is None:
+            ## Needs to be an "EcsOptimized" image to register to the cluster
+            # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_ecs.EcsOptimizedImage.html
+            machine_image = ecs_optimized_image(ec2_config)
+        else:
+            ## Built FROM the "EcsOptimized" image, with the container image already pulled.
+            # Resolved on launch, so the launch template doesn't need updating when it's rebuilt:
+            # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_ec2.MachineImage.html#static-resolvewbrssmwbrparameterwbratwbrlaunchparametername-options
+            machine_image = ec2.MachineImage.resolve_ssm_parameter_at_launch(
+                baked_ami_parameter.parameter_name,
+                os=ec2.OperatingSystemType.LINUX,
+            )
+
+        ## Contains the configuration information to launch an instance, and stores launch parameters
+        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_ec2.LaunchTemplate.html
+        return ec2.LaunchTemplate(
+            self,
+            "AsgLaunchTemplate",
+            # With a Mixed Instances Policy, its overrides pick the type instead. (See _asg_launch_kwargs):
+            instance_type=None if ec2_config["MixedInstances"] else ec2.InstanceType(ec2_config["InstanceType"]),
+            machine_image=machine_image,
+            # Lets Specific traffic to/from the instance:
+            security_group=sg_ec2_instance_traffic,
+            user_data=self.ec2_user_data,
+            role=self.ec2_role,
+            key_pair=ssh_key_pair,
+            ## Console recommends to enable IMDSv2:
+            http_tokens=ec2.LaunchTemplateHttpTokens.REQUIRED,
+            require_imdsv2=True,
+            ## Needed so traffic metric is updated every minute (instead of 5)
+            detailed_monitoring=True,
+            hibernation_configured=hibernation_configured,
+            block_devices=block_devices,
+        )
+
+    @staticmethod
+    def _asg_launch_kwargs(ec2_config: dict, launch_template: ec2.LaunchTemplate) -> dict:
+        """
+        How the ASG launches instances. (The AutoScalingGroup can only have one of these kwargs set)
+
+        With more than one instance type and/or Spot, it's a Mixed Instances Policy. It tries each
+        type in order, so if the first has no capacity in the AZ, the ASG falls back to the next
+        instead of failing to start. Otherwise it's just the launch template.
+        """
+        if not ec2_config["MixedInstances"]:
+            return {"launch_template": launch_template}
+        spot_config = ec2_config["Spot"]
+        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_autoscaling.MixedInstancesPolicy.html
+        return {"mixed_instances_policy": autoscaling.MixedInstancesPolicy(
+            launch_template=launch_template,
+            launch_template_overrides=[
+                autoscaling.LaunchTemplateOverrides(instance_type=ec2.InstanceType(instance_type))
+                for instance_type in ec2_config["InstanceTypes"]
+            ],
+            # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_autoscaling.InstancesDistribution.html
+            instances_distribution=autoscaling.InstancesDistribution(
+                # Without Spot, it's always On-Demand:
+                on_demand_base_capacity=spot_config["OnDemandBaseCapacity"] if spot_config["Enabled"] else 1,
+                on_demand_percentage_above_base_capacity=spot_config["OnDemandPercentageAboveBaseCapacity"] if spot_config["Enabled"] else 100,
+                # Both go down the list in order:
+                on_demand_allocation_strategy=autoscaling.OnDemandAllocationStrategy.PRIORITIZED,
+                # Capacity-optimized is least likely to be interrupted, and still tries the list in order:
+                spot_allocation_strategy=autoscaling.SpotAllocationStrategy.CAPACITY_OPTIMIZED_PRIORITIZED,
+            ),
+        )}
+
+    def _add_lifecycle_hooks(self, lifecycle_hook_names: dict[str, str | None]) -> None:
+        """
+        Hold the instance when it's terminating, until the instance scripts finish. (It waits
+        on every hook. Terminating hooks also hold instances going back into the warm pool,
+        the scripts check for both). Hooks named None are skipped.
+        """
+        # https://docs.aws.amazon.com/autoscaling/ec2/userguide/lifecycle-hooks.html
+        for hook_id, lifecycle_hook_name in lifecycle_hook_names.items():
+            if lifecycle_hook_name is None:
+                continue
+            # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_autoscaling.AutoScalingGroup.html#addwbrlifecyclewbrhookid-props
+            self.auto_scaling_group.add_lifecycle_hook(
+                hook_id,
+                lifecycle_hook_name=lifecycle_hook_name,
+                lifecycle_transition=autoscaling.LifecycleTransition.INSTANCE_TERMINATING,
+                # If the instance never answers, terminate it anyways:
+                default_result=autoscaling.DefaultResult.CONTINUE,
+                heartbeat_timeout=Duration.minutes(15),
+            )
+        if any(lifecycle_hook_names.values()):
+            ## A separate policy from the role's default one. The launch template depends on
+            # the role, and this needs the ASG. (The instance looks up the ASG's name itself):
+            iam.Policy(
+                self,
+                "LifecycleHookPolicy",
+                roles=[self.ec2_role],
+                statements=[
+                    iam.PolicyStatement(
+                        effect=iam.Effect.ALLOW,
+                        actions=["autoscaling:CompleteLifecycleAction"],
+                        resources=[self.auto_scaling_group.auto_scaling_group_arn],
+                    ),
+                    iam.PolicyStatement(
+                        effect=iam.Effect.ALLOW,
+                        actions=["autoscaling:DescribeAutoScalingInstances"],
+                        resources=["*"],
+                    ),
+                ],
+            )
+        if lifecycle_hook_names.get("EbsVolumesHook"):
+            ## Only this ASG's instances can attach/modify themselves:
+            iam.Policy(
+                self,
+                "EbsVolumesPolicy",
+                roles=[self.ec2_role],
+                statements=[
+                    iam.PolicyStatement(
+                        effect=iam.Effect.ALLOW,
+                        actions=["ec2:AttachVolume", "ec2:ModifyInstanceAttribute"],
+                        resources=[f"arn:{self.partition}:ec2:{self.region}:{self.account}:instance/*"],
+                        conditions={"StringEquals": {
+                            "aws:ResourceTag/aws:autoscaling:groupName": self.auto_scaling_group.auto_scaling_group_name,
+                        }},
+                    ),
+                ],
+            )
+
+    def _add_ec2_service(self, task_definition: ecs.Ec2TaskDefinition) -> None:
+        """ Run the task on whichever cluster this leaf's instance is in. """
+        ## This creates a service using the EC2 launch type on an ECS cluster
+        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_ecs.Ec2Service.html
+        self.ec2_service = ecs.Ec2Service(
+            self,
+            "Ec2Service",
+            cluster=self.ecs_cluster,
+            task_definition=task_definition,
+            # Uses pre-defined ECS Tags on the resource:
+            enable_ecs_managed_tags=True,
+            ## Daemon let me rip out SOOO much code. It will start the task for you whenever the instance
+            # starts automatically, so you don't need task management logic in the AsgStateChangeHook lambda.
+            # https://docs.aws.amazon.com/AmazonECS/latest/developerguide/ecs_services.html#service_scheduler_daemon
+            daemon=True,
+            min_healthy_percent=0,
+            max_healthy_percent=100,
+            ## We use the 'spin-down-asg-on-error' lambda to take care of circuit breaker-like
+            ## logic. If we *just* spun down the task, the instance would still be running.
+            ## That'd both charge money, and not let the system "spin back up/reset".
+            # circuit_breaker={
+            #     "rollback": False # Don't keep trying to restart the container if it fails
+            # },
+        )
+
+    def _join_host_group(
+        self,
+        leaf_construct_id: str,
+        container_id: str,
+        task_definition: ecs.Ec2TaskDefinition,
+        watchdog_config: dict,
+        efs_file_systems: dict[efs.FileSystem, list],
+        efs_mount_options: dict[efs.FileSystem, str],
+        host_group: HostGroup,
+    ) -> None:
+        """
+        Use the HostGroup's cluster and ASG, instead of creating this leaf's own. The
+        group's instance mounts the EFS's and counts the connections, from what's saved
+        here. (See 'instance_scripts/host_group.sh')
+        """
+        self.ecs_cluster = host_group.ecs_cluster
+        self.auto_scaling_group = host_group.auto_scaling_group
+        ## The group's role, so this leaf can add it's own permissions to it:
+        self.ec2_role = iam.Role.from_role_arn(
+            self,
+            "HostGroupEc2Role",
+            role_arn=host_group.ec2_role.role_arn,
+            mutable=True,
+        )
+        for efs_file_system in efs_file_systems:
+            efs_file_system.grant_read_write(self.ec2_role)
+        self.ec2_role.add_to_principal_policy(iam.PolicyStatement(
+            effect=iam.Effect.ALLOW,
+            actions=["cloudwatch:PutMetricData"],
+            resources=["*"],
+            conditions={"StringEquals": {"cloudwatch:namespace": leaf_construct_id}},
+        ))
+
+        ## Everything the group's instance needs to run this leaf:
+        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_ssm.StringParameter.html
+        self.host_group_parameter = ssm.StringParameter(
+            self,
+            "HostGroupParameter",
+            parameter_name=f"{host_group.member_parameter_prefix}/{container_id}",
+            description=f"What the '{host_group.group_name}' HostGroup's instance needs to run '{container_id}'.",
+            string_value=self.to_json_string({
+                "NAMESPACE": leaf_construct_id,
+                "CONTAINER_ID": container_id,
+                # i.e "tcp:25565 udp:19132":
+                "LISTEN_PORTS": " ".join(
+                    f"{port_mapping.protocol.value.lower()}:{port_mapping.container_port}"
+                    for port_mapping in task_definition.default_container.port_mappings
+                ),
+                "PERIOD_SECONDS": watchdog_config["PeriodSeconds"],
+                "EFS_MOUNTS": [
+                    {
+                        "FileSystemId": efs_file_system.file_system_id,
+                        "MountPoint": f"{host_group.efs_root_host(container_id)}/{efs_file_system.node.id}",
+                        "Options": efs_mount_options[efs_file_system],
+                        "Paths": mount_paths,
+                    } for efs_file_system, mount_paths in efs_file_systems.items()
+                ],
+            }),
+        )
@@ -0,0 +1,145 @@
+"""
+This module contains the PreWarm NestedStack class.
+"""
+
+import json
+
+from aws_cdk import (
+    NestedStack,
+    Duration,
+    RemovalPolicy,
+    aws_lambda,
+    aws_iam as iam,
+    aws_logs as logs,
+    aws_events as events,
+    aws_events_targets as events_targets,
+    aws_autoscaling as autoscaling,
+    aws_cloudwatch as cloudwatch,
+    aws_ssm as ssm,
+)
+from constructs import Construct
+
+from ContainerManager.utils.lambda_profile import lambda_code_kwargs, lambda_profile_kwargs
+from ContainerManager.utils.leaf_config_parser import leaf_lambdaProfile_defaults
+
+## How often the lambda checks if it should spin up. (The simulator uses this too):
+SCHEDULE_MINUTES = 5
+
+class PreWarm(NestedStack):
+    """
+    This learns when the leaf usually gets played from it's DNS hits, and
+    spins up the ASG a few minutes before then.
+    """
+    def __init__(
+        self,
+        scope: Construct,
+        leaf_construct_id: str,
+        container_id: str,
+        prewarm_config: dict,
+        auto_scaling_group: autoscaling.AutoScalingGroup,
+        traffic_dns_metric: cloudwatch.Metric,
+        activity_alarm: cloudwatch.Alarm,
+        **kwargs,
+    ) -> None:
+        super().__init__(scope, "PreWarmNestedStack", **kwargs)
+        container_id_alpha = "".join(e for e in container_id.title() if e.isalnum())
+
+        ## What the lambda has learned so far. It overwrites this every run:
+        #   (CloudFormation only sets the value when it's first created, or this changes)
+        # Advanced holds 8KB instead of 4KB, a busy week doesn't fit in Standard. (The lambda
+        # trims anything over, see MAX_STATE_BYTES in it's main.py):
+        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_ssm.StringParameter.html
+        self.state_parameter = ssm.StringParameter(
+            self,
+            "StateParameter",
+            parameter_name=f"/{leaf_construct_id}/PreWarmState",
+            description=f"The time-of-week histogram the PreWarm lambda learned for '{container_id}'.",
+            string_value="{}",
+            tier=ssm.ParameterTier.ADVANCED,
+        )
+
+        ## Log group for the lambda function:
+        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_logs.LogGroup.html
+        log_group_prewarm = logs.LogGroup(
+            self,
+            "LogGroupPreWarm",
+            retention=logs.RetentionDays.ONE_WEEK,
+            removal_policy=RemovalPolicy.DESTROY,
+            log_group_name=f"/aws/lambda/{container_id_alpha}-prewarm",
+        )
+
+        ## Lambda function to spin up the ASG ahead of time:
+        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_lambda.Function.html
+        self.lambda_prewarm = aws_lambda.Function(
+            self,
+            "PreWarm",
+            description=f"{container_id_alpha}-prewarm: Spins up the ASG before it's usually played.",
+            **lambda_code_kwargs("predictive_prewarm"),
+            runtime=aws_lambda.Runtime.PYTHON_3_12,
+            timeout=Duration.seconds(30),
+            # Nobody's waiting on it, the cheapest profile is fine:
+            **lambda_profile_kwargs(leaf_lambdaProfile_defaults),
+            log_group=log_group_prewarm,
+            environment={
+                "ASG_NAME": auto_scaling_group.auto_scaling_group_name,
+                "STATE_PARAMETER": self.state_parameter.parameter_name,
+                ## The DNS hits, the same ones the Watchdog resets with:
+                "METRIC_NAMESPACE": traffic_dns_metric.namespace,
+                "METRIC_NAME": traffic_dns_metric.metric_name,
+                "METRIC_DIMENSIONS": json.dumps(traffic_dns_metric.dimensions),
+                # Never spin down while someone's on, even if their DNS hit never showed up:
+                "ACTIVITY_ALARM_NAME": activity_alarm.alarm_name,
+                "LEAD_MINUTES": str(prewarm_config["LeadMinutes"]),
+                "CONFIDENCE": str(prewarm_config["Confidence"]),
+                "MAX_MINUTES_PER_DAY": str(prewarm_config["MaxMinutesPerDay"]),
+                "HISTORY_WEEKS": str(prewarm_config["HistoryWeeks"]),
+                "BIN_MINUTES": str(prewarm_config["BinMinutes"]),
+            },
+        )
+        ### Lambda Permissions:
+        # Give it write to it's own log group:
+        log_group_prewarm.grant_write(self.lambda_prewarm)
+        # Read and save what it's learned:
+        self.state_parameter.grant_read(self.lambda_prewarm)
+        self.state_parameter.grant_write(self.lambda_prewarm)
+        # Read the DNS hits, and see if it's already up. (Neither can be limited to a resource):
+        self.lambda_prewarm.add_to_role_policy(
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=[
+                    "cloudwatch:GetMetricData",
+                    "autoscaling:DescribeAutoScalingGroups",
+                ],
+                resources=["*"],
+            )
+        )
+        # See if anyone's on, before spinning it back down:
+        self.lambda_prewarm.add_to_role_policy(
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=["cloudwatch:DescribeAlarms"],
+                resources=[activity_alarm.alarm_arn],
+            )
+        )
+        # Spin it up (or back down, if it goes over budget):
+        self.lambda_prewarm.add_to_role_policy(
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=["autoscaling:UpdateAutoScalingGroup"],
+                resources=[auto_scaling_group.auto_scaling_group_arn],
+            )
+        )
+
+        ## Check every few minutes:
+        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_events.Rule.html
+        self.rule_prewarm = events.Rule(
+            self,
+            "RulePreWarm",
+            rule_name=f"{container_id_alpha}-rule-prewarm",
+            description="Check if it's about time for someone to show up",
+            schedule=events.Schedule.rate(Duration.minutes(SCHEDULE_MINUTES)),
+            targets=[
+                # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_events_targets.LambdaFunction.html
+                events_targets.LambdaFunction(self.lambda_prewarm),
+            ],
+        )
@@ -10,6 +10,8 @@ from aws_cdk import (
 )
 from constructs import Construct
 
+from ContainerManager.base_stack import HostGroup
+
 
 ### Nested Stack info:
 # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.NestedStack.html
@@ -25,29 +27,39 @@ class SecurityGroups(NestedStack):
         vpc: ec2.Vpc,
         container_id: str,
         container_ports_config: list,
+        host_group: HostGroup | None = None,
         **kwargs,
     ) -> None:
         super().__init__(scope, "SecurityGroupsNestedStack", **kwargs)
 
-        ## Security Group for Instance's traffic:
-        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_ec2.SecurityGroup.html
-        self.sg_ec2_instance_traffic = ec2.SecurityGroup(
-            self,
-            "SgEc2InstanceTraffic",
-            vpc=vpc,
-            description=f"({container_id}): Traffic for the EC2 Instance",
-            # Impossible to know container will need/want:
-            allow_all_outbound=True,
-        )
-        # Create a name of `<StackName>/sg-ec2-instance-traffic` to find it easier:
-        Tags.of(self.sg_ec2_instance_traffic).add("Name", f"{leaf_construct_id}/sg-ec2-instance-traffic")
-        ## Allow SSH traffic:
-        self.sg_ec2_instance_traffic.connections.allow_from(
-            ec2.Peer.any_ipv4(),
-            # Same as TCP 22:
-            ec2.Port.SSH,
-            description="Allow SSH traffic IN",
-        )
+        if host_group is None:
+            ## Security Group for Instance's traffic:
+            # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_ec2.SecurityGroup.html
+            self.sg_ec2_instance_traffic = ec2.SecurityGroup(
+                self,
+                "SgEc2InstanceTraffic",
+                vpc=vpc,
+                description=f"({container_id}): Traffic for the EC2 Instance",
+                # Impossible to know container will need/want:
+                allow_all_outbound=True,
+            )
+            # Create a name of `<StackName>/sg-ec2-instance-traffic` to find it easier:
+            Tags.of(self.sg_ec2_instance_traffic).add("Name", f"{leaf_construct_id}/sg-ec2-instance-traffic")
+            ## Allow SSH traffic:
+            self.sg_ec2_instance_traffic.connections.allow_from(
+                ec2.Peer.any_ipv4(),
+                # Same as TCP 22:
+                ec2.Port.SSH,
+                description="Allow SSH traffic IN",
+            )
+        else:
+            ## Every member of the group shares the instance's. This leaf only adds it's ports:
+            # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_ec2.SecurityGroup.html#static-fromwbrsecuritywbrgroupwbridscope-id-securitygroupid-options
+            self.sg_ec2_instance_traffic = ec2.SecurityGroup.from_security_group_id(
+                self,
+                "SgEc2InstanceTraffic",
+                security_group_id=host_group.sg_ec2_instance_traffic.security_group_id,
+            )
 
         ## Security Group for EFS instance's traffic:
         # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_ec2.SecurityGroup.html
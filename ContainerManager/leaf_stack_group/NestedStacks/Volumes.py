@@ -9,10 +9,12 @@ from aws_cdk import (
     NestedStack,
     Duration,
     RemovalPolicy,
+    Size,
     aws_ec2 as ec2,
     aws_ecs as ecs,
     aws_efs as efs,
     aws_iam as iam,
+    aws_s3 as s3,
     aws_cloudwatch as cloudwatch,
 )
 from constructs import Construct
@@ -33,21 +35,68 @@ class Volumes(NestedStack):
         container: ecs.ContainerDefinition,
         volumes_config: list,
         sg_efs_traffic: ec2.SecurityGroup,
+        efs_root_host: str = "/mnt/efs",
         **kwargs,
     ) -> None:
         super().__init__(scope, "VolumesNestedStack", **kwargs)
 
         self.efs_file_systems = {}
+        self.efs_mount_options = {}
+        ## Volumes the container uses a local copy of, and where that copy comes from:
+        # (EcsAsg keeps them in sync. The keys are the directory under /mnt/local)
+        self.local_copies = {}
+        self.s3_buckets = []
+        ## EBS volumes only exist while an instance is up, EcsAsg creates them from the last
+        # snapshot. (The keys are the directory under /mnt/ebs, the values are 'Volumes.<Id>.Ebs' + Paths):
+        self.ebs_volumes = {}
         traffic_out_metrics = {}
+        ## For the Dashboard, to see if the EFS is what's slow:
+        self.burst_credit_balance_metrics = []
+        self.percent_io_limit_metrics = []
+        self.permitted_throughput_metrics = []
         ## Loop over each volume in the config:
         for volume_name, volume_info in volumes_config.items():
-            if not volume_info["Type"] == "EFS":
-                continue
-
             volume_removal_policy = RemovalPolicy.RETAIN_ON_UPDATE_OR_DELETE \
                                     if volume_info["KeepOnDelete"] else \
                                     RemovalPolicy.DESTROY
 
+            if volume_info["Type"] == "S3":
+                # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_s3.Bucket.html
+                s3_bucket = s3.Bucket(
+                    self,
+                    f"S3-{volume_name}",
+                    removal_policy=volume_removal_policy,
+                    # Otherwise it can't be deleted, if there's anything in it:
+                    auto_delete_objects=not volume_info["KeepOnDelete"],
+                    encryption=s3.BucketEncryption.S3_MANAGED,
+                    enforce_ssl=True,
+                    block_public_access=s3.BlockPublicAccess.BLOCK_ALL,
+                    ## Each sync only uploads what changed. Versioning keeps what it replaced,
+                    # so older snapshots can still be restored for a while:
+                    versioned=volume_info["EnableBackups"],
+                    lifecycle_rules=[
+                        s3.LifecycleRule(noncurrent_version_expiration=Duration.days(30)),
+                    ] if volume_info["EnableBackups"] else None,
+                )
+                self.s3_buckets.append(s3_bucket)
+                ## S3 can't be mounted, so the container always uses a local copy:
+                self.local_copies[s3_bucket.node.id] = {
+                    "Source": f"s3://{s3_bucket.bucket_name}",
+                    "SyncMinutes": volume_info["LocalCopy"]["SyncMinutes"],
+                }
+                self._add_container_mounts(task_definition, container, "/mnt/local/", s3_bucket.node.id, volume_info["Paths"])
+                continue
+
+            if volume_info["Type"] == "EBS":
+                ebs_volume_id = f"Ebs-{volume_name}"
+                self.ebs_volumes[ebs_volume_id] = volume_info["Ebs"] | {
+                    "Paths": [path_info["Path"] for path_info in volume_info["Paths"]],
+                }
+                self._add_container_mounts(task_definition, container, "/mnt/ebs/", ebs_volume_id, volume_info["Paths"])
+                continue
+
+            performance_config = volume_info["Performance"]
+
             # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_efs.FileSystem.html
             efs_file_system = efs.FileSystem(
                 self,
@@ -58,9 +107,15 @@ class Volumes(NestedStack):
                 allow_anonymous_access=False,
                 enable_automatic_backups=volume_info["EnableBackups"],
                 encrypted=True,
-                ## No need to set, only in one AZ/Subnet already. If user increases that
-                ## number, they probably *want* more EFS instances. There's no other reason to:
-                # one_zone=True,
+                ## How fast it is. Bursting earns credits while idle, and slows to a crawl once
+                # a big world drains them. (Volumes.<Id>.Performance):
+                # https://docs.aws.amazon.com/efs/latest/ug/performance.html
+                throughput_mode=performance_config["ThroughputMode"],
+                provisioned_throughput_per_second=Size.mebibytes(performance_config["ProvisionedMiBps"]) \
+                                                  if performance_config["ProvisionedMiBps"] else None,
+                performance_mode=performance_config["PerformanceMode"],
+                # Cheaper, but only lives in the VPC's first AZ:
+                one_zone=performance_config["OneZone"],
             )
             ## Lock down in-transit encryption:
             # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_iam.PolicyStatement.html
@@ -78,6 +133,27 @@ class Volumes(NestedStack):
 
             ## Setup the paths to mount in the EC2:
             self.efs_file_systems[efs_file_system] = []
+            ## And how to mount them. (The NFS options are passed through the EFS mount helper):
+            # https://docs.aws.amazon.com/efs/latest/ug/mounting-fs-nfs-mount-settings.html
+            mount_options = volume_info["MountOptions"]
+            self.efs_mount_options[efs_file_system] = ",".join([
+                ## The docs didn't have 'iam', but you get permission denied without it:
+                "_netdev", "tls", "iam",
+                f"rsize={mount_options['ReadSizeBytes']}",
+                f"wsize={mount_options['WriteSizeBytes']}",
+                "noresvport" if mount_options["NoResvPort"] else "resvport",
+                # nconnect=1 is the kernel default, keep the fstab entry clean:
+                *([f"nconnect={mount_options['Nconnect']}"] if mount_options["Nconnect"] > 1 else []),
+            ])
+
+            ## Have the container use a copy on the instance store instead. EcsAsg keeps it in
+            # sync with the EFS, which stays the durable copy:
+            if volume_info["LocalCopy"]["Enabled"]:
+                self.local_copies[efs_file_system.node.id] = {
+                    "Source": f"{efs_root_host}/{efs_file_system.node.id}",
+                    "SyncMinutes": volume_info["LocalCopy"]["SyncMinutes"],
+                }
+            host_root = "/mnt/local/" if volume_info["LocalCopy"]["Enabled"] else f"{efs_root_host}/"
 
             ## (NOTE: There's a grant_root_access in EcsAsg.py ec2-role.
             #         I just didn't see a way to move it here without moving the role.)
@@ -93,30 +169,39 @@ class Volumes(NestedStack):
                 statistic="Sum",
             )
 
+            ## Performance Metrics. Credits draining means every spin-up is slower than the last:
+            # https://docs.aws.amazon.com/efs/latest/ug/efs-metrics.html
+            efs_dimensions = {"FileSystemId": efs_file_system.file_system_id}
+            self.burst_credit_balance_metrics.append(cloudwatch.Metric(
+                label=f"{volume_name} Burst Credits",
+                metric_name="BurstCreditBalance",
+                namespace="AWS/EFS",
+                dimensions_map=efs_dimensions,
+                period=Duration.minutes(1),
+                statistic="Minimum",
+            ))
+            self.permitted_throughput_metrics.append(cloudwatch.Metric(
+                label=f"{volume_name} Permitted Throughput",
+                metric_name="PermittedThroughput",
+                namespace="AWS/EFS",
+                dimensions_map=efs_dimensions,
+                period=Duration.minutes(1),
+                statistic="Minimum",
+            ))
+            # (Only General Purpose reports this one):
+            self.percent_io_limit_metrics.append(cloudwatch.Metric(
+                label=f"{volume_name} IO Limit",
+                metric_name="PercentIOLimit",
+                namespace="AWS/EFS",
+                dimensions_map=efs_dimensions,
+                period=Duration.minutes(1),
+                statistic="Maximum",
+                unit=cloudwatch.Unit.PERCENT,
+            ))
+
             ### Create mounts and attach them into the CONTAINER:
-            for volume_path_info in volume_info["Paths"]:
-                volume_path = volume_path_info["Path"]
-                self.efs_file_systems[efs_file_system].append(volume_path)
-                ## Create a UNIQUE name, using the path (Removing '.' and '/' too):
-                #   (Will be something like: `Efs-<Id>-<hash>`. Can't use path directly: names got too long, and prefix are all similar.)
-                volume_name = efs_file_system.node.id + "-" + hashlib.md5(volume_path.encode()).hexdigest()[:8]
-
-                # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_ecs.TaskDefinition.html#aws_cdk.aws_ecs.TaskDefinition.add_volume
-                task_definition.add_volume(
-                    name=volume_name,
-                    # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_ecs.Host.html
-                    host=ecs.Host(
-                        source_path="/mnt/efs/" + efs_file_system.node.id + volume_path,
-                    ),
-                )
-                # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_ecs.ContainerDefinition.html#addwbrmountwbrpointsmountpoints
-                container.add_mount_points(
-                    ecs.MountPoint(
-                        container_path=volume_path,
-                        source_volume=volume_name,
-                        read_only=volume_path_info["ReadOnly"],
-                    )
-                )
+            self.efs_file_systems[efs_file_system].extend(path_info["Path"] for path_info in volume_info["Paths"])
+            self._add_container_mounts(task_definition, container, host_root, efs_file_system.node.id, volume_info["Paths"])
 
         ## Get total traffic out:
         total_bytes_out = '+'.join(traffic_out_metrics.keys()) if traffic_out_metrics else "0"
@@ -130,3 +215,35 @@ class Volumes(NestedStack):
             using_metrics=traffic_out_metrics,
             period=Duration.minutes(1),
         )
+
+    def _add_container_mounts(
+        self,
+        task_definition: ecs.Ec2TaskDefinition,
+        container: ecs.ContainerDefinition,
+        host_root: str,
+        storage_id: str,
+        paths: list[dict],
+    ) -> None:
+        """ Mount each path from the host ('<host_root><storage_id><path>') into the container. """
+        for volume_path_info in paths:
+            volume_path = volume_path_info["Path"]
+            ## Create a UNIQUE name, using the path (Removing '.' and '/' too):
+            #   (Will be something like: `Efs-<Id>-<hash>`. Can't use path directly: names got too long, and prefix are all similar.)
+            volume_name = storage_id + "-" + hashlib.md5(volume_path.encode()).hexdigest()[:8]
+
+            # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_ecs.TaskDefinition.html#aws_cdk.aws_ecs.TaskDefinition.add_volume
+            task_definition.add_volume(
+                name=volume_name,
+                # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_ecs.Host.html
+                host=ecs.Host(
+                    source_path=host_root + storage_id + volume_path,
+                ),
+            )
+            # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_ecs.ContainerDefinition.html#addwbrmountwbrpointsmountpoints
+            container.add_mount_points(
+                ecs.MountPoint(
+                    container_path=volume_path,
+                    source_volume=volume_name,
+                    read_only=volume_path_info["ReadOnly"],
+                )
+            )
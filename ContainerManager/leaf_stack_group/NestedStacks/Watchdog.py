@@ -17,9 +17,16 @@ from aws_cdk import (
     aws_cloudwatch as cloudwatch,
     aws_cloudwatch_actions as cloudwatch_actions,
     aws_autoscaling as autoscaling,
+    aws_ssm as ssm,
 )
 from constructs import Construct
 
+from ContainerManager.base_stack import SharedLambda, HostGroup
+from ContainerManager.utils.lambda_profile import lambda_code_kwargs, lambda_profile_kwargs, lambda_profile_target
+
+## The phases the instance's 'boot_timing.sh' publishes, in the order they happen:
+BOOT_PHASES = ["OsBooted", "EfsMounted", "EcsRegistered", "ImagePulled", "TaskRunning", "Playable"]
+
 class Watchdog(NestedStack):
     """
     This sets up the logic for watching the container for
@@ -31,11 +38,16 @@ class Watchdog(NestedStack):
         leaf_construct_id: str,
         container_id: str,
         watchdog_config: dict,
+        ec2_config: dict,
         auto_scaling_group: autoscaling.AutoScalingGroup,
         metric_volume_bytes_out_per_second: cloudwatch.MathExpression,
         base_stack_sns_topic: sns.Topic,
         leaf_stack_sns_topic: sns.Topic,
         ecs_cluster: ecs.Cluster,
+        lambda_profile: dict,
+        shared_lambda: SharedLambda | None = None,
+        ec2_service: ecs.Ec2Service | None = None,
+        host_group: HostGroup | None = None,
         **kwargs,
     ) -> None:
         super().__init__(scope, "WatchdogNestedStack", **kwargs)
@@ -68,13 +80,18 @@ class Watchdog(NestedStack):
         self.metric_dimension_map = {
             "ContainerNameID": container_id,
         }
-        # And the metric it resets with:
+        ## How often the alarm checks. Under a minute, the metrics it reads are published
+        # as high-resolution too: (Only in the 'Connections' Mode, NetworkIn is 1-minute)
+        # https://docs.aws.amazon.com/AmazonCloudWatch/latest/monitoring/publishingMetrics.html#high-resolution-metrics
+        self.metric_period = Duration.seconds(watchdog_config["PeriodSeconds"])
+        # And the metric it resets with. (In a HostGroup, the group's. Someone asking for
+        # any member keeps the instance up, see the HostGroup's alarm):
         self.traffic_dns_metric = cloudwatch.Metric(
             label="DNS Traffic",
             metric_name="DNSTraffic",
-            namespace=self.metric_namespace,
-            dimensions_map=self.metric_dimension_map,
-            period=Duration.minutes(1),
+            namespace=self.metric_namespace if host_group is None else host_group.metric_namespace,
+            dimensions_map=self.metric_dimension_map if host_group is None else host_group.metric_dimension_map,
+            period=self.metric_period,
             statistic="Maximum",
             unit=self.metric_unit,
         )
@@ -106,30 +123,56 @@ class Watchdog(NestedStack):
             period=Duration.minutes(1),
         )
 
+        ## How many clients are connected, counted on the instance itself. Doesn't get fooled by
+        # the container downloading, or a quiet UDP stream. Also published by the instance:
+        # (See 'instance_scripts/connection_count.sh', only installed in the 'Connections' Mode)
+        self.connections_metric = cloudwatch.Metric(
+            label="Active Connections",
+            metric_name="ActiveConnections",
+            namespace=self.metric_namespace,
+            dimensions_map=self.metric_dimension_map,
+            period=self.metric_period,
+            statistic="Maximum",
+            unit=self.metric_unit,
+        )
+
         ## Combine metrics here before creating the alarm:
         # Docs: https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_cloudwatch.MathExpression.html
         # Info: https://docs.aws.amazon.com/AmazonCloudWatch/latest/monitoring/using-metric-math.html
         # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_cloudwatch.MathExpression.html
-        self.watchdog_traffic_metric = cloudwatch.MathExpression(
-            label="Watchdog Container Traffic",
-            # Only push data if positive. Also don't push anything otherwise: This happens when efs
-            # is accessed at the end of one poll, and it's traffic_in is in the next poll. Garbage
-            # anyways, so ignore it. (If you need to add it back, put '0' as a third augment to IF)
-            expression="IF(traffic_in - volumes_out > 0, traffic_in - volumes_out) + dns_hit",
-            using_metrics={
-                # Traffic in (to container) minus volumes out (of efs), to get traffic only from clients:
-                "traffic_in": self.bytes_in_per_second,
-                "volumes_out": metric_volume_bytes_out_per_second,
-                "dns_hit": self.traffic_dns_metric,
-            },
-            period=Duration.minutes(1),
-        )
+        if watchdog_config["Mode"] == "CONNECTIONS":
+            self.watchdog_traffic_metric = cloudwatch.MathExpression(
+                label="Watchdog Container Connections",
+                # The DNS hit only shows up when someone's trying to connect, don't let it hide the count:
+                expression="connections + FILL(dns_hit, 0)",
+                using_metrics={
+                    "connections": self.connections_metric,
+                    "dns_hit": self.traffic_dns_metric,
+                },
+                period=self.metric_period,
+            )
+        else:
+            self.watchdog_traffic_metric = cloudwatch.MathExpression(
+                label="Watchdog Container Traffic",
+                # Only push data if positive. Also don't push anything otherwise: This happens when efs
+                # is accessed at the end of one poll, and it's traffic_in is in the next poll. Garbage
+                # anyways, so ignore it. (If you need to add it back, put '0' as a third augment to IF)
+                expression="IF(traffic_in - volumes_out > 0, traffic_in - volumes_out) + dns_hit",
+                using_metrics={
+                    # Traffic in (to container) minus volumes out (of efs), to get traffic only from clients:
+                    "traffic_in": self.bytes_in_per_second,
+                    "volumes_out": metric_volume_bytes_out_per_second,
+                    "dns_hit": self.traffic_dns_metric,
+                },
+                period=Duration.minutes(1),
+            )
 
         ## Trigger if 0 people are connected for too long:
         # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_cloudwatch.Metric.html#createwbralarmscope-id-props
         #       Total Duration = Number of Periods * Period length... so
         #       Number of Periods = Total Duration / Period length
-        evaluation_periods = int(watchdog_config["MinutesWithoutConnections"].to_minutes() / self.watchdog_traffic_metric.period.to_minutes())
+        # (In seconds, so it works with sub-minute periods and windows too)
+        evaluation_periods = int(watchdog_config["MinutesWithoutConnections"].to_seconds() / self.watchdog_traffic_metric.period.to_seconds())
         self.alarm_container_activity = self.watchdog_traffic_metric.create_alarm(
             self,
             "AlarmContainerActivity",
@@ -142,27 +185,53 @@ class Watchdog(NestedStack):
         )
         ## Call this if switching to ALARM:
         # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_cloudwatch.Alarm.html#addwbralarmwbractionactions
-        self.alarm_container_activity.add_alarm_action(
-            cloudwatch_actions.AutoScalingAction(self.scale_down_asg_action)
-        )
+        #   (In a HostGroup, the other members might still be in use. The group's alarm
+        #   spins the instance down instead, once every member is empty)
+        if host_group is None:
+            self.alarm_container_activity.add_alarm_action(
+                cloudwatch_actions.AutoScalingAction(self.scale_down_asg_action)
+            )
 
 
         ################################
         ## Instance Up too-long Logic ##
         ################################
 
-        ## Use the `traffic_in_metric` from above. If it has data, the instance is up:
-        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_cloudwatch.MathExpression.html
-        self.instance_is_up = cloudwatch.MathExpression(
-            # Doing N/A or 1, so alarms are blank if no instance/data:
-            # (save on cloudwatch api calls when system is off)
-            label="Instance is Up (Bool)",
-            expression="network_in >= 0",
-            using_metrics={
-                "network_in": traffic_in_metric,
-            },
-            period=traffic_in_metric.period,
-        )
+        if ec2_config["WarmPool"]["Enabled"]:
+            ## Warm pool instances ALSO report traffic while they're being initialized, even
+            # though the ASG is at 0. Only count the instances that are actually InService:
+            # https://docs.aws.amazon.com/autoscaling/ec2/userguide/ec2-auto-scaling-metrics.html
+            in_service_metric = cloudwatch.Metric(
+                label="InService Instances",
+                metric_name="GroupInServiceInstances",
+                namespace="AWS/AutoScaling",
+                dimensions_map={"AutoScalingGroupName": auto_scaling_group.auto_scaling_group_name},
+                period=Duration.minutes(1),
+                statistic="Maximum",
+            )
+            self.instance_is_up = cloudwatch.MathExpression(
+                # Group metrics post '0' when nothing is up. Drop those, to
+                # keep the same N/A or 1 behavior as the traffic version below:
+                label="Instance is Up (Bool)",
+                expression="IF(in_service > 0, in_service)",
+                using_metrics={
+                    "in_service": in_service_metric,
+                },
+                period=in_service_metric.period,
+            )
+        else:
+            ## Use the `traffic_in_metric` from above. If it has data, the instance is up:
+            # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_cloudwatch.MathExpression.html
+            self.instance_is_up = cloudwatch.MathExpression(
+                # Doing N/A or 1, so alarms are blank if no instance/data:
+                # (save on cloudwatch api calls when system is off)
+                label="Instance is Up (Bool)",
+                expression="network_in >= 0",
+                using_metrics={
+                    "network_in": traffic_in_metric,
+                },
+                period=traffic_in_metric.period,
+            )
 
         ## Trigger if the instance is up too long:
         # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_cloudwatch.Alarm.html
@@ -195,6 +264,122 @@ class Watchdog(NestedStack):
             )
 
 
+        ########################
+        ## Boot Timing Metrics ##
+        ########################
+        ## Seconds since the OS started, that each phase finished. Published by the instance itself:
+        # (See 'instance_scripts/boot_timing.sh', installed by the EcsAsg user data)
+        self.boot_phase_metrics = {
+            phase: cloudwatch.Metric(
+                label=phase,
+                metric_name="BootPhaseSeconds",
+                namespace=self.metric_namespace,
+                dimensions_map=self.metric_dimension_map | {"Phase": phase},
+                period=Duration.minutes(1),
+                statistic="Maximum",
+                unit=cloudwatch.Unit.SECONDS,
+            ) for phase in BOOT_PHASES
+        }
+        # The one everyone cares about. How long until you can actually connect:
+        self.time_to_playable_metric = self.boot_phase_metrics["Playable"]
+
+        ## The root volume's average latency and queue depth. Also published by the instance:
+        # (See 'instance_scripts/ebs_stats.sh', installed by the EcsAsg user data)
+        self.ebs_latency_metrics = {
+            label: cloudwatch.Metric(
+                label=label,
+                metric_name=metric_name,
+                namespace=self.metric_namespace,
+                dimensions_map=self.metric_dimension_map,
+                period=Duration.minutes(1),
+                statistic="Maximum",
+                unit=cloudwatch.Unit.MILLISECONDS,
+            ) for label, metric_name in [("Read", "EbsReadLatency"), ("Write", "EbsWriteLatency")]
+        }
+        self.ebs_queue_depth_metric = cloudwatch.Metric(
+            label="Queue Depth",
+            metric_name="EbsQueueDepth",
+            namespace=self.metric_namespace,
+            dimensions_map=self.metric_dimension_map,
+            period=Duration.minutes(1),
+            statistic="Maximum",
+            unit=cloudwatch.Unit.COUNT,
+        )
+
+        ## How long each sync of the local copies took, how much it moved, and how fast. Pull is
+        # the copy down before the task starts, Push is writing it back. Also published by the instance:
+        # (See 'instance_scripts/local_copy.sh', only installed if a volume has 'LocalCopy' or is S3)
+        self.local_copy_sync_seconds_metrics = {
+            direction: cloudwatch.Metric(
+                label=f"{direction} Seconds",
+                metric_name="LocalCopySyncSeconds",
+                namespace=self.metric_namespace,
+                dimensions_map=self.metric_dimension_map | {"Direction": direction},
+                period=Duration.minutes(1),
+                statistic="Maximum",
+                unit=cloudwatch.Unit.SECONDS,
+            ) for direction in ["Pull", "Push"]
+        }
+        self.local_copy_sync_bytes_metrics = {
+            direction: cloudwatch.Metric(
+                label=f"{direction} Bytes",
+                metric_name="LocalCopySyncBytes",
+                namespace=self.metric_namespace,
+                dimensions_map=self.metric_dimension_map | {"Direction": direction},
+                period=Duration.minutes(1),
+                statistic="Sum",
+                unit=cloudwatch.Unit.BYTES,
+            ) for direction in ["Pull", "Push"]
+        }
+        self.local_copy_sync_throughput_metrics = {
+            direction: cloudwatch.Metric(
+                label=f"{direction} Throughput",
+                metric_name="LocalCopySyncThroughput",
+                namespace=self.metric_namespace,
+                dimensions_map=self.metric_dimension_map | {"Direction": direction},
+                period=Duration.minutes(1),
+                statistic="Average",
+                unit=cloudwatch.Unit.BYTES_PER_SECOND,
+            ) for direction in ["Pull", "Push"]
+        }
+
+
+        #######################
+        ## Cold Start Metric ##
+        #######################
+        ## Seconds from the first DNS query, to DNS pointing at the instance. This is what
+        # the person connecting actually waits through. The trigger_start_system lambda saves
+        # when the query came in here, and the instance-StateChange-hook publishes the metric:
+        self.cold_start_parameter_name = f"/{leaf_construct_id}/ColdStartTimestamp"
+        self.cold_start_metric = cloudwatch.Metric(
+            label="Cold Start",
+            metric_name="ColdStartSeconds",
+            namespace=self.metric_namespace,
+            dimensions_map=self.metric_dimension_map,
+            period=Duration.days(1),
+            statistic="Maximum",
+            unit=cloudwatch.Unit.SECONDS,
+        )
+        ## Optional, alert if spinning up gets slower than expected:
+        self.alarm_cold_start = None
+        if watchdog_config["ColdStartAlarmSeconds"] is not None:
+            self.alarm_cold_start = self.cold_start_metric.with_(period=Duration.hours(1)).create_alarm(
+                self,
+                "AlarmColdStart",
+                alarm_name=f"Cold Start - [{leaf_construct_id}]",
+                alarm_description="Trigger if spinning up took longer than expected",
+                threshold=watchdog_config["ColdStartAlarmSeconds"],
+                comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_THRESHOLD,
+                evaluation_periods=1,
+                # Only published when something spins up, most hours won't have data:
+                treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING,
+            )
+            # Only admin would care about this one too:
+            self.alarm_cold_start.add_alarm_action(
+                cloudwatch_actions.SnsAction(base_stack_sns_topic)
+            )
+
+
         ##########################################
         ## Container Crash-loop Detection Logic ##
         ##########################################
@@ -203,60 +388,99 @@ class Watchdog(NestedStack):
         # ECS would try to keep running the task, and it downloading would stop the
         # Watchdog traffic metric above from spinning down the system.
 
-        ## Log group for the lambda function:
-        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_logs.LogGroup.html
-        log_group_break_crash_loop = logs.LogGroup(
-            self,
-            "LogGroupStartSystem",
-            retention=logs.RetentionDays.ONE_WEEK,
-            removal_policy=RemovalPolicy.DESTROY,
-            log_group_name=f"/aws/lambda/{container_id_alpha}-break-crash-loop",
+        # Give it permissions to update the ASG desired_capacity:
+        break_crash_loop_statement = iam.PolicyStatement(
+            effect=iam.Effect.ALLOW,
+            actions=[
+                "autoscaling:UpdateAutoScalingGroup",
+            ],
+            resources=[auto_scaling_group.auto_scaling_group_arn],
         )
 
-        ## Policy/Role for lambda function:
-        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_iam.Role.html
-        role_break_crash_loop = iam.Role(
-            self,
-            "AsgStateChangeHookRole",
-            assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"),
-            description="Role for the AsgStateChangeHook lambda function.",
-        )
+        if shared_lambda is None:
+            ## Log group for the lambda function:
+            # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_logs.LogGroup.html
+            log_group_break_crash_loop = logs.LogGroup(
+                self,
+                "LogGroupStartSystem",
+                retention=logs.RetentionDays.ONE_WEEK,
+                removal_policy=RemovalPolicy.DESTROY,
+                log_group_name=f"/aws/lambda/{container_id_alpha}-break-crash-loop",
+            )
+
+            ## Policy/Role for lambda function:
+            # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_iam.Role.html
+            role_break_crash_loop = iam.Role(
+                self,
+                "AsgStateChangeHookRole",
+                assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"),
+                description="Role for the AsgStateChangeHook lambda function.",
+            )
+
+            ## Lambda function spin down ASG if container errors/throws:
+            # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_lambda.Function.html
+            self.lambda_break_crash_loop = aws_lambda.Function(
+                self,
+                "BreakCrashLoop",
+                description=f"{container_id_alpha}-break-crash-loop: Triggered if container throws, to spins down ASG.",
+                **lambda_code_kwargs("spin_down_asg_on_error"),
+                runtime=aws_lambda.Runtime.PYTHON_3_12,
+                **lambda_profile_kwargs(lambda_profile),
+                log_group=log_group_break_crash_loop,
+                role=role_break_crash_loop,
+                environment={
+                    "ASG_NAME": auto_scaling_group.auto_scaling_group_name,
+                },
+            )
+            # If SnapStart/ProvisionedConcurrency is on, the rule has to invoke a published version:
+            self.lambda_break_crash_loop_target = lambda_profile_target(self, self.lambda_break_crash_loop, lambda_profile)
+            ### Lambda Permissions:
+            # Give it write to it's own log group:
+            log_group_break_crash_loop.grant_write(self.lambda_break_crash_loop)
+        else:
+            ## Shared lambda: Save which ASG to spin down, under this leaf's cluster:
+            #   (The cluster's ARN has ':' in it, which SSM names can't. The lambda uses the name too)
+            # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_ssm.StringParameter.html
+            #   (Every member of a HostGroup has the same cluster, so the group saves it instead)
+            if host_group is None:
+                self.shared_lambda_parameter = ssm.StringParameter(
+                    self,
+                    "SharedLambdaParameter",
+                    # The name isn't known until deploy, and starts with a '/':
+                    simple_name=False,
+                    parameter_name=f"{shared_lambda.leaf_parameter_prefix}/{ecs_cluster.cluster_name}",
+                    description=f"Which ASG the shared BreakCrashLoop lambda spins down for '{container_id}'.",
+                    string_value=self.to_json_string({
+                        "ASG_NAME": auto_scaling_group.auto_scaling_group_name,
+                    }),
+                )
+            # The shared lambda's role, so this leaf can add it's own permissions to it:
+            role_break_crash_loop = iam.Role.from_role_arn(
+                self,
+                "SharedBreakCrashLoopRole",
+                role_arn=shared_lambda.role.role_arn,
+                mutable=True,
+            )
+            # The base stack already lets every rule in the account invoke it:
+            self.lambda_break_crash_loop_target = aws_lambda.Function.from_function_attributes(
+                self,
+                "SharedBreakCrashLoop",
+                function_arn=shared_lambda.function.function_arn,
+                skip_permissions=True,
+            )
+
         # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_iam.Policy.html
-        policy_break_crash_loop = iam.Policy(
+        iam.Policy(
             self,
             "AsgStateChangeHookPolicy",
             roles=[role_break_crash_loop],
-            # Statements added at the end of this file:
-            statements=[],
+            statements=[break_crash_loop_statement],
         )
 
-        ## Lambda function spin down ASG if container errors/throws:
-        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_lambda.Function.html
-        self.lambda_break_crash_loop = aws_lambda.Function(
-            self,
-            "BreakCrashLoop",
-            description=f"{container_id_alpha}-break-crash-loop: Triggered if container throws, to spins down ASG.",
-            code=aws_lambda.Code.from_asset("./ContainerManager/leaf_stack_group/lambda_functions/spin_down_asg_on_error/"),
-            handler="main.lambda_handler",
-            runtime=aws_lambda.Runtime.PYTHON_3_12,
-            log_group=log_group_break_crash_loop,
-            role=role_break_crash_loop,
-            environment={
-                "ASG_NAME": auto_scaling_group.auto_scaling_group_name,
-            },
-        )
-        ### Lambda Permissions:
-        # Give it write to it's own log group:
-        log_group_break_crash_loop.grant_write(self.lambda_break_crash_loop)
-        # Give it permissions to update the ASG desired_capacity:
-        policy_break_crash_loop.add_statements(
-            iam.PolicyStatement(
-                effect=iam.Effect.ALLOW,
-                actions=[
-                    "autoscaling:UpdateAutoScalingGroup",
-                ],
-                resources=[auto_scaling_group.auto_scaling_group_arn],
-            )
+        ## Only this leaf's task. (In a HostGroup, the cluster has every member's):
+        # https://docs.aws.amazon.com/AmazonECS/latest/developerguide/ecs_task_events.html
+        task_filter = {"clusterArn": [ecs_cluster.cluster_arn]} | (
+            {} if host_group is None else {"group": [f"service:{ec2_service.service_name}"]}
         )
 
         ### Check for the Task Failing:
@@ -273,7 +497,7 @@ class Watchdog(NestedStack):
                 detail={
                     ## For matching event detail patterns:
                     # https://docs.aws.amazon.com/eventbridge/latest/userguide/eb-create-pattern-operators.html
-                    "clusterArn": [ecs_cluster.cluster_arn],
+                    **task_filter,
                     "desiredStatus": ["STOPPED"],
                     "$or": [
                         # If the container doesn't start at all:
@@ -296,15 +520,27 @@ class Watchdog(NestedStack):
                 ## ALSO if DNS comes in and the instance tries to spin up during an error, this'll still trigger.
                 #  However the alarm will still be "alarmed", and won't trigger. This HAS to happen here.
                 ## https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_events_targets.LambdaFunction.html
-                events_targets.LambdaFunction(self.lambda_break_crash_loop),
+                events_targets.LambdaFunction(self.lambda_break_crash_loop_target),
             ],
         )
 
-        metric_break_crash_loop_count = self.lambda_break_crash_loop.metric_invocations(
-            unit=cloudwatch.Unit.COUNT,
-            statistic="Maximum",
-            period=Duration.minutes(1),
-        )
+        if shared_lambda is None:
+            metric_break_crash_loop_count = self.lambda_break_crash_loop.metric_invocations(
+                unit=cloudwatch.Unit.COUNT,
+                statistic="Maximum",
+                period=Duration.minutes(1),
+            )
+        else:
+            ## The shared lambda runs for every leaf. Count this leaf's rule triggering instead:
+            # https://docs.aws.amazon.com/eventbridge/latest/userguide/eb-monitoring.html
+            metric_break_crash_loop_count = cloudwatch.Metric(
+                namespace="AWS/Events",
+                metric_name="TriggeredRules",
+                dimensions_map={"RuleName": self.rule_break_crash_loop.rule_name},
+                unit=cloudwatch.Unit.COUNT,
+                statistic="Maximum",
+                period=Duration.minutes(1),
+            )
         self.alarm_break_crash_loop_count = metric_break_crash_loop_count.create_alarm(
             self,
             "AlarmBreakCrashLoop",
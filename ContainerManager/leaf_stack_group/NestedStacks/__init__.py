@@ -5,9 +5,11 @@ apart to keep things manageable.
 """
 
 from .AsgStateChangeHook import AsgStateChangeHook
+from .BakedAmi import BakedAmi
 from .Container import Container
 from .Dashboard import Dashboard
 from .EcsAsg import EcsAsg
+from .PreWarm import PreWarm
 from .Volumes import Volumes
 from .SecurityGroups import SecurityGroups
 from .Watchdog import Watchdog
@@ -71,6 +71,21 @@ class ContainerManagerStack(Stack):
         )
 
 
+        ################
+        ## Host Group ##
+        ################
+        ## Run on the group's instance, instead of this leaf's own:
+        self.host_group = None
+        if config["HostGroup"] is not None:
+            host_group_name = config["HostGroup"]["Name"]
+            if host_group_name not in base_stack.host_groups:
+                raise ValueError(f"HostGroup '{host_group_name}' isn't in the base config's 'HostGroups': {sorted(base_stack.host_groups)}")
+            self.host_group = base_stack.host_groups[host_group_name]
+            # The rest of the leaf (Dashboard, image architecture, etc) describes the instance with it:
+            if config["Ec2"]["InstanceTypes"] != [self.host_group.instance_type]:
+                raise ValueError(f"Ec2.InstanceType has to be the HostGroup's ('{self.host_group.instance_type}'), got: {config['Ec2']['InstanceTypes']}")
+
+
         #####################
         ## Core Leaf Stack ##
         #####################
@@ -83,6 +98,7 @@ class ContainerManagerStack(Stack):
             vpc=base_stack.vpc,
             container_id=container_id,
             container_ports_config=config["Container"]["Ports"],
+            host_group=self.host_group,
         )
 
         ### All the info for the Container Stuff
@@ -93,6 +109,8 @@ class ContainerManagerStack(Stack):
             container_id=container_id,
             ec2_config=config["Ec2"],
             container_config=config["Container"],
+            cached_registries=base_stack.cached_registries,
+            host_group_config=config["HostGroup"],
         )
 
         ### All the info for Volumes Stuff
@@ -104,21 +122,41 @@ class ContainerManagerStack(Stack):
             container=self.container_nested_stack.container,
             volumes_config=config["Volumes"],
             sg_efs_traffic=self.sg_nested_stack.sg_efs_traffic,
+            # Every member's EFS's are mounted on the same instance:
+            efs_root_host=self.host_group.efs_root_host(container_id) if self.host_group else "/mnt/efs",
         )
 
+        ### All the info for the Baked AMI Stuff
+        if config["Ec2"]["BakedAmi"]["Enabled"]:
+            self.baked_ami_nested_stack = NestedStacks.BakedAmi(
+                self,
+                description=f"Baked AMI Logic for {construct_id}",
+                leaf_construct_id=construct_id,
+                vpc=base_stack.vpc,
+                ec2_config=config["Ec2"],
+                container_config=config["Container"],
+                image_uri=self.container_nested_stack.image_uri,
+            )
+
         ### All the info for the ECS and ASG Stuff
         self.ecs_asg_nested_stack = NestedStacks.EcsAsg(
             self,
             description=f"Ec2Service Logic for {construct_id}",
             leaf_construct_id=construct_id,
+            container_id=container_id,
             vpc=base_stack.vpc,
             ssh_key_pair=base_stack.ssh_key_pair,
             base_stack_sns_topic=base_stack.sns_notify_topic,
             leaf_stack_sns_topic=self.sns_notify_topic,
             task_definition=self.container_nested_stack.task_definition,
             ec2_config=config["Ec2"],
+            watchdog_config=config["Watchdog"],
             sg_ec2_instance_traffic=self.sg_nested_stack.sg_ec2_instance_traffic,
-            efs_file_systems=self.volumes_nested_stack.efs_file_systems,
+            volumes_nested_stack=self.volumes_nested_stack,
+            baked_ami_parameter=self.baked_ami_nested_stack.ami_parameter if config["Ec2"]["BakedAmi"]["Enabled"] else None,
+            domain_stack=domain_stack,
+            dns_config=config["Dns"],
+            host_group=self.host_group,
         )
 
         ### All the info for the Watchdog Stuff
@@ -128,22 +166,47 @@ class ContainerManagerStack(Stack):
             leaf_construct_id=construct_id,
             container_id=container_id,
             watchdog_config=config["Watchdog"],
+            ec2_config=config["Ec2"],
             auto_scaling_group=self.ecs_asg_nested_stack.auto_scaling_group,
             metric_volume_bytes_out_per_second=self.volumes_nested_stack.bytes_out_per_second,
             base_stack_sns_topic=base_stack.sns_notify_topic,
             leaf_stack_sns_topic=self.sns_notify_topic,
             ecs_cluster=self.ecs_asg_nested_stack.ecs_cluster,
+            lambda_profile=config["Lambdas"]["BreakCrashLoop"],
+            shared_lambda=base_stack.shared_break_crash_loop,
+            ec2_service=self.ecs_asg_nested_stack.ec2_service,
+            host_group=self.host_group,
         )
 
+        ### Spin up ahead of when it's usually played:
+        if config["PreWarm"]["Enabled"]:
+            self.prewarm_nested_stack = NestedStacks.PreWarm(
+                self,
+                description=f"PreWarm Logic for {construct_id}",
+                leaf_construct_id=construct_id,
+                container_id=container_id,
+                prewarm_config=config["PreWarm"],
+                auto_scaling_group=self.ecs_asg_nested_stack.auto_scaling_group,
+                traffic_dns_metric=self.watchdog_nested_stack.traffic_dns_metric,
+                activity_alarm=self.watchdog_nested_stack.alarm_container_activity,
+            )
+
         ### All the info for the Asg StateChange Hook Stuff
         self.asg_state_change_hook_nested_stack = NestedStacks.AsgStateChangeHook(
             self,
             description=f"AsgStateChangeHook Logic for {construct_id}",
             container_id=container_id,
             domain_stack=domain_stack,
+            ec2_config=config["Ec2"],
             auto_scaling_group=self.ecs_asg_nested_stack.auto_scaling_group,
             base_stack_sns_topic=base_stack.sns_notify_topic,
             leaf_stack_sns_topic=self.sns_notify_topic,
+            cold_start_metric=self.watchdog_nested_stack.cold_start_metric,
+            cold_start_parameter_name=self.watchdog_nested_stack.cold_start_parameter_name,
+            lambda_profile=config["Lambdas"]["AsgStateChangeHook"],
+            dns_config=config["Dns"],
+            shared_lambda=base_stack.shared_asg_state_change_hook,
+            shared_queue=getattr(base_stack, "asg_state_change_queue", None),
         )
 
         ######################
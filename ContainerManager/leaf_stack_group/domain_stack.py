@@ -15,6 +15,15 @@ from constructs import Construct
 
 from ContainerManager.base_stack import BaseStack
 
+def dns_log_query_filter(sub_domain_name: str, record_type: route53.RecordType) -> str:
+    """
+    What the Start System's subscription filter looks for in the query logs.
+        (Also used by the simulators, to replay exported logs the same way)
+    """
+    # Spaces on the ends to not match sub-domains like "_tcp.*" that shows up in logs.
+    # The record_type is because BOTH A and AAAA appear, even if my ISP only supports one.
+    return f" {sub_domain_name} {record_type.value} "
+
 class DomainStack(Stack):
     """
     This stack creates a subdomain for the container, and ties it to the root domain.
@@ -37,9 +46,7 @@ class DomainStack(Stack):
         self.dns_ttl = 1
         self.record_type = route53.RecordType.A
         self.sub_domain_name = f"{container_id}.{base_stack.root_hosted_zone.zone_name}".lower()
-        # Spaces on the ends to not match sub-domains like "_tcp.*" that shows up in logs.
-        # The record_type is because BOTH A and AAAA appear, even if my ISP only supports one.
-        self.dns_log_query_filter = f" {self.sub_domain_name} {self.record_type.value} "
+        self.dns_log_query_filter = dns_log_query_filter(self.sub_domain_name, self.record_type)
 
         ## Log group for the Route53 DNS logs:
         self.route53_query_log_group = logs.LogGroup(
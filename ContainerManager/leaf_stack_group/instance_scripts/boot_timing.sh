@@ -0,0 +1,79 @@
+#!/bin/bash
+##
+## Publishes how long each phase of spinning up took, in seconds since the OS started.
+## Runs as the 'boot-timing' systemd service, so it runs on EVERY boot (not just the
+## first like user data). The variables come from /etc/boot-timing.env, written by
+## the EcsAsg user data:
+##   NAMESPACE, CONTAINER_ID, AWS_REGION, IMAGE, EFS_MOUNT_POINTS, LISTEN_PORTS
+##
+set -u
+
+# Give up after this long, and publish whatever phases finished:
+TIMEOUT_SECONDS=900
+ECS_INTROSPECTION="http://localhost:51678/v1"
+
+imds() {
+    local token
+    token=$(curl -s -X PUT "http://169.254.169.254/latest/api/token" -H "X-aws-ec2-metadata-token-ttl-seconds: 60")
+    curl -s -H "X-aws-ec2-metadata-token: $token" "http://169.254.169.254/latest/meta-data/$1"
+}
+
+## Warm pool instances boot once to initialize. Nobody is waiting on that one:
+if [[ "$(imds autoscaling/target-lifecycle-state)" == Warmed:* ]]; then
+    exit 0
+fi
+
+METRIC_DATA=()
+record_phase() {
+    local phase="$1" seconds="$2"
+    logger -s -t boot-timing "$phase after ${seconds}s"
+    METRIC_DATA+=("MetricName=BootPhaseSeconds,Dimensions=[{Name=ContainerNameID,Value=$CONTAINER_ID},{Name=Phase,Value=$phase}],Value=$seconds,Unit=Seconds")
+}
+
+wait_for_phase() {
+    local phase="$1"; shift
+    until "$@" >/dev/null 2>&1; do
+        if (( SECONDS > TIMEOUT_SECONDS )); then
+            logger -s -t boot-timing "Gave up waiting for $phase"
+            return 1
+        fi
+        sleep 1
+    done
+    record_phase "$phase" "$(cut -d' ' -f1 /proc/uptime)"
+}
+
+## The checks for each phase:
+efs_mounted() {
+    local mount_point
+    for mount_point in $EFS_MOUNT_POINTS; do
+        mountpoint -q "$mount_point" || return 1
+    done
+}
+ecs_registered() { curl -sf "$ECS_INTROSPECTION/metadata" | grep -q '"ContainerInstanceArn":"arn:'; }
+image_pulled() { docker image inspect "$IMAGE"; }
+task_running() { curl -sf "$ECS_INTROSPECTION/tasks" | grep -q '"KnownStatus":"RUNNING"'; }
+# Host networking, so the container's ports are the instance's. (Works for both TCP and UDP):
+ports_listening() {
+    local port
+    for port in $LISTEN_PORTS; do
+        [[ -n "$(ss -Hlnu "sport = :$port"; ss -Hlnt "sport = :$port")" ]] || return 1
+    done
+}
+
+## systemd already knows when the network came up, no need to wait on it:
+network_online_us=$(systemctl show network-online.target -p ActiveEnterTimestampMonotonic --value)
+record_phase "OsBooted" "$(( network_online_us / 1000000 ))"
+
+# Each phase happens after the one before it, stop at the first one that doesn't finish:
+wait_for_phase "EfsMounted" efs_mounted \
+    && wait_for_phase "EcsRegistered" ecs_registered \
+    && wait_for_phase "ImagePulled" image_pulled \
+    && wait_for_phase "TaskRunning" task_running \
+    && wait_for_phase "Playable" ports_listening
+
+## The ECS AMI doesn't always come with the cli:
+command -v aws >/dev/null || dnf install -y awscli-2
+aws cloudwatch put-metric-data \
+    --region "$AWS_REGION" \
+    --namespace "$NAMESPACE" \
+    --metric-data "${METRIC_DATA[@]}"
@@ -0,0 +1,56 @@
+#!/bin/bash
+##
+## Publishes how many clients are connected to the container every period, for the Watchdog
+## to use instead of guessing from network traffic. Established TCP connections come from
+## 'ss', and UDP "connections" from conntrack (games mostly use one unconnected UDP socket,
+## so 'ss' only ever sees one). A UDP flow drops out of conntrack once it's quiet for ~2 min.
+## Runs as the 'connection-count' systemd service, so it runs on EVERY boot. The variables
+## come from /etc/connection-count.env, written by the EcsAsg user data:
+##   NAMESPACE, CONTAINER_ID, AWS_REGION, LISTEN_PORTS (i.e "tcp:25565 udp:19132"),
+##   PERIOD_SECONDS (The Watchdog's 'PeriodSeconds')
+##
+set -u
+
+## Under a minute, the alarm needs high-resolution data to see each period:
+# https://docs.aws.amazon.com/AmazonCloudWatch/latest/monitoring/publishingMetrics.html#high-resolution-metrics
+STORAGE_RESOLUTION=60
+(( PERIOD_SECONDS < 60 )) && STORAGE_RESOLUTION=1
+
+imds() {
+    local token
+    token=$(curl -s -X PUT "http://169.254.169.254/latest/api/token" -H "X-aws-ec2-metadata-token-ttl-seconds: 60")
+    curl -s -H "X-aws-ec2-metadata-token: $token" "http://169.254.169.254/latest/meta-data/$1"
+}
+
+## Warm pool instances boot once to initialize. Nobody can connect to that one:
+if [[ "$(imds autoscaling/target-lifecycle-state)" == Warmed:* ]]; then
+    exit 0
+fi
+
+## The ECS AMI doesn't always come with these:
+command -v aws >/dev/null || dnf install -y awscli-2
+command -v conntrack >/dev/null || dnf install -y conntrack-tools
+
+## Host networking, so the container's ports are the instance's:
+count_connections() {
+    local entry protocol port total=0 count
+    for entry in $LISTEN_PORTS; do
+        IFS=: read -r protocol port <<< "$entry"
+        if [[ "$protocol" == "tcp" ]]; then
+            count=$(ss -Htn state established "( sport = :$port )" | wc -l)
+        else
+            count=$(conntrack -L -p udp --orig-port-dst "$port" 2>/dev/null | wc -l)
+        fi
+        total=$(( total + count ))
+    done
+    echo "$total"
+}
+
+while true; do
+    connections=$(count_connections)
+    aws cloudwatch put-metric-data \
+        --region "$AWS_REGION" \
+        --namespace "$NAMESPACE" \
+        --metric-data "MetricName=ActiveConnections,Dimensions=[{Name=ContainerNameID,Value=$CONTAINER_ID}],Value=$connections,Unit=Count,StorageResolution=$STORAGE_RESOLUTION"
+    sleep "$PERIOD_SECONDS"
+done
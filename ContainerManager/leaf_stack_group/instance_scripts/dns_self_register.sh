@@ -0,0 +1,43 @@
+#!/bin/bash
+##
+## Points the DNS record at this instance, as soon as it has a public IP. This skips
+## waiting on the ASG's "Launch Successful" event and the AsgStateChangeHook lambda,
+## which still runs afterwards as a fallback (and to reset the record on terminate).
+## Runs as the 'dns-self-register' systemd service, so it runs on EVERY boot. The
+## variables come from /etc/dns-self-register.env, written by the EcsAsg user data:
+##   HOSTED_ZONE_ID, DOMAIN_NAME, RECORD_TYPE, DNS_TTL
+##
+set -u
+
+imds() {
+    local token
+    token=$(curl -s -X PUT "http://169.254.169.254/latest/api/token" -H "X-aws-ec2-metadata-token-ttl-seconds: 60")
+    curl -sf -H "X-aws-ec2-metadata-token: $token" "http://169.254.169.254/latest/meta-data/$1"
+}
+
+## Warm pool instances boot once to initialize. They're stopped right after, don't point DNS at them:
+if [[ "$(imds autoscaling/target-lifecycle-state)" == Warmed:* ]]; then
+    exit 0
+fi
+
+## The public IP can lag a little behind the network coming up:
+public_ip=""
+for _ in $(seq 60); do
+    public_ip=$(imds public-ipv4) && [[ -n "$public_ip" ]] && break
+    sleep 1
+done
+if [[ -z "$public_ip" ]]; then
+    logger -s -t dns-self-register "No public IP, leaving DNS to the AsgStateChangeHook"
+    exit 1
+fi
+
+## The ECS AMI doesn't always come with the cli:
+command -v aws >/dev/null || dnf install -y awscli-2
+# The instance role can ONLY UPSERT this one record:
+aws route53 change-resource-record-sets \
+    --hosted-zone-id "$HOSTED_ZONE_ID" \
+    --change-batch "{\"Changes\": [{\"Action\": \"UPSERT\", \"ResourceRecordSet\": {
+        \"Name\": \"$DOMAIN_NAME\", \"Type\": \"$RECORD_TYPE\", \"TTL\": $DNS_TTL,
+        \"ResourceRecords\": [{\"Value\": \"$public_ip\"}]
+    }}]}" \
+    && logger -s -t dns-self-register "Pointed $DOMAIN_NAME at $public_ip"
@@ -0,0 +1,56 @@
+#!/bin/bash
+##
+## Publishes the root EBS volume's latency and queue depth every minute, to see if the
+## disk is what's slow while spinning up (extracting the image, loading the world, etc).
+## Runs as the 'ebs-stats' systemd service, so it runs on EVERY boot. The variables
+## come from /etc/ebs-stats.env, written by the EcsAsg user data:
+##   NAMESPACE, CONTAINER_ID, AWS_REGION
+##
+set -u
+
+INTERVAL_SECONDS=60
+
+imds() {
+    local token
+    token=$(curl -s -X PUT "http://169.254.169.254/latest/api/token" -H "X-aws-ec2-metadata-token-ttl-seconds: 60")
+    curl -s -H "X-aws-ec2-metadata-token: $token" "http://169.254.169.254/latest/meta-data/$1"
+}
+
+## Warm pool instances boot once to initialize. Nobody is waiting on that one:
+if [[ "$(imds autoscaling/target-lifecycle-state)" == Warmed:* ]]; then
+    exit 0
+fi
+
+## The disk the root filesystem is on. (i.e 'nvme0n1' on Nitro, 'xvda' on Xen):
+root_partition=$(findmnt -no SOURCE /)
+ROOT_DISK=$(lsblk -no PKNAME "$root_partition")
+[[ -n "$ROOT_DISK" ]] || ROOT_DISK=$(basename "$root_partition")
+
+## Fields are in: https://www.kernel.org/doc/Documentation/ABI/testing/procfs-diskstats
+# (reads completed, ms reading, writes completed, ms writing, weighted ms doing I/O)
+read_diskstats() { awk -v disk="$ROOT_DISK" '$3 == disk {print $4, $7, $8, $11, $14}' /proc/diskstats; }
+# Average of the first over the second, or 0 if there's nothing to divide by:
+divide() { awk -v top="$1" -v bottom="$2" 'BEGIN {printf "%.2f", bottom ? top / bottom : 0}'; }
+
+## The ECS AMI doesn't always come with the cli:
+command -v aws >/dev/null || dnf install -y awscli-2
+
+read -r reads read_ms writes write_ms weighted_ms < <(read_diskstats)
+while sleep "$INTERVAL_SECONDS"; do
+    read -r new_reads new_read_ms new_writes new_write_ms new_weighted_ms < <(read_diskstats)
+    read_latency=$(divide $(( new_read_ms - read_ms )) $(( new_reads - reads )))
+    write_latency=$(divide $(( new_write_ms - write_ms )) $(( new_writes - writes )))
+    # Time spent on each request, over the wall time, is how many were in flight on average:
+    queue_depth=$(divide $(( new_weighted_ms - weighted_ms )) $(( INTERVAL_SECONDS * 1000 )))
+
+    dimensions="Dimensions=[{Name=ContainerNameID,Value=$CONTAINER_ID}]"
+    aws cloudwatch put-metric-data \
+        --region "$AWS_REGION" \
+        --namespace "$NAMESPACE" \
+        --metric-data \
+            "MetricName=EbsReadLatency,$dimensions,Value=$read_latency,Unit=Milliseconds" \
+            "MetricName=EbsWriteLatency,$dimensions,Value=$write_latency,Unit=Milliseconds" \
+            "MetricName=EbsQueueDepth,$dimensions,Value=$queue_depth,Unit=Count"
+
+    reads=$new_reads read_ms=$new_read_ms writes=$new_writes write_ms=$new_write_ms weighted_ms=$new_weighted_ms
+done
@@ -0,0 +1,197 @@
+#!/bin/bash
+##
+## Gives the container a real block device for each EBS volume, instead of NFS. The volume
+## only exists while the instance is up: It's created from the latest snapshot on boot, and
+## snapshotted again once the task stops when the instance starts terminating (the ASG
+## lifecycle hook waits on it). Only the newest 'KeepSnapshots' are kept.
+## Runs as the 'ebs-volumes' systemd service, so it runs on EVERY boot. ECS waits on the
+## volumes being mounted before starting the task. The variables come from
+## /etc/ebs-volumes.env, written by the EcsAsg user data:
+##   AWS_REGION, LIFECYCLE_HOOK_NAME, EBS_ROOT, TAG_KEY, TAG_PREFIX, AVAILABILITY_ZONES,
+##   EBS_VOLUMES (i.e "Ebs-Data:20:gp3:::true:3:/data,/config". The directory under EBS_ROOT,
+##                SizeGiB, Type, Iops, ThroughputMiBps, FastSnapshotRestore, KeepSnapshots, Paths)
+##
+set -u
+
+ECS_INTROSPECTION="http://localhost:51678/v1"
+# Give the task this long to stop when terminating, and a new snapshot this long to finish:
+TASK_STOP_TIMEOUT_SECONDS=300
+SNAPSHOT_TIMEOUT_SECONDS=600
+# Attach each volume as the next one of these. (Nitro instances rename them to nvme*):
+DEVICE_LETTERS=(f g h i j k l m n o p)
+
+imds() {
+    local token
+    token=$(curl -s -X PUT "http://169.254.169.254/latest/api/token" -H "X-aws-ec2-metadata-token-ttl-seconds: 60")
+    curl -s -H "X-aws-ec2-metadata-token: $token" "http://169.254.169.254/latest/meta-data/$1"
+}
+log() { logger -s -t ebs-volumes "$*"; }
+ec2() { aws ec2 --region "$AWS_REGION" "$@"; }
+
+## Warm pool instances boot once to initialize, and the task doesn't run on them:
+if [[ "$(imds autoscaling/target-lifecycle-state)" == Warmed:* ]]; then
+    systemd-notify --ready
+    exit 0
+fi
+
+## The ECS AMI doesn't always come with the cli:
+command -v aws >/dev/null || dnf install -y awscli-2
+INSTANCE_ID=$(imds instance-id)
+AVAILABILITY_ZONE=$(imds placement/availability-zone)
+
+## Newest first. Only this leaf's snapshots of this volume are tagged with it:
+snapshots_of() {
+    ec2 describe-snapshots \
+        --owner-ids self \
+        --filters "Name=tag:$TAG_KEY,Values=$TAG_PREFIX/$1" \
+        --query "reverse(sort_by(Snapshots, &StartTime))[].SnapshotId" \
+        --output text
+}
+
+## The block device for a volume. Nitro shows it by it's id, Xen by the name it was attached as:
+# https://docs.aws.amazon.com/ebs/latest/userguide/identify-nvme-ebs-device.html
+wait_for_device() {
+    local volume_id="$1" device_name="$2" device
+    for _ in {1..120}; do
+        for device in "/dev/disk/by-id/nvme-Amazon_Elastic_Block_Store_${volume_id/-/}" "${device_name/sd/xvd}"; do
+            [[ -b "$device" ]] && { readlink -f "$device"; return 0; }
+        done
+        sleep 1
+    done
+    return 1
+}
+
+## Create (or find, after a reboot) each volume, and mount it:
+attach_volume() {
+    local name="$1" size="$2" type="$3" iops="$4" throughput="$5" paths="$6" device_name="$7"
+    local volume_id snapshot_id device path create_options=()
+    volume_id=$(ec2 describe-volumes \
+        --filters "Name=tag:$TAG_KEY,Values=$TAG_PREFIX/$name" "Name=attachment.instance-id,Values=$INSTANCE_ID" \
+        --query "Volumes[0].VolumeId" --output text)
+    if [[ "$volume_id" == "None" ]]; then
+        snapshot_id=$(snapshots_of "$name" | awk '{print $1}')
+        if [[ -n "$snapshot_id" ]]; then
+            log "Restoring $name from $snapshot_id"
+            # (If the last instance only just stopped, it might still be finishing)
+            ec2 wait snapshot-completed --snapshot-ids "$snapshot_id"
+            create_options+=(--snapshot-id "$snapshot_id")
+        else
+            log "No snapshots of $name yet, creating an empty one"
+        fi
+        [[ -n "$iops" ]] && create_options+=(--iops "$iops")
+        [[ -n "$throughput" ]] && create_options+=(--throughput "$throughput")
+        # (Restoring from a snapshot can't make it smaller. If you grow SizeGiB, it grows here)
+        volume_id=$(ec2 create-volume \
+            --availability-zone "$AVAILABILITY_ZONE" \
+            --size "$size" \
+            --volume-type "$type" \
+            --encrypted \
+            "${create_options[@]}" \
+            --tag-specifications "ResourceType=volume,Tags=[{Key=$TAG_KEY,Value=$TAG_PREFIX/$name},{Key=Name,Value=$TAG_PREFIX/$name}]" \
+            --query "VolumeId" --output text) || return 1
+        ec2 wait volume-available --volume-ids "$volume_id" || return 1
+        ec2 attach-volume --volume-id "$volume_id" --instance-id "$INSTANCE_ID" --device "$device_name" >/dev/null || return 1
+        ## Only the snapshots are kept. The volume goes away with the instance:
+        ec2 modify-instance-attribute \
+            --instance-id "$INSTANCE_ID" \
+            --block-device-mappings "DeviceName=$device_name,Ebs={DeleteOnTermination=true}"
+    fi
+    device=$(wait_for_device "$volume_id" "$device_name") || { log "$volume_id never showed up"; return 1; }
+    ## Brand new volumes don't have a filesystem yet:
+    blkid "$device" >/dev/null || mkfs.xfs -q "$device"
+    mkdir -p "$EBS_ROOT/$name"
+    mountpoint -q "$EBS_ROOT/$name" || mount "$device" "$EBS_ROOT/$name" || return 1
+    ## Same as the EFS paths. (See the comment on the 777's in EcsAsg.py):
+    for path in ${paths//,/ }; do
+        mkdir -p -m 777 "$EBS_ROOT/$name/${path#/}"
+    done
+    VOLUME_IDS[$name]="$volume_id"
+    log "Mounted $name ($volume_id) at $EBS_ROOT/$name"
+}
+
+## Snapshot each volume, move Fast Snapshot Restore over to the new one, and clean up old ones:
+snapshot_all() {
+    local entry name size type iops throughput fsr keep paths snapshot_id snapshot_status old_snapshots old_snapshot frozen
+    for entry in $EBS_VOLUMES; do
+        IFS=: read -r name size type iops throughput fsr keep paths <<< "$entry"
+        [[ -n "${VOLUME_IDS[$name]:-}" ]] || continue
+        # Flush everything to the disk, the snapshot is of the block device:
+        sync
+        ## If something still has it open, freeze it instead. Nothing can write to it until
+        # it's thawed again, so ALWAYS thaw it once the snapshot's been started:
+        frozen=false
+        if ! umount "$EBS_ROOT/$name"; then
+            fsfreeze --freeze "$EBS_ROOT/$name" && frozen=true
+        fi
+        # (The snapshot is point-in-time as soon as this returns, it doesn't need to finish):
+        snapshot_id=$(ec2 create-snapshot \
+            --volume-id "${VOLUME_IDS[$name]}" \
+            --description "$TAG_PREFIX/$name" \
+            --tag-specifications "ResourceType=snapshot,Tags=[{Key=$TAG_KEY,Value=$TAG_PREFIX/$name},{Key=Name,Value=$TAG_PREFIX/$name}]" \
+            --query "SnapshotId" --output text)
+        snapshot_status=$?
+        ! $frozen || fsfreeze --unfreeze "$EBS_ROOT/$name"
+        (( snapshot_status == 0 )) || { log "FAILED to snapshot $name"; continue; }
+        log "Snapshotting $name as $snapshot_id"
+        # https://docs.aws.amazon.com/ebs/latest/userguide/ebs-fast-snapshot-restore.html
+        if [[ "$fsr" == "true" ]]; then
+            ## It can only be turned on once the snapshot's done. If it takes too long, the
+            # next boot just restores without it:
+            if timeout "$SNAPSHOT_TIMEOUT_SECONDS" aws ec2 wait snapshot-completed --region "$AWS_REGION" --snapshot-ids "$snapshot_id"; then
+                ec2 enable-fast-snapshot-restores --availability-zones $AVAILABILITY_ZONES --source-snapshot-ids "$snapshot_id" >/dev/null
+                # It's billed per snapshot, only keep it on the newest:
+                old_snapshots=$(snapshots_of "$name" | tr '\t' '\n' | grep -vx "$snapshot_id")
+                [[ -z "$old_snapshots" ]] || ec2 disable-fast-snapshot-restores \
+                    --availability-zones $AVAILABILITY_ZONES --source-snapshot-ids $old_snapshots >/dev/null
+            else
+                log "$snapshot_id didn't finish in time, leaving Fast Snapshot Restore on the last one"
+            fi
+        fi
+        ## Only keep the newest 'KeepSnapshots':
+        for old_snapshot in $(snapshots_of "$name" | tr '\t' '\n' | tail -n +$(( keep + 1 ))); do
+            ec2 delete-snapshot --snapshot-id "$old_snapshot"
+        done
+    done
+}
+
+declare -A VOLUME_IDS
+device_index=0
+for entry in $EBS_VOLUMES; do
+    IFS=: read -r name size type iops throughput fsr keep paths <<< "$entry"
+    # If any fail, ECS doesn't start at all:
+    attach_volume "$name" "$size" "$type" "$iops" "$throughput" "$paths" "/dev/sd${DEVICE_LETTERS[device_index]}" || exit 1
+    device_index=$(( device_index + 1 ))
+done
+systemd-notify --ready
+
+## Shutting down without going through the lifecycle hook (i.e a reboot). Last chance:
+snapshotted=false
+trap '$snapshotted || snapshot_all; exit 0' TERM
+
+while true; do
+    ## The ASG is terminating the instance (or putting it back in the warm pool). Wait for the
+    # container to let go of the files, snapshot everything, and then let the lifecycle hook continue:
+    lifecycle_state=$(imds autoscaling/target-lifecycle-state)
+    if ! $snapshotted && [[ "$lifecycle_state" == "Terminated" || "$lifecycle_state" == Warmed:* ]]; then
+        log "Instance is leaving service, snapshotting once the task stops"
+        deadline=$(( SECONDS + TASK_STOP_TIMEOUT_SECONDS ))
+        while curl -sf "$ECS_INTROSPECTION/tasks" | grep -q '"KnownStatus":"RUNNING"' && (( SECONDS < deadline )); do
+            sleep 2
+        done
+        snapshot_all
+        snapshotted=true
+        asg_name=$(aws autoscaling describe-auto-scaling-instances \
+            --region "$AWS_REGION" \
+            --instance-ids "$INSTANCE_ID" \
+            --query "AutoScalingInstances[0].AutoScalingGroupName" \
+            --output text)
+        aws autoscaling complete-lifecycle-action \
+            --region "$AWS_REGION" \
+            --lifecycle-hook-name "$LIFECYCLE_HOOK_NAME" \
+            --auto-scaling-group-name "$asg_name" \
+            --instance-id "$INSTANCE_ID" \
+            --lifecycle-action-result CONTINUE
+    fi
+    # (In the background, so the TERM trap doesn't wait on the sleep)
+    sleep 5 & wait $!
+done
@@ -0,0 +1,95 @@
+#!/bin/bash
+##
+## Runs every member of a host group on the one instance. Mounts each member's EFS volumes,
+## then publishes how many clients are connected to each member every period, for their
+## Watchdogs. The total for the whole group goes to the group's own alarm, which spins the
+## instance down once EVERY member is empty. (The counting is the same as 'connection_count.sh')
+## Each member saves what it needs as JSON under MEMBER_PARAMETER_PREFIX when it's deployed:
+##   NAMESPACE, CONTAINER_ID, LISTEN_PORTS (i.e "tcp:25565 udp:19132"), PERIOD_SECONDS,
+##   EFS_MOUNTS (a list of FileSystemId, MountPoint, Options, and the Paths inside it)
+## so members deployed while the instance is up are only picked up on the next boot.
+## Runs as the 'host-group' systemd service, so it runs on EVERY boot. ECS waits on the
+## mounts before starting any member's task. The variables come from /etc/host-group.env,
+## written by the HostGroup user data:
+##   NAMESPACE, HOST_GROUP, AWS_REGION, MEMBER_PARAMETER_PREFIX
+##
+set -u
+
+log() { logger -s -t host-group "$*"; }
+
+## The ECS AMI doesn't always come with these:
+command -v aws >/dev/null || dnf install -y awscli-2
+command -v conntrack >/dev/null || dnf install -y conntrack-tools
+command -v jq >/dev/null || dnf install -y jq
+
+## One member per line:
+mapfile -t MEMBERS < <(
+    aws ssm get-parameters-by-path \
+        --region "$AWS_REGION" \
+        --path "$MEMBER_PARAMETER_PREFIX" \
+        --query "Parameters[].Value" \
+        --output json | jq -c '.[] | fromjson'
+)
+log "Found ${#MEMBERS[@]} members in '$HOST_GROUP'"
+
+## Same as the EcsAsg user data, but from the members' parameters. (In fstab, so it's
+# only added once, and the next boot mounts them before this even runs):
+MOUNT_PIDS=()
+time_mount() {
+    local mount_point="$1"; shift
+    local start_ms; start_ms=$(date +%s%3N)
+    mountpoint -q "$mount_point" || mount "$mount_point" || { log "FAILED to mount $mount_point"; return 1; }
+    log "Mounted $mount_point in $(( $(date +%s%3N) - start_ms ))ms"
+    # Make sure each specific mount path exists INSIDE the EFS, now that it's mounted:
+    for mount_path in "$@"; do mkdir -p -m 777 "$mount_point/${mount_path#/}"; done
+}
+for member in "${MEMBERS[@]}"; do
+    while IFS=$'\t' read -r file_system_id mount_point options paths; do
+        mkdir -p "$mount_point"
+        grep -q " $mount_point efs " /etc/fstab || echo "$file_system_id $mount_point efs $options 0 0" >> /etc/fstab
+        # shellcheck disable=SC2086 # (Split the paths into separate arguments)
+        time_mount "$mount_point" $paths &
+        MOUNT_PIDS+=($!)
+    done < <(jq -r '.EFS_MOUNTS[] | [.FileSystemId, .MountPoint, .Options, (.Paths | join(" "))] | @tsv' <<< "$member")
+done
+for pid in "${MOUNT_PIDS[@]}"; do wait "$pid"; done
+## Let ECS start the tasks:
+systemd-notify --ready
+
+## Host networking, so every member's ports are the instance's:
+count_connections() {
+    local entry protocol port total=0 count
+    for entry in $1; do
+        IFS=: read -r protocol port <<< "$entry"
+        if [[ "$protocol" == "tcp" ]]; then
+            count=$(ss -Htn state established "( sport = :$port )" | wc -l)
+        else
+            count=$(conntrack -L -p udp --orig-port-dst "$port" 2>/dev/null | wc -l)
+        fi
+        total=$(( total + count ))
+    done
+    echo "$total"
+}
+
+## Go as fast as the fastest member's Watchdog. The rest just see more datapoints:
+PERIOD_SECONDS=$(printf '%s\n' "${MEMBERS[@]}" | jq -s 'map(.PERIOD_SECONDS | tonumber) + [60] | min')
+STORAGE_RESOLUTION=60
+(( PERIOD_SECONDS < 60 )) && STORAGE_RESOLUTION=1
+
+while true; do
+    group_total=0
+    for member in "${MEMBERS[@]}"; do
+        IFS=$'\t' read -r namespace container_id listen_ports < <(jq -r '[.NAMESPACE, .CONTAINER_ID, .LISTEN_PORTS] | @tsv' <<< "$member")
+        connections=$(count_connections "$listen_ports")
+        group_total=$(( group_total + connections ))
+        aws cloudwatch put-metric-data \
+            --region "$AWS_REGION" \
+            --namespace "$namespace" \
+            --metric-data "MetricName=ActiveConnections,Dimensions=[{Name=ContainerNameID,Value=$container_id}],Value=$connections,Unit=Count,StorageResolution=$STORAGE_RESOLUTION"
+    done
+    aws cloudwatch put-metric-data \
+        --region "$AWS_REGION" \
+        --namespace "$NAMESPACE" \
+        --metric-data "MetricName=ActiveConnections,Dimensions=[{Name=HostGroup,Value=$HOST_GROUP}],Value=$group_total,Unit=Count,StorageResolution=$STORAGE_RESOLUTION"
+    sleep "$PERIOD_SECONDS"
+done
@@ -0,0 +1,183 @@
+#!/bin/bash
+##
+## Keeps a local copy of each volume the container shouldn't use directly: EFS volumes with
+## 'LocalCopy' (so it isn't waiting on a NFS round-trip for every small file), and S3 volumes
+## (which can't be mounted at all). The EFS/S3 stays the durable copy. Changes are written
+## back to it every 'SyncMinutes', once the task stops when the instance starts terminating
+## (the ASG lifecycle hook waits on it), and when this service stops on shutdown.
+## Runs as the 'local-copy' systemd service, so it runs on EVERY boot. ECS waits on the
+## first copy to finish before starting the task. The variables come from
+## /etc/local-copy.env, written by the EcsAsg user data:
+##   NAMESPACE, CONTAINER_ID, AWS_REGION, LIFECYCLE_HOOK_NAME, LOCAL_ROOT,
+##   LOCAL_COPIES (i.e "Efs-Data:5:/mnt/efs/Efs-Data S3-World:10:s3://bucket-name",
+##                 the directory under LOCAL_ROOT, it's SyncMinutes, and where it's from)
+##
+set -u
+
+ECS_INTROSPECTION="http://localhost:51678/v1"
+# Only write back if the first copy finished. Otherwise '--delete' would wipe the source:
+COPIED_MARKER=".local-copy-complete"
+# Give the EFS this long to mount, and the task this long to stop when terminating:
+MOUNT_TIMEOUT_SECONDS=300
+TASK_STOP_TIMEOUT_SECONDS=300
+
+imds() {
+    local token
+    token=$(curl -s -X PUT "http://169.254.169.254/latest/api/token" -H "X-aws-ec2-metadata-token-ttl-seconds: 60")
+    curl -s -H "X-aws-ec2-metadata-token: $token" "http://169.254.169.254/latest/meta-data/$1"
+}
+log() { logger -s -t local-copy "$*"; }
+
+## Warm pool instances boot once to initialize, and the task doesn't run on them:
+if [[ "$(imds autoscaling/target-lifecycle-state)" == Warmed:* ]]; then
+    systemd-notify --ready
+    exit 0
+fi
+
+## The ECS AMI doesn't always come with these:
+command -v aws >/dev/null || dnf install -y awscli-2
+command -v rsync >/dev/null || dnf install -y rsync
+## Big worlds are lots of files. Transfer more of them (and more parts of each) at once:
+# https://docs.aws.amazon.com/cli/latest/topic/s3-config.html
+aws configure set default.s3.max_concurrent_requests 64
+aws configure set default.s3.multipart_chunksize 16MB
+
+publish_sync() {
+    local direction="$1" seconds="$2" bytes="$3"
+    local dimensions="Dimensions=[{Name=ContainerNameID,Value=$CONTAINER_ID},{Name=Direction,Value=$direction}]"
+    aws cloudwatch put-metric-data \
+        --region "$AWS_REGION" \
+        --namespace "$NAMESPACE" \
+        --metric-data \
+            "MetricName=LocalCopySyncSeconds,$dimensions,Value=$seconds,Unit=Seconds" \
+            "MetricName=LocalCopySyncBytes,$dimensions,Value=$bytes,Unit=Bytes" \
+            "MetricName=LocalCopySyncThroughput,$dimensions,Value=$(awk -v b="$bytes" -v s="$seconds" 'BEGIN {printf "%.0f", s > 0 ? b / s : 0}'),Unit=Bytes/Second"
+}
+
+## Direction is 'Pull' (source -> local) or 'Push' (local -> source):
+sync_volume() {
+    local direction="$1" name="$2" source="$3"
+    local local_copy="$LOCAL_ROOT/$name" last_push="$LOCAL_ROOT/.$name.last-push"
+    local start_ms bytes seconds stats
+    if [[ "$direction" == "Push" && ! -f "$local_copy/$COPIED_MARKER" ]]; then
+        log "Never finished copying $name locally, NOT writing it back"
+        return 1
+    fi
+    mkdir -p "$local_copy"
+    # (Left over from last boot, if it's on the root volume. It has to finish again first)
+    [[ "$direction" == "Pull" ]] && rm -f "$local_copy/$COPIED_MARKER"
+    start_ms=$(date +%s%3N)
+    if [[ "$source" == s3://* ]]; then
+        ## Only what changed gets uploaded (the bucket's versioning keeps what it replaced):
+        if [[ "$direction" == "Pull" ]]; then
+            aws s3 sync "$source" "$local_copy" --delete --only-show-errors --region "$AWS_REGION" \
+                && bytes=$(du -sb --exclude="$COPIED_MARKER" "$local_copy" | cut -f1)
+        else
+            # Count it before uploading, so anything written during the upload is counted next time:
+            bytes=$(find "$local_copy" -type f -newer "$last_push" -printf '%s\n' | awk '{total += $1} END {print total + 0}')
+            touch "$last_push"
+            aws s3 sync "$local_copy" "$source" --delete --only-show-errors --region "$AWS_REGION" --exclude "$COPIED_MARKER"
+        fi
+    else
+        # (Excluded files are also protected from '--delete', so the marker stays put)
+        if [[ "$direction" == "Pull" ]]; then
+            stats=$(rsync -a --delete --stats --exclude="$COPIED_MARKER" "$source/" "$local_copy/")
+        else
+            stats=$(rsync -a --delete --stats --exclude="$COPIED_MARKER" "$local_copy/" "$source/")
+        fi && bytes=$(awk -F': ' '/^Total transferred file size/ {gsub(/[^0-9]/, "", $2); print $2}' <<< "$stats")
+    fi
+    # (The last command in each branch is the sync itself)
+    # shellcheck disable=SC2181
+    if (( $? != 0 )); then
+        log "FAILED to $direction $name"
+        return 1
+    fi
+    seconds=$(awk -v ms=$(( $(date +%s%3N) - start_ms )) 'BEGIN {printf "%.3f", ms / 1000}')
+    log "${direction}ed $name in ${seconds}s (${bytes:-0} bytes)"
+    publish_sync "$direction" "$seconds" "${bytes:-0}"
+    if [[ "$direction" == "Pull" ]]; then
+        touch "$local_copy/$COPIED_MARKER" "$last_push"
+    fi
+}
+
+push_all() {
+    local entry name minutes source
+    for entry in $LOCAL_COPIES; do
+        IFS=: read -r name minutes source <<< "$entry"
+        sync_volume "Push" "$name" "$source"
+    done
+}
+
+## The instance store is wiped whenever the instance stops, so set it up on every boot:
+# (If there's more than one disk, the first is plenty. The others would need a RAID)
+mkdir -p "$LOCAL_ROOT"
+if ! mountpoint -q "$LOCAL_ROOT"; then
+    device=$(lsblk -dpno NAME,MODEL | awk '/Instance Storage/ {print $1; exit}')
+    if [[ -z "$device" ]]; then
+        # Only S3 volumes get here, the config makes sure EFS local copies have one.
+        # (Whatever's left from last boot only makes the first sync faster):
+        log "No instance store found, using the root volume"
+    elif ! { mkfs.xfs -f -q "$device" && mount "$device" "$LOCAL_ROOT"; }; then
+        log "FAILED to mount $device"
+        exit 1
+    fi
+fi
+
+## Copy everything down before the task starts. If any fail, ECS doesn't start at all:
+declare -A next_push
+for entry in $LOCAL_COPIES; do
+    IFS=: read -r name minutes source <<< "$entry"
+    if [[ "$source" != s3://* ]]; then
+        deadline=$(( SECONDS + MOUNT_TIMEOUT_SECONDS ))
+        until mountpoint -q "$source"; do
+            (( SECONDS < deadline )) || { log "$source never mounted"; exit 1; }
+            sleep 1
+        done
+    fi
+    sync_volume "Pull" "$name" "$source" || exit 1
+    next_push[$name]=$(( SECONDS + minutes * 60 ))
+done
+systemd-notify --ready
+
+## Shutting down without going through the lifecycle hook (i.e a reboot). Last chance:
+written_back=false
+trap '$written_back || push_all; exit 0' TERM
+
+while true; do
+    ## The ASG is terminating the instance (or putting it back in the warm pool). Wait for the
+    # container to let go of the files, write everything back, and then let the lifecycle hook continue:
+    lifecycle_state=$(imds autoscaling/target-lifecycle-state)
+    if ! $written_back && [[ "$lifecycle_state" == "Terminated" || "$lifecycle_state" == Warmed:* ]]; then
+        log "Instance is leaving service, writing back once the task stops"
+        deadline=$(( SECONDS + TASK_STOP_TIMEOUT_SECONDS ))
+        while curl -sf "$ECS_INTROSPECTION/tasks" | grep -q '"KnownStatus":"RUNNING"' && (( SECONDS < deadline )); do
+            sleep 2
+        done
+        push_all
+        written_back=true
+        instance_id=$(imds instance-id)
+        asg_name=$(aws autoscaling describe-auto-scaling-instances \
+            --region "$AWS_REGION" \
+            --instance-ids "$instance_id" \
+            --query "AutoScalingInstances[0].AutoScalingGroupName" \
+            --output text)
+        aws autoscaling complete-lifecycle-action \
+            --region "$AWS_REGION" \
+            --lifecycle-hook-name "$LIFECYCLE_HOOK_NAME" \
+            --auto-scaling-group-name "$asg_name" \
+            --instance-id "$instance_id" \
+            --lifecycle-action-result CONTINUE
+    fi
+    ## Otherwise, write each one back on it's own schedule:
+    if ! $written_back; then
+        for entry in $LOCAL_COPIES; do
+            IFS=: read -r name minutes source <<< "$entry"
+            if (( SECONDS >= next_push[$name] )); then
+                sync_volume "Push" "$name" "$source"
+                next_push[$name]=$(( SECONDS + minutes * 60 ))
+            fi
+        done
+    fi
+    # (In the background, so the TERM trap doesn't wait on the sleep)
+    sleep 5 & wait $!
+done
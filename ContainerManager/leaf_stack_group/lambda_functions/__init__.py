@@ -0,0 +1,4 @@
+"""
+The lambda functions, one per directory. Each is deployed with this whole
+package, so they can share what's in 'common.py'.
+"""
@@ -0,0 +1,82 @@
+
+"""
+Code every lambda in this directory shares.
+
+Each lambda is deployed with the whole directory, so they can import this with
+'from ..common import ...'. (See 'ContainerManager/utils/lambda_profile.py')
+Only use what the lambda runtime already has here (boto3 and the standard library).
+"""
+
+import os
+import json
+import time
+from functools import cache
+from dataclasses import dataclass
+
+from botocore.config import Config
+
+## Every client here is on a short-lived lambda. Fail fast and retry, instead of hanging
+# until the lambda times out. (Keepalive stops idle connections from being dropped between
+# invocations of a warm lambda):
+# https://botocore.amazonaws.com/v1/documentation/api/latest/reference/config.html
+BOTO_CONFIG = Config(
+    connect_timeout=2,
+    read_timeout=5,
+    retries={"max_attempts": 3, "mode": "standard"},
+    tcp_keepalive=True,
+)
+
+# The router's lookup table. Module level, so it survives between invocations of
+# the same (warm) lambda container: {leaf key: (monotonic when fetched, EnvVars)}
+leaf_table = {}
+
+@dataclass(frozen=True)
+class RouterEnvVars:
+    """ Env vars that a shared router needs. Each leaf's EnvVars are in SSM instead. """
+    # pylint: disable=invalid-name
+    # Each leaf saves it's EnvVars as JSON, under '<prefix>/<leaf key>':
+    LEAF_PARAMETER_PREFIX: str
+    # How long to trust the lookup table, before checking SSM again:
+    LEAF_CACHE_SECONDS: str
+    # pylint: enable=invalid-name
+
+def load_env_vars(env_class: type):
+    """ Create the dataclass from the env vars with the same names """
+    # The dataclass will naturally error with ALL the missing env-vars on creation:
+    return env_class(**{
+        # DON'T use getenv. We don't want the key to exist if it's missing.
+        k: os.environ[k] for k in env_class.__annotations__.keys() if k in os.environ
+    })
+
+@cache
+def get_router_env_vars() -> RouterEnvVars:
+    """ Lazy-load and Validate the shared router's environment variables """
+    return load_env_vars(RouterEnvVars)
+
+def lookup_leaf_env_vars(ssm_client, leaf_key: str, env_class: type, by_path: bool = False):
+    """
+    A leaf's EnvVars (as env_class), from the router's lookup table. Refreshed from SSM
+    once it's older than LEAF_CACHE_SECONDS, so a warm router doesn't wait on SSM every time.
+
+    With by_path, it's a list of every parameter under '<prefix>/<leaf key>/' instead. (For
+    when several leaves share a key). An empty list isn't remembered, so a new leaf is found
+    right away.
+    """
+    router_env = get_router_env_vars()
+    cached = leaf_table.get(leaf_key)
+    if cached is not None and time.monotonic() - cached[0] < int(router_env.LEAF_CACHE_SECONDS):
+        return cached[1]
+    parameter_name = f"{router_env.LEAF_PARAMETER_PREFIX}/{leaf_key}"
+    if by_path:
+        # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/ssm/paginator/GetParametersByPath.html
+        paginator = ssm_client.get_paginator("get_parameters_by_path")
+        env = [
+            env_class(**json.loads(parameter["Value"]))
+            for page in paginator.paginate(Path=parameter_name)
+            for parameter in page["Parameters"]
+        ]
+    else:
+        env = env_class(**json.loads(ssm_client.get_parameter(Name=parameter_name)["Parameter"]["Value"]))
+    if env:
+        leaf_table[leaf_key] = (time.monotonic(), env)
+    return env
@@ -2,16 +2,27 @@
 """
 Lambda code for starting and stopping the management logic
 whenever the ASG state changes (instance starts or stops).
+
+Deployed either once per leaf (lambda_handler, configured by env vars), or once
+for every leaf in the base stack (router_handler, which gets the events through
+SQS, and looks up each leaf by it's ASG name).
 """
 
 import os
 import sys
 import json
+import time
+from itertools import groupby
 from functools import cache
 from dataclasses import dataclass, asdict
 
 import boto3
 
+from ..common import BOTO_CONFIG, load_env_vars, lookup_leaf_env_vars
+
+class SkipEvent(Exception):
+    """ The event isn't one this leaf should act on. (The message says why) """
+
 # frozen=True: This should never be modified (change cdk inputs instead)
 @dataclass(frozen=True)
 class EnvVars:
@@ -22,16 +33,21 @@ class EnvVars:
     UNAVAILABLE_IP: str
     DNS_TTL: str
     RECORD_TYPE: str
+    # For checking EC2 state-change events are from this ASG:
+    ASG_NAME: str
+    # "true" if EC2 state-change events update DNS, before the ASG event does:
+    EARLY_DNS_UPDATE: str
+    # For publishing how long it took from the first DNS query, to DNS pointing at the instance:
+    COLD_START_PARAMETER: str
+    METRIC_NAMESPACE: str
+    METRIC_NAME: str
+    METRIC_DIMENSIONS: str
     # pylint: enable=invalid-name
 
 @cache
 def get_env_vars() -> EnvVars:
     """ Lazy-load and Validate the environment variables """
-    # EnvVars will naturally error with ALL the missing env-vars on creation:
-    return EnvVars(**{
-        # DON'T use getenv. We don't want the key to exist if it's missing.
-        k: os.environ[k] for k in EnvVars.__annotations__.keys() if k in os.environ
-    })
+    return load_env_vars(EnvVars)
 
 
 ## Boto3 Clients:
@@ -40,17 +56,27 @@ def get_env_vars() -> EnvVars:
 @cache
 def get_route53_client():
     """ Used for updating the DNS record """
-    return boto3.client('route53')
+    return boto3.client('route53', config=BOTO_CONFIG)
 
 @cache
 def get_ec2_client():
     """ Used for getting the new instance's IP """
-    return boto3.client('ec2')
+    return boto3.client('ec2', config=BOTO_CONFIG)
 
 @cache
 def get_asg_client():
     """ Used for checking ASG instance states """
-    return boto3.client('autoscaling')
+    return boto3.client('autoscaling', config=BOTO_CONFIG)
+
+@cache
+def get_ssm_client():
+    """ Used for reading/clearing when the first DNS query came in, and the router's lookups """
+    return boto3.client('ssm', config=BOTO_CONFIG)
+
+@cache
+def get_cloudwatch_client():
+    """ Used for publishing the cold start metric """
+    return boto3.client('cloudwatch', config=BOTO_CONFIG)
 
 
 def lambda_handler(event: dict, context: dict) -> None:
@@ -59,21 +85,97 @@ def lambda_handler(event: dict, context: dict) -> None:
     """
     env = get_env_vars()
     print(json.dumps({"Event": event, "Context": context, "Env": asdict(env)}, default=str))
+    try:
+        new_ip = get_new_ip(env, event)
+    # Nothing else this lambda could do with the event:
+    except SkipEvent as e:
+        sys.exit(str(e))
+    ### Update the DNS record with the new IP:
+    update_dns_zone(env.HOSTED_ZONE_ID, [(env, new_ip)])
+    after_dns_update(env, event, new_ip)
 
+def router_handler(event: dict, context: dict) -> None:
+    """
+    Main function of the base stack's shared lambda. Every leaf's rules send their
+    events to it's queue, and this gets whatever came in close together as one batch.
+    Only the newest change to each record is kept, and each hosted zone's changes go
+    out in one Route53 call.
+    """
+    print(json.dumps({"Records": len(event["Records"]), "Context": context}, default=str))
+    # Every member of a HostGroup has a rule on the same ASG, and each sends the same event:
+    unique_events = {leaf_event["id"]: leaf_event for leaf_event in (json.loads(record["body"]) for record in event["Records"])}
+    # SQS doesn't keep them in order, but EventBridge timestamps each one:
+    leaf_events = sorted(unique_events.values(), key=lambda leaf_event: leaf_event["time"])
+    ## {(hosted zone, domain): (env, new_ip, event)}. Later events replace earlier ones:
+    changes = {}
+    for leaf_event in leaf_events:
+        asg_name = get_event_asg_name(leaf_event)
+        # Each leaf saves it's EnvVars under it's ASG name, then it's container id. (A HostGroup's
+        # members share the ASG):
+        envs = lookup_leaf_env_vars(get_ssm_client(), asg_name, EnvVars, by_path=True) if asg_name else []
+        if not envs:
+            print(f"Event '{leaf_event['id']}' isn't for any leaf's ASG, skipping it.")
+            continue
+        for env in envs:
+            print(json.dumps({"Event": leaf_event, "Env": asdict(env)}, default=str))
+            try:
+                new_ip = get_new_ip(env, leaf_event)
+            # Only this leaf skips it. The others on the ASG might still want it:
+            except SkipEvent:
+                continue
+            changes[(env.HOSTED_ZONE_ID, env.DOMAIN_NAME)] = (env, new_ip, leaf_event)
+
+    for hosted_zone_id, zone_changes in groupby(sorted(changes.items()), key=lambda item: item[0][0]):
+        zone_changes = [change for _, change in zone_changes]
+        update_dns_zone(hosted_zone_id, [(env, new_ip) for env, new_ip, _ in zone_changes])
+        for env, new_ip, leaf_event in zone_changes:
+            after_dns_update(env, leaf_event, new_ip)
+
+def get_event_asg_name(event: dict) -> str | None:
+    """ Which ASG the event is for. EC2 state-change events have to look it up """
+    if event["detail-type"] != "EC2 Instance State-change Notification":
+        return event["detail"]["AutoScalingGroupName"]
+    asg_client = get_asg_client()
+    asg_instances = asg_client.describe_auto_scaling_instances(InstanceIds=[event["detail"]["instance-id"]])["AutoScalingInstances"]
+    return asg_instances[0]["AutoScalingGroupName"] if asg_instances else None
+
+def get_new_ip(env: EnvVars, event: dict) -> str:
+    """ What the leaf's DNS record should point at, after this event """
+    # If the ec2 instance just got it's public IP (Only with Dns.EarlyUpdate):
+    if event["detail-type"] == "EC2 Instance State-change Notification":
+        ### Safety Check - This event is for EVERY instance in the region:
+        skip_if_not_asg_instance_launching(env, instance_id=event["detail"]["instance-id"])
+        ### Safety Check - The shared lambda gets these for every leaf, even without Dns.EarlyUpdate:
+        if env.EARLY_DNS_UPDATE.lower() != "true":
+            msg = f"ASG '{env.ASG_NAME}' doesn't update DNS early, skipping this event."
+            print(msg)
+            raise SkipEvent(msg)
+        return get_public_ip(instance_id=event["detail"]["instance-id"])
     # If the ec2 instance just FINISHED coming up:
     if event["detail-type"] == "EC2 Instance Launch Successful":
-        new_ip = get_public_ip(instance_id=event["detail"]["EC2InstanceId"])
+        ### Safety Check - Instances launching INTO the warm pool never get an IP to use:
+        skip_if_warm_pool_instance(event["detail"], direction="Destination")
+        # (With early DNS updates, this is just confirming the IP is still right)
+        return get_public_ip(instance_id=event["detail"]["EC2InstanceId"])
     # If the ec2 instance just STARTED to go down:
-    elif event["detail-type"] == "EC2 Instance-terminate Lifecycle Action":
+    if event["detail-type"] == "EC2 Instance-terminate Lifecycle Action":
+        ### Safety Check - Instances leaving the warm pool were never the one in DNS:
+        skip_if_warm_pool_instance(event["detail"], direction="Origin")
         ### Safety Check - If another instance is spinning up, just quit:
-        exit_if_asg_instance_coming_up(asg_name=event["detail"]["AutoScalingGroupName"])
+        skip_if_asg_instance_coming_up(asg_name=event["detail"]["AutoScalingGroupName"])
+        # The next DNS query should start timing a new cold start:
+        clear_cold_start_timestamp(env)
         # Now just update DNS like normal:
-        new_ip = env.UNAVAILABLE_IP
+        return env.UNAVAILABLE_IP
     # If the EventBridge filter somehow changed (This should never happen):
-    else:
-        raise RuntimeError(f"Unknown event type: '{event['detail-type']}'. Did you mess with the EventBridge Rule??")
-    ### Update the DNS record with the new IP:
-    update_dns_zone(new_ip)
+    raise RuntimeError(f"Unknown event type: '{event['detail-type']}'. Did you mess with the EventBridge Rule??")
+
+def after_dns_update(env: EnvVars, event: dict, new_ip: str) -> None:
+    """ If it's pointing at the instance now, the cold start is done """
+    #    (With early DNS updates, the state-change event already published it)
+    early_dns_update = env.EARLY_DNS_UPDATE.lower() == "true"
+    if new_ip != env.UNAVAILABLE_IP and not (early_dns_update and event["detail-type"] == "EC2 Instance Launch Successful"):
+        publish_cold_start(env)
 
 def get_public_ip(instance_id: str) -> str:
     """ Get the instance's public IP """
@@ -84,15 +186,15 @@ def get_public_ip(instance_id: str) -> str:
     return instance_details["PublicIpAddress"]
 
 
-def update_dns_zone(new_ip: str) -> None:
-    """ Update the DNS record with the new IP """
-    print(f"Changing to new IP: {new_ip}")
-    env = get_env_vars()
+def update_dns_zone(hosted_zone_id: str, new_ips: list[tuple[EnvVars, str]]) -> None:
+    """ Update each leaf's DNS record in the hosted zone with it's new IP, in one change batch """
+    for env, new_ip in new_ips:
+        print(f"Changing '{env.DOMAIN_NAME}' to new IP: {new_ip}")
 
-    ### Update the record with the new IP:
+    ### Update the records with the new IPs:
     route53_client = get_route53_client()
     route53_client.change_resource_record_sets(
-        HostedZoneId=env.HOSTED_ZONE_ID,
+        HostedZoneId=hosted_zone_id,
         ChangeBatch={
             'Changes': [{
                 'Action': 'UPSERT',
@@ -102,13 +204,84 @@ def update_dns_zone(new_ip: str) -> None:
                     'ResourceRecords': [{'Value': new_ip}],
                     'TTL': int(env.DNS_TTL),
                 }
-            }]
+            } for env, new_ip in new_ips]
         }
     )
 
-def exit_if_asg_instance_coming_up(asg_name: str) -> None:
+def publish_cold_start(env: EnvVars) -> None:
     """
-    SAFEGUARD: Exit if another instance is coming up in the ASG
+    Publish how long it took from the first DNS query, to DNS pointing at the instance.
+
+    The trigger_start_system lambda saves when the first query came in. If it doesn't exist,
+    the instance was started some other way (i.e the console), and nobody was waiting on it.
+    """
+    ssm_client = get_ssm_client()
+    try:
+        first_query_ms = int(ssm_client.get_parameter(Name=env.COLD_START_PARAMETER)["Parameter"]["Value"])
+    except ssm_client.exceptions.ParameterNotFound:
+        print("No DNS query started this instance, skipping the cold start metric.")
+        return
+    cold_start_seconds = time.time() - first_query_ms / 1000
+    print(f"Cold start took {cold_start_seconds:.1f} seconds.")
+
+    dimensions_input = json.loads(env.METRIC_DIMENSIONS)
+    # Change it to the format boto3 cloudwatch wants:
+    dimension_map = [{"Name": k, "Value": v} for k, v in dimensions_input.items()]
+    cloudwatch_client = get_cloudwatch_client()
+    cloudwatch_client.put_metric_data(
+        Namespace=env.METRIC_NAMESPACE,
+        MetricData=[{
+            'MetricName': env.METRIC_NAME,
+            'Dimensions': dimension_map,
+            'Unit': 'Seconds',
+            'Value': cold_start_seconds,
+        }],
+    )
+
+def clear_cold_start_timestamp(env: EnvVars) -> None:
+    """ Remove the first DNS query's timestamp, so the next one can save it's own """
+    ssm_client = get_ssm_client()
+    try:
+        ssm_client.delete_parameter(Name=env.COLD_START_PARAMETER)
+    except ssm_client.exceptions.ParameterNotFound:
+        # Never started by DNS, nothing to clear:
+        pass
+
+def skip_if_warm_pool_instance(event_detail: dict, direction: str) -> None:
+    """
+    SAFEGUARD: Skip the event if it's for an instance moving in/out of the warm pool
+
+    The EventBridge rules already filter these out when the warm pool is enabled. This is
+    just in case, since the instance is stopped in the pool and doesn't have a public IP.
+    (direction is either "Origin" or "Destination". Events without a warm pool won't have it.)
+    """
+    if event_detail.get(direction) == "WarmPool":
+        msg = f"Instance '{event_detail['EC2InstanceId']}' has '{direction}' of 'WarmPool', skipping this event."
+        print(msg)
+        raise SkipEvent(msg)
+
+def skip_if_not_asg_instance_launching(env: EnvVars, instance_id: str) -> None:
+    """
+    SAFEGUARD: Skip the event if the instance isn't launching into this ASG
+
+    EventBridge can't filter EC2 state-change events by ASG, so this sees every instance that
+    starts in the region. Warm pool instances also start while warming, and never keep an IP.
+    """
+    asg_client = get_asg_client()
+    asg_instances = asg_client.describe_auto_scaling_instances(InstanceIds=[instance_id])["AutoScalingInstances"]
+    if not asg_instances or asg_instances[0]["AutoScalingGroupName"] != env.ASG_NAME:
+        msg = f"Instance '{instance_id}' isn't in ASG '{env.ASG_NAME}', skipping this event."
+        print(msg)
+        raise SkipEvent(msg)
+    lifecycle_state = asg_instances[0]["LifecycleState"]
+    if lifecycle_state.startswith("Warmed"):
+        msg = f"Instance '{instance_id}' is in '{lifecycle_state}', skipping this event."
+        print(msg)
+        raise SkipEvent(msg)
+
+def skip_if_asg_instance_coming_up(asg_name: str) -> None:
+    """
+    SAFEGUARD: Skip the event if another instance is coming up in the ASG
     
     There's a window where if a instance is coming up as another spins down, the latter could wipe the
     ip of the new instance from route53. This is a safety check to make sure that doesn't happen.
@@ -118,10 +291,21 @@ def exit_if_asg_instance_coming_up(asg_name: str) -> None:
     asg_client = get_asg_client() # pylint: disable=redefined-outer-name
     # With using asg_name, we guarantee there's only one output:
     asg_info = asg_client.describe_auto_scaling_groups(AutoScalingGroupNames=[asg_name])['AutoScalingGroups'][0]
+    # (Instances in the warm pool aren't in this list. Their 'Warmed:*' states are only in describe_warm_pool)
     for instance in asg_info['Instances']:
         # If there's a instance in ANY of the Pending states, or just finished starting, let IT update the DNS stuff.
         # We don't want to step over it with this instance going down.
         if instance['LifecycleState'].startswith("Pending") or  instance['LifecycleState'] == "InService":
             msg = f"Instance '{instance['InstanceId']}' is in '{instance['LifecycleState']}', skipping this termination event."
             print(msg)
-            sys.exit(msg)
+            raise SkipEvent(msg)
+
+## SnapStart and Provisioned Concurrency run this module's init ahead of time, before anyone
+# is waiting on it. Create the clients then, so they're not part of the first invocation:
+# https://docs.aws.amazon.com/lambda/latest/dg/configuration-envvars.html#configuration-envvars-runtime
+if os.environ.get("AWS_LAMBDA_INITIALIZATION_TYPE") in ("snap-start", "provisioned-concurrency"):
+    get_route53_client()
+    get_ec2_client()
+    get_asg_client()
+    get_ssm_client()
+    get_cloudwatch_client()
@@ -0,0 +1,369 @@
+"""
+Lambda for spinning up the system *before* someone tries to connect.
+
+Runs on a schedule. It learns when the leaf usually gets played from the DNS hits
+the trigger_start_system lambda publishes, as a time-of-week histogram. If the
+next few minutes are usually busy, it sets the ASG's desired capacity to 1 ahead
+of time, so the first player doesn't wait on a cold start.
+
+Everything it learns is in one compact JSON 'state', saved to SSM between runs. The
+functions that work on it don't touch AWS, so the simulators can replay recorded
+DNS history through the same logic. (See 'ContainerManager/simulators/prewarm_replay.py')
+"""
+
+import json
+import time
+from datetime import datetime, timezone
+from functools import cache
+from dataclasses import dataclass, asdict
+
+import boto3
+
+from ..common import BOTO_CONFIG, load_env_vars
+
+SECONDS_PER_DAY = 24 * 60 * 60
+SECONDS_PER_WEEK = 7 * SECONDS_PER_DAY
+# Bins that fade below this are dropped, to keep the state small:
+MINIMUM_BIN_WEIGHT = 0.01
+## The state's parameter is Advanced tier, to hold up to 8KB. (A Standard one is only 4KB). A week
+# of 15 minute bins that were ALL busy is still a little over, so dump_state trims it to fit:
+MAX_STATE_BYTES = 8 * 1024
+# CloudWatch can take a couple minutes to show a datapoint. Look back this far every run:
+METRIC_LAG_SECONDS = 2 * 60
+
+# frozen=True: This should never be modified (change cdk inputs instead)
+@dataclass(frozen=True)
+class EnvVars:
+    """ Env vars that the lambda needs. """
+    # pylint: disable=invalid-name
+    ASG_NAME: str
+    # Where the learned histogram (and today's budget) is kept between runs:
+    STATE_PARAMETER: str
+    # The DNS hits, from trigger_start_system:
+    METRIC_NAMESPACE: str
+    METRIC_NAME: str
+    METRIC_DIMENSIONS: str
+    # The Watchdog's Container Activity alarm. (OK means someone's been on, inside it's window):
+    ACTIVITY_ALARM_NAME: str
+    # The leaf's 'PreWarm' config:
+    LEAD_MINUTES: str
+    CONFIDENCE: str
+    MAX_MINUTES_PER_DAY: str
+    HISTORY_WEEKS: str
+    BIN_MINUTES: str
+    # pylint: enable=invalid-name
+
+@dataclass(frozen=True)
+class PreWarmSettings:
+    """ The leaf's 'PreWarm' config, the only part of it the model needs. """
+    lead_minutes: float
+    confidence: float
+    max_minutes_per_day: float
+    history_weeks: int
+    bin_minutes: int
+
+    @classmethod
+    def from_env(cls, env: EnvVars) -> "PreWarmSettings":
+        """ Env vars are always strings """
+        return cls(
+            lead_minutes=float(env.LEAD_MINUTES),
+            confidence=float(env.CONFIDENCE),
+            max_minutes_per_day=float(env.MAX_MINUTES_PER_DAY),
+            history_weeks=int(env.HISTORY_WEEKS),
+            bin_minutes=int(env.BIN_MINUTES),
+        )
+
+    @property
+    def bin_seconds(self) -> int:
+        """ How long each bin of the histogram is """
+        return self.bin_minutes * 60
+
+    @property
+    def decay(self) -> float:
+        """ How much each week that goes by counts for less. (Only last week, with HistoryWeeks=1) """
+        return 1 - 1 / self.history_weeks
+
+@cache
+def get_env_vars() -> EnvVars:
+    """ Lazy-load and Validate the environment variables """
+    return load_env_vars(EnvVars)
+
+## Boto3 Clients:
+# ALWAYS use @cache for clients. Even if they're always called, it helps
+# them not exist until moto is setup inside of the test suite.
+@cache
+def get_asg_client():
+    """ Used for checking, and updating, the ASG desired capacity """
+    return boto3.client('autoscaling', config=BOTO_CONFIG)
+
+@cache
+def get_cloudwatch_client():
+    """ Used for reading the DNS hits, and the Watchdog's alarm """
+    return boto3.client('cloudwatch', config=BOTO_CONFIG)
+
+@cache
+def get_ssm_client():
+    """ Used for keeping the state between runs """
+    return boto3.client('ssm', config=BOTO_CONFIG)
+
+
+######################################
+## The Model (Doesn't touch AWS)    ##
+######################################
+def new_state() -> dict:
+    """ What a leaf that's never been played starts with. """
+    return {
+        # The week (since the epoch) it's in now:
+        "Week": None,
+        # How many weeks it's seen finish, with older ones counting less:
+        "Weeks": 0.0,
+        # {time-of-week bin: how many of those weeks had a DNS hit in it}. (JSON keys are strings):
+        "Bins": {},
+        # The bins with a DNS hit so far this week. Added to 'Bins' once the week's over:
+        "BinsThisWeek": [],
+        # The newest DNS hit added, so each one is only added once:
+        "LastHit": None,
+        # Today's (UTC) budget:
+        "Day": None,
+        "SpeculativeSeconds": 0.0,
+        # When it last spun up without anyone asking, until someone does (or it spins down).
+        #   (The start of the minute, same as the DNS hits. So a hit that same minute counts):
+        "PrewarmedAt": None,
+        # Only spin up once for each bin, even if the Watchdog spins it back down:
+        "LastPrewarmBin": None,
+        "LastRun": None,
+    }
+
+def _roll_to_week(state: dict, week: int, settings: PreWarmSettings) -> None:
+    """
+    Add the week that just finished to the histogram, then any empty ones after it. The
+    newest finished week always counts as 1, and the ones before it fade.
+    """
+    if state["Week"] is None:
+        state["Week"] = week
+        return
+    weeks_passed = week - state["Week"]
+    if weeks_passed <= 0:
+        return
+    ## The week that just finished:
+    bins = {time_of_week: weight * settings.decay for time_of_week, weight in state["Bins"].items()}
+    for time_of_week in state["BinsThisWeek"]:
+        bins[time_of_week] = bins.get(time_of_week, 0.0) + 1
+    weeks = state["Weeks"] * settings.decay + 1
+    ## Any weeks after that, where nobody showed up at all:
+    fade = settings.decay ** (weeks_passed - 1)
+    state["Bins"] = {
+        time_of_week: weight * fade
+        for time_of_week, weight in bins.items()
+        if weight * fade >= MINIMUM_BIN_WEIGHT
+    }
+    state["Weeks"] = weeks * fade + sum(settings.decay ** i for i in range(weeks_passed - 1))
+    state["Week"] = week
+    state["BinsThisWeek"] = []
+
+def add_hit(state: dict, timestamp: float, settings: PreWarmSettings) -> None:
+    """ One DNS hit, in time order. Anything at or before the last one added is skipped. """
+    if state["LastHit"] is not None and timestamp <= state["LastHit"]:
+        return
+    state["LastHit"] = timestamp
+    _roll_to_week(state, int(timestamp // SECONDS_PER_WEEK), settings)
+    time_of_week = str(int(timestamp % SECONDS_PER_WEEK // settings.bin_seconds))
+    if time_of_week not in state["BinsThisWeek"]:
+        state["BinsThisWeek"].append(time_of_week)
+
+def bin_probability(state: dict, timestamp: float, settings: PreWarmSettings) -> float:
+    """
+    How likely someone shows up in the bin 'timestamp' is in. The same bin of each finished
+    week, over how many weeks have finished plus one. (So one busy week alone is only 50%,
+    and a new pattern has to repeat before it beats the Confidence).
+    """
+    time_of_week = str(int(timestamp % SECONDS_PER_WEEK // settings.bin_seconds))
+    return state["Bins"].get(time_of_week, 0.0) / (state["Weeks"] + 1)
+
+def plan(state: dict, now: float, instance_up: bool, settings: PreWarmSettings, someone_on: bool = False) -> str | None:
+    """
+    What to do this run. Add the DNS hits before calling this. Returns:
+      - "PREWARM": Spin up, the bin LeadMinutes from now is usually busy.
+      - "STOP":    A pre-warm nobody's used went over today's MaxMinutesPerDay.
+      - None:      Leave it alone.
+    'someone_on' is if the Watchdog sees anyone connected. A player on a cached DNS answer
+    (or whose hit CloudWatch hasn't shown yet) never shows up as a hit, so it never STOPs then.
+    """
+    _roll_to_week(state, int(now // SECONDS_PER_WEEK), settings)
+    today = int(now // SECONDS_PER_DAY)
+    if state["Day"] != today:
+        state["Day"], state["SpeculativeSeconds"] = today, 0.0
+    last_run = state["LastRun"] if state["LastRun"] is not None else now
+    state["LastRun"] = now
+
+    if state["PrewarmedAt"] is not None:
+        return _charge_prewarm(state, now, last_run, instance_up, settings, someone_on)
+    if _should_prewarm(state, now, instance_up, settings):
+        state["PrewarmedAt"] = now // 60 * 60
+        state["LastPrewarmBin"] = int((now + settings.lead_minutes * 60) // settings.bin_seconds)
+        return "PREWARM"
+    return None
+
+def _charge_prewarm(
+    state: dict,
+    now: float,
+    last_run: float,
+    instance_up: bool,
+    settings: PreWarmSettings,
+    someone_on: bool,
+) -> str | None:
+    """ Add the time it's been up without anyone asking to today's budget. Stop if it's over. """
+    charged_from = max(last_run, state["PrewarmedAt"])
+    if state["LastHit"] is not None and state["LastHit"] >= state["PrewarmedAt"]:
+        ## Someone came. It's not speculative anymore:
+        state["SpeculativeSeconds"] += max(state["LastHit"] - charged_from, 0)
+        state["PrewarmedAt"] = None
+        return None
+    # Charge the whole time since the last run, even if it spun down part way through:
+    state["SpeculativeSeconds"] += now - charged_from
+    ## The Watchdog spun it down (nobody came):
+    if not instance_up:
+        state["PrewarmedAt"] = None
+        return None
+    ## Over budget. Leave it to the Watchdog if anyone's on, it'll keep charging until then:
+    if state["SpeculativeSeconds"] >= settings.max_minutes_per_day * 60 and not someone_on:
+        state["PrewarmedAt"] = None
+        return "STOP"
+    return None
+
+def dump_state(state: dict, max_bytes: int = MAX_STATE_BYTES) -> str:
+    """
+    The state as compact JSON. Weights are rounded, and this week's bins are a bitmap (as hex).
+    If it still doesn't fit in 'max_bytes', the faintest bins are dropped first. They're the
+    furthest from ever beating the Confidence.
+    """
+    bins = {time_of_week: round(weight, 3) for time_of_week, weight in state["Bins"].items()}
+    bins_this_week = sum(1 << int(time_of_week) for time_of_week in state["BinsThisWeek"])
+    state = state | {"Bins": bins, "BinsThisWeek": format(bins_this_week, "x")}
+    value = json.dumps(state, separators=(",", ":"))
+    excess = len(value) - max_bytes
+    if excess > 0:
+        for time_of_week in sorted(bins, key=bins.get):
+            if excess <= 0:
+                break
+            # Each one is '"<bin>":<weight>,' in there:
+            excess -= len(json.dumps({time_of_week: bins.pop(time_of_week)}, separators=(",", ":"))) - 1
+        print(f"State was {len(value)} bytes, dropped the faintest bins to fit in {max_bytes}.")
+        value = json.dumps(state, separators=(",", ":"))
+    return value
+
+def parse_state(value: str) -> dict:
+    """ The other half of dump_state. (CDK deploys it as '{}', anything missing is filled in) """
+    state = new_state() | json.loads(value)
+    if isinstance(state["BinsThisWeek"], str):
+        bins_this_week = int(state["BinsThisWeek"], 16)
+        state["BinsThisWeek"] = [str(i) for i in range(bins_this_week.bit_length()) if bins_this_week >> i & 1]
+    return state
+
+def _should_prewarm(state: dict, now: float, instance_up: bool, settings: PreWarmSettings) -> bool:
+    """ If it's down, there's budget left, and the bin LeadMinutes from now is usually busy (and not tried yet) """
+    lead_time = now + settings.lead_minutes * 60
+    return (
+        not instance_up
+        and state["SpeculativeSeconds"] < settings.max_minutes_per_day * 60
+        and int(lead_time // settings.bin_seconds) != state["LastPrewarmBin"]
+        and bin_probability(state, lead_time, settings) >= settings.confidence
+    )
+
+
+######################################
+## The Lambda                       ##
+######################################
+def lambda_handler(event, context):
+    """ Main function of the lambda. """
+    env = get_env_vars()
+    print(json.dumps({"Event": event, "Context": context, "Env": asdict(env)}, default=str))
+    settings = PreWarmSettings.from_env(env)
+    now = time.time()
+
+    state = load_state(env)
+    for hit in get_dns_hits(env, state, now):
+        add_hit(state, hit, settings)
+    instance_up = get_desired_capacity(env) > 0
+    # Only look it up if it could STOP this run:
+    someone_on = instance_up and state["PrewarmedAt"] is not None and get_activity_alarm_state(env) == "OK"
+    action = plan(state, now, instance_up=instance_up, settings=settings, someone_on=someone_on)
+    print(json.dumps({
+        "Action": action,
+        "Probability": bin_probability(state, now + settings.lead_minutes * 60, settings),
+        "State": state,
+    }, default=str))
+
+    if action is not None:
+        # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/autoscaling.html#AutoScaling.Client.update_auto_scaling_group
+        get_asg_client().update_auto_scaling_group(
+            AutoScalingGroupName=env.ASG_NAME,
+            DesiredCapacity=1 if action == "PREWARM" else 0,
+        )
+    save_state(env, state)
+
+def load_state(env: EnvVars) -> dict:
+    """ The state from the last run """
+    parameter = get_ssm_client().get_parameter(Name=env.STATE_PARAMETER)
+    return parse_state(parameter["Parameter"]["Value"])
+
+def save_state(env: EnvVars, state: dict) -> None:
+    """ For the next run. (Trimmed to fit, see dump_state) """
+    get_ssm_client().put_parameter(
+        Name=env.STATE_PARAMETER,
+        Value=dump_state(state),
+        Type="String",
+        # Same as CDK deploys it with. (Leaving it out would try to put it back to Standard):
+        Tier="Advanced",
+        Overwrite=True,
+    )
+
+def get_dns_hits(env: EnvVars, state: dict, now: float) -> list[float]:
+    """
+    When each minute with a DNS hit started, since the last run. (Anything already
+    added is skipped by add_hit, so looking back a little further is fine)
+    """
+    start = now - METRIC_LAG_SECONDS - SECONDS_PER_DAY
+    if state["LastRun"] is not None:
+        start = max(start, state["LastRun"] - METRIC_LAG_SECONDS)
+    # Line up with the period, or the datapoints won't be at the start of each minute:
+    start = start // 60 * 60
+    dimensions = [{"Name": k, "Value": v} for k, v in json.loads(env.METRIC_DIMENSIONS).items()]
+    # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/cloudwatch/paginator/GetMetricData.html
+    paginator = get_cloudwatch_client().get_paginator("get_metric_data")
+    hits = []
+    for page in paginator.paginate(
+        MetricDataQueries=[{
+            "Id": "dns_hit",
+            "MetricStat": {
+                "Metric": {
+                    "Namespace": env.METRIC_NAMESPACE,
+                    "MetricName": env.METRIC_NAME,
+                    "Dimensions": dimensions,
+                },
+                "Period": 60,
+                "Stat": "SampleCount",
+            },
+        }],
+        StartTime=datetime.fromtimestamp(start, tz=timezone.utc),
+        EndTime=datetime.fromtimestamp(now, tz=timezone.utc),
+        ScanBy="TimestampAscending",
+    ):
+        for result in page["MetricDataResults"]:
+            hits.extend(
+                timestamp.timestamp() for timestamp, value in zip(result["Timestamps"], result["Values"]) if value > 0
+            )
+    return sorted(hits)
+
+def get_activity_alarm_state(env: EnvVars) -> str:
+    """ 'OK' if the Watchdog saw someone on, somewhere in it's window """
+    # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/cloudwatch/client/describe_alarms.html
+    alarms = get_cloudwatch_client().describe_alarms(AlarmNames=[env.ACTIVITY_ALARM_NAME])["MetricAlarms"]
+    return alarms[0]["StateValue"] if alarms else "INSUFFICIENT_DATA"
+
+def get_desired_capacity(env: EnvVars) -> int:
+    """ If it's already up (or on it's way up), there's nothing to pre-warm """
+    asg = get_asg_client().describe_auto_scaling_groups(
+        AutoScalingGroupNames=[env.ASG_NAME],
+    )["AutoScalingGroups"][0]
+    return asg["DesiredCapacity"]
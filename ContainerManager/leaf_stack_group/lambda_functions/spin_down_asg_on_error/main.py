@@ -1,6 +1,10 @@
 
 """
 Lambda for spinning down the ASG if the container ever throws.
+
+Deployed either once per leaf (lambda_handler, configured by env vars), or once
+for every leaf in the base stack (router_handler, which looks up each leaf by
+it's ECS cluster).
 """
 
 import os
@@ -10,6 +14,8 @@ from dataclasses import dataclass, asdict
 
 import boto3
 
+from ..common import BOTO_CONFIG, load_env_vars, lookup_leaf_env_vars
+
 # frozen=True: This should never be modified (change cdk inputs instead)
 @dataclass(frozen=True)
 class EnvVars:
@@ -21,11 +27,7 @@ class EnvVars:
 @cache
 def get_env_vars() -> EnvVars:
     """ Lazy-load and Validate the environment variables """
-    # EnvVars will naturally error with ALL the missing env-vars on creation:
-    return EnvVars(**{
-        # DON'T use getenv. We don't want the key to exist if it's missing.
-        k: os.environ[k] for k in EnvVars.__annotations__.keys() if k in os.environ
-    })
+    return load_env_vars(EnvVars)
 
 ## Boto3 Clients:
 # ALWAYS use @cache for clients. Even if they're always called, it helps
@@ -33,12 +35,32 @@ def get_env_vars() -> EnvVars:
 @cache
 def get_asg_client():
     """ ASG client """
-    return boto3.client('autoscaling')
+    return boto3.client('autoscaling', config=BOTO_CONFIG)
+
+@cache
+def get_ssm_client():
+    """ Used for the router's lookups """
+    return boto3.client('ssm', config=BOTO_CONFIG)
 
 def lambda_handler(event, context):
     """ Main function of the lambda. """
     env = get_env_vars()
     print(json.dumps({"Event": event, "Context": context, "Env": asdict(env)}, default=str))
+    spin_down_asg(env)
+
+def router_handler(event, context):
+    """
+    Main function of the base stack's shared lambda. Every leaf's crash-loop rule
+    invokes it, and the event's cluster says which leaf it's for.
+    """
+    # The ARN's have ':' in them, which SSM names can't. The cluster name is after the last '/':
+    cluster_name = event["detail"]["clusterArn"].split("/")[-1]
+    env = lookup_leaf_env_vars(get_ssm_client(), cluster_name, EnvVars)
+    print(json.dumps({"Event": event, "Context": context, "Env": asdict(env)}, default=str))
+    spin_down_asg(env)
+
+def spin_down_asg(env: EnvVars) -> None:
+    """ Spin down the leaf's ASG """
     asg_client = get_asg_client()
 
     ## Spin down the instance. The instance-StateChange-hook will do the rest:
@@ -47,3 +69,10 @@ def lambda_handler(event, context):
         AutoScalingGroupName=env.ASG_NAME,
         DesiredCapacity=0,
     )
+
+## SnapStart and Provisioned Concurrency run this module's init ahead of time, before anyone
+# is waiting on it. Create the clients then, so they're not part of the first invocation:
+# https://docs.aws.amazon.com/lambda/latest/dg/configuration-envvars.html#configuration-envvars-runtime
+if os.environ.get("AWS_LAMBDA_INITIALIZATION_TYPE") in ("snap-start", "provisioned-concurrency"):
+    get_asg_client()
+    get_ssm_client()
@@ -1,15 +1,33 @@
 
 """
 Lambda code for starting the system when someone tries to connect.
+
+Deployed either once per leaf (lambda_handler, configured by env vars), or once
+for every leaf as the base stack's shared router (router_handler, which looks up
+each leaf by it's domain).
 """
 
 import os
 import json
+import gzip
+import time
+import base64
+from datetime import datetime, timezone
 from functools import cache
 from dataclasses import dataclass, asdict
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
 
+from ..common import BOTO_CONFIG, load_env_vars, lookup_leaf_env_vars
+
+## A single player connecting sends a burst of DNS queries, each its own delivery. If THIS
+# lambda container already set desired=1 recently, the ASG is already on its way up:
+SCALE_UP_DEBOUNCE_SECONDS = 30
+# Module level, so it survives between invocations of the same (warm) lambda container.
+# Keyed by ASG name, since the router starts every leaf: {asg_name: monotonic}
+last_scale_up = {}
+
 # frozen=True: This should never be modified (change cdk inputs instead)
 @dataclass(frozen=True)
 class EnvVars:
@@ -23,60 +41,176 @@ class EnvVars:
     METRIC_THRESHOLD: str
     METRIC_UNIT: str
     METRIC_DIMENSIONS: str
+    METRIC_PERIOD_SECONDS: str
+    # For timing how long it takes to spin up, from the first DNS query:
+    COLD_START_PARAMETER: str
     # pylint: enable=invalid-name
 
 @cache
 def get_env_vars() -> EnvVars:
     """ Lazy-load and Validate the environment variables """
-    # EnvVars will naturally error with ALL the missing env-vars on creation:
-    return EnvVars(**{
-        # DON'T use getenv. We don't want the key to exist if it's missing.
-        k: os.environ[k] for k in EnvVars.__annotations__.keys() if k in os.environ
-    })
+    return load_env_vars(EnvVars)
 
 ## Boto3 Clients:
 # ALWAYS use @cache for clients. Even if they're always called, it helps
 # them not exist until moto is setup inside of the test suite.
+# (Per region, since the router starts leaves in any of them)
 @cache
-def get_cloudwatch_client():
+def get_cloudwatch_client(region: str):
     """ Used for putting metric data """
-    env = get_env_vars()
-    return boto3.client('cloudwatch', region_name=env.MANAGER_STACK_REGION)
+    return boto3.client('cloudwatch', region_name=region, config=BOTO_CONFIG)
 
 @cache
-def get_asg_client():
+def get_asg_client(region: str):
     """ Used for updating the ASG desired capacity """
-    env = get_env_vars()
-    return boto3.client('autoscaling', region_name=env.MANAGER_STACK_REGION)
+    return boto3.client('autoscaling', region_name=region, config=BOTO_CONFIG)
+
+@cache
+def get_ssm_client(region: str):
+    """ Used for saving when the first DNS query came in, and the router's lookups """
+    return boto3.client('ssm', region_name=region, config=BOTO_CONFIG)
 
 
 def lambda_handler(event, context):
     """ Main function of the lambda. """
     env = get_env_vars()
     print(json.dumps({"Event": event, "Context": context, "Env": asdict(env)}, default=str))
+    start_system(env, decode_log_data(event)["logEvents"])
+
+def router_handler(event, context):
+    """
+    Main function of the base stack's shared router. Every leaf's subscription filter
+    points here, and is named after the leaf's domain.
+    """
+    log_data = decode_log_data(event)
+    domain = log_data["subscriptionFilters"][0]
+    # Each leaf saves it's EnvVars under it's domain. (The parameters are in the router's
+    # region, Lambda sets AWS_REGION):
+    env = lookup_leaf_env_vars(get_ssm_client(os.environ["AWS_REGION"]), domain, EnvVars)
+    print(json.dumps({"Domain": domain, "LogGroup": log_data["logGroup"], "Context": context, "Env": asdict(env)}, default=str))
+    start_system(env, log_data["logEvents"])
+
+def start_system(env: EnvVars, log_events: list) -> None:
+    """ Start one leaf, for the DNS queries in this batch """
+    print(f"Batch has {len(log_events)} DNS queries.")
+
+    ## Create the clients before using them in threads. (Creating them isn't thread-safe,
+    # but using them is):
+    region = env.MANAGER_STACK_REGION
+    clients = [get_cloudwatch_client(region)]
+    skip_scale_up = recently_scaled_up(env.ASG_NAME)
+    if not skip_scale_up:
+        clients += [get_asg_client(region), get_ssm_client(region)]
 
-    ### Let the metric know someone is trying to connect, to stop it
-    ### from alarming and spinning down the system:
-    ###   (Also if the system is in alarm, this resets it so it can spin down again)
+    ## None of these depend on each other, so send them all at once:
+    with ThreadPoolExecutor(max_workers=len(clients)) as executor:
+        futures = [
+            ### Let the metric know someone is trying to connect, to stop it
+            ### from alarming and spinning down the system:
+            ###   (Also if the system is in alarm, this resets it so it can spin down again)
+            executor.submit(put_dns_traffic_metric, env, log_events),
+        ]
+        if skip_scale_up:
+            print(f"Already set desired=1 in the last {SCALE_UP_DEBOUNCE_SECONDS} seconds, skipping.")
+        else:
+            ## Spin up the instance. The instance-StateChange-hook will do the rest:
+            futures.append(executor.submit(scale_up_asg, env))
+            ## Save when the first query came in. The instance takes minutes to
+            # come up, so it can't beat this: (A debounced batch already saved it's own)
+            futures.append(executor.submit(save_first_query_timestamp, env, log_events))
+        # Raise if any of them failed:
+        for future in futures:
+            future.result()
+
+def decode_log_data(event: dict) -> dict:
+    """
+    Subscription filter events are base64 encoded, gzipped json. Returns it decoded,
+    with the DNS query log events under 'logEvents'.
+    """
+    # https://docs.aws.amazon.com/AmazonCloudWatch/latest/logs/SubscriptionFilters.html#LambdaFunctionExample
+    return json.loads(gzip.decompress(base64.b64decode(event["awslogs"]["data"])))
+
+def put_dns_traffic_metric(env: EnvVars, log_events: list) -> None:
+    """
+    Push every query in the batch with one call. Queries are grouped by the period they
+    came in (the Watchdog alarm's), with one datum per period holding how many there were.
+    """
     dimensions_input = json.loads(env.METRIC_DIMENSIONS)
     # Change it to the format boto3 cloudwatch wants:
     dimension_map = [{"Name": k, "Value": v} for k, v in dimensions_input.items()]
-    cloudwatch_client = get_cloudwatch_client()
+    # One greater than the threshold, to make sure the alarm doesn't error:
+    value = 1+int(env.METRIC_THRESHOLD)
+
+    period_ms = int(env.METRIC_PERIOD_SECONDS) * 1000
+    hits_per_period = {}
+    for log_event in log_events:
+        period_start = log_event["timestamp"] // period_ms * period_ms
+        hits_per_period[period_start] = hits_per_period.get(period_start, 0) + 1
+
+    # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/cloudwatch/client/put_metric_data.html
+    cloudwatch_client = get_cloudwatch_client(env.MANAGER_STACK_REGION)
     cloudwatch_client.put_metric_data(
         Namespace=env.METRIC_NAMESPACE,
         MetricData=[{
             'MetricName': env.METRIC_NAME,
             'Dimensions': dimension_map,
             'Unit': env.METRIC_UNIT,
-            # One greater than the threshold, to make sure the alarm doesn't error:
-            'Value': 1+int(env.METRIC_THRESHOLD),
-        }],
+            'Timestamp': datetime.fromtimestamp(period_start / 1000, tz=timezone.utc),
+            # Sub-minute alarms can only see high-resolution data:
+            'StorageResolution': 1 if period_ms < 60_000 else 60,
+            # The alarm uses 'Maximum', so it sees the same value no matter how many hits:
+            'StatisticValues': {
+                'SampleCount': hits,
+                'Sum': hits * value,
+                'Minimum': value,
+                'Maximum': value,
+            },
+        } for period_start, hits in hits_per_period.items()],
+    )
+
+def recently_scaled_up(asg_name: str) -> bool:
+    """ If this lambda container already set desired=1 in the last SCALE_UP_DEBOUNCE_SECONDS """
+    return (
+        asg_name in last_scale_up
+        and time.monotonic() - last_scale_up[asg_name] < SCALE_UP_DEBOUNCE_SECONDS
     )
 
-    ## Spin up the instance. The instance-StateChange-hook will do the rest:
+def scale_up_asg(env: EnvVars) -> None:
+    """ Set the ASG's desired capacity to 1, and remember when we did """
     # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/autoscaling.html#AutoScaling.Client.update_auto_scaling_group
-    asg_client = get_asg_client()
+    asg_client = get_asg_client(env.MANAGER_STACK_REGION)
     asg_client.update_auto_scaling_group(
         AutoScalingGroupName=env.ASG_NAME,
         DesiredCapacity=1,
     )
+    last_scale_up[env.ASG_NAME] = time.monotonic()
+
+def save_first_query_timestamp(env: EnvVars, log_events: list) -> None:
+    """
+    Save when the earliest DNS query in this batch came in. The instance-StateChange-hook
+    publishes how long it took, once DNS points at the instance.
+
+    Only the FIRST query of a spin-up counts. Every query after it (while the system is
+    starting, or already up) fails to overwrite it, until the hook clears it on spin-down.
+    """
+    first_query_ms = min(log_event["timestamp"] for log_event in log_events)
+
+    ssm_client = get_ssm_client(env.MANAGER_STACK_REGION)
+    try:
+        ssm_client.put_parameter(
+            Name=env.COLD_START_PARAMETER,
+            Value=str(first_query_ms),
+            Type="String",
+            Overwrite=False,
+        )
+    except ssm_client.exceptions.ParameterAlreadyExists:
+        print("An earlier DNS query already started the system, keeping it's timestamp.")
+
+## SnapStart and Provisioned Concurrency run this module's init ahead of time, before anyone
+# is waiting on it. Create the clients then, so they're not part of the first invocation:
+# https://docs.aws.amazon.com/lambda/latest/dg/configuration-envvars.html#configuration-envvars-runtime
+# (Only the per-leaf lambda uses these. The router doesn't know which regions it needs yet)
+if os.environ.get("AWS_LAMBDA_INITIALIZATION_TYPE") in ("snap-start", "provisioned-concurrency"):
+    get_cloudwatch_client(get_env_vars().MANAGER_STACK_REGION)
+    get_asg_client(get_env_vars().MANAGER_STACK_REGION)
+    get_ssm_client(get_env_vars().MANAGER_STACK_REGION)
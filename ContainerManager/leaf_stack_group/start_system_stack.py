@@ -18,18 +18,22 @@ from aws_cdk import (
     aws_logs as logs,
     aws_logs_destinations as logs_destinations,
     aws_lambda as aws_lambda,
+    aws_ssm as ssm,
 )
 from constructs import Construct
 
 from cdk_nag import NagSuppressions
 
+from ContainerManager.base_stack import StartRouterStack
 from ContainerManager.leaf_stack_group.container_manager_stack import ContainerManagerStack
 from ContainerManager.leaf_stack_group.domain_stack import DomainStack
+from ContainerManager.utils.lambda_profile import lambda_code_kwargs, lambda_profile_kwargs, lambda_profile_target
 
 class StartSystemStack(Stack):
     """
     This stacks sets up the lambda to turn the system on,
-    and adds the DNS records to trigger it.
+    and adds the DNS records to trigger it. (Or if the base stack
+    has a shared router, points the DNS logs at that instead).
     """
     def __init__(
         self,
@@ -38,65 +42,142 @@ class StartSystemStack(Stack):
         domain_stack: DomainStack,
         container_manager_stack: ContainerManagerStack,
         container_id: str,
+        lambda_profile: dict,
+        start_router_stack: StartRouterStack | None = None,
         **kwargs
     ) -> None:
         super().__init__(scope, construct_id, **kwargs)
         container_id_alpha = "".join(e for e in container_id.title() if e.isalnum())
+        watchdog_nested_stack = container_manager_stack.watchdog_nested_stack
+
+        ## Everything the lambda needs to start this leaf. Either it's own lambda's env
+        # vars, or what the base stack's shared router looks up by domain:
+        self.start_system_env_vars = {
+            "ASG_NAME": container_manager_stack.ecs_asg_nested_stack.auto_scaling_group.auto_scaling_group_name,
+            "MANAGER_STACK_REGION": container_manager_stack.region,
+            ## Metric info to let the system know someone is trying to connect, and don't spin down:
+            #   (In a HostGroup, it's the group's. See the Watchdog)
+            "METRIC_NAMESPACE": watchdog_nested_stack.traffic_dns_metric.namespace,
+            "METRIC_NAME": watchdog_nested_stack.traffic_dns_metric.metric_name,
+            "METRIC_THRESHOLD": str(watchdog_nested_stack.threshold),
+            ## Convert METRIC_UNIT from an Enum, to a string that boto3 expects. (Words must have first
+            #   letter capitalized too, which is what `.title()` does. Otherwise they'd be all caps).
+            "METRIC_UNIT": watchdog_nested_stack.metric_unit.value.title(),
+            "METRIC_DIMENSIONS": json.dumps(watchdog_nested_stack.traffic_dns_metric.dimensions),
+            # Group the hits by the alarm's period. (Under a minute, they're high-resolution):
+            "METRIC_PERIOD_SECONDS": str(int(watchdog_nested_stack.metric_period.to_seconds())),
+            ## Where to save when the first DNS query came in, for the cold start metric:
+            "COLD_START_PARAMETER": watchdog_nested_stack.cold_start_parameter_name,
+        }
+
+        ## What the lambda is allowed to do to this leaf:
+        start_system_statements = [
+            # Give it permissions to push to the metric:
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=["cloudwatch:PutMetricData"],
+                resources=["*"],
+                conditions={
+                    "StringEquals": {
+                        "cloudwatch:namespace": watchdog_nested_stack.traffic_dns_metric.namespace,
+                    }
+                }
+            ),
+            # Give it permissions to update the ASG desired_capacity:
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=[
+                    "autoscaling:UpdateAutoScalingGroup",
+                ],
+                resources=[container_manager_stack.ecs_asg_nested_stack.auto_scaling_group.auto_scaling_group_arn],
+            ),
+            # Give it permissions to save when the first DNS query came in:
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=["ssm:PutParameter"],
+                # The parameter lives in the container manager's region, not this one:
+                resources=[self.format_arn(
+                    service="ssm",
+                    region=container_manager_stack.region,
+                    resource="parameter",
+                    # The name already starts with a '/':
+                    resource_name=watchdog_nested_stack.cold_start_parameter_name.lstrip("/"),
+                )],
+            ),
+        ]
+
+        if start_router_stack is None:
+            ## Log group for the lambda function:
+            # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_logs.LogGroup.html
+            self.log_group_start_system = logs.LogGroup(
+                self,
+                "LogGroupStartSystem",
+                retention=logs.RetentionDays.ONE_WEEK,
+                removal_policy=RemovalPolicy.DESTROY,
+                log_group_name=f"/aws/lambda/{container_id}-lambda-start-system",
+            )
 
-        ## Log group for the lambda function:
-        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_logs.LogGroup.html
-        self.log_group_start_system = logs.LogGroup(
-            self,
-            "LogGroupStartSystem",
-            retention=logs.RetentionDays.ONE_WEEK,
-            removal_policy=RemovalPolicy.DESTROY,
-            log_group_name=f"/aws/lambda/{container_id}-lambda-start-system",
-        )
+            ## Policy/Role for lambda function:
+            # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_iam.Role.html
+            self.start_system_role = iam.Role(
+                self,
+                "StartSystemRole",
+                assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"),
+                description="Role for the StartSystem lambda function.",
+            )
+
+            ## Lambda that turns system on
+            # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_lambda.Function.html
+            self.lambda_start_system = aws_lambda.Function(
+                self,
+                "StartSystem",
+                description=f"{container_id_alpha}-lambda-start-system: Spin up ASG when someone connects.",
+                **lambda_code_kwargs("trigger_start_system"),
+                runtime=aws_lambda.Runtime.PYTHON_3_12,
+                timeout=Duration.seconds(30),
+                **lambda_profile_kwargs(lambda_profile),
+                log_group=self.log_group_start_system,
+                role=self.start_system_role,
+                environment=self.start_system_env_vars,
+            )
+            # Let lambda write to it's log group:
+            self.log_group_start_system.grant_write(self.lambda_start_system)
+            # If SnapStart/ProvisionedConcurrency is on, the trigger has to invoke a published version:
+            self.lambda_start_system_target = lambda_profile_target(self, self.lambda_start_system, lambda_profile)
+        else:
+            ## Shared router: Save what it needs to start this leaf, under this leaf's domain:
+            # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_ssm.StringParameter.html
+            self.start_router_parameter = ssm.StringParameter(
+                self,
+                "StartRouterParameter",
+                parameter_name=f"{start_router_stack.leaf_parameter_prefix}/{domain_stack.sub_domain_name}",
+                description=f"What the shared StartSystem router needs to start '{container_id}'.",
+                string_value=self.to_json_string(self.start_system_env_vars),
+            )
+            # The router's role, so this leaf can add it's own permissions to it.
+            #   (The router can't know about every leaf, it'd have to depend on them):
+            self.start_system_role = iam.Role.from_role_arn(
+                self,
+                "StartRouterRole",
+                role_arn=start_router_stack.start_router_role.role_arn,
+                mutable=True,
+            )
+            # The router already lets every leaf's query logs invoke it:
+            self.lambda_start_system_target = aws_lambda.Function.from_function_attributes(
+                self,
+                "StartRouter",
+                function_arn=start_router_stack.lambda_start_router.function_arn,
+                skip_permissions=True,
+            )
 
-        ## Policy/Role for lambda function:
-        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_iam.Role.html
-        self.start_system_role = iam.Role(
-            self,
-            "StartSystemRole",
-            assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"),
-            description="Role for the StartSystem lambda function.",
-        )
         # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_iam.Policy.html
         self.start_system_policy = iam.Policy(
             self,
             "StartSystemPolicy",
             roles=[self.start_system_role],
-            # Statements added at the end of this file:
-            statements=[],
-        )
-
-        ## Lambda that turns system on
-        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_lambda.Function.html
-        self.lambda_start_system = aws_lambda.Function(
-            self,
-            "StartSystem",
-            description=f"{container_id_alpha}-lambda-start-system: Spin up ASG when someone connects.",
-            code=aws_lambda.Code.from_asset("./ContainerManager/leaf_stack_group/lambda_functions/trigger_start_system/"),
-            handler="main.lambda_handler",
-            runtime=aws_lambda.Runtime.PYTHON_3_12,
-            timeout=Duration.seconds(30),
-            log_group=self.log_group_start_system,
-            role=self.start_system_role,
-            environment={
-                "ASG_NAME": container_manager_stack.ecs_asg_nested_stack.auto_scaling_group.auto_scaling_group_name,
-                "MANAGER_STACK_REGION": container_manager_stack.region,
-                ## Metric info to let the system know someone is trying to connect, and don't spin down:
-                "METRIC_NAMESPACE": container_manager_stack.watchdog_nested_stack.metric_namespace,
-                "METRIC_NAME": container_manager_stack.watchdog_nested_stack.traffic_dns_metric.metric_name,
-                "METRIC_THRESHOLD": str(container_manager_stack.watchdog_nested_stack.threshold),
-                ## Convert METRIC_UNIT from an Enum, to a string that boto3 expects. (Words must have first
-                #   letter capitalized too, which is what `.title()` does. Otherwise they'd be all caps).
-                "METRIC_UNIT": container_manager_stack.watchdog_nested_stack.metric_unit.value.title(),
-                "METRIC_DIMENSIONS": json.dumps(container_manager_stack.watchdog_nested_stack.metric_dimension_map),
-            },
+            statements=start_system_statements,
         )
 
-
         ## Trigger the system when someone connects:
         # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_logs.SubscriptionFilter.html
         # https://conermurphy.com/blog/route53-hosted-zone-lambda-dns-invocation-aws-cdk
@@ -104,37 +185,11 @@ class StartSystemStack(Stack):
             self,
             "SubscriptionFilter",
             log_group=domain_stack.route53_query_log_group,
-            destination=logs_destinations.LambdaDestination(self.lambda_start_system),
+            destination=logs_destinations.LambdaDestination(self.lambda_start_system_target),
             # Spaces on either side, so it doesn't match the "_tcp" query that pairs with it:
             filter_pattern=logs.FilterPattern.any_term(domain_stack.dns_log_query_filter),
-        )
-
-
-        ### Add Lambda's permissions, now that you can reference everything:
-        # Let lambda write to it's log group:
-        self.log_group_start_system.grant_write(self.lambda_start_system)
-        # Give it permissions to push to the metric:
-        self.start_system_policy.add_statements(
-            iam.PolicyStatement(
-                effect=iam.Effect.ALLOW,
-                actions=["cloudwatch:PutMetricData"],
-                resources=["*"],
-                conditions={
-                    "StringEquals": {
-                        "cloudwatch:namespace": container_manager_stack.watchdog_nested_stack.metric_namespace,
-                    }
-                }
-            )
-        )
-        # Give it permissions to update the ASG desired_capacity:
-        self.start_system_policy.add_statements(
-            iam.PolicyStatement(
-                effect=iam.Effect.ALLOW,
-                actions=[
-                    "autoscaling:UpdateAutoScalingGroup",
-                ],
-                resources=[container_manager_stack.ecs_asg_nested_stack.auto_scaling_group.auto_scaling_group_arn],
-            )
+            # The shared router finds which leaf it's starting by this name:
+            filter_name=domain_stack.sub_domain_name,
         )
 
         ###############
@@ -0,0 +1,3 @@
+"""
+Local tools for tuning a leaf config offline, against recorded metrics.
+"""
@@ -0,0 +1,190 @@
+"""
+dns_cost.py
+
+Replays exported Route53 query logs through the start/stop policy, to see what a
+leaf would cost before deploying it. Someone looking up the domain starts it (the
+same filter the Start System's subscription uses), and the Watchdog's window stops
+it again once they're done. Reads the logs as a stream, so months of them is fine.
+
+    python3 -m ContainerManager.simulators.dns_cost \\
+        --config-file ./Examples/Minecraft.java.example.yaml \\
+        --domain-name minecraft.example.com \\
+        --log-files ./query-logs/*.gz \\
+        --price m5.large=0.096 t3.large=0.0832 --minutes 5 10
+"""
+
+import argparse
+import gzip
+import re
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+
+from aws_cdk import aws_route53 as route53
+
+from ContainerManager.leaf_stack_group.domain_stack import dns_log_query_filter
+from ContainerManager.utils.config_loader import load_leaf_watchdog_config
+from .watchdog_replay import alarm_period_seconds, parse_timestamp
+
+## Route53 query logs start with the log format version, then when it was queried:
+# https://docs.aws.amazon.com/Route53/latest/DeveloperGuide/query-logs.html#query-logs-format
+#   (Exports to S3 put the ingestion time in front of that, so just search for it)
+QUERY_TIMESTAMP = re.compile(r"\b1\.0 (\d{4}-\d{2}-\d{2}T\S+)")
+# EC2 (Linux) is billed per second, with a one minute minimum each time it starts:
+# https://aws.amazon.com/ec2/pricing/on-demand/
+MINIMUM_BILLED_SECONDS = 60
+AVERAGE_DAYS_PER_MONTH = 365.25 / 12
+
+
+@dataclass
+class DnsCostResult:
+    """ What one MinutesWithoutConnections would have done, over the whole export. """
+    minutes_without_connections: float
+    starts: int = 0
+    instance_seconds: float = 0.0
+    # Billed after the last player left, while the Watchdog waits out it's window:
+    idle_seconds: float = 0.0
+    first_query: datetime | None = None
+    last_query: datetime | None = None
+    # Keyed by 'YYYY-MM', of when each run started:
+    instance_hours_by_month: dict[str, float] = field(default_factory=dict)
+
+    @property
+    def instance_hours(self) -> float:
+        """ Over the whole export """
+        return self.instance_seconds / 3600
+
+    @property
+    def idle_minutes(self) -> float:
+        """ Over the whole export """
+        return self.idle_seconds / 60
+
+    @property
+    def monthly_instance_hours(self) -> float:
+        """ Scaled to an average month. (Anything under a day of logs counts as a day) """
+        if self.first_query is None:
+            return 0.0
+        days = max((self.last_query - self.first_query).total_seconds() / 86400, 1)
+        return self.instance_hours * AVERAGE_DAYS_PER_MONTH / days
+
+
+def read_queries(log_files: Iterable[str], query_filter: str) -> Iterator[datetime]:
+    """
+    When each query the Start System would have seen happened, one line at a time.
+    Files ending in '.gz' (S3 exports) are read compressed.
+    """
+    for log_file in log_files:
+        opener = gzip.open if log_file.endswith(".gz") else open
+        with opener(log_file, "rt", encoding="utf-8") as logs:
+            for line in logs:
+                if query_filter not in line:
+                    continue
+                match = QUERY_TIMESTAMP.search(line)
+                if match:
+                    yield parse_timestamp(match.group(1))
+
+
+class StartStopPolicy:
+    """
+    Follows the instance through the queries for one MinutesWithoutConnections. Each query is
+    a player, on for 'play_minutes' after it. Their DNS hit (and play time) counts for whole
+    alarm periods, and the Watchdog spins down once the window after that's gone by.
+    """
+    def __init__(self, period_seconds: int, minutes_without_connections: float, play_minutes: float = 0):
+        window_seconds = round(minutes_without_connections * 60)
+        if window_seconds % period_seconds != 0:
+            raise ValueError(
+                f"MinutesWithoutConnections ({minutes_without_connections}) has to be a whole number of periods ({period_seconds}s)."
+            )
+        self.period_seconds = period_seconds
+        self.window = timedelta(seconds=window_seconds)
+        self.play_time = timedelta(minutes=play_minutes)
+        self.result = DnsCostResult(minutes_without_connections=minutes_without_connections)
+        self._up_since = None
+        self._active_until = None
+        self._last_activity = None
+
+    def _period_end(self, timestamp: datetime) -> datetime:
+        period_start = timestamp.timestamp() // self.period_seconds * self.period_seconds
+        return datetime.fromtimestamp(period_start + self.period_seconds, tz=timezone.utc)
+
+    def _spin_down(self) -> None:
+        stop = self._active_until + self.window
+        seconds = max((stop - self._up_since).total_seconds(), MINIMUM_BILLED_SECONDS)
+        self.result.instance_seconds += seconds
+        self.result.idle_seconds += (stop - self._last_activity).total_seconds()
+        month = self._up_since.strftime("%Y-%m")
+        self.result.instance_hours_by_month[month] = self.result.instance_hours_by_month.get(month, 0) + seconds / 3600
+        self._up_since = None
+
+    def add_query(self, timestamp: datetime) -> None:
+        """ One query, in time order. (Edge locations can log a little out of order, those count as 'now') """
+        if self.result.last_query is not None:
+            timestamp = max(timestamp, self.result.last_query)
+        self.result.first_query = self.result.first_query or timestamp
+        self.result.last_query = timestamp
+        if self._up_since is not None and timestamp >= self._active_until + self.window:
+            self._spin_down()
+        if self._up_since is None:
+            self._up_since = timestamp
+            self._active_until = self._last_activity = timestamp
+            self.result.starts += 1
+        self._last_activity = max(self._last_activity, timestamp + self.play_time)
+        self._active_until = max(self._active_until, self._period_end(timestamp + self.play_time))
+
+    def finish(self) -> DnsCostResult:
+        """ Let the last run spin down, and return the totals. """
+        if self._up_since is not None:
+            self._spin_down()
+        return self.result
+
+
+def replay_queries(queries: Iterable[datetime], policies: list[StartStopPolicy]) -> list[DnsCostResult]:
+    """ Feed every query to every policy in one pass, so the logs are only read once. """
+    for timestamp in queries:
+        for policy in policies:
+            policy.add_query(timestamp)
+    return [policy.finish() for policy in policies]
+
+
+def _instance_price(price: str) -> tuple[str, float]:
+    """ 'm5.large=0.096' -> ('m5.large', 0.096) """
+    instance_type, _, usd_per_hour = price.partition("=")
+    try:
+        return instance_type, float(usd_per_hour)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(f"Expected '<instance-type>=<USD per hour>', got '{price}'.") from e
+
+def main(argv: list[str] | None = None) -> None:
+    """ Print what each MinutesWithoutConnections would cost a month, on each instance type. """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config-file", required=True, help="The leaf config, for it's 'Watchdog' block.")
+    parser.add_argument("--domain-name", required=True, help="The leaf's domain. ('<container-id>.<root hosted zone>')")
+    parser.add_argument("--log-files", required=True, nargs="+", help="Exported query logs, in time order. ('.gz' is fine)")
+    parser.add_argument("--price", required=True, type=_instance_price, nargs="+", help="'<instance-type>=<USD per hour>' to compare.")
+    parser.add_argument("--minutes", type=float, nargs="+", help="MinutesWithoutConnections to try. (Default: The config's)")
+    parser.add_argument("--play-minutes", type=float, default=0, help="How long each query keeps someone on. (Default: 0)")
+    args = parser.parse_args(argv)
+
+    watchdog_config = load_leaf_watchdog_config(args.config_file)
+    period_seconds = alarm_period_seconds(watchdog_config)
+    minutes = args.minutes or [watchdog_config["MinutesWithoutConnections"].to_seconds() / 60]
+    query_filter = dns_log_query_filter(args.domain_name.lower(), route53.RecordType.A)
+    results = replay_queries(
+        read_queries(args.log_files, query_filter),
+        [StartStopPolicy(period_seconds, minutes_without_connections, args.play_minutes) for minutes_without_connections in minutes],
+    )
+
+    print(f"{'Minutes':>8} {'Starts':>7} {'InstanceHours':>14} {'HoursPerMonth':>14} {'IdleMinutes':>12}" + "".join(
+        f" {instance_type + ' $/Month':>20}" for instance_type, _ in args.price
+    ))
+    for result in results:
+        print(
+            f"{result.minutes_without_connections:>8g} {result.starts:>7} {result.instance_hours:>14.2f} "
+            f"{result.monthly_instance_hours:>14.2f} {result.idle_minutes:>12.1f}" + "".join(
+                f" {result.monthly_instance_hours * usd_per_hour:>20.2f}" for _, usd_per_hour in args.price
+            )
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""
+prewarm_replay.py
+
+Replays exported Route53 query logs through the PreWarm lambda's model, to see how
+many cold starts it would have saved (and what that costs) before turning it on.
+The lambda runs every few minutes, learning from the queries it's seen so far, and
+the Watchdog's window spins it down again (pre-warmed or not).
+
+    python3 -m ContainerManager.simulators.prewarm_replay \\
+        --config-file ./Examples/Minecraft.java.example.yaml \\
+        --domain-name minecraft.example.com \\
+        --log-files ./query-logs/*.gz \\
+        --confidence 0.4 0.6 0.8 --max-minutes 30 60
+"""
+
+import argparse
+import itertools
+from collections.abc import Iterable
+from dataclasses import dataclass
+from datetime import datetime
+
+from aws_cdk import aws_route53 as route53
+
+from ContainerManager.leaf_stack_group.domain_stack import dns_log_query_filter
+from ContainerManager.leaf_stack_group.NestedStacks.PreWarm import SCHEDULE_MINUTES
+from ContainerManager.leaf_stack_group.lambda_functions.predictive_prewarm.main import (
+    PreWarmSettings,
+    new_state,
+    add_hit,
+    plan,
+)
+from ContainerManager.utils.config_loader import load_leaf_watchdog_config, load_leaf_prewarm_config
+from .dns_cost import read_queries, MINIMUM_BILLED_SECONDS
+from .watchdog_replay import alarm_period_seconds
+
+
+@dataclass
+class PreWarmResult:
+    """ What one Confidence / MaxMinutesPerDay combination would have done. (Both None if it's off) """
+    confidence: float | None
+    max_minutes_per_day: float | None
+    # Someone looked up the domain, and had to wait for it to start:
+    cold_starts: int = 0
+    # Someone looked up the domain, and it was already pre-warmed for them:
+    warm_starts: int = 0
+    prewarms: int = 0
+    # Pre-warms nobody showed up for:
+    wasted_prewarms: int = 0
+    # Up because of a pre-warm, before anyone showed up:
+    speculative_seconds: float = 0.0
+    instance_seconds: float = 0.0
+    first_query: float | None = None
+    last_query: float | None = None
+
+    @property
+    def days(self) -> float:
+        """ How long the logs cover. (Anything under a day counts as a day) """
+        if self.first_query is None:
+            return 1.0
+        return max((self.last_query - self.first_query) / 86400, 1)
+
+    @property
+    def speculative_minutes_per_day(self) -> float:
+        """ Averaged over the whole export """
+        return self.speculative_seconds / 60 / self.days
+
+    @property
+    def instance_hours(self) -> float:
+        """ Over the whole export """
+        return self.instance_seconds / 3600
+
+
+class PreWarmReplay:
+    """
+    Follows the instance through the queries for one PreWarm setting. Each query is a
+    player, on for 'play_minutes' after it, and the Watchdog spins down once the window
+    after their last alarm period has gone by. The lambda only sees a query at it's next
+    run, as the minute it happened in. (Same as the DNSTraffic metric it reads)
+    """
+    def __init__(
+        self,
+        settings: PreWarmSettings | None,
+        period_seconds: int,
+        minutes_without_connections: float,
+        play_minutes: float = 0,
+    ):
+        self.settings = settings
+        self.period_seconds = period_seconds
+        self.window_seconds = minutes_without_connections * 60
+        self.play_seconds = play_minutes * 60
+        self.tick_seconds = SCHEDULE_MINUTES * 60
+        self.result = PreWarmResult(
+            confidence=settings.confidence if settings else None,
+            max_minutes_per_day=settings.max_minutes_per_day if settings else None,
+        )
+        self.state = new_state()
+        self._unseen_hits = []
+        self._next_tick = None
+        self._up_since = None
+        self._down_at = None
+        # When the current pre-warm started, until someone shows up:
+        self._prewarmed_at = None
+        # The end of the last alarm period someone was on. (None if nobody's come since it started):
+        self._active_until = None
+
+    def _period_end(self, timestamp: float) -> float:
+        return (timestamp // self.period_seconds + 1) * self.period_seconds
+
+    def _start(self, timestamp: float) -> None:
+        self._up_since = timestamp
+        self._down_at = timestamp + self.window_seconds
+        self._active_until = None
+
+    def _someone_on(self, now: float) -> bool:
+        """ The Watchdog's alarm is OK, if anyone was on inside it's window """
+        return self._active_until is not None and now < self._active_until + self.window_seconds
+
+    def _stop(self, timestamp: float) -> None:
+        self.result.instance_seconds += max(timestamp - self._up_since, MINIMUM_BILLED_SECONDS)
+        if self._prewarmed_at is not None:
+            self.result.wasted_prewarms += 1
+            self.result.speculative_seconds += timestamp - self._prewarmed_at
+            self._prewarmed_at = None
+        self._up_since = None
+
+    def _check_watchdog(self, now: float) -> None:
+        if self._up_since is not None and now >= self._down_at:
+            self._stop(self._down_at)
+
+    def _tick(self, now: float) -> None:
+        """ One run of the lambda """
+        self._check_watchdog(now)
+        if self.settings is None:
+            return
+        for hit in self._unseen_hits:
+            add_hit(self.state, hit, self.settings)
+        self._unseen_hits = []
+        action = plan(
+            self.state,
+            now,
+            instance_up=self._up_since is not None,
+            settings=self.settings,
+            someone_on=self._up_since is not None and self._someone_on(now),
+        )
+        if action == "PREWARM":
+            self.result.prewarms += 1
+            self._start(now)
+            self._prewarmed_at = now
+        elif action == "STOP":
+            self._stop(now)
+
+    def _run_ticks(self, until: float) -> None:
+        if self._next_tick is None:
+            self._next_tick = (until // self.tick_seconds + 1) * self.tick_seconds
+        while self._next_tick <= until:
+            self._tick(self._next_tick)
+            self._next_tick += self.tick_seconds
+
+    def add_query(self, timestamp: datetime) -> None:
+        """ One query, in time order. (Edge locations can log a little out of order, those count as 'now') """
+        now = timestamp.timestamp()
+        if self.result.last_query is not None:
+            now = max(now, self.result.last_query)
+        self._run_ticks(now)
+        if self.result.first_query is None:
+            self.result.first_query = now
+        self.result.last_query = now
+        self._check_watchdog(now)
+
+        if self._up_since is None:
+            self.result.cold_starts += 1
+            self._start(now)
+        elif self._prewarmed_at is not None:
+            self.result.warm_starts += 1
+            self.result.speculative_seconds += now - self._prewarmed_at
+            self._prewarmed_at = None
+        self._active_until = max(self._active_until or now, self._period_end(now + self.play_seconds))
+        self._down_at = max(self._down_at, self._active_until + self.window_seconds)
+        self._unseen_hits.append(now // 60 * 60)
+
+    def finish(self) -> PreWarmResult:
+        """ Let the last run spin down, and return the totals. """
+        if self._up_since is not None:
+            self._run_ticks(self._down_at)
+            self._check_watchdog(self._down_at)
+        return self.result
+
+
+def replay_prewarm(queries: Iterable[datetime], replays: list[PreWarmReplay]) -> list[PreWarmResult]:
+    """ Feed every query to every replay in one pass, so the logs are only read once. """
+    for timestamp in queries:
+        for replay in replays:
+            replay.add_query(timestamp)
+    return [replay.finish() for replay in replays]
+
+
+def main(argv: list[str] | None = None) -> None:
+    """ Print the cold starts each Confidence / MaxMinutesPerDay would have saved, against having it off. """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config-file", required=True, help="The leaf config, for it's 'Watchdog' and 'PreWarm' blocks.")
+    parser.add_argument("--domain-name", required=True, help="The leaf's domain. ('<container-id>.<root hosted zone>')")
+    parser.add_argument("--log-files", required=True, nargs="+", help="Exported query logs, in time order. ('.gz' is fine)")
+    parser.add_argument("--confidence", type=float, nargs="+", help="Confidences to try. (Default: The config's)")
+    parser.add_argument("--max-minutes", type=float, nargs="+", help="MaxMinutesPerDay to try. (Default: The config's)")
+    parser.add_argument("--play-minutes", type=float, default=0, help="How long each query keeps someone on. (Default: 0)")
+    args = parser.parse_args(argv)
+
+    watchdog_config = load_leaf_watchdog_config(args.config_file)
+    prewarm_config = load_leaf_prewarm_config(args.config_file)
+    period_seconds = alarm_period_seconds(watchdog_config)
+    minutes_without_connections = watchdog_config["MinutesWithoutConnections"].to_seconds() / 60
+    settings = [None] + [
+        PreWarmSettings(
+            lead_minutes=prewarm_config["LeadMinutes"],
+            confidence=confidence,
+            max_minutes_per_day=max_minutes,
+            history_weeks=prewarm_config["HistoryWeeks"],
+            bin_minutes=prewarm_config["BinMinutes"],
+        ) for confidence, max_minutes in itertools.product(
+            args.confidence or [prewarm_config["Confidence"]],
+            args.max_minutes or [prewarm_config["MaxMinutesPerDay"]],
+        )
+    ]
+    query_filter = dns_log_query_filter(args.domain_name.lower(), route53.RecordType.A)
+    results = replay_prewarm(
+        read_queries(args.log_files, query_filter),
+        [PreWarmReplay(setting, period_seconds, minutes_without_connections, args.play_minutes) for setting in settings],
+    )
+
+    print(
+        f"{'Confidence':>10} {'MaxMinutes':>10} {'ColdStarts':>10} {'WarmStarts':>10} {'PreWarms':>9} "
+        f"{'Wasted':>7} {'SpeculativeMin/Day':>18} {'InstanceHours':>14}"
+    )
+    for result in results:
+        confidence = "Off" if result.confidence is None else f"{result.confidence:g}"
+        max_minutes = "-" if result.max_minutes_per_day is None else f"{result.max_minutes_per_day:g}"
+        print(
+            f"{confidence:>10} {max_minutes:>10} {result.cold_starts:>10} {result.warm_starts:>10} {result.prewarms:>9} "
+            f"{result.wasted_prewarms:>7} {result.speculative_minutes_per_day:>18.1f} {result.instance_hours:>14.2f}"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""
+watchdog_replay.py
+
+Replays recorded metrics through the same metric math and alarm settings the
+Watchdog nested stack creates, to see when the system *would* have spun down.
+Lets you tune 'Threshold' and 'MinutesWithoutConnections' offline, instead of
+against real players (and a real bill).
+
+    python3 -m ContainerManager.simulators.watchdog_replay \\
+        --config-file ./Examples/Minecraft.java.example.yaml \\
+        --metrics-file ./metrics.json \\
+        --threshold 800 1175 1500 --minutes 3 5 7
+"""
+
+import argparse
+import csv
+import json
+import itertools
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+
+from ContainerManager.utils.config_loader import load_leaf_watchdog_config
+
+## The metric ids, same as the ones in the Watchdog's MathExpressions:
+#   traffic_in:  NetworkIn (Sum), of the ASG.
+#   volumes_out: DataReadIOBytes (Sum), of all the leaf's EFS volumes added together.
+#   dns_hit:     DNSTraffic, there's a datapoint whenever someone looked up the domain.
+#   connections: ActiveConnections (Maximum), only for the 'Connections' Mode.
+METRIC_IDS = ["traffic_in", "volumes_out", "dns_hit", "connections"]
+
+
+@dataclass
+class SimulationResult:
+    """ What one Threshold / MinutesWithoutConnections combination would have done. """
+    threshold: int
+    minutes_without_connections: float
+    spin_downs: list[datetime] = field(default_factory=list)
+    instance_hours: float = 0.0
+    sessions: int = 0
+    sessions_cut_off: int = 0
+
+
+def parse_timestamp(timestamp: str) -> datetime:
+    """ CloudWatch exports are ISO 8601. Treat anything without a timezone as UTC. """
+    parsed = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+def alarm_period_seconds(watchdog_config: dict) -> int:
+    """ The alarm's period. NetworkIn only comes in 1-minute periods (Same as the Watchdog nested stack). """
+    return watchdog_config["PeriodSeconds"] if watchdog_config["Mode"] == "CONNECTIONS" else 60
+
+def load_metrics(path: str) -> dict[str, dict[datetime, float]]:
+    """
+    Load a recorded export, as {metric_id: {timestamp: value}}. Either:
+      - JSON: The output of 'aws cloudwatch get-metric-data', using the ids in METRIC_IDS.
+      - CSV:  A 'Timestamp' column, and one column per id in METRIC_IDS. (Empty cells are missing data).
+    """
+    metrics = {metric_id: {} for metric_id in METRIC_IDS}
+    with open(path, encoding="utf-8") as metrics_file:
+        if path.endswith(".json"):
+            for result in json.load(metrics_file)["MetricDataResults"]:
+                if result["Id"] in metrics:
+                    for timestamp, value in zip(result["Timestamps"], result["Values"]):
+                        metrics[result["Id"]][parse_timestamp(timestamp)] = float(value)
+        else:
+            for row in csv.DictReader(metrics_file):
+                for metric_id in METRIC_IDS:
+                    if row.get(metric_id, "") != "":
+                        metrics[metric_id][parse_timestamp(row["Timestamp"])] = float(row[metric_id])
+    return metrics
+
+
+class WatchdogReplay:
+    """
+    Replays one recording. The recorded activity (what players actually did) stays the
+    same, each simulate() just changes the alarm's settings.
+    """
+    def __init__(self, metrics: dict[str, dict[datetime, float]], watchdog_config: dict):
+        self.mode = watchdog_config["Mode"]
+        self.period_seconds = alarm_period_seconds(watchdog_config)
+        self.threshold = watchdog_config["Threshold"]
+
+        ## Line every metric up on the alarm's periods:
+        period = timedelta(seconds=self.period_seconds)
+        self.metrics = {metric_id: {} for metric_id in METRIC_IDS}
+        for metric_id, datapoints in metrics.items():
+            for timestamp, value in datapoints.items():
+                period_start = datetime.fromtimestamp(
+                    timestamp.timestamp() // self.period_seconds * self.period_seconds,
+                    tz=timezone.utc,
+                )
+                # Same as the alarm's statistic, Maximum for everything but NetworkIn/EFS's Sum:
+                previous = self.metrics[metric_id].get(period_start)
+                if metric_id in ("traffic_in", "volumes_out"):
+                    self.metrics[metric_id][period_start] = (previous or 0) + value
+                else:
+                    self.metrics[metric_id][period_start] = max(previous or value, value)
+        all_timestamps = [timestamp for datapoints in self.metrics.values() for timestamp in datapoints]
+        if not all_timestamps:
+            raise ValueError("No datapoints found in the recording.")
+        first, last = min(all_timestamps), max(all_timestamps)
+        self.periods = [first + period * i for i in range((last - first) // period + 1)]
+
+        ## The instance was up whenever it's own metric was being published:
+        self.instance_metric = "connections" if self.mode == "CONNECTIONS" else "traffic_in"
+        # If the simulation keeps it up longer than it really was, it just idles. Use the
+        # quietest it ever got while it was up:
+        self.idle_value = min(self.metrics[self.instance_metric].values(), default=0)
+        # What it actually cost, to compare against:
+        self.recorded_instance_hours = len(self.metrics[self.instance_metric]) * self.period_seconds / 3600
+        self.recorded_sessions = self._recorded_sessions()
+
+    def _watchdog_value(self, timestamp: datetime, instance_up: bool, threshold: int) -> float | None:
+        """
+        The Watchdog's 'watchdog_traffic_metric' for one period, or None if it has no datapoint.
+        A term that has no datapoint adds nothing. (The DNS hit is only ever published when
+        there is one). If *every* term is missing, so is the result.
+        """
+        dns_hit = threshold + 1 if timestamp in self.metrics["dns_hit"] else None
+        instance_value = None
+        if instance_up:
+            instance_value = self.metrics[self.instance_metric].get(timestamp, self.idle_value)
+        if self.mode == "CONNECTIONS":
+            # "connections + FILL(dns_hit, 0)"
+            terms = [instance_value, dns_hit]
+        else:
+            # "IF(traffic_in - volumes_out > 0, traffic_in - volumes_out) + dns_hit"
+            client_traffic = None
+            if instance_value is not None:
+                # (b_in/PERIOD(b_in)) - ((volumes)/60)
+                client_traffic = instance_value / self.period_seconds - self.metrics["volumes_out"].get(timestamp, 0) / 60
+                if client_traffic <= 0:
+                    client_traffic = None
+            terms = [client_traffic, dns_hit]
+        present = [term for term in terms if term is not None]
+        return sum(present) if present else None
+
+    def _recorded_sessions(self) -> list[tuple[datetime, datetime]]:
+        """
+        When players were actually on: From the first to the last period above the configured
+        Threshold, within each stretch the real instance was up. A lull in the middle is still
+        part of the session, spinning down there is what cuts players off.
+        """
+        sessions = []
+        first_active = last_active = None
+        for timestamp in self.periods + [None]:
+            recorded_up = timestamp in self.metrics[self.instance_metric]
+            if not recorded_up:
+                if first_active is not None:
+                    sessions.append((first_active, last_active))
+                first_active = last_active = None
+                continue
+            value = self._watchdog_value(timestamp, instance_up=True, threshold=self.threshold)
+            if value is not None and value > self.threshold:
+                first_active = first_active or timestamp
+                last_active = timestamp
+        return sessions
+
+    def simulate(self, threshold: int, minutes_without_connections: float) -> SimulationResult:
+        """
+        Step through every period, the same way the 'Container Activity' alarm would:
+          - LESS_THAN_OR_EQUAL_TO_THRESHOLD, over the last 'evaluation periods' datapoints.
+          - TreatMissingData.MISSING: Periods without a datapoint are skipped, not counted.
+          - Going into ALARM scales the ASG to 0. A DNS hit scales it back up.
+        """
+        window_seconds = round(minutes_without_connections * 60)
+        if window_seconds % self.period_seconds != 0:
+            raise ValueError(
+                f"MinutesWithoutConnections ({minutes_without_connections}) has to be a whole number of periods ({self.period_seconds}s)."
+            )
+        evaluation_periods = window_seconds // self.period_seconds
+        result = SimulationResult(threshold=threshold, minutes_without_connections=minutes_without_connections)
+
+        instance_up = self.periods[0] in self.metrics[self.instance_metric]
+        in_alarm = False
+        datapoints = []
+        up_periods = 0
+        for timestamp in self.periods:
+            ## Someone looking up the domain starts it back up:
+            if not instance_up and timestamp in self.metrics["dns_hit"]:
+                instance_up = True
+            up_periods += instance_up
+            value = self._watchdog_value(timestamp, instance_up, threshold)
+            if value is None:
+                continue
+            datapoints = (datapoints + [value])[-evaluation_periods:]
+            breaching = len(datapoints) == evaluation_periods and all(point <= threshold for point in datapoints)
+            ## The scale down action only runs when it *goes into* ALARM:
+            if breaching and not in_alarm and instance_up:
+                instance_up = False
+                result.spin_downs.append(timestamp)
+            in_alarm = breaching
+
+        result.instance_hours = up_periods * self.period_seconds / 3600
+        result.sessions = len(self.recorded_sessions)
+        result.sessions_cut_off = sum(
+            any(start <= spin_down < end for spin_down in result.spin_downs)
+            for start, end in self.recorded_sessions
+        )
+        return result
+
+    def sweep(self, thresholds: list[int], minutes: list[float]) -> list[SimulationResult]:
+        """ simulate() every combination. Ones that don't line up with the period are skipped. """
+        return [
+            self.simulate(threshold, minutes_without_connections)
+            for threshold, minutes_without_connections in itertools.product(thresholds, minutes)
+            if round(minutes_without_connections * 60) % self.period_seconds == 0
+        ]
+
+
+def main(argv: list[str] | None = None) -> None:
+    """ Print what each combination would have done, cheapest first. """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config-file", required=True, help="The leaf config, for it's 'Watchdog' block.")
+    parser.add_argument("--metrics-file", required=True, help="The recording, as JSON (get-metric-data) or CSV.")
+    parser.add_argument("--threshold", type=int, nargs="+", help="Thresholds to try. (Default: The config's)")
+    parser.add_argument("--minutes", type=float, nargs="+", help="MinutesWithoutConnections to try. (Default: The config's)")
+    args = parser.parse_args(argv)
+
+    watchdog_config = load_leaf_watchdog_config(args.config_file)
+    replay = WatchdogReplay(load_metrics(args.metrics_file), watchdog_config)
+    results = replay.sweep(
+        thresholds=args.threshold or [watchdog_config["Threshold"]],
+        minutes=args.minutes or [watchdog_config["MinutesWithoutConnections"].to_seconds() / 60],
+    )
+    print(f"Recorded: {replay.recorded_instance_hours:.2f} instance hours, {len(replay.recorded_sessions)} sessions")
+    print(f"{'Threshold':>10} {'Minutes':>8} {'SpinDowns':>10} {'InstanceHours':>14} {'CutOff':>10}")
+    for result in sorted(results, key=lambda result: (result.sessions_cut_off, result.instance_hours)):
+        print(
+            f"{result.threshold:>10} {result.minutes_without_connections:>8g} {len(result.spin_downs):>10} "
+            f"{result.instance_hours:>14.2f} {result.sessions_cut_off:>5}/{result.sessions:<4}"
+        )
+
+if __name__ == "__main__":
+    main()
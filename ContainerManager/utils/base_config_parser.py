@@ -3,9 +3,12 @@ Base Config Parser
 
 The docs for schema is at: https://github.com/keleshev/schema
 """
-from schema import Schema, And, Use, Optional
+from schema import Schema, And, Or, Use, Optional
+from aws_cdk import Duration
 
 from .sns_subscriptions import sns_schema
+from .ecr_pull_through_cache import pull_through_cache_schema
+from .leaf_config_parser import add_instance_type_info, leaf_rootVolume_config, leaf_rootVolume_defaults
 
 
 ###################
@@ -13,9 +16,37 @@ from .sns_subscriptions import sns_schema
 ###################
 vpc_config = Schema({
     Optional("MaxAZs", default=1): int,
+    Optional("S3GatewayEndpoint", default=False): bool,
 })
 vpc_config_defaults = vpc_config.validate({})
 
+shared_lambdas_config = Schema({
+    # StartSystem: One router lambda starts every leaf, instead of one lambda per leaf:
+    Optional("StartSystem", default=False): bool,
+    # AsgStateChangeHook: One lambda keeps every leaf's DNS in sync, batching the Route53 changes:
+    Optional("AsgStateChangeHook", default=False): bool,
+    # BreakCrashLoop: One lambda spins down any leaf whose container keeps crashing:
+    Optional("BreakCrashLoop", default=False): bool,
+})
+shared_lambdas_defaults = shared_lambdas_config.validate({})
+
+## One instance, shared by every leaf that names this group in it's 'HostGroup':
+host_group_config = Schema(And(
+    {
+        # InstanceType: Size it for every member's 'HostGroup.MemoryReservationMiB' together, plus 2GB for the host:
+        "InstanceType": And(str, Use(str.lower)),
+        Optional("RootVolume", default=leaf_rootVolume_defaults): leaf_rootVolume_config,
+        # MinutesWithoutConnections: Optional, how long EVERY member has to be empty before it spins down:
+        Optional("MinutesWithoutConnections",
+            default=Duration.minutes(7),
+        ): And(Or(int, float), lambda n: n > 0, Use(lambda minutes: Duration.seconds(round(minutes * 60)))),
+    },
+    # Same lookup as the leaf's Ec2 config, for the AMI's architecture:
+    Use(lambda info: add_instance_type_info(info | {"InstanceTypes": [info["InstanceType"]]})),
+    # The alarm looks at whole minutes:
+    lambda info: info["MinutesWithoutConnections"].to_seconds() % 60 == 0,
+))
+
 def base_config_schema():
     """ Base config schema for the base stack. """
     return Schema({
@@ -28,4 +59,8 @@ def base_config_schema():
             Optional("Email"): str,
         },
         Optional("AlertSubscription", default={}): sns_schema,
+        Optional("PullThroughCache", default={}): pull_through_cache_schema,
+        Optional("SharedLambdas", default=shared_lambdas_defaults): shared_lambdas_config,
+        # HostGroups: Optional, the key is the group's name. (It ends up in the cluster's name):
+        Optional("HostGroups", default={}): {And(str, str.isalnum): host_group_config},
     })
@@ -13,10 +13,10 @@ from pyaml_env import parse_config
 
 ## Using schema for validation and modification of the config file, so
 # it's easy for our app to consume it.
-from schema import Schema, SchemaError
+from schema import Schema, SchemaError, Optional
 from git import Repo, exc
 
-from .leaf_config_parser import leaf_config_schema
+from .leaf_config_parser import leaf_config_schema, leaf_watchdog_config, leaf_preWarm_config, leaf_preWarm_defaults
 from .base_config_parser import base_config_schema
 from .maturity import Maturity
 
@@ -54,11 +54,38 @@ def load_base_config(path: str) -> dict:
     return _load(path, schema, error_info)
 
 # Default maturity to "Prod", for the test suite:
-def load_leaf_config(path: str, maturity: Maturity=Maturity.PROD) -> dict:
-    """ Load the leaf stack config file and validate it against the schema. """
+def load_leaf_config(path: str, maturity: Maturity=Maturity.PROD, check_image: bool=False) -> dict:
+    """
+    Load the leaf stack config file and validate it against the schema.
+    'check_image' asks the image's registry over the network, see leaf_config_schema.
+    """
     error_info = {
         "online_docs": "tree/main/Examples#config-file-options",
         "local_docs": "./Examples/README.md",
     }
-    schema = leaf_config_schema(maturity)
+    schema = leaf_config_schema(maturity, check_image=check_image)
     return _load(path, schema, error_info)
+
+def load_leaf_watchdog_config(path: str) -> dict:
+    """
+    Only validate the 'Watchdog' block of a leaf config file. The rest of the
+    schema asks AWS about the instance type, and the simulators run offline.
+    """
+    error_info = {
+        "online_docs": "tree/main/Examples#watchdog",
+        "local_docs": "./Examples/README.md",
+    }
+    schema = Schema({"Watchdog": leaf_watchdog_config}, ignore_extra_keys=True)
+    return _load(path, schema, error_info)["Watchdog"]
+
+def load_leaf_prewarm_config(path: str) -> dict:
+    """
+    Only validate the 'PreWarm' block of a leaf config file. (Same reason as
+    load_leaf_watchdog_config, the simulators run offline)
+    """
+    error_info = {
+        "online_docs": "tree/main/Examples#prewarm",
+        "local_docs": "./Examples/README.md",
+    }
+    schema = Schema({Optional("PreWarm", default=leaf_preWarm_defaults): leaf_preWarm_config}, ignore_extra_keys=True)
+    return _load(path, schema, error_info)["PreWarm"]
@@ -0,0 +1,76 @@
+"""
+ecr_pull_through_cache.py
+
+Broken into it's own file since the cache rules are created in the base stack,
+but the leaf stacks need to know how to point their images at them.
+"""
+
+from schema import Schema, And, Optional
+
+from aws_cdk import (
+    aws_ecr as ecr,
+)
+
+from .image_manifest import split_image_host
+
+## The upstream registries we support caching, and what they look like in an image name:
+# https://docs.aws.amazon.com/AmazonECR/latest/userguide/pull-through-cache-creating-rule.html
+UPSTREAM_REGISTRIES = {
+    "DockerHub": {
+        "UpstreamRegistry": "docker-hub",
+        "UpstreamRegistryUrl": "registry-1.docker.io",
+        "RepositoryPrefix": "docker-hub",
+        "Hosts": ["docker.io", "registry-1.docker.io", "index.docker.io"],
+    },
+    "GitHub": {
+        "UpstreamRegistry": "github-container-registry",
+        "UpstreamRegistryUrl": "ghcr.io",
+        "RepositoryPrefix": "ghcr",
+        "Hosts": ["ghcr.io"],
+    },
+}
+
+## Both registries need credentials, and ECR requires the secret name to start with "ecr-pullthroughcache/":
+# https://docs.aws.amazon.com/AmazonECR/latest/userguide/pull-through-cache-creating-secret.html
+pull_through_cache_schema = Schema({
+    Optional(registry): {
+        "CredentialArn": And(str, lambda arn: ":secret:ecr-pullthroughcache/" in arn),
+    } for registry in UPSTREAM_REGISTRIES
+})
+
+def add_pull_through_cache_rules(context, pull_through_cache: dict) -> dict:
+    """
+    Add a ECR Pull Through Cache Rule for each registry in the config
+        (Normally 'pull_through_cache' is the 'PullThroughCache' block from the base config)
+    Returns which registries are cached, and the repository prefix they're cached under.
+    """
+    cached_registries = {}
+    for registry, registry_config in pull_through_cache.items():
+        upstream = UPSTREAM_REGISTRIES[registry]
+        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_ecr.CfnPullThroughCacheRule.html
+        ecr.CfnPullThroughCacheRule(
+            context,
+            f"PullThroughCacheRule-{registry}",
+            ecr_repository_prefix=upstream["RepositoryPrefix"],
+            upstream_registry=upstream["UpstreamRegistry"],
+            upstream_registry_url=upstream["UpstreamRegistryUrl"],
+            credential_arn=registry_config["CredentialArn"],
+        )
+        cached_registries[registry] = upstream["RepositoryPrefix"]
+    return cached_registries
+
+def cached_image_uri(image: str, cached_registries: dict, account: str, region: str) -> str:
+    """
+    Point a image (i.e 'itzg/minecraft-server:latest') at it's in-region cached copy,
+    if it's registry is cached. Otherwise return the image unchanged.
+        (Normally 'cached_registries' is the return of 'add_pull_through_cache_rules')
+    """
+    host, path = split_image_host(image)
+    for registry, repository_prefix in cached_registries.items():
+        if host not in UPSTREAM_REGISTRIES[registry]["Hosts"]:
+            continue
+        ## Official Docker Hub images live under 'library/' (i.e 'nginx' -> 'library/nginx'):
+        if registry == "DockerHub" and "/" not in path:
+            path = f"library/{path}"
+        return f"{account}.dkr.ecr.{region}.amazonaws.com/{repository_prefix}/{path}"
+    return image
@@ -0,0 +1,116 @@
+"""
+image_manifest.py
+
+Asks a container image's registry which CPU architectures the image is published for.
+Used by the leaf config parser, so a Graviton (arm64) instance doesn't get an image that
+only runs on x86_64. (ECS would just fail to start the task, over and over).
+"""
+
+import json
+import re
+import urllib.error
+import urllib.parse
+import urllib.request
+from functools import cache
+
+## Docker and EC2 don't agree on what to call x86_64:
+# https://github.com/opencontainers/image-spec/blob/main/image-index.md#platform-variants
+EC2_TO_IMAGE_ARCHITECTURE = {
+    "x86_64": "amd64",
+    "arm64": "arm64",
+}
+
+## Both multi-arch indexes, and single-arch manifests. Whichever the registry has:
+MANIFEST_MEDIA_TYPES = ", ".join([
+    "application/vnd.oci.image.index.v1+json",
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+    "application/vnd.oci.image.manifest.v1+json",
+    "application/vnd.docker.distribution.manifest.v2+json",
+])
+# Don't hold up synth for long, if the registry is slow or unreachable:
+REGISTRY_TIMEOUT_SECONDS = 5
+
+
+def split_image_host(image: str) -> tuple[str, str]:
+    """
+    Split a image (i.e 'itzg/minecraft-server:latest') into it's registry
+    host, and the rest of the path. Images without a host are on Docker Hub.
+    """
+    ## The first part is only a registry if it looks like a host. Otherwise it's Docker Hub:
+    # (Same rules docker uses: https://github.com/distribution/reference/blob/main/normalize.go)
+    first, _, rest = image.partition("/")
+    if rest and ("." in first or ":" in first or first == "localhost"):
+        return first, rest
+    return "docker.io", image
+
+def _registry_reference(image: str) -> tuple[str, str, str]:
+    """ Returns the registry API host, repository, and tag/digest of a image. """
+    host, path = split_image_host(image)
+    if host in ("docker.io", "index.docker.io"):
+        host = "registry-1.docker.io"
+        ## Official Docker Hub images live under 'library/' (i.e 'nginx' -> 'library/nginx'):
+        if "/" not in path:
+            path = f"library/{path}"
+    if "@" in path:
+        repository, reference = path.split("@", 1)
+    elif ":" in path.rsplit("/", 1)[-1]:
+        repository, reference = path.rsplit(":", 1)
+    else:
+        repository, reference = path, "latest"
+    return host, repository, reference
+
+def _registry_get(url: str, accept: str) -> dict:
+    """
+    GET a JSON document from a registry. If it asks for a token, get an
+    anonymous one and try again. (Private images will still fail here).
+    """
+    request = urllib.request.Request(url, headers={"Accept": accept})
+    challenge = ""
+    try:
+        with urllib.request.urlopen(request, timeout=REGISTRY_TIMEOUT_SECONDS) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as error:
+        if error.code != 401:
+            raise
+        challenge = error.headers.get("WWW-Authenticate", "")
+
+    ## i.e: Bearer realm="https://auth.docker.io/token",service="registry.docker.io",scope="repository:library/nginx:pull"
+    # https://distribution.github.io/distribution/spec/auth/token/
+    challenge_params = dict(re.findall(r'(\w+)="([^"]*)"', challenge))
+    realm = challenge_params.pop("realm")
+    with urllib.request.urlopen(
+        f"{realm}?{urllib.parse.urlencode(challenge_params)}",
+        timeout=REGISTRY_TIMEOUT_SECONDS,
+    ) as response:
+        token_info = json.load(response)
+    request.add_header("Authorization", f"Bearer {token_info.get('token') or token_info['access_token']}")
+    with urllib.request.urlopen(request, timeout=REGISTRY_TIMEOUT_SECONDS) as response:
+        return json.load(response)
+
+@cache
+def get_image_architectures(image: str) -> frozenset[str] | None:
+    """
+    Which architectures (i.e 'amd64', 'arm64') the image is published for.
+    Returns None if the registry couldn't tell us, so the caller can decide
+    whether to skip the check. (No network, private image, etc).
+    """
+    host, repository, reference = _registry_reference(image)
+    base_url = f"https://{host}/v2/{repository}"
+    # https://distribution.github.io/distribution/spec/api/#pulling-an-image-manifest
+    try:
+        manifest = _registry_get(f"{base_url}/manifests/{reference}", accept=MANIFEST_MEDIA_TYPES)
+        ## Multi-arch images list a manifest per platform:
+        if "manifests" in manifest:
+            return frozenset(
+                entry["platform"]["architecture"]
+                for entry in manifest["manifests"]
+                # Attestations show up as 'unknown/unknown':
+                if entry.get("platform", {}).get("architecture", "unknown") != "unknown"
+            )
+        ## Single-arch images only say which one in their config blob:
+        config = _registry_get(f"{base_url}/blobs/{manifest['config']['digest']}", accept="*/*")
+        return frozenset([config["architecture"]])
+    except (OSError, ValueError, KeyError) as error:
+        # (urllib's errors and TimeoutError are OSError's, json's are ValueError's)
+        print(f"WARNING: Couldn't look up the architectures for image '{image}': {error}")
+        return None
@@ -0,0 +1,93 @@
+"""
+User data helpers for the instances. Shared by the leaf's EcsAsg and BakedAmi
+stacks, and the base stack's HostGroups.
+"""
+
+from aws_cdk import aws_ecs as ecs
+
+## Add ECS Agent Config Variables:
+# (Full list at: https://github.com/aws/amazon-ecs-agent/blob/master/README.md#environment-variables)
+# (ECS Agent config information: https://docs.aws.amazon.com/AmazonECS/latest/developerguide/ecs-agent-config.html)
+# (The BakedAmi stack also bakes these into it's AMI, instead of running them every boot)
+ECS_AGENT_CONFIG_COMMANDS = [
+    ### Security Flags:
+    'echo "ECS_DISABLE_PRIVILEGED=true" >> /etc/ecs/ecs.config',
+    # Enable SELinux Enforcing mode (It's passive on Amazon 2023??)
+    'sudo setenforce 1',
+    # Make SELinux enforcing on reboot (Userdata only runs on first boot):
+    'sudo sed -i "s/^SELINUX=.*/SELINUX=enforcing/" /etc/selinux/config',
+    'echo "ECS_SELINUX_CAPABLE=true" >> /etc/ecs/ecs.config',
+    ### Instance isn't ever on long enough to worry about cleanup anyways:
+    'echo "ECS_DISABLE_IMAGE_CLEANUP=true" >> /etc/ecs/ecs.config',
+]
+
+def ecs_optimized_image(ec2_config: dict) -> ecs.EcsOptimizedImage:
+    """
+    The ECS-Optimized AMI that matches the instance type's architecture.
+        (Graviton instances need the ARM one, they can't boot the x86_64 AMI)
+    """
+    # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_ecs.AmiHardwareType.html
+    hardware_type = ecs.AmiHardwareType.ARM if ec2_config["Architecture"] == "arm64" else ecs.AmiHardwareType.STANDARD
+    return ecs.EcsOptimizedImage.amazon_linux2023(hardware_type=hardware_type)
+
+def boot_service_commands(
+    name: str,
+    description: str,
+    script_path: str,
+    environment: dict,
+    ecs_waits_for_ready: bool = False,
+) -> list[str]:
+    """
+    User data commands to install a script from 'instance_scripts' as a systemd service.
+    User data only runs on the first boot, but services run on every one. (Warm pool
+    instances only run the user data once, while warming).
+        (The script reads 'environment' from /etc/<name>.env)
+    If 'ecs_waits_for_ready', the ECS agent (and the task) won't start until the script
+    runs `systemd-notify --ready`. If the script fails before that, ECS won't start at all.
+    """
+    with open(script_path, encoding="utf-8") as script:
+        script_contents = script.read().rstrip("\n")
+    heredoc = f"{name.upper().replace('-', '_')}_EOF"
+    if ecs_waits_for_ready:
+        unit_options = ["Before=ecs.service"]
+        service_options = [
+            # 'notify' lets the script keep running, after telling systemd it's ready:
+            # https://www.freedesktop.org/software/systemd/man/latest/systemd.service.html#Type=
+            "Type=notify",
+            "NotifyAccess=all",
+            "TimeoutStartSec=infinity",
+            # Give it time to clean up on shutdown:
+            "TimeoutStopSec=300",
+        ]
+        install_options = ["RequiredBy=ecs.service"]
+    else:
+        unit_options = []
+        # NOT oneshot. That'd hold up multi-user.target, and the ECS agent waits on that:
+        service_options = ["Type=simple"]
+        install_options = []
+    return [
+        f"cat > /usr/local/bin/{name}.sh <<'{heredoc}'",
+        script_contents,
+        heredoc,
+        f"chmod +x /usr/local/bin/{name}.sh",
+        f"cat > /etc/{name}.env <<'{heredoc}'",
+        *(f'{key}="{value}"' for key, value in environment.items()),
+        heredoc,
+        f"cat > /etc/systemd/system/{name}.service <<'{heredoc}'",
+        "[Unit]",
+        f"Description={description}",
+        "Wants=network-online.target",
+        "After=network-online.target",
+        *unit_options,
+        "[Service]",
+        *service_options,
+        f"EnvironmentFile=/etc/{name}.env",
+        f"ExecStart=/usr/local/bin/{name}.sh",
+        "[Install]",
+        "WantedBy=multi-user.target",
+        *install_options,
+        heredoc,
+        "systemctl daemon-reload",
+        f"systemctl enable {name}.service",
+        f"systemctl start --no-block {name}.service",
+    ]
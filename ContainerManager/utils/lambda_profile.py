@@ -0,0 +1,65 @@
+"""
+lambda_profile.py
+
+Broken into it's own file since every leaf lambda is created the same way, but
+they live in different stacks. (StartSystem has to be in us-east-1).
+"""
+
+from aws_cdk import (
+    aws_lambda,
+)
+
+## The leaf lambdas, and the key they're configured under in 'Lambdas':
+LAMBDA_FUNCTIONS = ["StartSystem", "AsgStateChangeHook", "BreakCrashLoop"]
+
+def lambda_profile_kwargs(lambda_profile: dict) -> dict:
+    """
+    The aws_lambda.Function kwargs for a lambda's profile.
+        (Normally 'lambda_profile' is one of the blocks under 'Lambdas' in the leaf config)
+    """
+    return {
+        "architecture": lambda_profile["Architecture"],
+        "memory_size": lambda_profile["MemorySize"],
+        ## Snapshots the function after it's init, so it doesn't run on every cold start:
+        # https://docs.aws.amazon.com/lambda/latest/dg/snapstart.html
+        "snap_start": aws_lambda.SnapStartConf.ON_PUBLISHED_VERSIONS if lambda_profile["SnapStart"] else None,
+    }
+
+def lambda_code_kwargs(lambda_directory: str, handler: str = "lambda_handler") -> dict:
+    """
+    The aws_lambda.Function 'code' and 'handler' kwargs, for one of the lambdas in
+    'leaf_stack_group/lambda_functions'. (lambda_directory is the one it's main.py is in)
+
+    Every lambda is deployed with the whole 'lambda_functions' directory, so they can
+    all import it's 'common.py'. That needs the directory itself in the package, not
+    just what's inside it, so the handler can import it as the parent.
+    """
+    return {
+        # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_lambda.Code.html#static-fromwbrassetpath-options
+        "code": aws_lambda.Code.from_asset(
+            "./ContainerManager/leaf_stack_group/",
+            exclude=["*", "!lambda_functions", "!lambda_functions/**", "**/__pycache__"],
+        ),
+        "handler": f"lambda_functions.{lambda_directory}.main.{handler}",
+    }
+
+def lambda_profile_target(context, function: aws_lambda.Function, lambda_profile: dict) -> aws_lambda.IFunction:
+    """
+    What triggers should invoke for a lambda's profile.
+
+    SnapStart and Provisioned Concurrency only apply to published versions, not $LATEST.
+    If either is on, this returns an alias pointing at the current version. Otherwise it
+    just returns the function, so nothing changes if you don't use them.
+    """
+    if not lambda_profile["SnapStart"] and not lambda_profile["ProvisionedConcurrency"]:
+        return function
+    # https://docs.aws.amazon.com/cdk/api/v2/docs/aws-cdk-lib.aws_lambda.Alias.html
+    return aws_lambda.Alias(
+        context,
+        f"{function.node.id}Live",
+        alias_name="live",
+        version=function.current_version,
+        # Instances already initialized and waiting, for each trigger:
+        # https://docs.aws.amazon.com/lambda/latest/dg/provisioned-concurrency.html
+        provisioned_concurrent_executions=lambda_profile["ProvisionedConcurrency"] or None,
+    )
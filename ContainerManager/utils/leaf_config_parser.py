@@ -10,10 +10,16 @@ from schema import Schema, And, Or, Use, Optional
 import boto3
 from aws_cdk import (
     Duration,
+    aws_ec2 as ec2,
     aws_ecs as ecs,
+    aws_efs as efs,
+    aws_lambda,
+    aws_autoscaling as autoscaling,
 )
 
 from .sns_subscriptions import sns_schema
+from .lambda_profile import LAMBDA_FUNCTIONS
+from .image_manifest import get_image_architectures, EC2_TO_IMAGE_ARCHITECTURE
 from .maturity import Maturity
 
 @cache
@@ -34,6 +40,208 @@ leaf_instanceLeftUp_config = Schema({ # pylint: disable=invalid-name
 })
 leaf_instanceLeftUp_defaults = leaf_instanceLeftUp_config.validate({})
 
+leaf_warmPool_config = Schema({ # pylint: disable=invalid-name
+    Optional("Enabled", default=False): bool,
+    # PoolState: Optional, returns the cdk PoolState enum.
+    Optional("PoolState",
+        default=autoscaling.PoolState.STOPPED,
+    ): And(
+        Use(str.upper),
+        # RUNNING would charge for the instance the whole time, defeating the point:
+        Or("STOPPED", "HIBERNATED"),
+        Use(lambda state: getattr(autoscaling.PoolState, state)),
+    ),
+})
+leaf_warmPool_defaults = leaf_warmPool_config.validate({})
+
+leaf_spot_config = Schema({ # pylint: disable=invalid-name
+    Optional("Enabled", default=False): bool,
+    # OnDemandBaseCapacity: Optional, how many instances are always On-Demand. (There's only ever one):
+    Optional("OnDemandBaseCapacity", default=0): And(int, lambda n: 0 <= n <= 1),
+    # OnDemandPercentageAboveBaseCapacity: Optional, the On-Demand/Spot split after that:
+    Optional("OnDemandPercentageAboveBaseCapacity", default=0): And(int, lambda n: 0 <= n <= 100),
+})
+leaf_spot_defaults = leaf_spot_config.validate({})
+
+leaf_bakedAmi_config = Schema({ # pylint: disable=invalid-name
+    Optional("Enabled", default=False): bool,
+    Optional("FastSnapshotRestore", default=False): bool,
+})
+leaf_bakedAmi_defaults = leaf_bakedAmi_config.validate({})
+
+## Shared by the root volume, and EBS data volumes:
+ebs_volume_type_options = { # pylint: disable=invalid-name
+    # Type: Optional, returns the cdk EbsDeviceVolumeType:
+    Optional("Type", default=ec2.EbsDeviceVolumeType.GP3): And(
+        Use(str.upper),
+        Or("GP2", "GP3", "IO1", "IO2"),
+        Use(lambda volume_type: getattr(ec2.EbsDeviceVolumeType, volume_type)),
+    ),
+    # Iops: Optional, gp3 defaults to 3000 (and io1/io2 require it):
+    Optional("Iops", default=None): Or(None, And(int, lambda n: 100 <= n <= 256000)),
+    # ThroughputMiBps: Optional, gp3 defaults to 125:
+    Optional("ThroughputMiBps", default=None): Or(None, And(int, lambda n: 125 <= n <= 2000)),
+}
+## What each volume type supports:
+# https://docs.aws.amazon.com/ebs/latest/userguide/ebs-volume-types.html
+ebs_volume_type_checks = [ # pylint: disable=invalid-name
+    lambda volume: volume["Iops"] is None or volume["Type"] != ec2.EbsDeviceVolumeType.GP2,
+    lambda volume: volume["Iops"] is not None or volume["Type"] not in (ec2.EbsDeviceVolumeType.IO1, ec2.EbsDeviceVolumeType.IO2),
+    lambda volume: volume["ThroughputMiBps"] is None or volume["Type"] == ec2.EbsDeviceVolumeType.GP3,
+]
+
+leaf_rootVolume_config = Schema(And( # pylint: disable=invalid-name
+    {
+        # SizeGiB: Optional, the ECS AMI's default. (Hibernating adds the instance's memory on top):
+        Optional("SizeGiB", default=30): And(int, lambda n: 30 <= n <= 16384),
+        **ebs_volume_type_options,
+    },
+    *ebs_volume_type_checks,
+))
+leaf_rootVolume_defaults = leaf_rootVolume_config.validate({})
+
+leaf_mountOptions_config = Schema({ # pylint: disable=invalid-name
+    # Nconnect: Optional, how many TCP connections to spread the NFS traffic over:
+    Optional("Nconnect", default=1): And(int, lambda n: 1 <= n <= 16),
+    # ReadSize/WriteSize: Optional, the max bytes per NFS request. (EFS recommends the max):
+    Optional("ReadSizeBytes", default=1048576): And(int, lambda n: 1024 <= n <= 1048576),
+    Optional("WriteSizeBytes", default=1048576): And(int, lambda n: 1024 <= n <= 1048576),
+    Optional("NoResvPort", default=True): bool,
+})
+leaf_mountOptions_defaults = leaf_mountOptions_config.validate({})
+
+leaf_localCopy_config = Schema({ # pylint: disable=invalid-name
+    Optional("Enabled", default=False): bool,
+    # SyncMinutes: Optional, how often to write the local copy back to EFS while it's up:
+    Optional("SyncMinutes", default=5): And(int, lambda n: n >= 1),
+})
+leaf_localCopy_defaults = leaf_localCopy_config.validate({})
+
+leaf_ebsVolume_config = Schema(And( # pylint: disable=invalid-name
+    {
+        # SizeGiB: Optional, only used the first time. After that it's restored from the last snapshot:
+        Optional("SizeGiB", default=20): And(int, lambda n: 1 <= n <= 16384),
+        **ebs_volume_type_options,
+        # FastSnapshotRestore: Optional, so the first reads from a restored volume don't come from S3:
+        Optional("FastSnapshotRestore", default=False): bool,
+        # KeepSnapshots: Optional, how many of the latest snapshots to keep around:
+        Optional("KeepSnapshots", default=3): And(int, lambda n: n >= 1),
+    },
+    *ebs_volume_type_checks,
+))
+leaf_ebsVolume_defaults = leaf_ebsVolume_config.validate({})
+
+leaf_efsPerformance_config = Schema(And( # pylint: disable=invalid-name
+    {
+        # ThroughputMode: Optional, returns the cdk ThroughputMode:
+        Optional("ThroughputMode", default=efs.ThroughputMode.BURSTING): And(
+            Use(str.upper),
+            Or("BURSTING", "ELASTIC", "PROVISIONED"),
+            Use(lambda mode: getattr(efs.ThroughputMode, mode)),
+        ),
+        # ProvisionedMiBps: Only with the 'Provisioned' ThroughputMode (and required for it):
+        Optional("ProvisionedMiBps", default=None): Or(None, And(int, lambda n: n >= 1)),
+        # PerformanceMode: Optional, returns the cdk PerformanceMode:
+        Optional("PerformanceMode", default=efs.PerformanceMode.GENERAL_PURPOSE): And(
+            Use(str.upper),
+            Or("GENERALPURPOSE", "MAXIO"),
+            Use(lambda mode: efs.PerformanceMode.MAX_IO if mode == "MAXIO" else efs.PerformanceMode.GENERAL_PURPOSE),
+        ),
+        Optional("OneZone", default=False): bool,
+    },
+    ## What each mode works with:
+    # https://docs.aws.amazon.com/efs/latest/ug/performance.html
+    lambda perf: (perf["ProvisionedMiBps"] is not None) == (perf["ThroughputMode"] == efs.ThroughputMode.PROVISIONED),
+    lambda perf: perf["PerformanceMode"] != efs.PerformanceMode.MAX_IO or \
+        (perf["ThroughputMode"] != efs.ThroughputMode.ELASTIC and not perf["OneZone"]),
+))
+leaf_efsPerformance_defaults = leaf_efsPerformance_config.validate({})
+
+leaf_lambdaProfile_config = Schema(And( # pylint: disable=invalid-name
+    {
+        # Architecture: Optional, returns the cdk Architecture. (None of the lambdas have native code):
+        Optional("Architecture",
+            default=aws_lambda.Architecture.ARM_64,
+        ): And(
+            Use(str.lower),
+            Or("arm64", "x86_64"),
+            Use(lambda arch: aws_lambda.Architecture.ARM_64 if arch == "arm64" else aws_lambda.Architecture.X86_64),
+        ),
+        # MemorySize: Optional, in MB. Lambda also scales CPU with this:
+        Optional("MemorySize", default=128): And(int, lambda n: 128 <= n <= 10240),
+        Optional("SnapStart", default=False): bool,
+        # ProvisionedConcurrency: Optional, how many instances to keep initialized. (Billed while up):
+        Optional("ProvisionedConcurrency", default=0): And(int, lambda n: n >= 0),
+    },
+    # AWS doesn't allow both on the same version:
+    lambda profile: not (profile["SnapStart"] and profile["ProvisionedConcurrency"]),
+))
+leaf_lambdaProfile_defaults = leaf_lambdaProfile_config.validate({})
+
+leaf_lambdas_config = Schema({ # pylint: disable=invalid-name
+    Optional(function, default=leaf_lambdaProfile_defaults): leaf_lambdaProfile_config
+    for function in LAMBDA_FUNCTIONS
+})
+leaf_lambdas_defaults = leaf_lambdas_config.validate({})
+
+## Also loaded on it's own by the simulators, so they don't need the rest of the config:
+leaf_watchdog_config = Schema(And( # pylint: disable=invalid-name
+    {
+        # Mode: Optional, what 'Threshold' is compared against. Either network traffic
+        # (Bytes/Sec), or the connections counted on the instance:
+        Optional("Mode", default="TRAFFIC"): And(
+            Use(str.upper),
+            Or("TRAFFIC", "CONNECTIONS"),
+        ),
+        "Threshold": int,
+        # PeriodSeconds: Optional, how often the alarm checks. Under 60 is a high-resolution alarm:
+        # https://docs.aws.amazon.com/AmazonCloudWatch/latest/monitoring/AlarmThatSendsEmail.html#high-resolution-alarms
+        Optional("PeriodSeconds", default=60): Or(10, 30, 60),
+        # MinutesWithoutConnections: Optional, returns a cdk Duration. (Can be a fraction, i.e 0.5):
+        Optional("MinutesWithoutConnections",
+            default=Duration.minutes(7),
+        ): And(Or(int, float), lambda n: n > 0, Use(lambda minutes: Duration.seconds(round(minutes * 60)))),
+        Optional("InstanceLeftUp", default=leaf_instanceLeftUp_defaults): leaf_instanceLeftUp_config,
+        # Alert if it takes longer than this, from the first DNS query to DNS pointing at the instance:
+        Optional("ColdStartAlarmSeconds", default=None): Or(None, And(int, lambda n: n > 0)),
+    },
+    # The alarm looks at whole periods:
+    lambda watchdog: watchdog["MinutesWithoutConnections"].to_seconds() % watchdog["PeriodSeconds"] == 0,
+    # NetworkIn only comes in 1-minute periods. Only the instance's own count can go faster:
+    lambda watchdog: watchdog["PeriodSeconds"] == 60 or watchdog["Mode"] == "CONNECTIONS",
+))
+
+leaf_dns_config = Schema({ # pylint: disable=invalid-name
+    # SelfRegister: Optional, the instance points DNS at itself when it boots:
+    Optional("SelfRegister", default=False): bool,
+    # EarlyUpdate: Optional, update DNS when EC2 says it's running, instead of waiting on the ASG:
+    Optional("EarlyUpdate", default=False): bool,
+})
+leaf_dns_defaults = leaf_dns_config.validate({})
+
+leaf_hostGroup_config = Schema({ # pylint: disable=invalid-name
+    # Name: Which of the base config's 'HostGroups' to share an instance with:
+    "Name": str,
+    # MemoryReservationMiB: This container's share of the instance. (The soft limit, same as without a group):
+    "MemoryReservationMiB": And(int, lambda n: n >= 512),
+})
+
+## Also loaded on it's own by the simulators, so they don't need the rest of the config:
+leaf_preWarm_config = Schema({ # pylint: disable=invalid-name
+    Optional("Enabled", default=False): bool,
+    # LeadMinutes: Optional, how long before a usually-busy bin to spin up. (About how long a cold start takes):
+    Optional("LeadMinutes", default=5): And(Or(int, float), lambda n: n > 0),
+    # Confidence: Optional, how many of the past weeks that bin had to be busy, to spin up for it:
+    Optional("Confidence", default=0.6): And(Or(int, float), lambda n: 0 < n <= 1),
+    # MaxMinutesPerDay: Optional, how long it can be up each day (UTC) without anyone asking:
+    Optional("MaxMinutesPerDay", default=60): And(Or(int, float), lambda n: n > 0),
+    # HistoryWeeks: Optional, about how many weeks back it remembers. Older weeks fade out:
+    Optional("HistoryWeeks", default=4): And(int, lambda n: n >= 1),
+    # BinMinutes: Optional, how finely it splits up the week. (Has to fit evenly in an hour):
+    Optional("BinMinutes", default=15): Or(5, 10, 15, 20, 30, 60),
+})
+leaf_preWarm_defaults = leaf_preWarm_config.validate({})
+
 leaf_dashboard_config = Schema({
     Optional("Enabled", default=True): bool,
     Optional("IntervalMinutes",
@@ -43,74 +251,170 @@ leaf_dashboard_config = Schema({
 })
 leaf_dashboard_defaults = leaf_dashboard_config.validate({})
 
+def add_instance_type_info(ec2_info: dict) -> dict:
+    """
+    Add the boto3 response with ALL the InstanceType's info to the Ec2 config. If there's more
+    than one, use the one with the least memory. It's the one the container has to fit on.
+        (describe_instance_types also throws if ANY of them aren't a real instance type)
+    """
+    # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/ec2/client/describe_instance_types.html#EC2.Client.describe_instance_types
+    instance_types_info = get_ec2_client().describe_instance_types(
+        InstanceTypes=ec2_info["InstanceTypes"],
+    )["InstanceTypes"]
+    smallest_instance_info = min(instance_types_info, key=lambda info: info["MemoryInfo"]["SizeInMiB"])
+    ## Graviton types can only run arm64 AMI's (and images). Everything else here is x86_64:
+    architectures = {
+        "arm64" if "arm64" in info["ProcessorInfo"]["SupportedArchitectures"] else "x86_64"
+        for info in instance_types_info
+    }
+    # They all launch from the same AMI, so they have to agree:
+    if len(architectures) > 1:
+        raise ValueError(f"InstanceTypes can't mix architectures, got: {sorted(architectures)}")
+    return ec2_info | smallest_instance_info | {"Architecture": architectures.pop()}
+
+def image_supports_architecture(leaf_config: dict) -> bool:
+    """
+    Make sure the container image is published for the instance's architecture.
+    If the registry can't tell us (private image, no network, etc), don't block
+    the deploy on it. get_image_architectures already printed a warning.
+    """
+    image_architectures = get_image_architectures(leaf_config["Container"]["Image"])
+    if image_architectures is None:
+        return True
+    return EC2_TO_IMAGE_ARCHITECTURE[leaf_config["Ec2"]["Architecture"]] in image_architectures
+
 ###################
 ### Leaf Config ###
 ###################
-def leaf_config_schema(maturity: Maturity) -> Schema:
-    """ Leaf config schema for the leaf stack. """
-    return Schema({
-        "Ec2": And(
-            {"InstanceType": Use(str.lower)},
-            ## Cast the InstanceType to the boto3 response with ALL it's info:
-            # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/ec2/client/describe_instance_types.html#EC2.Client.describe_instance_types
-            Use(lambda info: get_ec2_client().describe_instance_types(
-                InstanceTypes=[info["InstanceType"]])["InstanceTypes"][0],
-            ),
-            # Make sure we have at LEAST 2 GB for Host, and 1 GB for guest:
-            lambda instance_info: instance_info["MemoryInfo"]["SizeInMiB"] >= 3*1024, # # 3 GB
-        ),
-        "Container": {
-            "Image": Use(str.lower),
-            "Ports": [
-                And(
-                    # Cast the dict types to what you want:
-                    {Use(str.upper): Use(int)},
-                    # Assert the ONE key is either TCP or UDP:
-                    {Or("TCP", "UDP", only_one=True): int},
-                    # Cast it to an ecs port mapping:
-                    Use(lambda info: ecs.PortMapping(
-                        container_port=list(info.values())[0],
-                        host_port=list(info.values())[0],
-                        protocol=getattr(ecs.Protocol, list(info.keys())[0]),
-                    )),
+def leaf_config_schema(maturity: Maturity, check_image: bool = False) -> Schema:
+    """
+    Leaf config schema for the leaf stack. 'check_image' asks the image's registry
+    which architectures it has, so it's only on when deploying. (Not every synth/test).
+    """
+    return Schema(And(
+        {
+            "Ec2": And(
+                {
+                    # InstanceType: Either one type, or an ordered list to fall back on if there's no capacity:
+                    "InstanceType": Or(
+                        And(str, Use(lambda instance_type: [instance_type])),
+                        And([str], lambda instance_types: len(instance_types) > 0),
+                    ),
+                    Optional("Spot", default=leaf_spot_defaults): leaf_spot_config,
+                    Optional("WarmPool", default=leaf_warmPool_defaults): leaf_warmPool_config,
+                    Optional("BakedAmi", default=leaf_bakedAmi_defaults): leaf_bakedAmi_config,
+                    Optional("RootVolume", default=leaf_rootVolume_defaults): leaf_rootVolume_config,
+                },
+                ## InstanceTypes is always the ordered list. (InstanceType gets replaced below):
+                Use(lambda info: info | {"InstanceTypes": [instance_type.lower() for instance_type in info["InstanceType"]]}),
+                Use(add_instance_type_info),
+                # The ASG uses a Mixed Instances Policy if there's more than one type, or Spot:
+                Use(lambda info: info | {"MixedInstances": len(info["InstanceTypes"]) > 1 or info["Spot"]["Enabled"]}),
+                # ASG's with a Mixed Instances Policy can't have a warm pool:
+                # https://docs.aws.amazon.com/autoscaling/ec2/userguide/ec2-auto-scaling-warm-pools.html#warm-pools-limitations
+                lambda instance_info: not (instance_info["MixedInstances"] and instance_info["WarmPool"]["Enabled"]),
+                # Make sure we have at LEAST 2 GB for Host, and 1 GB for guest:
+                lambda instance_info: instance_info["MemoryInfo"]["SizeInMiB"] >= 3*1024, # # 3 GB
+                # Only some instance families can hibernate. (PoolState doesn't matter without a pool):
+                lambda instance_info: instance_info["HibernationSupported"] or not (
+                    instance_info["WarmPool"]["Enabled"] and
+                    instance_info["WarmPool"]["PoolState"] == autoscaling.PoolState.HIBERNATED
                 ),
-            ],
-            # Key: Optional, but defaults value to empty dict if not declared:
-            # Value: Either a empty dict, or a dict of strings (that casts all values to string).
-            #        Make bools all lowercase. Some containers are case-insensitive, others expect all lower.
-            Optional("Environment", default={}): Or({Use(str): Use(
-                # All values must be strings. If it's a bool, also make it all-lowercase:
-                lambda val: str(val).lower() if isinstance(val, bool) else str(val))},
-                # You're allowed to set an empty dict here:
-                {},
             ),
-        },
-        Optional("Volumes", default={}): {
-            # The ID can be anything:
-            str: {
-                # Contents of each volume config:
-                Optional("Type", default="EFS"): And(
-                    Use(str.upper),
-                    # Add S3 as apart of the Or here when it's supported!
-                    Or("EFS")
+            "Container": {
+                "Image": Use(str.lower),
+                "Ports": [
+                    And(
+                        # Cast the dict types to what you want:
+                        {Use(str.upper): Use(int)},
+                        # Assert the ONE key is either TCP or UDP:
+                        {Or("TCP", "UDP", only_one=True): int},
+                        # Cast it to an ecs port mapping:
+                        Use(lambda info: ecs.PortMapping(
+                            container_port=list(info.values())[0],
+                            host_port=list(info.values())[0],
+                            protocol=getattr(ecs.Protocol, list(info.keys())[0]),
+                        )),
+                    ),
+                ],
+                # Key: Optional, but defaults value to empty dict if not declared:
+                # Value: Either a empty dict, or a dict of strings (that casts all values to string).
+                #        Make bools all lowercase. Some containers are case-insensitive, others expect all lower.
+                Optional("Environment", default={}): Or({Use(str): Use(
+                    # All values must be strings. If it's a bool, also make it all-lowercase:
+                    lambda val: str(val).lower() if isinstance(val, bool) else str(val))},
+                    # You're allowed to set an empty dict here:
+                    {},
                 ),
-                Optional("EnableBackups", default=bool(maturity == Maturity.PROD)): bool,
-                Optional("KeepOnDelete", default=bool(maturity == Maturity.PROD)): bool,
-                # List of Path Configs to save:
-                "Paths": [{
-                    "Path": str,
-                    Optional("ReadOnly", default=False): bool,
-                }],
             },
+            Optional("Volumes", default={}): {
+                # The ID can be anything:
+                str: And(
+                    {
+                        # Contents of each volume config:
+                        Optional("Type", default="EFS"): And(
+                            Use(str.upper),
+                            Or("EFS", "S3", "EBS"),
+                        ),
+                        Optional("EnableBackups", default=bool(maturity == Maturity.PROD)): bool,
+                        Optional("KeepOnDelete", default=bool(maturity == Maturity.PROD)): bool,
+                        # MountOptions/Performance: Only used by EFS volumes:
+                        Optional("MountOptions", default=leaf_mountOptions_defaults): leaf_mountOptions_config,
+                        Optional("LocalCopy", default=leaf_localCopy_defaults): leaf_localCopy_config,
+                        Optional("Performance", default=leaf_efsPerformance_defaults): leaf_efsPerformance_config,
+                        # Ebs: Only used by EBS volumes:
+                        Optional("Ebs", default=leaf_ebsVolume_defaults): leaf_ebsVolume_config,
+                        # List of Path Configs to save:
+                        "Paths": [{
+                            "Path": str,
+                            Optional("ReadOnly", default=False): bool,
+                        }],
+                    },
+                    # S3 can't be mounted. The container ALWAYS uses a local copy of it:
+                    Use(lambda volume: volume | {"LocalCopy": volume["LocalCopy"] | {"Enabled": True}} if volume["Type"] == "S3" else volume),
+                    # EBS is already local to the instance:
+                    lambda volume: volume["Type"] != "EBS" or not volume["LocalCopy"]["Enabled"],
+                ),
+            },
+            "Watchdog": leaf_watchdog_config,
+            Optional("Dns", default=leaf_dns_defaults): leaf_dns_config,
+            # HostGroup: Optional, run on the group's instance instead of this leaf's own:
+            Optional("HostGroup", default=None): Or(None, leaf_hostGroup_config),
+            # PreWarm: Optional, spin up ahead of when it's usually played:
+            Optional("PreWarm", default=leaf_preWarm_defaults): leaf_preWarm_config,
+            Optional("Lambdas", default=leaf_lambdas_defaults): leaf_lambdas_config,
+            Optional("AlertSubscription", default={}): sns_schema,
+            Optional("Dashboard", default=leaf_dashboard_defaults): leaf_dashboard_config,
         },
-        "Watchdog": {
-            "Threshold": int,
-            # MinutesWithoutConnections: Optional, returns a cdk Duration in minutes.
-            Optional("MinutesWithoutConnections",
-                default=Duration.minutes(7),
-            ): And(int, Use(Duration.minutes)),
-            Optional("InstanceLeftUp", default=leaf_instanceLeftUp_defaults): leaf_instanceLeftUp_config,
-        },
-        Optional("AlertSubscription", default={}): sns_schema,
-        Optional("Dashboard", default=leaf_dashboard_defaults): leaf_dashboard_config,
-    })
+        # The image has to run on the instance type. (Graviton can't run x86_64 images):
+        image_supports_architecture if check_image else lambda config: True,
+        # EFS local copies live on the instance store, so the instance type has to have one:
+        # (S3 volumes fall back to the root volume)
+        lambda config: config["Ec2"]["InstanceStorageSupported"] or not any(
+            volume["Type"] == "EFS" and volume["LocalCopy"]["Enabled"] for volume in config["Volumes"].values()
+        ),
+        ## A hibernated instance resumes instead of booting. The services for these skipped
+        # themselves while it was warming, and never get another chance to start:
+        # (See the 'Warmed:*' check in each of 'instance_scripts/')
+        lambda config: not (
+            config["Ec2"]["WarmPool"]["Enabled"]
+            and config["Ec2"]["WarmPool"]["PoolState"] == autoscaling.PoolState.HIBERNATED
+        ) or (
+            config["Watchdog"]["Mode"] != "CONNECTIONS"
+            and not config["Dns"]["SelfRegister"]
+            and all(volume["Type"] != "EBS" and not volume["LocalCopy"]["Enabled"] for volume in config["Volumes"].values())
+        ),
+        # The group's instance is only set up with what every member can share:
+        lambda config: config["HostGroup"] is None or (
+            # NetworkIn is the whole instance's, it can't tell the members apart:
+            config["Watchdog"]["Mode"] == "CONNECTIONS"
+            # Only EFS can be mounted when the instance boots. The rest are tied to one leaf's ASG:
+            and all(volume["Type"] == "EFS" and not volume["LocalCopy"]["Enabled"] for volume in config["Volumes"].values())
+            and not config["Dns"]["SelfRegister"]
+            and not config["Ec2"]["WarmPool"]["Enabled"]
+            and not config["Ec2"]["BakedAmi"]["Enabled"]
+            and not config["Ec2"]["MixedInstances"]
+            # A pre-warm would check (and spin down) the group's shared ASG:
+            and not config["PreWarm"]["Enabled"]
+        ),
+    ))
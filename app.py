@@ -14,7 +14,7 @@ from aws_cdk import (
 )
 # import cdk_nag
 
-from ContainerManager.base_stack import BaseStack
+from ContainerManager.base_stack import BaseStack, StartRouterStack
 from ContainerManager.leaf_stack_group.domain_stack import DomainStack
 from ContainerManager.leaf_stack_group.container_manager_stack import ContainerManagerStack
 from ContainerManager.leaf_stack_group.start_system_stack import StartSystemStack
@@ -64,6 +64,17 @@ base_stack = BaseStack(
     application_id_tag_name=APPLICATION_ID_TAG_NAME,
     application_id_tag_value=application_id,
 )
+### One StartSystem lambda for every leaf, instead of one each:
+#   (In us-east-1 with the Route53 query logs, same as each leaf's StartSystemStack)
+start_router_stack = None
+if base_config["SharedLambdas"]["StartSystem"]:
+    start_router_stack = StartRouterStack(
+        app,
+        f"{app.node.get_context('_base_stack_name')}-StartRouter",
+        description=f"{maturity_description}The StartSystem lambda, shared by all ContainerManager leaf stacks.",
+        env=us_east_1_env,
+        application_id=application_id,
+    )
 
 ##################
 ### Leaf Stack ###
@@ -71,7 +82,12 @@ base_stack = BaseStack(
 ### Create the application for ONE Container:
 file_path = app.node.try_get_context("config-file")
 if file_path:
-    leaf_config = load_leaf_config(file_path, maturity=maturity)
+    # Only ask the image's registry when deploying, not every synth: (See the Makefile)
+    leaf_config = load_leaf_config(
+        file_path,
+        maturity=maturity,
+        check_image=str(app.node.try_get_context("check-image")).lower() == "true",
+    )
     # You can override container_id if you need to:
     container_id = app.node.try_get_context("container-id")
     if not container_id:
@@ -126,6 +142,8 @@ if file_path:
         domain_stack=domain_stack,
         container_manager_stack=container_manager_stack,
         container_id=container_id,
+        lambda_profile=leaf_config["Lambdas"]["StartSystem"],
+        start_router_stack=start_router_stack,
     )
     for key, val in stack_tags.items():
         Tags.of(start_system_stack).add(key, val)
@@ -1,3 +1,10 @@
+import pytest
+
+from aws_cdk.assertions import Match
+
+from tests.configs import BASE_PULL_THROUGH_CACHE, BASE_SHARED_LAMBDAS, BASE_HOST_GROUPS, LEAF_HOST_GROUP
+
+
 
 class TestBaseStack:
 
@@ -21,3 +28,120 @@ class TestBaseStack:
         assert base_template.find_resources(
             "AWS::EC2::NatGateway"
         ) == {}, "NAT Gateways are very expensive"
+
+class TestBaseStackPullThroughCache:
+    @pytest.fixture(scope="class")
+    def pull_through_cache_app(self, cdk_app):
+        return cdk_app(base_config=BASE_PULL_THROUGH_CACHE)
+
+    def test_nothing_cached_by_default(self, minimal_app):
+        minimal_app.base_template.resource_count_is("AWS::ECR::PullThroughCacheRule", 0)
+        minimal_app.base_template.resource_count_is("AWS::EC2::VPCEndpoint", 0)
+
+    def test_cache_rules(self, pull_through_cache_app):
+        base_template = pull_through_cache_app.base_template
+        base_template.resource_count_is("AWS::ECR::PullThroughCacheRule", 2)
+        base_template.has_resource_properties(
+            "AWS::ECR::PullThroughCacheRule",
+            {
+                "EcrRepositoryPrefix": "docker-hub",
+                "UpstreamRegistry": "docker-hub",
+                "UpstreamRegistryUrl": "registry-1.docker.io",
+            },
+        )
+        ## Free, and where ECR serves the layers from:
+        base_template.has_resource_properties(
+            "AWS::EC2::VPCEndpoint",
+            {"VpcEndpointType": "Gateway"},
+        )
+
+class TestBaseStackStartRouter:
+    @pytest.fixture(scope="class")
+    def shared_app(self, cdk_app):
+        return cdk_app(base_config=BASE_SHARED_LAMBDAS)
+
+    def test_no_router_by_default(self, minimal_app):
+        assert minimal_app.start_router_stack is None
+
+    def test_router_function(self, shared_app):
+        shared_app.start_router_template.has_resource_properties(
+            "AWS::Lambda::Function",
+            {
+                "Handler": "lambda_functions.trigger_start_system.main.router_handler",
+                "Environment": {"Variables": {"LEAF_PARAMETER_PREFIX": "/test-app/StartRouter"}},
+            },
+        )
+        ## Every leaf's query logs can invoke it, without the router knowing about them:
+        shared_app.start_router_template.has_resource_properties(
+            "AWS::Lambda::Permission",
+            {
+                "Principal": "logs.amazonaws.com",
+                "SourceArn": {"Fn::Join": ["", Match.array_with([Match.string_like_regexp(":log-group:/aws/route53/test-app-\\*")])]},
+            },
+        )
+
+class TestBaseStackHostGroups:
+    @pytest.fixture(scope="class")
+    def host_group_app(self, cdk_app):
+        return cdk_app(base_config=BASE_HOST_GROUPS, leaf_config=LEAF_HOST_GROUP)
+
+    def test_no_host_groups_by_default(self, minimal_app):
+        minimal_app.base_template.resource_count_is("AWS::ECS::Cluster", 0)
+        minimal_app.base_template.resource_count_is("AWS::AutoScaling::AutoScalingGroup", 0)
+
+    def test_one_instance_per_group(self, host_group_app):
+        base_template = host_group_app.base_template
+        base_template.resource_count_is("AWS::ECS::Cluster", 2)
+        base_template.has_resource_properties("AWS::ECS::Cluster", {"ClusterName": "test-app-Shared-ecs-cluster"})
+        base_template.resource_count_is("AWS::AutoScaling::AutoScalingGroup", 2)
+        base_template.has_resource_properties(
+            "AWS::AutoScaling::AutoScalingGroup",
+            {"MinSize": "0", "MaxSize": "1"},
+        )
+        base_template.has_resource_properties(
+            "AWS::EC2::LaunchTemplate",
+            {"LaunchTemplateData": Match.object_like({"InstanceType": "m5.2xlarge"})},
+        )
+
+    def test_group_alarm_spins_down_once_every_member_is_empty(self, host_group_app):
+        host_group_app.base_template.has_resource_properties(
+            "AWS::CloudWatch::Alarm",
+            {
+                "AlarmName": Match.string_like_regexp("Group Activity"),
+                "EvaluationPeriods": 15,
+                "Threshold": 0,
+                "AlarmActions": [{"Ref": Match.string_like_regexp("^HostGroupBigScaleDownAsgAction")}],
+                "Metrics": Match.array_with([
+                    Match.object_like({"Expression": "connections + FILL(dns_hit, 0)"}),
+                    Match.object_like({
+                        "Id": "connections",
+                        "MetricStat": Match.object_like({
+                            "Metric": {
+                                "Dimensions": [{"Name": "HostGroup", "Value": "Big"}],
+                                "MetricName": "ActiveConnections",
+                                "Namespace": "test-app-HostGroups",
+                            },
+                        }),
+                    }),
+                ]),
+            },
+        )
+
+    def test_instance_reads_every_member(self, host_group_app):
+        host_group_app.base_template.has_resource_properties(
+            "AWS::IAM::Policy",
+            {
+                "PolicyDocument": {
+                    "Statement": Match.array_with([
+                        Match.object_like({
+                            "Action": "ssm:GetParametersByPath",
+                            "Resource": {"Fn::Join": ["", Match.array_with([":parameter/test-app/HostGroups/Shared"])]},
+                        }),
+                        Match.object_like({
+                            "Action": "cloudwatch:PutMetricData",
+                            "Condition": {"StringEquals": {"cloudwatch:namespace": "test-app-HostGroups"}},
+                        }),
+                    ]),
+                },
+            },
+        )
@@ -6,7 +6,7 @@ import pytest
 import aws_cdk as cdk
 from aws_cdk.assertions import Template
 
-from ContainerManager.base_stack import BaseStack
+from ContainerManager.base_stack import BaseStack, StartRouterStack
 from ContainerManager.leaf_stack_group.domain_stack import DomainStack
 from ContainerManager.leaf_stack_group.container_manager_stack import ContainerManagerStack
 from ContainerManager.leaf_stack_group.start_system_stack import StartSystemStack
@@ -55,15 +55,25 @@ class CdkApp():
         application_id="test-app"
         container_id="test-stack"
         self.app = cdk.App()
+        base_config_output = base_config.create_config()
+        leaf_config_output = leaf_config.create_config()
         ## Stacks:
         # Create the base stack:
         self.base_stack = BaseStack(
             self.app,
             "TestBaseStack",
-            config=base_config.create_config(),
+            config=base_config_output,
             application_id_tag_name="ApplicationId",
             application_id_tag_value=application_id
         )
+        # And the shared router, if it's on:
+        self.start_router_stack = None
+        if base_config_output["SharedLambdas"]["StartSystem"]:
+            self.start_router_stack = StartRouterStack(
+                self.app,
+                "TestBaseStack-StartRouter",
+                application_id=application_id,
+            )
         # Create the domain stack:
         self.domain_stack = DomainStack(
             self.app,
@@ -79,7 +89,7 @@ class CdkApp():
             domain_stack=self.domain_stack,
             application_id=application_id,
             container_id=container_id,
-            config=leaf_config.create_config(),
+            config=leaf_config_output,
         )
         # Create the start system stack:
         self.start_system_stack = StartSystemStack(
@@ -88,11 +98,15 @@ class CdkApp():
             domain_stack=self.domain_stack,
             container_manager_stack=self.container_manager_stack,
             container_id=container_id,
+            lambda_profile=leaf_config_output["Lambdas"]["StartSystem"],
+            start_router_stack=self.start_router_stack,
         )
         ## Templates:
         # You can't modify the stack after you create the template (It gets synthed),
         # So create them here:
         self.base_template = Template.from_stack(self.base_stack)
+        if self.start_router_stack is not None:
+            self.start_router_template = Template.from_stack(self.start_router_stack)
         # Domain Stack
         self.domain_template = Template.from_stack(self.domain_stack)
         # Core Container Manager Stack
@@ -107,6 +121,12 @@ class CdkApp():
         # Start System Stack
         self.start_system_template = Template.from_stack(self.start_system_stack)
 
+    @property
+    def user_data(self) -> str:
+        """ The instance's user data, as one string to search through. (Scripts included) """
+        launch_templates = self.container_manager_ecs_asg_template.find_resources("AWS::EC2::LaunchTemplate")
+        return json.dumps(list(launch_templates.values())[0]["Properties"]["LaunchTemplateData"]["UserData"])
+
 @pytest.fixture(scope="session")
 def minimal_app(cdk_app):
     return cdk_app(
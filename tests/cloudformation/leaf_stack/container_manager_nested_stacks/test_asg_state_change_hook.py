@@ -0,0 +1,85 @@
+import pytest
+from aws_cdk.assertions import Match
+
+from tests.configs import BASE_SHARED_LAMBDAS, LEAF_DNS_EARLY_UPDATE
+
+
+class TestAsgStateChangeHook():
+    def test_no_instance_running_rule_by_default(self, minimal_app):
+        minimal_app.container_manager_asg_state_change_hook_template.resource_properties_count_is(
+            "AWS::Events::Rule",
+            {"EventPattern": Match.object_like({"source": ["aws.ec2"]})},
+            0,
+        )
+
+    def test_instance_running_rule(self, cdk_app):
+        app = cdk_app(leaf_config=LEAF_DNS_EARLY_UPDATE)
+        app.container_manager_asg_state_change_hook_template.has_resource_properties(
+            "AWS::Events::Rule",
+            {
+                "EventPattern": {
+                    "source": ["aws.ec2"],
+                    "detail-type": ["EC2 Instance State-change Notification"],
+                    "detail": {"state": ["running"]},
+                },
+            },
+        )
+        ## The lambda knows not to publish the cold start twice:
+        app.container_manager_asg_state_change_hook_template.has_resource_properties(
+            "AWS::Lambda::Function",
+            {"Environment": {"Variables": Match.object_like({"EARLY_DNS_UPDATE": "true"})}},
+        )
+
+
+class TestSharedAsgStateChangeHook():
+    @pytest.fixture(scope="class")
+    def shared_app(self, cdk_app):
+        return cdk_app(base_config=BASE_SHARED_LAMBDAS, leaf_config=LEAF_DNS_EARLY_UPDATE)
+
+    def test_no_lambda_of_its_own(self, shared_app):
+        template = shared_app.container_manager_asg_state_change_hook_template
+        template.resource_count_is("AWS::Lambda::Function", 0)
+        template.resource_count_is("AWS::IAM::Role", 0)
+        ## The base stack's rule sends every 'running' instance already:
+        template.resource_properties_count_is(
+            "AWS::Events::Rule",
+            {"EventPattern": Match.object_like({"source": ["aws.ec2"]})},
+            0,
+        )
+
+    def test_rules_send_to_base_queue(self, shared_app):
+        shared_app.container_manager_asg_state_change_hook_template.resource_properties_count_is(
+            "AWS::Events::Rule",
+            {"Targets": Match.array_with([Match.object_like({"Arn": {"Fn::ImportValue": Match.string_like_regexp("AsgStateChangeQueue")}})])},
+            2,
+        )
+        ## And saves what the lambda needs, under it's ASG name:
+        shared_app.container_manager_asg_state_change_hook_template.has_resource_properties(
+            "AWS::SSM::Parameter",
+            {"Value": {"Fn::Join": ["", Match.array_with([Match.string_like_regexp('"EARLY_DNS_UPDATE":"true"')])]}},
+        )
+
+    def test_base_stack_batches_events(self, shared_app):
+        base_template = shared_app.base_template
+        base_template.has_resource_properties(
+            "AWS::Lambda::Function",
+            {
+                "Handler": "lambda_functions.instance_StateChange_hook.main.router_handler",
+                "Environment": {"Variables": {
+                    "LEAF_PARAMETER_PREFIX": "/test-app/AsgStateChangeHook",
+                    "LEAF_CACHE_SECONDS": "300",
+                }},
+            },
+        )
+        base_template.has_resource_properties(
+            "AWS::Lambda::EventSourceMapping",
+            {"BatchSize": 10, "MaximumBatchingWindowInSeconds": 2},
+        )
+        base_template.has_resource_properties(
+            "AWS::Events::Rule",
+            {"EventPattern": {
+                "source": ["aws.ec2"],
+                "detail-type": ["EC2 Instance State-change Notification"],
+                "detail": {"state": ["running"]},
+            }},
+        )
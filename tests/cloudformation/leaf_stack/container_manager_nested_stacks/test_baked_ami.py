@@ -0,0 +1,82 @@
+import pytest
+
+from aws_cdk.assertions import Template, Match
+
+from tests.configs import LEAF_BAKED_AMI
+
+
+class TestBakedAmi():
+    @pytest.fixture(scope="class")
+    def baked_ami_app(self, cdk_app):
+        return cdk_app(leaf_config=LEAF_BAKED_AMI)
+
+    @pytest.fixture(scope="class")
+    def baked_ami_template(self, baked_ami_app):
+        return Template.from_stack(baked_ami_app.container_manager_stack.baked_ami_nested_stack)
+
+    def test_no_baked_ami_by_default(self, minimal_app):
+        assert not hasattr(minimal_app.container_manager_stack, "baked_ami_nested_stack")
+        ## The plain ECS AMI is looked up from the public SSM parameter when deploying:
+        minimal_app.container_manager_ecs_asg_template.has_parameter(
+            "*",
+            {"Type": "AWS::SSM::Parameter::Value<AWS::EC2::Image::Id>"},
+        )
+
+    def test_image_is_built(self, baked_ami_template):
+        baked_ami_template.resource_count_is("AWS::ImageBuilder::Image", 1)
+        baked_ami_template.has_resource_properties(
+            "AWS::ImageBuilder::Component",
+            {
+                "Platform": "Linux",
+                "Data": Match.string_like_regexp("docker pull hello-world:latest"),
+            },
+        )
+        baked_ami_template.has_resource_properties(
+            "AWS::ImageBuilder::InfrastructureConfiguration",
+            {"InstanceTypes": ["m5.large"]},
+        )
+
+    def test_component_changes_with_image(self, cdk_app):
+        ## Components are immutable, so the name has to change to rebuild:
+        def _component_name(image: str) -> str:
+            config = LEAF_BAKED_AMI.copy(
+                config_input=LEAF_BAKED_AMI.config_input | {
+                    "Container": LEAF_BAKED_AMI.config_input["Container"] | {"Image": image},
+                },
+            )
+            app = cdk_app(leaf_config=config)
+            template = Template.from_stack(app.container_manager_stack.baked_ami_nested_stack)
+            components = template.find_resources("AWS::ImageBuilder::Component")
+            return list(components.values())[0]["Properties"]["Name"]
+        assert _component_name("hello-world:latest") != _component_name("hello-world:linux")
+
+    def test_prefer_cached_only_with_digest(self, cdk_app, baked_ami_template):
+        ## A tag can move after the AMI's baked, so the agent has to keep checking the registry:
+        component = list(baked_ami_template.find_resources("AWS::ImageBuilder::Component").values())[0]
+        assert "prefer-cached" not in component["Properties"]["Data"]
+        ## A digest can't, so there's no reason to:
+        config = LEAF_BAKED_AMI.copy(
+            config_input=LEAF_BAKED_AMI.config_input | {
+                "Container": LEAF_BAKED_AMI.config_input["Container"] | {"Image": f"hello-world@sha256:{'0' * 64}"},
+            },
+        )
+        app = cdk_app(leaf_config=config)
+        Template.from_stack(app.container_manager_stack.baked_ami_nested_stack).has_resource_properties(
+            "AWS::ImageBuilder::Component",
+            {"Data": Match.string_like_regexp("ECS_IMAGE_PULL_BEHAVIOR=prefer-cached")},
+        )
+
+    def test_launch_template_uses_baked_ami(self, baked_ami_app):
+        ecs_asg_template = baked_ami_app.container_manager_ecs_asg_template
+        ecs_asg_template.has_resource_properties(
+            "AWS::EC2::LaunchTemplate",
+            {
+                "LaunchTemplateData": Match.object_like({
+                    "ImageId": {"Fn::Join": ["", Match.array_with(["resolve:ssm:"])]},
+                }),
+            },
+        )
+
+    def test_fast_snapshot_restore(self, baked_ami_template):
+        ## One to find the AMI's snapshot, one to enable it:
+        baked_ami_template.resource_count_is("Custom::AWS", 2)
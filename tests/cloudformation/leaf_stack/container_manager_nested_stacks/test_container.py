@@ -0,0 +1,54 @@
+import json
+import pytest
+
+from aws_cdk.assertions import Match
+
+from ContainerManager.utils.ecr_pull_through_cache import cached_image_uri
+
+from tests.configs import BASE_PULL_THROUGH_CACHE, LEAF_MINIMAL
+
+
+CACHE_HOST = "123456789012.dkr.ecr.us-west-2.amazonaws.com"
+
+class TestContainerPullThroughCache():
+    @pytest.mark.parametrize("image,expected", [
+        # Docker Hub, with and without the registry host:
+        ("itzg/minecraft-server:latest", f"{CACHE_HOST}/docker-hub/itzg/minecraft-server:latest"),
+        ("docker.io/itzg/minecraft-server", f"{CACHE_HOST}/docker-hub/itzg/minecraft-server"),
+        # Official images live under 'library/':
+        ("nginx:1.27", f"{CACHE_HOST}/docker-hub/library/nginx:1.27"),
+        # GitHub:
+        ("ghcr.io/owner/image@sha256:abc", f"{CACHE_HOST}/ghcr/owner/image@sha256:abc"),
+        # Not a cached registry, leave it alone:
+        ("public.ecr.aws/owner/image:latest", "public.ecr.aws/owner/image:latest"),
+        ("localhost:5000/image", "localhost:5000/image"),
+    ])
+    def test_cached_image_uri(self, image, expected):
+        cached_registries = {"DockerHub": "docker-hub", "GitHub": "ghcr"}
+        assert cached_image_uri(image, cached_registries, "123456789012", "us-west-2") == expected
+
+    def test_nothing_cached(self):
+        assert cached_image_uri("nginx", {}, "123456789012", "us-west-2") == "nginx"
+
+    def test_container_uses_cache(self, cdk_app):
+        app = cdk_app(base_config=BASE_PULL_THROUGH_CACHE, leaf_config=LEAF_MINIMAL)
+        container_nested_stack = app.container_manager_stack.container_nested_stack
+        # hello-world is an official Docker Hub image:
+        assert container_nested_stack.image_uri.endswith(".amazonaws.com/docker-hub/library/hello-world:latest")
+        ## The execution role can import the image into the cache:
+        app.container_manager_container_template.has_resource_properties(
+            "AWS::IAM::Policy",
+            {
+                "PolicyDocument": {
+                    "Statement": Match.array_with([
+                        Match.object_like({
+                            "Action": Match.array_with(["ecr:BatchImportUpstreamImage"]),
+                        }),
+                    ]),
+                },
+            },
+        )
+        # Not hardcoded to 'aws', so it works in aws-cn/aws-us-gov too:
+        policies = json.dumps(app.container_manager_container_template.find_resources("AWS::IAM::Policy"))
+        assert "arn:aws:ecr" not in policies
+        assert ":ecr:" in policies
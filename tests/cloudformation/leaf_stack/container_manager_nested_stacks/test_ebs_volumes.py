@@ -0,0 +1,74 @@
+
+import pytest
+
+from aws_cdk.assertions import Match
+
+from tests.configs import LEAF_VOLUMES_EBS
+
+
+@pytest.fixture(scope="module")
+def app(cdk_app):
+    return cdk_app(leaf_config=LEAF_VOLUMES_EBS)
+
+
+class TestEbsVolumes():
+
+    def test_no_storage_in_stack(self, app):
+        ## The volume only exists while an instance is up, nothing is created ahead of time:
+        app.container_manager_volumes_template.resource_count_is("AWS::EFS::FileSystem", 0)
+        app.container_manager_volumes_template.resource_count_is("AWS::S3::Bucket", 0)
+
+    def test_container_uses_block_device(self, app):
+        app.container_manager_container_template.has_resource_properties(
+            "AWS::ECS::TaskDefinition",
+            {"Volumes": Match.array_with([
+                Match.object_like({"Host": {"SourcePath": "/mnt/ebs/Ebs-World/data"}}),
+            ])},
+        )
+
+    def test_ebs_volumes_service(self, app):
+        user_data = app.user_data
+        assert "systemctl enable ebs-volumes.service" in user_data
+        # ECS can't start the task until it's mounted:
+        assert "RequiredBy=ecs.service" in user_data
+        # (Name:SizeGiB:Type:Iops:ThroughputMiBps:FastSnapshotRestore:KeepSnapshots:Paths)
+        assert 'EBS_VOLUMES=\\"Ebs-World:50:gp3:6000::true:3:/data\\"' in user_data
+        assert "local-copy" not in user_data
+        # A volume frozen for its snapshot always gets thawed again, or every write to it hangs:
+        assert user_data.count("fsfreeze --freeze") == user_data.count("fsfreeze --unfreeze") == 1
+
+    def test_lifecycle_hook_waits_on_snapshot(self, app):
+        ecs_asg_template = app.container_manager_ecs_asg_template
+        ecs_asg_template.resource_count_is("AWS::AutoScaling::LifecycleHook", 1)
+        ecs_asg_template.has_resource_properties(
+            "AWS::AutoScaling::LifecycleHook",
+            {
+                "LifecycleHookName": "TestLeafStack-ContainerManager-ebs-volumes",
+                "LifecycleTransition": "autoscaling:EC2_INSTANCE_TERMINATING",
+            },
+        )
+
+    def test_permissions_locked_to_leaf(self, app):
+        ecs_asg_template = app.container_manager_ecs_asg_template
+        ## Snapshots/volumes only if they're tagged as this leaf's:
+        ecs_asg_template.has_resource_properties(
+            "AWS::IAM::Policy",
+            {"PolicyDocument": {"Statement": Match.array_with([
+                Match.object_like({
+                    "Action": Match.array_with(["ec2:AttachVolume", "ec2:DeleteSnapshot"]),
+                    "Condition": {"StringLike": {
+                        "aws:ResourceTag/ContainerManager:Volume": "TestLeafStack-ContainerManager/*",
+                    }},
+                }),
+            ])}},
+        )
+        ## And only the ASG's own instances:
+        ecs_asg_template.has_resource_properties(
+            "AWS::IAM::Policy",
+            {"PolicyDocument": {"Statement": [
+                Match.object_like({
+                    "Action": ["ec2:AttachVolume", "ec2:ModifyInstanceAttribute"],
+                    "Condition": {"StringEquals": {"aws:ResourceTag/aws:autoscaling:groupName": Match.any_value()}},
+                }),
+            ]}},
+        )
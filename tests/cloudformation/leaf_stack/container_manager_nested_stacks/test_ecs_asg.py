@@ -1,3 +1,10 @@
+import json
+import pytest
+
+from aws_cdk.assertions import Match
+
+from tests.configs import BASE_HOST_GROUPS, LEAF_HOST_GROUP, LEAF_WARM_POOL, LEAF_WARM_POOL_DISABLED_HIBERNATED, LEAF_DNS_SELF_REGISTER, LEAF_SPOT_FALLBACK_TYPES, LEAF_GRAVITON, LEAF_ROOT_VOLUME
+
 
 class TestEcsAsg():
     def test_ec2_permissions(self, minimal_app):
@@ -13,6 +20,17 @@ class TestEcsAsg():
         ec2_policy_properties = {
             "PolicyDocument": {
                 "Statement": [
+                    {
+                        # For the boot timing metrics, ONLY in this leaf's namespace:
+                        "Action": "cloudwatch:PutMetricData",
+                        "Condition": {
+                            "StringEquals": {
+                                "cloudwatch:namespace": "TestLeafStack-ContainerManager"
+                            }
+                        },
+                        "Effect": "Allow",
+                        "Resource": "*"
+                    },
                     {
                         "Action": [
                             "ecs:DeregisterContainerInstance",
@@ -63,3 +81,260 @@ class TestEcsAsg():
             "AWS::IAM::Policy",
             ec2_policy_properties,
         )
+
+    def test_boot_timing_service(self, minimal_app):
+        ## The boot timing script is installed as a service, so it runs every boot:
+        user_data = minimal_app.user_data
+        assert "cat > /usr/local/bin/boot-timing.sh" in user_data
+        assert "systemctl enable boot-timing.service" in user_data
+        # (json.dumps escapes the quotes around the value):
+        assert 'IMAGE=\\"hello-world:latest\\"' in user_data
+        ## Off by default:
+        assert "dns-self-register" not in user_data
+
+class TestEcsAsgDnsSelfRegister():
+    @pytest.fixture(scope="class")
+    def self_register_app(self, cdk_app):
+        return cdk_app(leaf_config=LEAF_DNS_SELF_REGISTER)
+
+    def test_self_register_service(self, self_register_app):
+        user_data = self_register_app.user_data
+        assert "cat > /usr/local/bin/dns-self-register.sh" in user_data
+        assert "systemctl enable dns-self-register.service" in user_data
+
+    def test_role_scoped_to_one_record(self, self_register_app):
+        self_register_app.container_manager_ecs_asg_template.has_resource_properties(
+            "AWS::IAM::Policy",
+            {
+                "PolicyDocument": {
+                    "Statement": Match.array_with([{
+                        "Action": "route53:ChangeResourceRecordSets",
+                        "Condition": {"ForAllValues:StringEquals": {
+                            "route53:ChangeResourceRecordSetsNormalizedRecordNames": ["test-stack.example.com"],
+                            "route53:ChangeResourceRecordSetsRecordTypes": ["A"],
+                            "route53:ChangeResourceRecordSetsActions": ["UPSERT"],
+                        }},
+                        "Effect": "Allow",
+                        "Resource": Match.any_value(),
+                    }]),
+                },
+            },
+        )
+
+class TestEcsAsgWarmPool():
+    @pytest.fixture(scope="class")
+    def warm_pool_app(self, cdk_app):
+        return cdk_app(leaf_config=LEAF_WARM_POOL)
+
+    def test_no_warm_pool_by_default(self, minimal_app):
+        minimal_app.container_manager_ecs_asg_template.resource_count_is("AWS::AutoScaling::WarmPool", 0)
+
+    def test_warm_pool_properties(self, warm_pool_app):
+        ecs_asg_template = warm_pool_app.container_manager_ecs_asg_template
+        ecs_asg_template.resource_count_is("AWS::AutoScaling::WarmPool", 1)
+        ecs_asg_template.has_resource_properties(
+            "AWS::AutoScaling::WarmPool",
+            {
+                "PoolState": "Stopped",
+                "InstanceReusePolicy": {"ReuseOnScaleIn": True},
+            },
+        )
+        ## The Watchdog needs InService instances, since warm ones still send traffic:
+        ecs_asg_template.has_resource_properties(
+            "AWS::AutoScaling::AutoScalingGroup",
+            {
+                "MetricsCollection": [
+                    {
+                        "Granularity": "1Minute",
+                        "Metrics": ["GroupInServiceInstances"],
+                    },
+                ],
+            },
+        )
+
+    def test_warm_pool_events_filtered(self, warm_pool_app):
+        ## Only instances moving in/out of the ASG itself should touch DNS:
+        hook_template = warm_pool_app.container_manager_asg_state_change_hook_template
+        hook_template.has_resource_properties(
+            "AWS::Events::Rule",
+            {
+                "EventPattern": Match.object_like({
+                    "detail-type": ["EC2 Instance Launch Successful"],
+                    "detail": Match.object_like({"Destination": ["AutoScalingGroup"]}),
+                }),
+            },
+        )
+        hook_template.has_resource_properties(
+            "AWS::Events::Rule",
+            {
+                "EventPattern": Match.object_like({
+                    "detail-type": ["EC2 Instance-terminate Lifecycle Action"],
+                    "detail": Match.object_like({"Origin": ["AutoScalingGroup"]}),
+                }),
+            },
+        )
+
+class TestEcsAsgMixedInstances():
+    def test_single_type_by_default(self, minimal_app):
+        ecs_asg_template = minimal_app.container_manager_ecs_asg_template
+        ecs_asg_template.has_resource_properties(
+            "AWS::AutoScaling::AutoScalingGroup",
+            {"MixedInstancesPolicy": Match.absent()},
+        )
+        ecs_asg_template.has_resource_properties(
+            "AWS::EC2::LaunchTemplate",
+            {"LaunchTemplateData": Match.object_like({"InstanceType": "m5.large"})},
+        )
+
+    def test_mixed_instances_policy(self, cdk_app):
+        app = cdk_app(leaf_config=LEAF_SPOT_FALLBACK_TYPES)
+        app.container_manager_ecs_asg_template.has_resource_properties(
+            "AWS::AutoScaling::AutoScalingGroup",
+            {
+                "MixedInstancesPolicy": {
+                    "LaunchTemplate": Match.object_like({
+                        # Same order as the config:
+                        "Overrides": [{"InstanceType": "m5.xlarge"}, {"InstanceType": "m5.large"}],
+                    }),
+                    "InstancesDistribution": {
+                        "OnDemandAllocationStrategy": "prioritized",
+                        "OnDemandBaseCapacity": 0,
+                        "OnDemandPercentageAboveBaseCapacity": 0,
+                        "SpotAllocationStrategy": "capacity-optimized-prioritized",
+                    },
+                },
+            },
+        )
+        ## The container has to fit on the smallest type:
+        app.container_manager_container_template.has_resource_properties(
+            "AWS::ECS::TaskDefinition",
+            {"ContainerDefinitions": [Match.object_like({"MemoryReservation": 8*1024 - 2*1024})]},
+        )
+
+class TestEcsAsgGraviton():
+    @staticmethod
+    def _ami_parameter_defaults(template) -> list:
+        ## The ECS AMI is looked up from a public SSM parameter when deploying:
+        parameters = template.find_parameters("*", {"Type": "AWS::SSM::Parameter::Value<AWS::EC2::Image::Id>"})
+        return [parameter["Default"] for parameter in parameters.values()]
+
+    def test_x86_ami_by_default(self, minimal_app):
+        ami_parameters = self._ami_parameter_defaults(minimal_app.container_manager_ecs_asg_template)
+        assert ami_parameters == ["/aws/service/ecs/optimized-ami/amazon-linux-2023/recommended/image_id"]
+
+    def test_arm_ami_for_graviton(self, cdk_app):
+        app = cdk_app(leaf_config=LEAF_GRAVITON)
+        ami_parameters = self._ami_parameter_defaults(app.container_manager_ecs_asg_template)
+        assert ami_parameters == ["/aws/service/ecs/optimized-ami/amazon-linux-2023/arm64/recommended/image_id"]
+
+class TestEcsAsgRootVolume():
+    def test_default_root_volume(self, minimal_app):
+        minimal_app.container_manager_ecs_asg_template.has_resource_properties(
+            "AWS::EC2::LaunchTemplate",
+            {"LaunchTemplateData": Match.object_like({
+                "BlockDeviceMappings": [{
+                    "DeviceName": "/dev/xvda",
+                    "Ebs": {"VolumeSize": 30, "VolumeType": "gp3", "Encrypted": True},
+                }],
+            })},
+        )
+
+    def test_root_volume_performance(self, cdk_app):
+        app = cdk_app(leaf_config=LEAF_ROOT_VOLUME)
+        app.container_manager_ecs_asg_template.has_resource_properties(
+            "AWS::EC2::LaunchTemplate",
+            {"LaunchTemplateData": Match.object_like({
+                "BlockDeviceMappings": [{
+                    "DeviceName": "/dev/xvda",
+                    "Ebs": {"VolumeSize": 50, "VolumeType": "gp3", "Encrypted": True, "Iops": 6000, "Throughput": 500},
+                }],
+            })},
+        )
+
+    def test_hibernation_needs_warm_pool(self, cdk_app):
+        ## PoolState alone doesn't hibernate anything, so the root volume isn't grown for the RAM:
+        app = cdk_app(leaf_config=LEAF_WARM_POOL_DISABLED_HIBERNATED)
+        app.container_manager_ecs_asg_template.has_resource_properties(
+            "AWS::EC2::LaunchTemplate",
+            {"LaunchTemplateData": Match.object_like({
+                "BlockDeviceMappings": [{
+                    "DeviceName": "/dev/xvda",
+                    "Ebs": {"VolumeSize": 30, "VolumeType": "gp3", "Encrypted": True},
+                }],
+                "HibernationOptions": {"Configured": False},
+            })},
+        )
+
+    def test_ebs_stats_service(self, minimal_app):
+        ## Publishes the latency/queue depth for the Dashboard, every boot:
+        user_data = minimal_app.user_data
+        assert "cat > /usr/local/bin/ebs-stats.sh" in user_data
+        assert "systemctl enable ebs-stats.service" in user_data
+
+
+class TestHostGroup():
+    @pytest.fixture(scope="class")
+    def host_group_app(self, cdk_app):
+        return cdk_app(base_config=BASE_HOST_GROUPS, leaf_config=LEAF_HOST_GROUP)
+
+    def test_runs_on_the_group_instance(self, host_group_app):
+        ecs_asg_template = host_group_app.container_manager_ecs_asg_template
+        ## The group's ASG and cluster live in the base stack:
+        ecs_asg_template.resource_count_is("AWS::AutoScaling::AutoScalingGroup", 0)
+        ecs_asg_template.resource_count_is("AWS::ECS::Cluster", 0)
+        ecs_asg_template.has_resource_properties(
+            "AWS::ECS::Service",
+            {
+                "Cluster": {"Fn::ImportValue": Match.string_like_regexp("HostGroupSharedEcsCluster")},
+                "SchedulingStrategy": "DAEMON",
+            },
+        )
+
+    def test_member_parameter(self, host_group_app):
+        parameters = host_group_app.container_manager_ecs_asg_template.find_resources(
+            "AWS::SSM::Parameter",
+            {"Properties": {"Name": "/test-app/HostGroups/Shared/test-stack"}},
+        )
+        assert len(parameters) == 1
+        value = json.dumps(list(parameters.values())[0]["Properties"]["Value"])
+        ## Each member gets it's own directory, so their volumes don't collide:
+        assert "/mnt/efs/test-stack/" in value
+        assert "tcp:25565" in value
+
+    def test_ports_open_on_group_sg(self, host_group_app):
+        sg_template = host_group_app.container_manager_sg_template
+        ## Only the EFS one. The instance's SG is the group's:
+        sg_template.resource_count_is("AWS::EC2::SecurityGroup", 1)
+        sg_template.has_resource_properties(
+            "AWS::EC2::SecurityGroupIngress",
+            {
+                "FromPort": 25565,
+                "GroupId": {"Fn::ImportValue": Match.string_like_regexp("HostGroupShared")},
+            },
+        )
+
+    def test_crash_loop_only_watches_this_member(self, host_group_app):
+        watchdog_template = host_group_app.container_manager_watchdog_template
+        watchdog_template.has_resource_properties(
+            "AWS::Events::Rule",
+            {
+                "EventPattern": Match.object_like({
+                    "detail": Match.object_like({"group": [{"Fn::Join": ["", Match.array_with(["service:"])]}]}),
+                }),
+            },
+        )
+        ## The group's alarm spins it down, not this member's:
+        watchdog_template.has_resource_properties(
+            "AWS::CloudWatch::Alarm",
+            {
+                "AlarmName": Match.string_like_regexp("Container Activity"),
+                "AlarmActions": Match.absent(),
+            },
+        )
+
+    def test_instance_type_has_to_match(self, cdk_app):
+        other_type = LEAF_HOST_GROUP.copy(
+            config_input=LEAF_HOST_GROUP.config_input | {"Ec2": {"InstanceType": "m5.xlarge"}},
+        )
+        with pytest.raises(ValueError, match="InstanceType"):
+            cdk_app(base_config=BASE_HOST_GROUPS, leaf_config=other_type)
@@ -5,7 +5,7 @@ import pytest
 
 from aws_cdk.assertions import Match
 
-from tests.configs import LEAF_VOLUMES
+from tests.configs import LEAF_VOLUMES, LEAF_VOLUMES_LOCAL_COPY, LEAF_VOLUMES_PERFORMANCE
 
 
 @pytest.fixture(scope="module")
@@ -126,3 +126,95 @@ class TestEfsVolumes():
                     ])
                 },
             )
+
+    def test_volume_mount_user_data(self, app):
+        ## Every EFS should mount in the background, with it's own mount options:
+        user_data = app.user_data
+        volumes_config = LEAF_VOLUMES.create_config()["Volumes"]
+        for volume_id in volumes_config:
+            assert f'time_mount \\"/mnt/efs/Efs-{volume_id}\\"' in user_data
+        assert user_data.count("MOUNT_PIDS+=($!)") == len(volumes_config)
+        assert "efs _netdev,tls,iam,rsize=524288,wsize=1048576,resvport,nconnect=4 0 0" in user_data
+        assert "efs _netdev,tls,iam,rsize=1048576,wsize=1048576,noresvport 0 0" in user_data
+        ## Off by default:
+        assert "local-copy" not in user_data
+        app.container_manager_ecs_asg_template.resource_count_is("AWS::AutoScaling::LifecycleHook", 0)
+
+
+class TestEfsVolumesLocalCopy():
+    @pytest.fixture(scope="class")
+    def local_copy_app(self, cdk_app):
+        return cdk_app(leaf_config=LEAF_VOLUMES_LOCAL_COPY)
+
+    def test_container_uses_local_copy(self, local_copy_app):
+        ## Only the volume with 'LocalCopy' points at the instance store:
+        local_copy_app.container_manager_container_template.has_resource_properties(
+            "AWS::ECS::TaskDefinition",
+            {"Volumes": Match.array_with([
+                Match.object_like({"Host": {"SourcePath": "/mnt/local/Efs-Local/data-local"}}),
+                Match.object_like({"Host": {"SourcePath": "/mnt/efs/Efs-Remote/data-remote"}}),
+            ])},
+        )
+
+    def test_local_copy_service(self, local_copy_app):
+        user_data = local_copy_app.user_data
+        assert "systemctl enable local-copy.service" in user_data
+        # ECS can't start the task until the copy's there:
+        assert "Before=ecs.service" in user_data
+        assert "RequiredBy=ecs.service" in user_data
+        # Only the one with 'LocalCopy', synced straight from where it's mounted:
+        assert 'LOCAL_COPIES=\\"Efs-Local:10:/mnt/efs/Efs-Local\\"' in user_data
+        # Writes back before going into a warm pool too, not only when terminating:
+        assert '\\"$lifecycle_state\\" == Warmed:*' in user_data
+
+    def test_lifecycle_hook_waits_on_write_back(self, local_copy_app):
+        ecs_asg_template = local_copy_app.container_manager_ecs_asg_template
+        ecs_asg_template.has_resource_properties(
+            "AWS::AutoScaling::LifecycleHook",
+            {
+                "LifecycleHookName": "TestLeafStack-ContainerManager-local-copy",
+                "LifecycleTransition": "autoscaling:EC2_INSTANCE_TERMINATING",
+                "DefaultResult": "CONTINUE",
+            },
+        )
+        ecs_asg_template.has_resource_properties(
+            "AWS::IAM::Policy",
+            {"PolicyDocument": {"Statement": Match.array_with([
+                Match.object_like({
+                    "Action": "autoscaling:CompleteLifecycleAction",
+                    "Resource": Match.any_value(),
+                }),
+            ])}},
+        )
+
+
+class TestEfsVolumesPerformance():
+    def test_default_performance(self, app):
+        ## Same as the EFS defaults, unless you ask otherwise:
+        app.container_manager_volumes_template.all_resources_properties(
+            "AWS::EFS::FileSystem",
+            {
+                "ThroughputMode": "bursting",
+                "PerformanceMode": "generalPurpose",
+                "AvailabilityZoneName": Match.absent(),
+            },
+        )
+
+    def test_performance_modes(self, cdk_app):
+        volumes_template = cdk_app(leaf_config=LEAF_VOLUMES_PERFORMANCE).container_manager_volumes_template
+        volumes_template.has_resource_properties(
+            "AWS::EFS::FileSystem",
+            {
+                "ThroughputMode": "elastic",
+                # One Zone lives in just one AZ:
+                "AvailabilityZoneName": Match.any_value(),
+            },
+        )
+        volumes_template.has_resource_properties(
+            "AWS::EFS::FileSystem",
+            {
+                "ThroughputMode": "provisioned",
+                "ProvisionedThroughputInMibps": 50,
+                "PerformanceMode": "maxIO",
+            },
+        )
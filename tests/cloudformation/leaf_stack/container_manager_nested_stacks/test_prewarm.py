@@ -0,0 +1,67 @@
+import json
+
+import pytest
+
+from aws_cdk.assertions import Template, Match
+
+from tests.configs import LEAF_PRE_WARM
+
+
+class TestPreWarm():
+    @pytest.fixture(scope="class")
+    def prewarm_app(self, cdk_app):
+        return cdk_app(leaf_config=LEAF_PRE_WARM)
+
+    @pytest.fixture(scope="class")
+    def prewarm_template(self, prewarm_app):
+        return Template.from_stack(prewarm_app.container_manager_stack.prewarm_nested_stack)
+
+    def test_no_prewarm_by_default(self, minimal_app):
+        assert not hasattr(minimal_app.container_manager_stack, "prewarm_nested_stack")
+
+    def test_runs_on_schedule(self, prewarm_template):
+        prewarm_template.has_resource_properties(
+            "AWS::Events::Rule",
+            {
+                "ScheduleExpression": "rate(5 minutes)",
+                "Targets": [Match.object_like({"Arn": Match.any_value()})],
+            },
+        )
+
+    def test_lambda_reads_dns_metric(self, prewarm_template):
+        prewarm_template.has_resource_properties(
+            "AWS::Lambda::Function",
+            {
+                "Handler": "lambda_functions.predictive_prewarm.main.lambda_handler",
+                "Environment": {
+                    "Variables": Match.object_like({
+                        "METRIC_NAME": "DNSTraffic",
+                        "METRIC_DIMENSIONS": json.dumps({"ContainerNameID": "test-stack"}),
+                        "CONFIDENCE": "0.8",
+                        "BIN_MINUTES": "30",
+                    }),
+                },
+            },
+        )
+
+    def test_state_starts_empty(self, prewarm_template):
+        prewarm_template.has_resource_properties(
+            "AWS::SSM::Parameter",
+            # A busy week doesn't fit in Standard's 4KB:
+            {"Value": "{}", "Tier": "Advanced"},
+        )
+
+    def test_can_update_asg(self, prewarm_template):
+        prewarm_template.has_resource_properties(
+            "AWS::IAM::Policy",
+            {
+                "PolicyDocument": {
+                    "Statement": Match.array_with([
+                        Match.object_like({
+                            "Action": "autoscaling:UpdateAutoScalingGroup",
+                            "Effect": "Allow",
+                        }),
+                    ]),
+                },
+            },
+        )
@@ -0,0 +1,61 @@
+
+import pytest
+
+from aws_cdk.assertions import Match
+
+from tests.configs import LEAF_VOLUMES_S3
+
+
+@pytest.fixture(scope="module")
+def app(cdk_app):
+    return cdk_app(leaf_config=LEAF_VOLUMES_S3)
+
+
+class TestS3Volumes():
+
+    def test_bucket(self, app):
+        ## No EFS, just the one private bucket:
+        app.container_manager_volumes_template.resource_count_is("AWS::EFS::FileSystem", 0)
+        app.container_manager_volumes_template.resource_count_is("AWS::S3::Bucket", 1)
+        app.container_manager_volumes_template.has_resource_properties(
+            "AWS::S3::Bucket",
+            {
+                "PublicAccessBlockConfiguration": {
+                    "BlockPublicAcls": True,
+                    "BlockPublicPolicy": True,
+                    "IgnorePublicAcls": True,
+                    "RestrictPublicBuckets": True,
+                },
+                # 'EnableBackups' keeps old versions around for a while:
+                "VersioningConfiguration": {"Status": "Enabled"},
+                "LifecycleConfiguration": {"Rules": [
+                    Match.object_like({"NoncurrentVersionExpiration": {"NoncurrentDays": 30}}),
+                ]},
+            },
+        )
+
+    def test_container_uses_local_copy(self, app):
+        app.container_manager_container_template.has_resource_properties(
+            "AWS::ECS::TaskDefinition",
+            {"Volumes": Match.array_with([
+                Match.object_like({"Host": {"SourcePath": "/mnt/local/S3-World/data"}}),
+            ])},
+        )
+
+    def test_local_copy_service(self, app):
+        user_data = app.user_data
+        assert "systemctl enable local-copy.service" in user_data
+        assert "S3-World:5:s3://" in user_data
+        # Nothing to mount:
+        assert 'time_mount \\"' not in user_data
+        app.container_manager_ecs_asg_template.resource_count_is("AWS::AutoScaling::LifecycleHook", 1)
+
+    def test_instance_can_sync_bucket(self, app):
+        app.container_manager_ecs_asg_template.has_resource_properties(
+            "AWS::IAM::Policy",
+            {"PolicyDocument": {"Statement": Match.array_with([
+                Match.object_like({
+                    "Action": Match.array_with(["s3:DeleteObject*", "s3:PutObject"]),
+                }),
+            ])}},
+        )
@@ -0,0 +1,154 @@
+import pytest
+from aws_cdk.assertions import Match
+
+from tests.configs import BASE_SHARED_LAMBDAS, LEAF_COLD_START_ALARM, LEAF_WATCHDOG_CONNECTIONS, LEAF_WATCHDOG_HIGH_RESOLUTION
+
+
+class TestColdStart():
+    def test_no_cold_start_alarm_by_default(self, minimal_app):
+        minimal_app.container_manager_watchdog_template.resource_properties_count_is(
+            "AWS::CloudWatch::Alarm",
+            {"AlarmName": Match.string_like_regexp("Cold Start")},
+            0,
+        )
+
+    def test_cold_start_alarm(self, cdk_app):
+        app = cdk_app(leaf_config=LEAF_COLD_START_ALARM)
+        app.container_manager_watchdog_template.has_resource_properties(
+            "AWS::CloudWatch::Alarm",
+            {
+                "Metrics": [Match.object_like({
+                    "MetricStat": Match.object_like({
+                        "Metric": Match.object_like({"MetricName": "ColdStartSeconds"}),
+                        "Period": 3600,
+                        "Stat": "Maximum",
+                    }),
+                })],
+                "Threshold": 180,
+                "ComparisonOperator": "GreaterThanThreshold",
+                "TreatMissingData": "notBreaching",
+            },
+        )
+
+    def test_hook_can_publish_cold_start(self, minimal_app):
+        ## The hook reads the timestamp the trigger_start_system lambda saved, then publishes the metric:
+        minimal_app.container_manager_asg_state_change_hook_template.has_resource_properties(
+            "AWS::IAM::Policy",
+            {
+                "PolicyDocument": {
+                    "Statement": Match.array_with([
+                        Match.object_like({
+                            "Action": ["ssm:GetParameter", "ssm:DeleteParameter"],
+                        }),
+                        Match.object_like({
+                            "Action": "cloudwatch:PutMetricData",
+                            "Condition": {"StringEquals": {"cloudwatch:namespace": Match.any_value()}},
+                        }),
+                    ]),
+                },
+            },
+        )
+
+
+class TestConnectionsMode():
+    def test_traffic_by_default(self, minimal_app):
+        minimal_app.container_manager_watchdog_template.has_resource_properties(
+            "AWS::CloudWatch::Alarm",
+            {
+                "AlarmName": Match.string_like_regexp("Container Activity"),
+                "Metrics": Match.array_with([
+                    Match.object_like({"Expression": Match.string_like_regexp("traffic_in - volumes_out")}),
+                ]),
+            },
+        )
+        user_data = minimal_app.user_data
+        assert "connection-count" not in user_data
+
+    def test_alarm_uses_connections(self, cdk_app):
+        app = cdk_app(leaf_config=LEAF_WATCHDOG_CONNECTIONS)
+        app.container_manager_watchdog_template.has_resource_properties(
+            "AWS::CloudWatch::Alarm",
+            {
+                "AlarmName": Match.string_like_regexp("Container Activity"),
+                "Metrics": Match.array_with([
+                    Match.object_like({"Expression": "connections + FILL(dns_hit, 0)"}),
+                    Match.object_like({
+                        "Id": "connections",
+                        "MetricStat": Match.object_like({
+                            "Metric": Match.object_like({"MetricName": "ActiveConnections"}),
+                        }),
+                    }),
+                ]),
+                "Threshold": 0,
+            },
+        )
+        ## And the instance counts them, on each of the container's ports:
+        user_data = app.user_data
+        assert "systemctl enable connection-count.service" in user_data
+        assert 'LISTEN_PORTS=\\"tcp:25565 udp:12345\\"' in user_data
+
+
+class TestHighResolution():
+    def test_one_minute_by_default(self, minimal_app):
+        minimal_app.container_manager_watchdog_template.has_resource_properties(
+            "AWS::CloudWatch::Alarm",
+            {
+                "AlarmName": Match.string_like_regexp("Container Activity"),
+                "Period": Match.absent(),
+                # The default 'MinutesWithoutConnections':
+                "EvaluationPeriods": 7,
+            },
+        )
+
+    def test_ten_second_periods(self, cdk_app):
+        app = cdk_app(leaf_config=LEAF_WATCHDOG_HIGH_RESOLUTION)
+        app.container_manager_watchdog_template.has_resource_properties(
+            "AWS::CloudWatch::Alarm",
+            {
+                "AlarmName": Match.string_like_regexp("Container Activity"),
+                "Metrics": Match.array_with([
+                    Match.object_like({
+                        "Id": "connections",
+                        "MetricStat": Match.object_like({"Period": 10}),
+                    }),
+                ]),
+                # 30 seconds of nobody connected:
+                "EvaluationPeriods": 3,
+            },
+        )
+        ## Both sides publish every period, at high resolution:
+        user_data = app.user_data
+        assert 'PERIOD_SECONDS=\\"10\\"' in user_data
+        app.start_system_template.has_resource_properties(
+            "AWS::Lambda::Function",
+            {"Environment": {"Variables": Match.object_like({"METRIC_PERIOD_SECONDS": "10"})}},
+        )
+
+
+class TestSharedBreakCrashLoop():
+    @pytest.fixture(scope="class")
+    def shared_app(self, cdk_app):
+        return cdk_app(base_config=BASE_SHARED_LAMBDAS)
+
+    def test_no_lambda_of_its_own(self, shared_app):
+        shared_app.container_manager_watchdog_template.resource_count_is("AWS::Lambda::Function", 0)
+        ## Saves which ASG to spin down, under it's cluster's name:
+        shared_app.container_manager_watchdog_template.has_resource_properties(
+            "AWS::SSM::Parameter",
+            {"Name": {"Fn::Join": ["", Match.array_with(["/test-app/BreakCrashLoop/"])]}},
+        )
+
+    def test_alarm_counts_rule_not_lambda(self, shared_app):
+        ## The shared lambda runs for every leaf, so the alarm watches this leaf's rule:
+        shared_app.container_manager_watchdog_template.has_resource_properties(
+            "AWS::CloudWatch::Alarm",
+            {
+                "AlarmName": Match.string_like_regexp("Break Crash Loop"),
+                "Namespace": "AWS/Events",
+                "MetricName": "TriggeredRules",
+            },
+        )
+        shared_app.base_template.has_resource_properties(
+            "AWS::Lambda::Permission",
+            {"Principal": "events.amazonaws.com", "FunctionName": {"Fn::GetAtt": [Match.string_like_regexp("BreakCrashLoop"), "Arn"]}},
+        )
@@ -1,3 +1,10 @@
+from pathlib import Path
+
+import pytest
+from aws_cdk.assertions import Match
+
+from tests.configs import BASE_SHARED_LAMBDAS, LEAF_LAMBDA_PROFILE
+
 
 class TestLeafStackStartSystem:
     def test_minimal_create(self, minimal_app):
@@ -7,3 +14,87 @@ class TestLeafStackStartSystem:
         # Add your test logic here
         assert leaf_stack_start_system is not None # TMP
         assert leaf_template_start_system is not None # TMP
+
+    def test_default_lambda_profile(self, minimal_app):
+        minimal_app.start_system_template.has_resource_properties(
+            "AWS::Lambda::Function",
+            {"Architectures": ["arm64"], "MemorySize": 128, "SnapStart": Match.absent()},
+        )
+        # Nothing to publish, the trigger invokes the function directly:
+        minimal_app.start_system_template.resource_count_is("AWS::Lambda::Alias", 0)
+
+    def test_lambda_code_includes_common(self, minimal_app):
+        minimal_app.start_system_template.has_resource_properties(
+            "AWS::Lambda::Function",
+            {"Handler": "lambda_functions.trigger_start_system.main.lambda_handler"},
+        )
+        ## Every lambda is deployed with the whole 'lambda_functions' directory, and nothing else:
+        asset_dirs = list(Path(minimal_app.app.outdir).glob("asset.*/lambda_functions"))
+        assert asset_dirs
+        for asset_dir in asset_dirs:
+            assert (asset_dir / "common.py").is_file()
+            assert (asset_dir / "trigger_start_system" / "main.py").is_file()
+            assert [path.name for path in asset_dir.parent.iterdir()] == ["lambda_functions"]
+            assert not list(asset_dir.glob("**/__pycache__"))
+
+    def test_snap_start_invoked_through_alias(self, cdk_app):
+        app = cdk_app(leaf_config=LEAF_LAMBDA_PROFILE)
+        app.start_system_template.has_resource_properties(
+            "AWS::Lambda::Function",
+            {
+                "Architectures": ["x86_64"],
+                "MemorySize": 512,
+                "SnapStart": {"ApplyOn": "PublishedVersions"},
+            },
+        )
+        app.start_system_template.resource_count_is("AWS::Lambda::Alias", 1)
+        ## The trigger has to invoke the alias, or SnapStart never kicks in:
+        app.start_system_template.has_resource_properties(
+            "AWS::Logs::SubscriptionFilter",
+            {"DestinationArn": {"Ref": Match.string_like_regexp("StartSystemLive")}},
+        )
+        ## Provisioned concurrency on the hook:
+        app.container_manager_asg_state_change_hook_template.has_resource_properties(
+            "AWS::Lambda::Alias",
+            {"ProvisionedConcurrencyConfig": {"ProvisionedConcurrentExecutions": 1}},
+        )
+
+class TestLeafStackSharedStartRouter:
+    @pytest.fixture(scope="class")
+    def shared_app(self, cdk_app):
+        return cdk_app(base_config=BASE_SHARED_LAMBDAS)
+
+    def test_filter_named_after_domain(self, minimal_app):
+        minimal_app.start_system_template.has_resource_properties(
+            "AWS::Logs::SubscriptionFilter",
+            {"FilterName": "test-stack.example.com"},
+        )
+
+    def test_no_lambda_of_its_own(self, shared_app):
+        shared_app.start_system_template.resource_count_is("AWS::Lambda::Function", 0)
+        shared_app.start_system_template.resource_count_is("AWS::IAM::Role", 0)
+
+    def test_points_at_router(self, shared_app):
+        shared_app.start_system_template.has_resource_properties(
+            "AWS::Logs::SubscriptionFilter",
+            {
+                "FilterName": "test-stack.example.com",
+                "DestinationArn": {"Fn::ImportValue": Match.string_like_regexp("StartRouter")},
+            },
+        )
+        ## Saves what the router needs, under it's domain:
+        shared_app.start_system_template.has_resource_properties(
+            "AWS::SSM::Parameter",
+            {"Name": "/test-app/StartRouter/test-stack.example.com"},
+        )
+
+    def test_permissions_on_router_role(self, shared_app):
+        shared_app.start_system_template.has_resource_properties(
+            "AWS::IAM::Policy",
+            {
+                "PolicyDocument": {"Statement": Match.array_with([
+                    Match.object_like({"Action": "autoscaling:UpdateAutoScalingGroup"}),
+                ])},
+                "Roles": [Match.any_value()],
+            },
+        )
@@ -1,9 +1,15 @@
 
+from functools import partial
+
 import pytest
+from schema import SchemaError
 
+from ContainerManager.utils import leaf_config_parser, image_manifest, load_leaf_config
 from tests.configs import (
     LEAF_VOLUMES,
     LEAF_CONTAINER_ENVIRONMENT,
+    LEAF_MINIMAL,
+    LEAF_GRAVITON,
 )
 
 
@@ -68,3 +74,52 @@ class TestLeafConfigEnvironment():
             assert output_value == str(input_value), f"Numeric environment variable {input_name} should become its string representation."
         else:
             pytest.fail(f"Unhandled type {type(input_value)} for environment variable {input_name}.")
+
+
+class TestLeafConfigImageArchitecture():
+    # Only checked when deploying: (app.py's 'check-image' context)
+    check_image_loader = partial(load_leaf_config, check_image=True)
+
+    def test_image_missing_architecture(self, monkeypatch):
+        ## Graviton can't run an image that's only published for x86_64:
+        monkeypatch.setattr(leaf_config_parser, "get_image_architectures", lambda image: frozenset(["amd64"]))
+        LEAF_MINIMAL.copy(loader=self.check_image_loader).create_config()
+        with pytest.raises(SchemaError):
+            LEAF_GRAVITON.copy(loader=self.check_image_loader).create_config()
+
+    def test_registry_unreachable(self, monkeypatch):
+        ## Don't block the deploy if we can't check:
+        monkeypatch.setattr(leaf_config_parser, "get_image_architectures", lambda image: None)
+        config = LEAF_GRAVITON.copy(loader=self.check_image_loader).create_config()
+        assert config["Ec2"]["Architecture"] == "arm64"
+
+    def test_registry_not_asked_by_default(self, monkeypatch):
+        ## Synths and the test suite shouldn't depend on the network:
+        def _get_image_architectures(image):
+            pytest.fail(f"Asked the registry about '{image}'.")
+        monkeypatch.setattr(leaf_config_parser, "get_image_architectures", _get_image_architectures)
+        LEAF_GRAVITON.create_config()
+
+    @pytest.mark.parametrize(
+        "image,expected_url",
+        [
+            ("nginx", "https://registry-1.docker.io/v2/library/nginx/manifests/latest"),
+            ("itzg/minecraft-server:java21", "https://registry-1.docker.io/v2/itzg/minecraft-server/manifests/java21"),
+            ("ghcr.io/owner/app@sha256:abc", "https://ghcr.io/v2/owner/app/manifests/sha256:abc"),
+            ("localhost:5000/app", "https://localhost:5000/v2/app/manifests/latest"),
+        ],
+    )
+    def test_manifest_index_architectures(self, monkeypatch, image, expected_url):
+        requested_urls = []
+        def _registry_get(url, accept):
+            requested_urls.append(url)
+            return {"manifests": [
+                {"platform": {"architecture": "amd64", "os": "linux"}},
+                {"platform": {"architecture": "arm64", "os": "linux"}},
+                # Attestations aren't an architecture:
+                {"platform": {"architecture": "unknown", "os": "unknown"}},
+            ]}
+        monkeypatch.setattr(image_manifest, "_registry_get", _registry_get)
+        image_manifest.get_image_architectures.cache_clear()
+        assert image_manifest.get_image_architectures(image) == {"amd64", "arm64"}
+        assert requested_urls == [expected_url]
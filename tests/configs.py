@@ -5,8 +5,12 @@ import yaml
 
 from aws_cdk import (
     Duration,
+    aws_ec2 as ec2,
     aws_ecs as ecs,
+    aws_efs as efs,
     aws_sns as sns,
+    aws_lambda,
+    aws_autoscaling as autoscaling,
 )
 from moto import mock_aws
 from ContainerManager.utils.config_loader import load_base_config, load_leaf_config, _parse_config
@@ -54,7 +58,15 @@ BASE_MINIMAL = ConfigInfo(
         },
         'Vpc': {
             'MaxAZs': 1,
+            'S3GatewayEndpoint': False,
         },
+        'PullThroughCache': {},
+        'SharedLambdas': {
+            'StartSystem': False,
+            'AsgStateChangeHook': False,
+            'BreakCrashLoop': False,
+        },
+        'HostGroups': {},
     },
 )
 
@@ -69,8 +81,151 @@ BASE_VPC_MAXAZS = BASE_MINIMAL.copy(
     expected_output=BASE_MINIMAL.expected_output | {
         'Vpc': {
             'MaxAZs': 2,
+            'S3GatewayEndpoint': False,
+        },
+    },
+)
+
+BASE_PULL_THROUGH_CACHE = BASE_MINIMAL.copy(
+    label="BasePullThroughCache",
+    config_input=BASE_MINIMAL.config_input | {
+        'Vpc': {
+            'S3GatewayEndpoint': True,
+        },
+        'PullThroughCache': {
+            'DockerHub': {
+                'CredentialArn': "arn:aws:secretsmanager:us-west-2:123456789012:secret:ecr-pullthroughcache/docker-hub-AbCdEf",
+            },
+            'GitHub': {
+                'CredentialArn': "arn:aws:secretsmanager:us-west-2:123456789012:secret:ecr-pullthroughcache/github-AbCdEf",
+            },
+        },
+    },
+    expected_output=BASE_MINIMAL.expected_output | {
+        'Vpc': {
+            'MaxAZs': 1,
+            'S3GatewayEndpoint': True,
+        },
+        'PullThroughCache': {
+            'DockerHub': {
+                'CredentialArn': "arn:aws:secretsmanager:us-west-2:123456789012:secret:ecr-pullthroughcache/docker-hub-AbCdEf",
+            },
+            'GitHub': {
+                'CredentialArn': "arn:aws:secretsmanager:us-west-2:123456789012:secret:ecr-pullthroughcache/github-AbCdEf",
+            },
+        },
+    },
+)
+
+BASE_PULL_THROUGH_CACHE_BAD_SECRET = BASE_MINIMAL.copy(
+    label="BasePullThroughCacheBadSecret",
+    config_input=BASE_MINIMAL.config_input | {
+        'PullThroughCache': {
+            'DockerHub': {
+                # ECR requires the 'ecr-pullthroughcache/' prefix:
+                'CredentialArn': "arn:aws:secretsmanager:us-west-2:123456789012:secret:docker-hub-AbCdEf",
+            },
+        },
+    },
+    expected_output=None,
+)
+
+BASE_SHARED_LAMBDAS = BASE_MINIMAL.copy(
+    label="BaseSharedLambdas",
+    config_input=BASE_MINIMAL.config_input | {
+        'SharedLambdas': {
+            'StartSystem': True,
+            'AsgStateChangeHook': True,
+            'BreakCrashLoop': True,
+        },
+    },
+    expected_output=BASE_MINIMAL.expected_output | {
+        'SharedLambdas': {
+            'StartSystem': True,
+            'AsgStateChangeHook': True,
+            'BreakCrashLoop': True,
+        },
+    },
+)
+
+BASE_HOST_GROUPS = BASE_MINIMAL.copy(
+    label="BaseHostGroups",
+    config_input=BASE_MINIMAL.config_input | {
+        'HostGroups': {
+            # Same InstanceType as LEAF_MINIMAL, so LEAF_HOST_GROUP can join it:
+            'Shared': {
+                'InstanceType': "m5.large",
+            },
+            'Big': {
+                'InstanceType': "M5.2xLarge",
+                'RootVolume': {
+                    'SizeGiB': 50,
+                },
+                'MinutesWithoutConnections': 15,
+            },
+        },
+    },
+    expected_output=BASE_MINIMAL.expected_output | {
+        'HostGroups': {
+            'Shared': {
+                'InstanceType': "m5.large",
+                'InstanceTypes': ["m5.large"],
+                'Architecture': "x86_64",
+                'MemoryInfo': {
+                    'SizeInMiB': int,
+                },
+                'RootVolume': {
+                    'SizeGiB': 30,
+                    'Type': ec2.EbsDeviceVolumeType.GP3,
+                    'Iops': None,
+                    'ThroughputMiBps': None,
+                },
+                'MinutesWithoutConnections': Duration,
+            },
+            'Big': {
+                'InstanceType': "m5.2xlarge",
+                'InstanceTypes': ["m5.2xlarge"],
+                'Architecture': "x86_64",
+                'MemoryInfo': {
+                    'SizeInMiB': int,
+                },
+                'RootVolume': {
+                    'SizeGiB': 50,
+                    'Type': ec2.EbsDeviceVolumeType.GP3,
+                    'Iops': None,
+                    'ThroughputMiBps': None,
+                },
+                'MinutesWithoutConnections': Duration,
+            },
+        },
+    },
+)
+
+BASE_HOST_GROUPS_BAD_NAME = BASE_MINIMAL.copy(
+    label="BaseHostGroupsBadName",
+    config_input=BASE_MINIMAL.config_input | {
+        'HostGroups': {
+            # The name ends up in resource names, so only letters and numbers:
+            'my-group': {
+                'InstanceType': "m5.large",
+            },
         },
     },
+    expected_output=None,
+)
+
+BASE_HOST_GROUPS_PARTIAL_MINUTE = BASE_MINIMAL.copy(
+    label="BaseHostGroupsPartialMinute",
+    config_input=BASE_MINIMAL.config_input | {
+        'HostGroups': {
+            'Shared': {
+                'InstanceType': "m5.large",
+                # The group's alarm only looks at whole minutes:
+                'MinutesWithoutConnections': 1.5,
+            },
+        },
+    },
+    expected_output=None,
 )
 
 BASE_ALERT_SUBSCRIPTION = BASE_MINIMAL.copy(
@@ -129,17 +284,63 @@ LEAF_MINIMAL = ConfigInfo(
         },
         'Ec2': {
             'InstanceType': "m5.large",
+            'InstanceTypes': ["m5.large"],
+            'Architecture': "x86_64",
+            'MixedInstances': False,
             'MemoryInfo': {
                 'SizeInMiB': int,
             },
+            'Spot': {
+                'Enabled': False,
+                'OnDemandBaseCapacity': 0,
+                'OnDemandPercentageAboveBaseCapacity': 0,
+            },
+            'WarmPool': {
+                'Enabled': False,
+                'PoolState': autoscaling.PoolState.STOPPED,
+            },
+            'BakedAmi': {
+                'Enabled': False,
+                'FastSnapshotRestore': False,
+            },
+            'RootVolume': {
+                'SizeGiB': 30,
+                'Type': ec2.EbsDeviceVolumeType.GP3,
+                'Iops': None,
+                'ThroughputMiBps': None,
+            },
         },
         'Watchdog': {
+            'Mode': "TRAFFIC",
+            'PeriodSeconds': 60,
             'Threshold': 2000,
             'InstanceLeftUp': {
                 'DurationHours': Duration,
                 'ShouldStop': bool,
             },
             'MinutesWithoutConnections': Duration,
+            'ColdStartAlarmSeconds': None,
+        },
+        'Dns': {
+            'SelfRegister': False,
+            'EarlyUpdate': False,
+        },
+        'HostGroup': None,
+        'PreWarm': {
+            'Enabled': False,
+            'LeadMinutes': 5,
+            'Confidence': 0.6,
+            'MaxMinutesPerDay': 60,
+            'HistoryWeeks': 4,
+            'BinMinutes': 15,
+        },
+        'Lambdas': {
+            function: {
+                'Architecture': aws_lambda.Architecture,
+                'MemorySize': 128,
+                'SnapStart': False,
+                'ProvisionedConcurrency': 0,
+            } for function in ["StartSystem", "AsgStateChangeHook", "BreakCrashLoop"]
         },
         'Dashboard': {
             'Enabled': bool,
@@ -242,6 +443,17 @@ LEAF_VOLUMES = LEAF_MINIMAL.copy(
                     {"Path": "/config-2"},
                 ],
             },
+            # 5: To check NFS mount options:
+            "MountOptions": {
+                "Paths": [
+                    {"Path": "/data-mount-options"},
+                ],
+                "MountOptions": {
+                    "Nconnect": 4,
+                    "ReadSizeBytes": 524288,
+                    "NoResvPort": False,
+                },
+            },
         },
     },
     expected_output=LEAF_MINIMAL.expected_output | {
@@ -278,10 +490,772 @@ LEAF_VOLUMES = LEAF_MINIMAL.copy(
                 "EnableBackups": True,
                 "KeepOnDelete": True,
             },
+            "MountOptions": {
+                "Paths": [
+                    {"Path": "/data-mount-options", "ReadOnly": False},
+                ],
+                "EnableBackups": True,
+                "KeepOnDelete": True,
+                "MountOptions": {
+                    "Nconnect": 4,
+                    "ReadSizeBytes": 524288,
+                    "WriteSizeBytes": 1048576,
+                    "NoResvPort": False,
+                },
+            },
+        },
+    },
+)
+
+LEAF_WARM_POOL = LEAF_MINIMAL.copy(
+    label="LeafWarmPool",
+    config_input=LEAF_MINIMAL.config_input | {
+        "Ec2": LEAF_MINIMAL.config_input["Ec2"] | {
+            "WarmPool": {
+                "Enabled": True,
+            },
+        },
+    },
+    expected_output=LEAF_MINIMAL.expected_output | {
+        "Ec2": LEAF_MINIMAL.expected_output["Ec2"] | {
+            "WarmPool": {
+                "Enabled": True,
+                "PoolState": autoscaling.PoolState.STOPPED,
+            },
         },
     },
 )
 
+LEAF_WARM_POOL_HIBERNATED = LEAF_MINIMAL.copy(
+    label="LeafWarmPoolHibernated",
+    config_input=LEAF_MINIMAL.config_input | {
+        "Ec2": LEAF_MINIMAL.config_input["Ec2"] | {
+            "WarmPool": {
+                "Enabled": True,
+                # Case-insensitive:
+                "PoolState": "hibernated",
+            },
+        },
+    },
+    expected_output=LEAF_MINIMAL.expected_output | {
+        "Ec2": LEAF_MINIMAL.expected_output["Ec2"] | {
+            "WarmPool": {
+                "Enabled": True,
+                "PoolState": autoscaling.PoolState.HIBERNATED,
+            },
+        },
+    },
+)
+
+LEAF_WARM_POOL_RUNNING = LEAF_MINIMAL.copy(
+    label="LeafWarmPoolRunning",
+    config_input=LEAF_MINIMAL.config_input | {
+        "Ec2": LEAF_MINIMAL.config_input["Ec2"] | {
+            "WarmPool": {
+                "Enabled": True,
+                # Would be billed the whole time, not allowed:
+                "PoolState": "Running",
+            },
+        },
+    },
+    expected_output=None,
+)
+
+LEAF_WARM_POOL_HIBERNATED_UNSUPPORTED = LEAF_MINIMAL.copy(
+    label="LeafWarmPoolHibernatedUnsupported",
+    config_input=LEAF_MINIMAL.config_input | {
+        "Ec2": LEAF_MINIMAL.config_input["Ec2"] | {
+            # This family can't hibernate:
+            "InstanceType": "c5a.large",
+            "WarmPool": {
+                "Enabled": True,
+                "PoolState": "Hibernated",
+            },
+        },
+    },
+    expected_output=None,
+)
+
+LEAF_WARM_POOL_DISABLED_HIBERNATED = LEAF_MINIMAL.copy(
+    label="LeafWarmPoolDisabledHibernated",
+    config_input=LEAF_MINIMAL.config_input | {
+        "Ec2": LEAF_MINIMAL.config_input["Ec2"] | {
+            "InstanceType": "c5a.large",
+            # There's no pool, so it never hibernates. Fine on any family:
+            "WarmPool": {
+                "Enabled": False,
+                "PoolState": "Hibernated",
+            },
+        },
+    },
+    expected_output=LEAF_MINIMAL.expected_output | {
+        "Ec2": LEAF_MINIMAL.expected_output["Ec2"] | {
+            "InstanceType": "c5a.large",
+            "InstanceTypes": ["c5a.large"],
+            "WarmPool": {
+                "Enabled": False,
+                "PoolState": autoscaling.PoolState.HIBERNATED,
+            },
+        },
+    },
+)
+
+LEAF_SPOT_FALLBACK_TYPES = LEAF_MINIMAL.copy(
+    label="LeafSpotFallbackTypes",
+    config_input=LEAF_MINIMAL.config_input | {
+        "Ec2": LEAF_MINIMAL.config_input["Ec2"] | {
+            # Tried in order:
+            "InstanceType": ["m5.xlarge", "M5.large"],
+            "Spot": {
+                "Enabled": True,
+            },
+        },
+    },
+    expected_output=LEAF_MINIMAL.expected_output | {
+        "Ec2": LEAF_MINIMAL.expected_output["Ec2"] | {
+            # The one with the least memory, since the container has to fit on it:
+            "InstanceType": "m5.large",
+            "InstanceTypes": ["m5.xlarge", "m5.large"],
+            "MixedInstances": True,
+            "Spot": {
+                "Enabled": True,
+                "OnDemandBaseCapacity": 0,
+                "OnDemandPercentageAboveBaseCapacity": 0,
+            },
+        },
+    },
+)
+
+LEAF_GRAVITON = LEAF_MINIMAL.copy(
+    label="LeafGraviton",
+    config_input=LEAF_MINIMAL.config_input | {
+        "Ec2": LEAF_MINIMAL.config_input["Ec2"] | {
+            "InstanceType": "m6g.large",
+        },
+    },
+    expected_output=LEAF_MINIMAL.expected_output | {
+        "Ec2": LEAF_MINIMAL.expected_output["Ec2"] | {
+            "InstanceType": "m6g.large",
+            "InstanceTypes": ["m6g.large"],
+            # Picked from the instance type, for the ECS AMI:
+            "Architecture": "arm64",
+        },
+    },
+)
+
+LEAF_MIXED_ARCHITECTURES = LEAF_MINIMAL.copy(
+    label="LeafMixedArchitectures",
+    config_input=LEAF_MINIMAL.config_input | {
+        "Ec2": LEAF_MINIMAL.config_input["Ec2"] | {
+            # Can't launch both from the same AMI:
+            "InstanceType": ["m6g.large", "m5.large"],
+        },
+    },
+    expected_output=None,
+)
+
+LEAF_ROOT_VOLUME = LEAF_MINIMAL.copy(
+    label="LeafRootVolume",
+    config_input=LEAF_MINIMAL.config_input | {
+        "Ec2": LEAF_MINIMAL.config_input["Ec2"] | {
+            "RootVolume": {
+                "SizeGiB": 50,
+                "Type": "gp3",
+                "Iops": 6000,
+                "ThroughputMiBps": 500,
+            },
+        },
+    },
+    expected_output=LEAF_MINIMAL.expected_output | {
+        "Ec2": LEAF_MINIMAL.expected_output["Ec2"] | {
+            "RootVolume": {
+                "SizeGiB": 50,
+                "Type": ec2.EbsDeviceVolumeType.GP3,
+                "Iops": 6000,
+                "ThroughputMiBps": 500,
+            },
+        },
+    },
+)
+
+LEAF_ROOT_VOLUME_GP2_THROUGHPUT = LEAF_MINIMAL.copy(
+    label="LeafRootVolumeGp2Throughput",
+    config_input=LEAF_MINIMAL.config_input | {
+        "Ec2": LEAF_MINIMAL.config_input["Ec2"] | {
+            # Only gp3 lets you set throughput:
+            "RootVolume": {
+                "Type": "gp2",
+                "ThroughputMiBps": 500,
+            },
+        },
+    },
+    expected_output=None,
+)
+
+LEAF_VOLUMES_LOCAL_COPY = LEAF_MINIMAL.copy(
+    label="LeafVolumesLocalCopy",
+    config_input=LEAF_MINIMAL.config_input | {
+        "Ec2": LEAF_MINIMAL.config_input["Ec2"] | {
+            # Has an instance store:
+            "InstanceType": "m5d.large",
+        },
+        "Volumes": {
+            "Local": {
+                "Paths": [
+                    {"Path": "/data-local"},
+                ],
+                "LocalCopy": {
+                    "Enabled": True,
+                    "SyncMinutes": 10,
+                },
+            },
+            "Remote": {
+                "Paths": [
+                    {"Path": "/data-remote"},
+                ],
+            },
+        },
+    },
+    expected_output=LEAF_MINIMAL.expected_output | {
+        "Ec2": LEAF_MINIMAL.expected_output["Ec2"] | {
+            "InstanceType": "m5d.large",
+            "InstanceTypes": ["m5d.large"],
+            "InstanceStorageSupported": True,
+        },
+        "Volumes": {
+            "Local": {
+                "Paths": [
+                    {"Path": "/data-local", "ReadOnly": False},
+                ],
+                "LocalCopy": {
+                    "Enabled": True,
+                    "SyncMinutes": 10,
+                },
+            },
+            "Remote": {
+                "Paths": [
+                    {"Path": "/data-remote", "ReadOnly": False},
+                ],
+                "LocalCopy": {
+                    "Enabled": False,
+                    "SyncMinutes": 5,
+                },
+            },
+        },
+    },
+)
+
+LEAF_VOLUMES_LOCAL_COPY_NO_INSTANCE_STORE = LEAF_VOLUMES_LOCAL_COPY.copy(
+    label="LeafVolumesLocalCopyNoInstanceStore",
+    config_input=LEAF_VOLUMES_LOCAL_COPY.config_input | {
+        # m5.large doesn't have an instance store:
+        "Ec2": LEAF_MINIMAL.config_input["Ec2"],
+    },
+    expected_output=None,
+)
+
+LEAF_VOLUMES_PERFORMANCE = LEAF_MINIMAL.copy(
+    label="LeafVolumesPerformance",
+    config_input=LEAF_MINIMAL.config_input | {
+        "Volumes": {
+            "Elastic": {
+                "Paths": [{"Path": "/data-elastic"}],
+                "Performance": {
+                    "ThroughputMode": "Elastic",
+                    "OneZone": True,
+                },
+            },
+            "Provisioned": {
+                "Paths": [{"Path": "/data-provisioned"}],
+                "Performance": {
+                    "ThroughputMode": "provisioned",
+                    "ProvisionedMiBps": 50,
+                    "PerformanceMode": "MaxIO",
+                },
+            },
+        },
+    },
+    expected_output=LEAF_MINIMAL.expected_output | {
+        "Volumes": {
+            "Elastic": {
+                "Paths": [{"Path": "/data-elastic", "ReadOnly": False}],
+                "Performance": {
+                    "ThroughputMode": efs.ThroughputMode.ELASTIC,
+                    "ProvisionedMiBps": None,
+                    "PerformanceMode": efs.PerformanceMode.GENERAL_PURPOSE,
+                    "OneZone": True,
+                },
+            },
+            "Provisioned": {
+                "Paths": [{"Path": "/data-provisioned", "ReadOnly": False}],
+                "Performance": {
+                    "ThroughputMode": efs.ThroughputMode.PROVISIONED,
+                    "ProvisionedMiBps": 50,
+                    "PerformanceMode": efs.PerformanceMode.MAX_IO,
+                    "OneZone": False,
+                },
+            },
+        },
+    },
+)
+
+LEAF_VOLUMES_PROVISIONED_NO_MIBPS = LEAF_MINIMAL.copy(
+    label="LeafVolumesProvisionedNoMiBps",
+    config_input=LEAF_MINIMAL.config_input | {
+        "Volumes": {
+            "Data": {
+                "Paths": [{"Path": "/data"}],
+                # Provisioned has to say how much:
+                "Performance": {
+                    "ThroughputMode": "Provisioned",
+                },
+            },
+        },
+    },
+    expected_output=None,
+)
+
+LEAF_VOLUMES_S3 = LEAF_MINIMAL.copy(
+    label="LeafVolumesS3",
+    config_input=LEAF_MINIMAL.config_input | {
+        "Volumes": {
+            "World": {
+                "Type": "s3",
+                "EnableBackups": True,
+                "Paths": [
+                    {"Path": "/data"},
+                ],
+            },
+        },
+    },
+    expected_output=LEAF_MINIMAL.expected_output | {
+        "Volumes": {
+            "World": {
+                "Type": "S3",
+                "EnableBackups": True,
+                # S3 is always used through a local copy. (m5.large falls back to the root volume):
+                "LocalCopy": {
+                    "Enabled": True,
+                    "SyncMinutes": 5,
+                },
+                "Paths": [
+                    {"Path": "/data", "ReadOnly": False},
+                ],
+            },
+        },
+    },
+)
+
+LEAF_VOLUMES_EBS = LEAF_MINIMAL.copy(
+    label="LeafVolumesEbs",
+    config_input=LEAF_MINIMAL.config_input | {
+        "Volumes": {
+            "World": {
+                "Type": "ebs",
+                "Ebs": {
+                    "SizeGiB": 50,
+                    "Iops": 6000,
+                    "FastSnapshotRestore": True,
+                },
+                "Paths": [
+                    {"Path": "/data"},
+                ],
+            },
+        },
+    },
+    expected_output=LEAF_MINIMAL.expected_output | {
+        "Volumes": {
+            "World": {
+                "Type": "EBS",
+                "Ebs": {
+                    "SizeGiB": 50,
+                    "Type": ec2.EbsDeviceVolumeType.GP3,
+                    "Iops": 6000,
+                    "ThroughputMiBps": None,
+                    "FastSnapshotRestore": True,
+                    "KeepSnapshots": 3,
+                },
+                "Paths": [
+                    {"Path": "/data", "ReadOnly": False},
+                ],
+            },
+        },
+    },
+)
+
+LEAF_VOLUMES_EBS_LOCAL_COPY = LEAF_MINIMAL.copy(
+    label="LeafVolumesEbsLocalCopy",
+    config_input=LEAF_MINIMAL.config_input | {
+        "Volumes": {
+            "World": {
+                "Type": "EBS",
+                # EBS is already on the instance:
+                "LocalCopy": {
+                    "Enabled": True,
+                },
+                "Paths": [{"Path": "/data"}],
+            },
+        },
+    },
+    expected_output=None,
+)
+
+LEAF_SPOT_WARM_POOL = LEAF_MINIMAL.copy(
+    label="LeafSpotWarmPool",
+    config_input=LEAF_MINIMAL.config_input | {
+        "Ec2": LEAF_MINIMAL.config_input["Ec2"] | {
+            # ASG's with Spot can't have a warm pool:
+            "Spot": {
+                "Enabled": True,
+            },
+            "WarmPool": {
+                "Enabled": True,
+            },
+        },
+    },
+    expected_output=None,
+)
+
+LEAF_BAKED_AMI = LEAF_MINIMAL.copy(
+    label="LeafBakedAmi",
+    config_input=LEAF_MINIMAL.config_input | {
+        "Ec2": LEAF_MINIMAL.config_input["Ec2"] | {
+            "BakedAmi": {
+                "Enabled": True,
+                "FastSnapshotRestore": True,
+            },
+        },
+    },
+    expected_output=LEAF_MINIMAL.expected_output | {
+        "Ec2": LEAF_MINIMAL.expected_output["Ec2"] | {
+            "BakedAmi": {
+                "Enabled": True,
+                "FastSnapshotRestore": True,
+            },
+        },
+    },
+)
+
+LEAF_COLD_START_ALARM = LEAF_MINIMAL.copy(
+    label="LeafColdStartAlarm",
+    config_input=LEAF_MINIMAL.config_input | {
+        "Watchdog": LEAF_MINIMAL.config_input["Watchdog"] | {
+            "ColdStartAlarmSeconds": 180,
+        },
+    },
+    expected_output=LEAF_MINIMAL.expected_output | {
+        "Watchdog": LEAF_MINIMAL.expected_output["Watchdog"] | {
+            "ColdStartAlarmSeconds": 180,
+        },
+    },
+)
+
+LEAF_WATCHDOG_CONNECTIONS = LEAF_CONTAINER_PORTS.copy(
+    label="LeafWatchdogConnections",
+    config_input=LEAF_CONTAINER_PORTS.config_input | {
+        "Watchdog": LEAF_MINIMAL.config_input["Watchdog"] | {
+            "Mode": "Connections",
+            # Spin down once nobody's connected:
+            "Threshold": 0,
+        },
+    },
+    expected_output=LEAF_CONTAINER_PORTS.expected_output | {
+        "Watchdog": LEAF_MINIMAL.expected_output["Watchdog"] | {
+            "Mode": "CONNECTIONS",
+            "Threshold": 0,
+        },
+    },
+)
+
+LEAF_HOST_GROUP = LEAF_WATCHDOG_CONNECTIONS.copy(
+    label="LeafHostGroup",
+    config_input=LEAF_WATCHDOG_CONNECTIONS.config_input | {
+        "HostGroup": {
+            # From BASE_HOST_GROUPS:
+            "Name": "Shared",
+            "MemoryReservationMiB": 2048,
+        },
+        "Volumes": {
+            "Data": {
+                "Paths": [
+                    {"Path": "/data"},
+                ],
+            },
+        },
+    },
+    expected_output=LEAF_WATCHDOG_CONNECTIONS.expected_output | {
+        "HostGroup": {
+            "Name": "Shared",
+            "MemoryReservationMiB": 2048,
+        },
+        "Volumes": {
+            "Data": {
+                "Type": "EFS",
+                "Paths": [
+                    {"Path": "/data", "ReadOnly": False},
+                ],
+                "EnableBackups": True,
+                "KeepOnDelete": True,
+            },
+        },
+    },
+)
+
+LEAF_HOST_GROUP_TRAFFIC = LEAF_MINIMAL.copy(
+    label="LeafHostGroupTraffic",
+    config_input=LEAF_MINIMAL.config_input | {
+        # NetworkIn is the whole instance's, it can't tell the members apart:
+        "HostGroup": LEAF_HOST_GROUP.config_input["HostGroup"],
+    },
+    expected_output=None,
+)
+
+LEAF_HOST_GROUP_EBS = LEAF_HOST_GROUP.copy(
+    label="LeafHostGroupEbs",
+    config_input=LEAF_HOST_GROUP.config_input | {
+        # EBS volumes are tied to one leaf's ASG:
+        "Volumes": LEAF_VOLUMES_EBS.config_input["Volumes"],
+    },
+    expected_output=None,
+)
+
+LEAF_HOST_GROUP_SELF_REGISTER = LEAF_HOST_GROUP.copy(
+    label="LeafHostGroupSelfRegister",
+    config_input=LEAF_HOST_GROUP.config_input | {
+        "Dns": {
+            "SelfRegister": True,
+        },
+    },
+    expected_output=None,
+)
+
+LEAF_HOST_GROUP_SMALL_RESERVATION = LEAF_HOST_GROUP.copy(
+    label="LeafHostGroupSmallReservation",
+    config_input=LEAF_HOST_GROUP.config_input | {
+        "HostGroup": LEAF_HOST_GROUP.config_input["HostGroup"] | {
+            "MemoryReservationMiB": 128,
+        },
+    },
+    expected_output=None,
+)
+
+LEAF_PRE_WARM = LEAF_MINIMAL.copy(
+    label="LeafPreWarm",
+    config_input=LEAF_MINIMAL.config_input | {
+        "PreWarm": {
+            "Enabled": True,
+            "Confidence": 0.8,
+            "BinMinutes": 30,
+        },
+    },
+    expected_output=LEAF_MINIMAL.expected_output | {
+        "PreWarm": LEAF_MINIMAL.expected_output["PreWarm"] | {
+            "Enabled": True,
+            "Confidence": 0.8,
+            "BinMinutes": 30,
+        },
+    },
+)
+
+LEAF_PRE_WARM_UNEVEN_BINS = LEAF_PRE_WARM.copy(
+    label="LeafPreWarmUnevenBins",
+    config_input=LEAF_PRE_WARM.config_input | {
+        "PreWarm": LEAF_PRE_WARM.config_input["PreWarm"] | {
+            # Has to divide an hour evenly:
+            "BinMinutes": 7,
+        },
+    },
+    expected_output=None,
+)
+
+LEAF_PRE_WARM_ZERO_CONFIDENCE = LEAF_PRE_WARM.copy(
+    label="LeafPreWarmZeroConfidence",
+    config_input=LEAF_PRE_WARM.config_input | {
+        "PreWarm": LEAF_PRE_WARM.config_input["PreWarm"] | {
+            # It'd spin up every bin, all day:
+            "Confidence": 0,
+        },
+    },
+    expected_output=None,
+)
+
+LEAF_HOST_GROUP_PRE_WARM = LEAF_HOST_GROUP.copy(
+    label="LeafHostGroupPreWarm",
+    config_input=LEAF_HOST_GROUP.config_input | {
+        # The ASG is the whole group's, a pre-warm could spin it down under another member:
+        "PreWarm": LEAF_PRE_WARM.config_input["PreWarm"],
+    },
+    expected_output=None,
+)
+
+LEAF_WATCHDOG_HIGH_RESOLUTION = LEAF_WATCHDOG_CONNECTIONS.copy(
+    label="LeafWatchdogHighResolution",
+    config_input=LEAF_WATCHDOG_CONNECTIONS.config_input | {
+        "Watchdog": LEAF_WATCHDOG_CONNECTIONS.config_input["Watchdog"] | {
+            "PeriodSeconds": 10,
+            "MinutesWithoutConnections": 0.5,
+        },
+    },
+    expected_output=LEAF_WATCHDOG_CONNECTIONS.expected_output | {
+        "Watchdog": LEAF_WATCHDOG_CONNECTIONS.expected_output["Watchdog"] | {
+            "PeriodSeconds": 10,
+        },
+    },
+)
+
+LEAF_WATCHDOG_HIGH_RESOLUTION_TRAFFIC = LEAF_MINIMAL.copy(
+    label="LeafWatchdogHighResolutionTraffic",
+    config_input=LEAF_MINIMAL.config_input | {
+        "Watchdog": LEAF_MINIMAL.config_input["Watchdog"] | {
+            # NetworkIn is only ever every minute:
+            "PeriodSeconds": 10,
+        },
+    },
+    expected_output=None,
+)
+
+LEAF_WATCHDOG_UNEVEN_PERIODS = LEAF_WATCHDOG_CONNECTIONS.copy(
+    label="LeafWatchdogUnevenPeriods",
+    config_input=LEAF_WATCHDOG_CONNECTIONS.config_input | {
+        "Watchdog": LEAF_WATCHDOG_CONNECTIONS.config_input["Watchdog"] | {
+            # 45 seconds isn't a whole number of 30 second periods:
+            "PeriodSeconds": 30,
+            "MinutesWithoutConnections": 0.75,
+        },
+    },
+    expected_output=None,
+)
+
+LEAF_WATCHDOG_UNKNOWN_MODE = LEAF_MINIMAL.copy(
+    label="LeafWatchdogUnknownMode",
+    config_input=LEAF_MINIMAL.config_input | {
+        "Watchdog": LEAF_MINIMAL.config_input["Watchdog"] | {
+            "Mode": "Packets",
+        },
+    },
+    expected_output=None,
+)
+
+LEAF_COLD_START_ALARM_ZERO = LEAF_MINIMAL.copy(
+    label="LeafColdStartAlarmZero",
+    config_input=LEAF_MINIMAL.config_input | {
+        "Watchdog": LEAF_MINIMAL.config_input["Watchdog"] | {
+            # Would always be alarming:
+            "ColdStartAlarmSeconds": 0,
+        },
+    },
+    expected_output=None,
+)
+
+LEAF_DNS_SELF_REGISTER = LEAF_MINIMAL.copy(
+    label="LeafDnsSelfRegister",
+    config_input=LEAF_MINIMAL.config_input | {
+        "Dns": {
+            "SelfRegister": True,
+        },
+    },
+    expected_output=LEAF_MINIMAL.expected_output | {
+        "Dns": {
+            "SelfRegister": True,
+            "EarlyUpdate": False,
+        },
+    },
+)
+
+LEAF_DNS_EARLY_UPDATE = LEAF_MINIMAL.copy(
+    label="LeafDnsEarlyUpdate",
+    config_input=LEAF_MINIMAL.config_input | {
+        "Dns": {
+            "EarlyUpdate": True,
+        },
+    },
+    expected_output=LEAF_MINIMAL.expected_output | {
+        "Dns": {
+            "SelfRegister": False,
+            "EarlyUpdate": True,
+        },
+    },
+)
+
+## A hibernated instance resumes instead of booting, so these never get set up again:
+LEAF_WARM_POOL_HIBERNATED_CONNECTIONS = LEAF_WATCHDOG_CONNECTIONS.copy(
+    label="LeafWarmPoolHibernatedConnections",
+    config_input=LEAF_WATCHDOG_CONNECTIONS.config_input | {
+        "Ec2": LEAF_WARM_POOL_HIBERNATED.config_input["Ec2"],
+    },
+    expected_output=None,
+)
+
+LEAF_WARM_POOL_HIBERNATED_SELF_REGISTER = LEAF_DNS_SELF_REGISTER.copy(
+    label="LeafWarmPoolHibernatedSelfRegister",
+    config_input=LEAF_DNS_SELF_REGISTER.config_input | {
+        "Ec2": LEAF_WARM_POOL_HIBERNATED.config_input["Ec2"],
+    },
+    expected_output=None,
+)
+
+LEAF_WARM_POOL_HIBERNATED_EBS = LEAF_VOLUMES_EBS.copy(
+    label="LeafWarmPoolHibernatedEbs",
+    config_input=LEAF_VOLUMES_EBS.config_input | {
+        "Ec2": LEAF_WARM_POOL_HIBERNATED.config_input["Ec2"],
+    },
+    expected_output=None,
+)
+
+LEAF_WARM_POOL_HIBERNATED_S3 = LEAF_VOLUMES_S3.copy(
+    label="LeafWarmPoolHibernatedS3",
+    config_input=LEAF_VOLUMES_S3.config_input | {
+        "Ec2": LEAF_WARM_POOL_HIBERNATED.config_input["Ec2"],
+    },
+    expected_output=None,
+)
+
+LEAF_LAMBDA_PROFILE = LEAF_MINIMAL.copy(
+    label="LeafLambdaProfile",
+    config_input=LEAF_MINIMAL.config_input | {
+        "Lambdas": {
+            "StartSystem": {
+                "Architecture": "x86_64",
+                "MemorySize": 512,
+                "SnapStart": True,
+            },
+            "AsgStateChangeHook": {
+                "ProvisionedConcurrency": 1,
+            },
+        },
+    },
+    expected_output=LEAF_MINIMAL.expected_output | {
+        "Lambdas": LEAF_MINIMAL.expected_output["Lambdas"] | {
+            "StartSystem": {
+                "Architecture": aws_lambda.Architecture,
+                "MemorySize": 512,
+                "SnapStart": True,
+                "ProvisionedConcurrency": 0,
+            },
+            "AsgStateChangeHook": {
+                "Architecture": aws_lambda.Architecture,
+                "MemorySize": 128,
+                "SnapStart": False,
+                "ProvisionedConcurrency": 1,
+            },
+        },
+    },
+)
+
+LEAF_LAMBDA_PROFILE_SNAPSTART_AND_PROVISIONED = LEAF_MINIMAL.copy(
+    label="LeafLambdaProfileSnapStartAndProvisioned",
+    config_input=LEAF_MINIMAL.config_input | {
+        "Lambdas": {
+            # AWS doesn't allow both on the same version:
+            "StartSystem": {
+                "SnapStart": True,
+                "ProvisionedConcurrency": 1,
+            },
+        },
+    },
+    expected_output=None,
+)
+
 BASE_CONFIG_LOADED = ConfigInfo(
     label="base-stack-config.yaml",
     loader=load_base_config,
@@ -311,9 +1285,59 @@ CONFIGS_VALID = CONFIGS_MINIMAL + CONFIGS_LOADED + [
     BASE_VPC_MAXAZS,
     BASE_ALERT_SUBSCRIPTION,
     BASE_ALERT_SUBSCRIPTION_NONE,
+    BASE_PULL_THROUGH_CACHE,
+    BASE_SHARED_LAMBDAS,
+    BASE_HOST_GROUPS,
     LEAF_CONTAINER_PORTS,
     LEAF_CONTAINER_ENVIRONMENT,
     LEAF_VOLUMES,
+    LEAF_WARM_POOL,
+    LEAF_WARM_POOL_HIBERNATED,
+    LEAF_WARM_POOL_DISABLED_HIBERNATED,
+    LEAF_BAKED_AMI,
+    LEAF_COLD_START_ALARM,
+    LEAF_LAMBDA_PROFILE,
+    LEAF_DNS_SELF_REGISTER,
+    LEAF_DNS_EARLY_UPDATE,
+    LEAF_SPOT_FALLBACK_TYPES,
+    LEAF_GRAVITON,
+    LEAF_ROOT_VOLUME,
+    LEAF_VOLUMES_LOCAL_COPY,
+    LEAF_VOLUMES_PERFORMANCE,
+    LEAF_VOLUMES_S3,
+    LEAF_VOLUMES_EBS,
+    LEAF_WATCHDOG_CONNECTIONS,
+    LEAF_WATCHDOG_HIGH_RESOLUTION,
+    LEAF_HOST_GROUP,
+    LEAF_PRE_WARM,
 ]
 # All invalid configs:
-CONFIGS_INVALID = []
+CONFIGS_INVALID = [
+    BASE_PULL_THROUGH_CACHE_BAD_SECRET,
+    BASE_HOST_GROUPS_BAD_NAME,
+    BASE_HOST_GROUPS_PARTIAL_MINUTE,
+    LEAF_WARM_POOL_RUNNING,
+    LEAF_WARM_POOL_HIBERNATED_UNSUPPORTED,
+    LEAF_WARM_POOL_HIBERNATED_CONNECTIONS,
+    LEAF_WARM_POOL_HIBERNATED_SELF_REGISTER,
+    LEAF_WARM_POOL_HIBERNATED_EBS,
+    LEAF_WARM_POOL_HIBERNATED_S3,
+    LEAF_COLD_START_ALARM_ZERO,
+    LEAF_LAMBDA_PROFILE_SNAPSTART_AND_PROVISIONED,
+    LEAF_SPOT_WARM_POOL,
+    LEAF_MIXED_ARCHITECTURES,
+    LEAF_ROOT_VOLUME_GP2_THROUGHPUT,
+    LEAF_VOLUMES_LOCAL_COPY_NO_INSTANCE_STORE,
+    LEAF_VOLUMES_PROVISIONED_NO_MIBPS,
+    LEAF_VOLUMES_EBS_LOCAL_COPY,
+    LEAF_WATCHDOG_UNKNOWN_MODE,
+    LEAF_WATCHDOG_HIGH_RESOLUTION_TRAFFIC,
+    LEAF_WATCHDOG_UNEVEN_PERIODS,
+    LEAF_HOST_GROUP_TRAFFIC,
+    LEAF_HOST_GROUP_EBS,
+    LEAF_HOST_GROUP_SELF_REGISTER,
+    LEAF_HOST_GROUP_SMALL_RESERVATION,
+    LEAF_PRE_WARM_UNEVEN_BINS,
+    LEAF_PRE_WARM_ZERO_CONFIDENCE,
+    LEAF_HOST_GROUP_PRE_WARM,
+]
@@ -1,6 +1,8 @@
 
 import pytest
 
+from ContainerManager.leaf_stack_group.lambda_functions import common
+
 @pytest.fixture()
 def setup_env(monkeypatch):
     def _set_envs(env_vars: dict):
@@ -8,3 +10,9 @@ def setup_env(monkeypatch):
         for k, v in env_vars.items():
             monkeypatch.setenv(k, v)
     return _set_envs
+
+@pytest.fixture(autouse=True)
+def reset_router_lookups():
+    """ The shared routers' lookup table lives in common.py. Make each test a "cold start" for it too """
+    common.get_router_env_vars.cache_clear()
+    common.leaf_table.clear()
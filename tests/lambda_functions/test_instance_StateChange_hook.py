@@ -1,4 +1,7 @@
 
+import json
+import time
+
 from moto import mock_aws
 import pytest
 
@@ -18,7 +21,16 @@ class TestInstanceStateChangeHook:
             "DOMAIN_NAME": "test.example.com",
             "UNAVAILABLE_IP": "0.0.0.0",
             "DNS_TTL": "1",
-            "RECORD_TYPE": "A"
+            "RECORD_TYPE": "A",
+            "ASG_NAME": "test-asg",
+            "EARLY_DNS_UPDATE": "false",
+            # For publishing how long the cold start took:
+            "COLD_START_PARAMETER": "/test-stack/ColdStartTimestamp",
+            "METRIC_NAMESPACE": "test-namespace",
+            "METRIC_NAME": "ColdStartSeconds",
+            "METRIC_DIMENSIONS": json.dumps({
+                "ContainerNameID": "test-stack",
+            }),
         }
 
     def setup_method(self, _method):
@@ -29,9 +41,13 @@ class TestInstanceStateChangeHook:
         instance_StateChange_hook.get_route53_client.cache_clear()
         instance_StateChange_hook.get_ec2_client.cache_clear()
         instance_StateChange_hook.get_asg_client.cache_clear()
+        instance_StateChange_hook.get_ssm_client.cache_clear()
+        instance_StateChange_hook.get_cloudwatch_client.cache_clear()
 
         self.route53_client = instance_StateChange_hook.get_route53_client() # pylint: disable=attribute-defined-outside-init
         self.asg_client = instance_StateChange_hook.get_asg_client() # pylint: disable=attribute-defined-outside-init
+        self.ssm_client = instance_StateChange_hook.get_ssm_client() # pylint: disable=attribute-defined-outside-init
+        self.cloudwatch_client = instance_StateChange_hook.get_cloudwatch_client() # pylint: disable=attribute-defined-outside-init
 
         ## Create a hosted zone for each test:
         # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/route53/client/create_hosted_zone.html
@@ -172,6 +188,59 @@ class TestInstanceStateChangeHook:
                 context={},
             )
 
+    def test_lambda_sets_ip_on_instance_running(self, setup_env, monkeypatch):
+        """ With Dns.EarlyUpdate, the EC2 'running' event updates DNS before the ASG event """
+        setup_env(self.env)
+        monkeypatch.setenv("EARLY_DNS_UPDATE", "true")
+        instance_id = self.asg_client.describe_auto_scaling_instances()["AutoScalingInstances"][0]["InstanceId"]
+        # Moto doesn't support public IPs, so we have to mock it:
+        ec2_client = instance_StateChange_hook.get_ec2_client()
+        mock_ec2_response = {"Reservations": [{"Instances": [{"PublicIpAddress": "1.2.3.4"}]}]}
+        monkeypatch.setattr(ec2_client, "describe_instances", lambda *args, **kwargs: mock_ec2_response)
+        instance_StateChange_hook.lambda_handler(
+            event={
+                "detail-type": "EC2 Instance State-change Notification",
+                "detail": {"instance-id": instance_id, "state": "running"},
+            },
+            context={},
+        )
+        records = self.route53_client.list_resource_record_sets(
+            HostedZoneId=self.env['HOSTED_ZONE_ID']
+        )["ResourceRecordSets"]
+        assert records[2]["ResourceRecords"] == [{"Value": "1.2.3.4"}]
+
+    def test_lambda_exit_if_running_instance_not_in_asg(self, setup_env):
+        """ EC2 state-change events are for EVERY instance, only care about this ASG's """
+        setup_env(self.env)
+        instance_id = "i-1234567890abcdef0"
+        with pytest.raises(SystemExit, match=f"Instance '{instance_id}' isn't in ASG '{self.asg_name}', skipping this event."):
+            instance_StateChange_hook.lambda_handler(
+                event={
+                    "detail-type": "EC2 Instance State-change Notification",
+                    "detail": {"instance-id": instance_id, "state": "running"},
+                },
+                context={},
+            )
+
+    def test_lambda_exit_if_running_instance_warming(self, setup_env, monkeypatch):
+        """ Warm pool instances start while warming, and never keep their IP """
+        setup_env(self.env)
+        instance_id = "i-1234567890abcdef0"
+        mock_asg_response = {"AutoScalingInstances": [{
+            "InstanceId": instance_id,
+            "AutoScalingGroupName": self.asg_name,
+            "LifecycleState": "Warmed:Pending",
+        }]}
+        monkeypatch.setattr(self.asg_client, "describe_auto_scaling_instances", lambda *args, **kwargs: mock_asg_response)
+        with pytest.raises(SystemExit, match=f"Instance '{instance_id}' is in 'Warmed:Pending', skipping this event."):
+            instance_StateChange_hook.lambda_handler(
+                event={
+                    "detail-type": "EC2 Instance State-change Notification",
+                    "detail": {"instance-id": instance_id, "state": "running"},
+                },
+                context={},
+            )
+
     def test_lambda_raises_on_unknown_event(self, setup_env):
         """ Test that the lambda raises an error on an unknown event type """
         setup_env(self.env)
@@ -183,3 +252,174 @@ class TestInstanceStateChangeHook:
                 },
                 context={},
             )
+
+    @pytest.mark.parametrize("event_type,direction", [
+        ("EC2 Instance Launch Successful", "Destination"),
+        ("EC2 Instance-terminate Lifecycle Action", "Origin"),
+    ])
+    def test_lambda_exit_if_warm_pool_instance(self, setup_env, event_type, direction):
+        """
+        Instances moving in/out of the warm pool are stopped there, and don't
+        have a public IP. Make sure they never touch the DNS record.
+        """
+        setup_env(self.env)
+        instance_id = "i-1234567890abcdef0"
+        with pytest.raises(SystemExit, match=f"Instance '{instance_id}' has '{direction}' of 'WarmPool', skipping this event."):
+            instance_StateChange_hook.lambda_handler(
+                event={
+                    "detail-type": event_type,
+                    "detail": {
+                        "AutoScalingGroupName": self.asg_name,
+                        "EC2InstanceId": instance_id,
+                        direction: "WarmPool",
+                    }
+                },
+                context={},
+            )
+        ## The record should still be the starting value:
+        records = self.route53_client.list_resource_record_sets(
+            HostedZoneId=self.env['HOSTED_ZONE_ID']
+        )["ResourceRecordSets"]
+        assert records[2]["ResourceRecords"] == [{"Value": self.env["UNAVAILABLE_IP"]}]
+
+    def test_publish_cold_start(self, setup_env):
+        """ Test the time since the first DNS query is published, once DNS points at the instance """
+        setup_env(self.env)
+        # The first query came in 90 seconds ago:
+        self.ssm_client.put_parameter(
+            Name=self.env["COLD_START_PARAMETER"],
+            Value=str(int((time.time() - 90) * 1000)),
+            Type="String",
+        )
+        instance_StateChange_hook.publish_cold_start(instance_StateChange_hook.get_env_vars())
+        metric_data = self.cloudwatch_client.get_metric_data(
+            MetricDataQueries=[{
+                "Id": "coldstart",
+                "MetricStat": {
+                    "Metric": {
+                        "Namespace": self.env["METRIC_NAMESPACE"],
+                        "MetricName": self.env["METRIC_NAME"],
+                        "Dimensions": [{"Name": "ContainerNameID", "Value": "test-stack"}],
+                    },
+                    "Period": 60,
+                    "Stat": "Maximum",
+                },
+            }],
+            StartTime=time.time() - 300,
+            EndTime=time.time() + 300,
+        )["MetricDataResults"][0]["Values"]
+        assert len(metric_data) == 1
+        assert 90 <= metric_data[0] < 100
+
+    def test_publish_cold_start_skips_without_dns_query(self, setup_env):
+        """ If DNS didn't start the instance (i.e the console did), there's nothing to publish """
+        setup_env(self.env)
+        instance_StateChange_hook.publish_cold_start(instance_StateChange_hook.get_env_vars())
+        metrics = self.cloudwatch_client.list_metrics(Namespace=self.env["METRIC_NAMESPACE"])["Metrics"]
+        assert metrics == []
+
+    def test_clear_cold_start_timestamp(self, setup_env):
+        """ Spinning down clears the timestamp, so the next DNS query can save it's own """
+        setup_env(self.env)
+        self.ssm_client.put_parameter(Name=self.env["COLD_START_PARAMETER"], Value="1", Type="String")
+        instance_StateChange_hook.clear_cold_start_timestamp(instance_StateChange_hook.get_env_vars())
+        with pytest.raises(self.ssm_client.exceptions.ParameterNotFound):
+            self.ssm_client.get_parameter(Name=self.env["COLD_START_PARAMETER"])
+        # And doesn't care if it's already gone:
+        instance_StateChange_hook.clear_cold_start_timestamp(instance_StateChange_hook.get_env_vars())
+
+    @pytest.fixture
+    def change_batches(self, monkeypatch) -> list:
+        """ Every change batch sent to Route53. (They still go through to moto too) """
+        change_batches = []
+        real_change = self.route53_client.change_resource_record_sets
+        def record_change(**kwargs):
+            change_batches.append(kwargs["ChangeBatch"]["Changes"])
+            return real_change(**kwargs)
+        monkeypatch.setattr(self.route53_client, "change_resource_record_sets", record_change)
+        return change_batches
+
+    def save_leaf_parameter(self, env: dict, container_id: str = "test-stack", prefix: str = "/test-app/AsgStateChangeHook") -> None:
+        """ What the leaf stack saves for the shared lambda, under it's ASG name """
+        self.ssm_client.put_parameter(Name=f"{prefix}/{env['ASG_NAME']}/{container_id}", Value=json.dumps(env), Type="String")
+
+    def test_router_batches_changes_per_zone(self, setup_env, monkeypatch, change_batches):
+        """ The shared lambda sends every change to a hosted zone in one call, keeping only the newest per record """
+        setup_env({"LEAF_PARAMETER_PREFIX": "/test-app/AsgStateChangeHook", "LEAF_CACHE_SECONDS": "300"})
+        other_leaf = self.env | {"DOMAIN_NAME": "other.example.com", "ASG_NAME": "other-asg"}
+        setup_autoscaling_group("other-asg")
+        self.save_leaf_parameter(self.env)
+        self.save_leaf_parameter(other_leaf)
+        monkeypatch.setattr(
+            instance_StateChange_hook.get_ec2_client(),
+            "describe_instances",
+            lambda *args, **kwargs: {"Reservations": [{"Instances": [{"PublicIpAddress": "1.2.3.4"}]}]},
+        )
+
+        def sqs_record(asg_name: str, event_type: str, event_time: str) -> dict:
+            return {"body": json.dumps({
+                "id": f"{asg_name}-{event_time}",
+                "time": event_time,
+                "detail-type": event_type,
+                "detail": {"AutoScalingGroupName": asg_name, "EC2InstanceId": "i-1234567890abcdef0"},
+            })}
+        instance_StateChange_hook.router_handler(
+            event={"Records": [
+                # Out of order. The 'up' for test-asg happened after it's 'down':
+                sqs_record("test-asg", "EC2 Instance Launch Successful", "2024-01-01T00:00:02Z"),
+                sqs_record("test-asg", "EC2 Instance-terminate Lifecycle Action", "2024-01-01T00:00:01Z"),
+                sqs_record("other-asg", "EC2 Instance Launch Successful", "2024-01-01T00:00:03Z"),
+                # Not a leaf's, and shouldn't stop the rest:
+                sqs_record("not-a-leaf", "EC2 Instance Launch Successful", "2024-01-01T00:00:04Z"),
+            ]},
+            context={},
+        )
+        assert len(change_batches) == 1
+        assert sorted(
+            (change["ResourceRecordSet"]["Name"], change["ResourceRecordSet"]["ResourceRecords"][0]["Value"])
+            for change in change_batches[0]
+        ) == [("other.example.com", "1.2.3.4"), ("test.example.com", "1.2.3.4")]
+
+    def test_router_updates_every_host_group_member(self, setup_env, monkeypatch, change_batches):
+        """ Members of a HostGroup share one ASG. Each one's rule sends the same event, and each gets updated once """
+        setup_env({"LEAF_PARAMETER_PREFIX": "/test-app/AsgStateChangeHook", "LEAF_CACHE_SECONDS": "300"})
+        self.save_leaf_parameter(self.env, container_id="member-one")
+        self.save_leaf_parameter(self.env | {"DOMAIN_NAME": "other.example.com"}, container_id="member-two")
+        monkeypatch.setattr(
+            instance_StateChange_hook.get_ec2_client(),
+            "describe_instances",
+            lambda *args, **kwargs: {"Reservations": [{"Instances": [{"PublicIpAddress": "1.2.3.4"}]}]},
+        )
+
+        record = {"body": json.dumps({
+            "id": "launch",
+            "time": "2024-01-01T00:00:00Z",
+            "detail-type": "EC2 Instance Launch Successful",
+            "detail": {"AutoScalingGroupName": "test-asg", "EC2InstanceId": "i-1234567890abcdef0"},
+        })}
+        # Once from each member's rule:
+        instance_StateChange_hook.router_handler(event={"Records": [record, record]}, context={})
+        assert len(change_batches) == 1
+        assert sorted(
+            (change["ResourceRecordSet"]["Name"], change["ResourceRecordSet"]["ResourceRecords"][0]["Value"])
+            for change in change_batches[0]
+        ) == [("other.example.com", "1.2.3.4"), ("test.example.com", "1.2.3.4")]
+
+    def test_router_skips_instance_running_without_early_update(self, setup_env):
+        """ The shared lambda gets every instance's 'running' event, only leaves with Dns.EarlyUpdate care """
+        setup_env({"LEAF_PARAMETER_PREFIX": "/test-app/AsgStateChangeHook", "LEAF_CACHE_SECONDS": "300"})
+        self.save_leaf_parameter(self.env)
+        instance_id = self.asg_client.describe_auto_scaling_instances()["AutoScalingInstances"][0]["InstanceId"]
+        instance_StateChange_hook.router_handler(
+            event={"Records": [{"body": json.dumps({
+                "id": "running",
+                "time": "2024-01-01T00:00:00Z",
+                "detail-type": "EC2 Instance State-change Notification",
+                "detail": {"instance-id": instance_id, "state": "running"},
+            })}]},
+            context={},
+        )
+        records = self.route53_client.list_resource_record_sets(
+            HostedZoneId=self.env['HOSTED_ZONE_ID']
+        )["ResourceRecordSets"]
+        assert records[2]["ResourceRecords"] == [{"Value": self.env["UNAVAILABLE_IP"]}]
@@ -0,0 +1,294 @@
+
+import json
+import time
+from datetime import datetime, timezone
+
+from moto import mock_aws
+import pytest
+
+## These imports have to be the long forum, to let us modify the values here:
+# https://stackoverflow.com/a/12496239/11650472
+import ContainerManager.leaf_stack_group.lambda_functions.predictive_prewarm.main as predictive_prewarm
+
+from .utils import setup_autoscaling_group
+
+WEEK = predictive_prewarm.SECONDS_PER_WEEK
+# A Friday, 20:00 UTC. (The start of a 15 minute bin):
+FRIDAY_NIGHT = datetime(2024, 1, 5, 20, tzinfo=timezone.utc).timestamp()
+SETTINGS = predictive_prewarm.PreWarmSettings(
+    lead_minutes=5,
+    confidence=0.6,
+    max_minutes_per_day=60,
+    history_weeks=4,
+    bin_minutes=15,
+)
+
+def learn_weeks(state: dict, weeks: int, settings=SETTINGS) -> None:
+    """ Someone shows up Friday night, every week. (Starting 'weeks' before FRIDAY_NIGHT) """
+    for week in range(-weeks, 0):
+        predictive_prewarm.add_hit(state, FRIDAY_NIGHT + week * WEEK, settings)
+        predictive_prewarm.add_hit(state, FRIDAY_NIGHT + week * WEEK + 60, settings)
+
+
+class TestModel:
+    def test_learns_weekly_pattern(self):
+        state = predictive_prewarm.new_state()
+        learn_weeks(state, 3)
+        # Last week only counts once it's over:
+        assert predictive_prewarm.plan(state, FRIDAY_NIGHT - 30 * 60, instance_up=False, settings=SETTINGS) is None
+        # The same time next week is likely, any other time isn't:
+        assert predictive_prewarm.bin_probability(state, FRIDAY_NIGHT, SETTINGS) > 0.6
+        assert predictive_prewarm.bin_probability(state, FRIDAY_NIGHT + 60 * 60, SETTINGS) == 0
+        # Both hits were in the same bin, it only counts once that week:
+        assert len(state["Bins"]) == 1
+
+    def test_hits_only_added_once(self):
+        state = predictive_prewarm.new_state()
+        predictive_prewarm.add_hit(state, FRIDAY_NIGHT, SETTINGS)
+        predictive_prewarm.add_hit(state, FRIDAY_NIGHT - WEEK, SETTINGS)
+        assert state["LastHit"] == FRIDAY_NIGHT
+        assert state["BinsThisWeek"] == [str(int(FRIDAY_NIGHT % WEEK // SETTINGS.bin_seconds))]
+
+    def test_old_weeks_fade(self):
+        state = predictive_prewarm.new_state()
+        learn_weeks(state, 3)
+        predictive_prewarm.plan(state, FRIDAY_NIGHT - 30 * 60, instance_up=False, settings=SETTINGS)
+        learned = predictive_prewarm.bin_probability(state, FRIDAY_NIGHT, SETTINGS)
+        ## Nobody shows up for a month:
+        predictive_prewarm.plan(state, FRIDAY_NIGHT + 4 * WEEK - 10 * 60, instance_up=False, settings=SETTINGS)
+        assert predictive_prewarm.bin_probability(state, FRIDAY_NIGHT, SETTINGS) < learned / 2
+
+    def test_prewarms_before_usual_time(self):
+        state = predictive_prewarm.new_state()
+        learn_weeks(state, 3)
+        # Too early, the bin LeadMinutes from now isn't busy:
+        assert predictive_prewarm.plan(state, FRIDAY_NIGHT - 10 * 60, instance_up=False, settings=SETTINGS) is None
+        assert predictive_prewarm.plan(state, FRIDAY_NIGHT - 5 * 60, instance_up=False, settings=SETTINGS) == "PREWARM"
+
+    @pytest.mark.parametrize("weeks,confidence,expected", [
+        # One week alone is only 50%:
+        (1, 0.6, None),
+        (1, 0.5, "PREWARM"),
+        (3, 0.6, "PREWARM"),
+        (3, 0.8, None),
+    ])
+    def test_confidence_threshold(self, weeks, confidence, expected):
+        settings = predictive_prewarm.PreWarmSettings(**{**SETTINGS.__dict__, "confidence": confidence})
+        state = predictive_prewarm.new_state()
+        learn_weeks(state, weeks, settings)
+        assert predictive_prewarm.plan(state, FRIDAY_NIGHT - 5 * 60, instance_up=False, settings=settings) == expected
+
+    def test_not_if_already_up(self):
+        state = predictive_prewarm.new_state()
+        learn_weeks(state, 3)
+        assert predictive_prewarm.plan(state, FRIDAY_NIGHT - 5 * 60, instance_up=True, settings=SETTINGS) is None
+
+    def test_once_per_bin(self):
+        state = predictive_prewarm.new_state()
+        learn_weeks(state, 3)
+        now = FRIDAY_NIGHT - 5 * 60
+        assert predictive_prewarm.plan(state, now, instance_up=False, settings=SETTINGS) == "PREWARM"
+        ## The Watchdog spun it down before the next run. Don't just spin it back up:
+        assert predictive_prewarm.plan(state, now + 5 * 60, instance_up=False, settings=SETTINGS) is None
+        assert state["PrewarmedAt"] is None
+        assert predictive_prewarm.plan(state, now + 10 * 60, instance_up=False, settings=SETTINGS) is None
+
+    def test_someone_showed_up(self):
+        state = predictive_prewarm.new_state()
+        learn_weeks(state, 3)
+        now = FRIDAY_NIGHT - 5 * 60
+        predictive_prewarm.plan(state, now, instance_up=False, settings=SETTINGS)
+        predictive_prewarm.add_hit(state, now + 2 * 60, SETTINGS)
+        assert predictive_prewarm.plan(state, now + 5 * 60, instance_up=True, settings=SETTINGS) is None
+        # Only the time before they showed up counts against the budget:
+        assert state["PrewarmedAt"] is None
+        assert state["SpeculativeSeconds"] == 2 * 60
+
+    def test_stops_over_budget(self):
+        settings = predictive_prewarm.PreWarmSettings(**{**SETTINGS.__dict__, "max_minutes_per_day": 10})
+        state = predictive_prewarm.new_state()
+        learn_weeks(state, 3, settings)
+        now = FRIDAY_NIGHT - 5 * 60
+        assert predictive_prewarm.plan(state, now, instance_up=False, settings=settings) == "PREWARM"
+        assert predictive_prewarm.plan(state, now + 5 * 60, instance_up=True, settings=settings) is None
+        assert predictive_prewarm.plan(state, now + 10 * 60, instance_up=True, settings=settings) == "STOP"
+        ## The budget's gone for today, even for a different busy bin:
+        state["Bins"][str(int((FRIDAY_NIGHT + 2 * 60 * 60) % WEEK // settings.bin_seconds))] = 3
+        assert predictive_prewarm.plan(state, FRIDAY_NIGHT + 2 * 60 * 60 - 5 * 60, instance_up=False, settings=settings) is None
+
+    def test_hit_same_minute_as_prewarm(self):
+        settings = predictive_prewarm.PreWarmSettings(**{**SETTINGS.__dict__, "max_minutes_per_day": 10})
+        state = predictive_prewarm.new_state()
+        learn_weeks(state, 3, settings)
+        now = FRIDAY_NIGHT - 5 * 60 + 30
+        assert predictive_prewarm.plan(state, now, instance_up=False, settings=settings) == "PREWARM"
+        ## Their hit is 20 seconds later, but DNSTraffic only has it as the start of that minute:
+        predictive_prewarm.add_hit(state, (now + 20) // 60 * 60, settings)
+        assert predictive_prewarm.plan(state, now + 5 * 60, instance_up=True, settings=settings) is None
+        assert state["PrewarmedAt"] is None
+        # Nothing to charge, they were there the whole time:
+        assert predictive_prewarm.plan(state, now + 10 * 60, instance_up=True, settings=settings) is None
+
+    def test_never_stops_while_someone_on(self):
+        ## Someone's on a cached DNS answer, so there's no hit:
+        settings = predictive_prewarm.PreWarmSettings(**{**SETTINGS.__dict__, "max_minutes_per_day": 10})
+        state = predictive_prewarm.new_state()
+        learn_weeks(state, 3, settings)
+        now = FRIDAY_NIGHT - 5 * 60
+        assert predictive_prewarm.plan(state, now, instance_up=False, settings=settings) == "PREWARM"
+        assert predictive_prewarm.plan(state, now + 10 * 60, instance_up=True, settings=settings, someone_on=True) is None
+        # Still counts it, in case they leave before the Watchdog's window:
+        assert state["PrewarmedAt"] is not None
+        assert predictive_prewarm.plan(state, now + 15 * 60, instance_up=True, settings=settings) == "STOP"
+
+    @pytest.mark.parametrize("days_ago,expected", [
+        # Today's budget is already used up:
+        (0, None),
+        # Yesterday's was, it resets at midnight UTC:
+        (1, "PREWARM"),
+    ])
+    def test_budget_resets_each_day(self, days_ago, expected):
+        state = predictive_prewarm.new_state()
+        learn_weeks(state, 3)
+        state["Day"] = int(FRIDAY_NIGHT // predictive_prewarm.SECONDS_PER_DAY) - days_ago
+        state["SpeculativeSeconds"] = SETTINGS.max_minutes_per_day * 60
+        assert predictive_prewarm.plan(state, FRIDAY_NIGHT - 5 * 60, instance_up=False, settings=SETTINGS) == expected
+
+
+@mock_aws
+class TestPredictivePrewarm:
+    @classmethod
+    def setup_class(cls):
+        ## DON'T use boto3.clients here. The resources they create, won't reset between each test.
+        cls.env = {
+            "ASG_NAME": "test-asg",
+            "STATE_PARAMETER": "/test-leaf/PreWarmState",
+            "METRIC_NAMESPACE": "test-leaf",
+            "METRIC_NAME": "DNSTraffic",
+            "METRIC_DIMENSIONS": json.dumps({"ContainerNameID": "test-leaf"}),
+            "ACTIVITY_ALARM_NAME": "Container Activity - [test-leaf]",
+            "LEAD_MINUTES": "5",
+            "CONFIDENCE": "0.6",
+            "MAX_MINUTES_PER_DAY": "60",
+            "HISTORY_WEEKS": "4",
+            "BIN_MINUTES": "15",
+        }
+
+    def setup_method(self, _method):
+        # Reset everything, so each test is a "cold start":
+        predictive_prewarm.get_env_vars.cache_clear()
+        predictive_prewarm.get_asg_client.cache_clear()
+        predictive_prewarm.get_cloudwatch_client.cache_clear()
+        predictive_prewarm.get_ssm_client.cache_clear()
+
+        setup_autoscaling_group(self.env["ASG_NAME"])
+        self.asg_client = predictive_prewarm.get_asg_client() # pylint: disable=attribute-defined-outside-init
+        self.asg_client.update_auto_scaling_group(AutoScalingGroupName=self.env["ASG_NAME"], DesiredCapacity=0)
+        predictive_prewarm.get_ssm_client().put_parameter(
+            Name=self.env["STATE_PARAMETER"],
+            Value="{}",
+            Type="String",
+            Tier="Advanced",
+        )
+
+    def desired_capacity(self) -> int:
+        return self.asg_client.describe_auto_scaling_groups(
+            AutoScalingGroupNames=[self.env["ASG_NAME"]],
+        )["AutoScalingGroups"][0]["DesiredCapacity"]
+
+    def saved_state(self) -> dict:
+        return predictive_prewarm.load_state(predictive_prewarm.get_env_vars())
+
+    def test_learns_dns_hits(self, setup_env):
+        setup_env(self.env)
+        hit = datetime.fromtimestamp(time.time() // 60 * 60 - 5 * 60, tz=timezone.utc)
+        predictive_prewarm.get_cloudwatch_client().put_metric_data(
+            Namespace=self.env["METRIC_NAMESPACE"],
+            MetricData=[{
+                "MetricName": self.env["METRIC_NAME"],
+                "Dimensions": [{"Name": "ContainerNameID", "Value": "test-leaf"}],
+                "Timestamp": hit,
+                "Value": 1,
+                "Unit": "Count",
+            }],
+        )
+        predictive_prewarm.lambda_handler(event={}, context={})
+        state = self.saved_state()
+        assert state["LastHit"] == hit.timestamp()
+        assert len(state["BinsThisWeek"]) == 1
+        # Nothing's been learned until the week's over:
+        assert self.desired_capacity() == 0
+
+    @pytest.mark.parametrize("bin_minutes", [5, 15])
+    def test_every_bin_busy_still_saves(self, setup_env, bin_minutes):
+        """ A leaf that's busy all week, every week, still fits in the parameter """
+        setup_env(self.env | {"BIN_MINUTES": str(bin_minutes)})
+        bins_per_week = WEEK // (bin_minutes * 60)
+        state = predictive_prewarm.new_state() | {
+            "Weeks": 3.999,
+            # Spread out, so there's a 'faintest' to drop first:
+            "Bins": {str(time_of_week): 3.999 - time_of_week / bins_per_week for time_of_week in range(bins_per_week)},
+            "BinsThisWeek": [str(time_of_week) for time_of_week in range(bins_per_week)],
+        }
+        predictive_prewarm.save_state(predictive_prewarm.get_env_vars(), state)
+
+        value = predictive_prewarm.get_ssm_client().get_parameter(Name=self.env["STATE_PARAMETER"])["Parameter"]["Value"]
+        assert len(value) <= predictive_prewarm.MAX_STATE_BYTES
+        saved = self.saved_state()
+        # Nothing from this week is lost:
+        assert sorted(saved["BinsThisWeek"], key=int) == state["BinsThisWeek"]
+        # Only the faintest bins were dropped, the rest are all there:
+        dropped = state["Bins"].keys() - saved["Bins"].keys()
+        assert all(saved["Bins"][kept] >= round(state["Bins"][faintest], 3) for kept in saved["Bins"] for faintest in dropped)
+        # Nearly all of them at 15 minute bins. At 5, only the busiest 600 or so (out of 2016) fit:
+        assert len(saved["Bins"]) >= min(bins_per_week - 10, 600)
+
+    def test_prewarms_asg(self, setup_env):
+        setup_env(self.env)
+        settings = predictive_prewarm.PreWarmSettings.from_env(predictive_prewarm.get_env_vars())
+        ## Someone's shown up around now, every week for a month:
+        state = predictive_prewarm.new_state()
+        for week in range(-4, 0):
+            predictive_prewarm.add_hit(state, time.time() + 5 * 60 + week * WEEK, settings)
+        predictive_prewarm.save_state(predictive_prewarm.get_env_vars(), state)
+
+        predictive_prewarm.lambda_handler(event={}, context={})
+        assert self.desired_capacity() == 1
+        assert self.saved_state()["PrewarmedAt"] is not None
+
+    @pytest.mark.parametrize("alarm_state,expected_capacity", [
+        ("OK", 1),
+        ("ALARM", 0),
+    ])
+    def test_over_budget_checks_watchdog(self, setup_env, alarm_state, expected_capacity):
+        setup_env(self.env)
+        self.asg_client.update_auto_scaling_group(AutoScalingGroupName=self.env["ASG_NAME"], DesiredCapacity=1)
+        cloudwatch_client = predictive_prewarm.get_cloudwatch_client()
+        cloudwatch_client.put_metric_alarm(
+            AlarmName=self.env["ACTIVITY_ALARM_NAME"],
+            Namespace=self.env["METRIC_NAMESPACE"],
+            MetricName=self.env["METRIC_NAME"],
+            Statistic="Maximum",
+            Period=60,
+            EvaluationPeriods=5,
+            Threshold=0,
+            ComparisonOperator="LessThanOrEqualToThreshold",
+        )
+        cloudwatch_client.set_alarm_state(
+            AlarmName=self.env["ACTIVITY_ALARM_NAME"],
+            StateValue=alarm_state,
+            StateReason="Test",
+        )
+        ## A pre-warm nobody's asked for, that's used up today's budget:
+        now = time.time()
+        state = predictive_prewarm.new_state() | {
+            "Day": int(now // predictive_prewarm.SECONDS_PER_DAY),
+            "SpeculativeSeconds": 60 * 60,
+            "PrewarmedAt": now - 10 * 60,
+            "LastRun": now - 5 * 60,
+        }
+        predictive_prewarm.save_state(predictive_prewarm.get_env_vars(), state)
+
+        predictive_prewarm.lambda_handler(event={}, context={})
+        # If the Watchdog sees someone on, leave it up:
+        assert self.desired_capacity() == expected_capacity
@@ -1,4 +1,6 @@
 
+import json
+
 from moto import mock_aws
 import pytest
 
@@ -25,6 +27,7 @@ class TestSpinDownASGOnError:
         # Reset everything, so each test is a "cold start":
         spin_down_asg_on_error.get_env_vars.cache_clear()
         spin_down_asg_on_error.get_asg_client.cache_clear()
+        spin_down_asg_on_error.get_ssm_client.cache_clear()
 
         setup_autoscaling_group(
             self.env["ASG_NAME"],
@@ -64,3 +67,20 @@ class TestSpinDownASGOnError:
             AutoScalingGroupNames=[self.env["ASG_NAME"]],
         )["AutoScalingGroups"][0]
         assert asg_info["DesiredCapacity"] == 0
+
+    def test_router_spins_down_leaf_by_cluster(self, setup_env):
+        """ The shared lambda looks up which ASG to spin down, by the event's cluster """
+        setup_env({"LEAF_PARAMETER_PREFIX": "/test-app/BreakCrashLoop", "LEAF_CACHE_SECONDS": "300"})
+        spin_down_asg_on_error.get_ssm_client().put_parameter(
+            Name="/test-app/BreakCrashLoop/test-cluster",
+            Value=json.dumps(self.env),
+            Type="String",
+        )
+        spin_down_asg_on_error.router_handler(
+            event={"detail": {"clusterArn": "arn:aws:ecs:us-west-2:123456789012:cluster/test-cluster"}},
+            context={},
+        )
+        asg_info = self.asg_client.describe_auto_scaling_groups(
+            AutoScalingGroupNames=[self.env["ASG_NAME"]],
+        )["AutoScalingGroups"][0]
+        assert asg_info["DesiredCapacity"] == 0
@@ -1,11 +1,30 @@
-
 import json
+import gzip
+import time
+import base64
+from datetime import datetime, timezone
 
 from moto import mock_aws
 
 ## This has to be the full path, to let us modify the values here:
 # https://stackoverflow.com/a/12496239/11650472
 import ContainerManager.leaf_stack_group.lambda_functions.trigger_start_system.main as trigger_start_system
+from ContainerManager.leaf_stack_group.lambda_functions import common
+
+from .utils import setup_autoscaling_group
+
+def subscription_filter_event(timestamps: list, filter_name: str = "test.example.com") -> dict:
+    """ What a CloudWatch Logs subscription filter sends, with one log event per timestamp """
+    log_data = {
+        "logGroup": "/aws/route53/test-stack-query-logs",
+        # (In shared router mode, each leaf's filter is named after it's domain)
+        "subscriptionFilters": [filter_name],
+        "logEvents": [
+            {"id": str(i), "timestamp": timestamp, "message": "1.0 2017-12-13T08:15:50.235Z test.example.com A"}
+            for i, timestamp in enumerate(timestamps)
+        ],
+    }
+    return {"awslogs": {"data": base64.b64encode(gzip.compress(json.dumps(log_data).encode())).decode()}}
 
 @mock_aws
 class TestTriggerStartSystem:
@@ -23,6 +42,9 @@ class TestTriggerStartSystem:
             "METRIC_DIMENSIONS": json.dumps({
                 "ContainerNameID": "test-stack",
             }),
+            "METRIC_PERIOD_SECONDS": "60",
+            # For timing the cold start:
+            "COLD_START_PARAMETER": "/test-stack/ColdStartTimestamp",
         }
 
     def setup_method(self, _method):
@@ -31,12 +53,115 @@ class TestTriggerStartSystem:
         # And reset the boto3 clients:
         trigger_start_system.get_cloudwatch_client.cache_clear()
         trigger_start_system.get_asg_client.cache_clear()
+        trigger_start_system.get_ssm_client.cache_clear()
+        # And the warm container's memory of scaling up:
+        trigger_start_system.last_scale_up.clear()
+
+        ## Create an ASG that's spun down, for the lambda to spin up:
+        self.asg_client, _ = setup_autoscaling_group(self.env["ASG_NAME"]) # pylint: disable=attribute-defined-outside-init
+        self.asg_client.update_auto_scaling_group(AutoScalingGroupName=self.env["ASG_NAME"], DesiredCapacity=0)
 
-        ## CAN'T Create shared clients here. They have to be initialized
+        ## CAN'T Create the lambda's clients here. They have to be initialized
         # after the `setup_env` call in each test, so the env-vars exist.
 
-    def test_stuff(self, setup_env):
+    def desired_capacity(self) -> int:
+        return self.asg_client.describe_auto_scaling_groups(
+            AutoScalingGroupNames=[self.env["ASG_NAME"]],
+        )["AutoScalingGroups"][0]["DesiredCapacity"]
+
+    def test_lambda_spins_up_asg(self, setup_env):
+        setup_env(self.env)
+        now_ms = int(time.time() * 1000)
+        trigger_start_system.lambda_handler(subscription_filter_event([now_ms]), context={})
+        assert self.desired_capacity() == 1
+
+    def test_lambda_debounces_scale_up(self, setup_env, monkeypatch):
+        """ A burst of deliveries to the same warm container only updates the ASG (and SSM) once """
         setup_env(self.env)
-        _cloudwatch_client = trigger_start_system.get_cloudwatch_client()
-        _asg_client = trigger_start_system.get_asg_client()
-        assert True, "Add real tests here."
+        calls, ssm_calls = [], []
+        asg_client = trigger_start_system.get_asg_client(self.env["MANAGER_STACK_REGION"])
+        monkeypatch.setattr(asg_client, "update_auto_scaling_group", lambda **kwargs: calls.append(kwargs))
+        ssm_client = trigger_start_system.get_ssm_client(self.env["MANAGER_STACK_REGION"])
+        monkeypatch.setattr(ssm_client, "put_parameter", lambda **kwargs: ssm_calls.append(kwargs))
+        now_ms = int(time.time() * 1000)
+        for _ in range(3):
+            trigger_start_system.lambda_handler(subscription_filter_event([now_ms]), context={})
+        assert len(calls) == 1
+        assert len(ssm_calls) == 1
+        ## Once the window passes, it updates again:
+        trigger_start_system.last_scale_up[self.env["ASG_NAME"]] -= trigger_start_system.SCALE_UP_DEBOUNCE_SECONDS
+        trigger_start_system.lambda_handler(subscription_filter_event([now_ms]), context={})
+        assert len(calls) == 2
+        assert len(ssm_calls) == 2
+
+    def test_put_dns_traffic_metric_groups_by_minute(self, setup_env, monkeypatch):
+        """ Every hit in the batch goes out in one call, one datum per minute with the real count """
+        setup_env(self.env)
+        calls = []
+        cloudwatch_client = trigger_start_system.get_cloudwatch_client(self.env["MANAGER_STACK_REGION"])
+        monkeypatch.setattr(cloudwatch_client, "put_metric_data", lambda **kwargs: calls.append(kwargs))
+        # Three hits in the first minute, one in the next:
+        trigger_start_system.put_dns_traffic_metric(trigger_start_system.get_env_vars(), [
+            {"timestamp": 60_000}, {"timestamp": 61_000}, {"timestamp": 119_999}, {"timestamp": 120_000},
+        ])
+        assert len(calls) == 1
+        metric_data = calls[0]["MetricData"]
+        assert [datum["Timestamp"] for datum in metric_data] == [
+            datetime.fromtimestamp(60, tz=timezone.utc),
+            datetime.fromtimestamp(120, tz=timezone.utc),
+        ]
+        assert [datum["StatisticValues"]["SampleCount"] for datum in metric_data] == [3, 1]
+        # The alarm reads 'Maximum', which has to stay over the threshold:
+        threshold = int(self.env["METRIC_THRESHOLD"])
+        assert all(datum["StatisticValues"]["Maximum"] == threshold + 1 for datum in metric_data)
+        assert all(datum["StorageResolution"] == 60 for datum in metric_data)
+
+    def test_put_dns_traffic_metric_high_resolution(self, setup_env, monkeypatch):
+        """ With a 10 second alarm period, hits are grouped (and stored) by 10 seconds """
+        setup_env(self.env | {"METRIC_PERIOD_SECONDS": "10"})
+        calls = []
+        cloudwatch_client = trigger_start_system.get_cloudwatch_client(self.env["MANAGER_STACK_REGION"])
+        monkeypatch.setattr(cloudwatch_client, "put_metric_data", lambda **kwargs: calls.append(kwargs))
+        trigger_start_system.put_dns_traffic_metric(trigger_start_system.get_env_vars(), [
+            {"timestamp": 60_000}, {"timestamp": 69_999}, {"timestamp": 70_000},
+        ])
+        metric_data = calls[0]["MetricData"]
+        assert [datum["Timestamp"] for datum in metric_data] == [
+            datetime.fromtimestamp(60, tz=timezone.utc),
+            datetime.fromtimestamp(70, tz=timezone.utc),
+        ]
+        assert [datum["StatisticValues"]["SampleCount"] for datum in metric_data] == [2, 1]
+        assert all(datum["StorageResolution"] == 1 for datum in metric_data)
+
+    def test_save_first_query_timestamp(self, setup_env):
+        """ The earliest query in the batch is saved, and later batches don't overwrite it """
+        setup_env(self.env)
+        ssm_client = trigger_start_system.get_ssm_client(self.env["MANAGER_STACK_REGION"])
+        trigger_start_system.save_first_query_timestamp(trigger_start_system.get_env_vars(), [{"timestamp": 2000}, {"timestamp": 1000}, {"timestamp": 3000}])
+        parameter = ssm_client.get_parameter(Name=self.env["COLD_START_PARAMETER"])["Parameter"]
+        assert parameter["Value"] == "1000"
+        ## Someone else connects while it's spinning up:
+        trigger_start_system.save_first_query_timestamp(trigger_start_system.get_env_vars(), [{"timestamp": 5000}])
+        parameter = ssm_client.get_parameter(Name=self.env["COLD_START_PARAMETER"])["Parameter"]
+        assert parameter["Value"] == "1000"
+
+    def test_router_starts_leaf_by_domain(self, setup_env, monkeypatch):
+        """ The shared router looks up the leaf from the filter's name, and only asks SSM once """
+        setup_env({"LEAF_PARAMETER_PREFIX": "/test-app/StartRouter", "LEAF_CACHE_SECONDS": "300"})
+        monkeypatch.setenv("AWS_REGION", "us-east-1")
+        ssm_client = trigger_start_system.get_ssm_client("us-east-1")
+        ssm_client.put_parameter(
+            Name="/test-app/StartRouter/test.example.com",
+            Value=json.dumps(self.env),
+            Type="String",
+        )
+        lookups = []
+        get_parameter = ssm_client.get_parameter
+        monkeypatch.setattr(ssm_client, "get_parameter", lambda **kwargs: lookups.append(kwargs) or get_parameter(**kwargs))
+        now_ms = int(time.time() * 1000)
+        trigger_start_system.router_handler(subscription_filter_event([now_ms]), context={})
+        assert self.desired_capacity() == 1
+        ## A warm router uses it's lookup table:
+        trigger_start_system.router_handler(subscription_filter_event([now_ms]), context={})
+        assert len(lookups) == 1
+        assert common.leaf_table["test.example.com"][1].ASG_NAME == self.env["ASG_NAME"]
@@ -0,0 +1,96 @@
+import gzip
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from ContainerManager.simulators import dns_cost
+from ContainerManager.simulators.dns_cost import StartStopPolicy, read_queries, replay_queries
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+QUERY_FILTER = " minecraft.example.com A "
+
+def query_log(minute: float, name: str = "minecraft.example.com", record_type: str = "A") -> str:
+    """ A line of a Route53 query log, 'minute' minutes after START """
+    timestamp = (START + timedelta(minutes=minute)).isoformat().replace("+00:00", "Z")
+    return f"1.0 {timestamp} Z123412341234 {name} {record_type} NOERROR UDP IAD89-C1 192.0.2.1 -\n"
+
+
+class TestReadingLogs():
+    def test_only_matches_start_system_filter(self, tmp_path):
+        log_file = tmp_path / "queries.log"
+        log_file.write_text(
+            query_log(0)
+            # The other record type, and the sub-domains, don't start anything:
+            + query_log(1, record_type="AAAA")
+            + query_log(2, name="_minecraft._tcp.minecraft.example.com", record_type="SRV")
+            + query_log(3)
+        )
+        assert list(read_queries([str(log_file)], QUERY_FILTER)) == [START, START + timedelta(minutes=3)]
+
+    def test_s3_export(self, tmp_path):
+        ## Exports are gzipped, with when it was ingested in front:
+        log_file = tmp_path / "000000.gz"
+        with gzip.open(log_file, "wt", encoding="utf-8") as logs:
+            logs.write("2024-01-01T00:00:01.000Z " + query_log(0))
+        assert list(read_queries([str(log_file)], QUERY_FILTER)) == [START]
+
+
+class TestStartStopPolicy():
+    def test_window_after_last_query(self):
+        policy = StartStopPolicy(period_seconds=60, minutes_without_connections=5)
+        result = replay_queries([START, START + timedelta(minutes=2, seconds=30)], [policy])[0]
+        # Up until the end of the last query's minute, plus the window:
+        assert result.starts == 1
+        assert result.instance_seconds == (3 + 5) * 60
+        assert result.idle_seconds == (30 + 5 * 60)
+
+    def test_restarts_after_spin_down(self):
+        policy = StartStopPolicy(period_seconds=60, minutes_without_connections=5, play_minutes=30)
+        queries = [START, START + timedelta(minutes=20), START + timedelta(hours=2)]
+        result = replay_queries(queries, [policy])[0]
+        # The second query is while someone's still on, the third is long after:
+        assert result.starts == 2
+        assert result.instance_hours == pytest.approx((56 + 36) / 60)
+        assert result.idle_minutes == pytest.approx(2 * 6)
+
+    def test_minimum_billed_minute(self):
+        policy = StartStopPolicy(period_seconds=10, minutes_without_connections=1 / 6)
+        result = replay_queries([START], [policy])[0]
+        # Up for 20 seconds, billed for 60:
+        assert result.instance_seconds == 60
+
+    def test_monthly_projection(self):
+        ## Two hour-long runs, two days apart:
+        policy = StartStopPolicy(period_seconds=60, minutes_without_connections=5, play_minutes=54)
+        result = replay_queries([START, START + timedelta(days=2)], [policy])[0]
+        assert result.instance_hours_by_month == {"2024-01": pytest.approx(2)}
+        assert result.monthly_instance_hours == pytest.approx(2 * (365.25 / 12) / 2)
+
+    def test_out_of_order_counts_as_now(self):
+        policy = StartStopPolicy(period_seconds=60, minutes_without_connections=5)
+        result = replay_queries([START + timedelta(minutes=1), START], [policy])[0]
+        assert result.starts == 1
+        assert result.first_query == result.last_query == START + timedelta(minutes=1)
+
+    def test_window_has_to_match_period(self):
+        with pytest.raises(ValueError):
+            StartStopPolicy(period_seconds=60, minutes_without_connections=2.5)
+
+
+def test_main_compares_instance_types(tmp_path, capsys):
+    config_file = tmp_path / "leaf.yaml"
+    config_file.write_text("Watchdog:\n  Threshold: 100\n")
+    log_file = tmp_path / "queries.log"
+    log_file.write_text(query_log(0) + query_log(60 * 24))
+    dns_cost.main([
+        "--config-file", str(config_file),
+        "--domain-name", "Minecraft.Example.com",
+        "--log-files", str(log_file),
+        "--price", "m5.large=0.096", "t3.large=0.0832",
+        "--minutes", "5", "10",
+    ])
+    lines = capsys.readouterr().out.strip().splitlines()
+    assert "m5.large $/Month" in lines[0] and "t3.large $/Month" in lines[0]
+    # One row per window, both runs started:
+    assert len(lines) == 3
+    assert lines[1].split()[:2] == ["5", "2"]
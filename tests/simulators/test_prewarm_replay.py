@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from ContainerManager.leaf_stack_group.lambda_functions.predictive_prewarm.main import PreWarmSettings
+from ContainerManager.simulators import prewarm_replay
+from ContainerManager.simulators.prewarm_replay import PreWarmReplay, replay_prewarm
+
+# A Friday, 20:00 UTC:
+FRIDAY_NIGHT = datetime(2024, 1, 5, 20, tzinfo=timezone.utc)
+SETTINGS = PreWarmSettings(
+    lead_minutes=5,
+    confidence=0.6,
+    max_minutes_per_day=60,
+    history_weeks=4,
+    bin_minutes=15,
+)
+
+def fridays(weeks: int) -> list[datetime]:
+    """ Someone shows up at the same time every Friday """
+    return [FRIDAY_NIGHT + timedelta(weeks=week) for week in range(weeks)]
+
+def replay(queries: list[datetime], settings: PreWarmSettings | None = SETTINGS):
+    return replay_prewarm(queries, [
+        PreWarmReplay(settings, period_seconds=60, minutes_without_connections=10, play_minutes=60),
+    ])[0]
+
+
+class TestPreWarmReplay():
+    def test_off_is_all_cold_starts(self):
+        result = replay(fridays(6), settings=None)
+        assert result.confidence is None
+        assert (result.cold_starts, result.warm_starts, result.prewarms) == (6, 0, 0)
+        assert result.instance_hours == pytest.approx(6 * (61 + 10) / 60)
+
+    def test_prewarms_once_learned(self):
+        result = replay(fridays(6))
+        # The first two Fridays (a 50% chance after one) are cold, the rest were waiting for them:
+        assert (result.cold_starts, result.warm_starts) == (2, 4)
+        assert (result.prewarms, result.wasted_prewarms) == (4, 0)
+        # Each one was up LeadMinutes early:
+        assert result.speculative_seconds == 4 * 5 * 60
+        assert result.speculative_minutes_per_day == pytest.approx(20 / 35)
+
+    def test_wasted_prewarm(self):
+        ## They stop showing up Friday nights, only once more on a Monday two weeks later:
+        result = replay(fridays(4) + [FRIDAY_NIGHT + timedelta(weeks=5, days=3)])
+        assert (result.cold_starts, result.warm_starts) == (3, 2)
+        assert (result.prewarms, result.wasted_prewarms) == (3, 1)
+        # Up from the pre-warm, until the Watchdog's window went by:
+        assert result.speculative_seconds == 2 * 5 * 60 + 10 * 60
+
+    def test_higher_confidence_waits_longer(self):
+        settings = PreWarmSettings(**{**SETTINGS.__dict__, "confidence": 0.7})
+        result = replay(fridays(6), settings=settings)
+        # It takes four Fridays to be 70% sure:
+        assert (result.cold_starts, result.warm_starts) == (4, 2)
+
+
+def test_main_compares_confidences(tmp_path, capsys):
+    config_file = tmp_path / "leaf.yaml"
+    config_file.write_text("Watchdog:\n  Threshold: 100\n  MinutesWithoutConnections: 10\n")
+    log_file = tmp_path / "queries.log"
+    log_file.write_text("".join(
+        f"1.0 {query.isoformat().replace('+00:00', 'Z')} Z123412341234 minecraft.example.com A NOERROR UDP IAD89-C1 192.0.2.1 -\n"
+        for query in fridays(6)
+    ))
+    prewarm_replay.main([
+        "--config-file", str(config_file),
+        "--domain-name", "Minecraft.Example.com",
+        "--log-files", str(log_file),
+        "--confidence", "0.6", "0.9",
+    ])
+    lines = capsys.readouterr().out.strip().splitlines()
+    assert lines[0].split()[:3] == ["Confidence", "MaxMinutes", "ColdStarts"]
+    # Off, then one row per confidence. (With the config's default MaxMinutesPerDay):
+    assert [line.split()[:4] for line in lines[1:]] == [
+        ["Off", "-", "6", "0"],
+        ["0.6", "60", "2", "4"],
+        ["0.9", "60", "6", "0"],
+    ]
@@ -0,0 +1,129 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from ContainerManager.simulators import watchdog_replay
+from ContainerManager.simulators.watchdog_replay import WatchdogReplay, load_metrics
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+TRAFFIC_WATCHDOG = {"Mode": "TRAFFIC", "Threshold": 100, "PeriodSeconds": 60}
+CONNECTIONS_WATCHDOG = {"Mode": "CONNECTIONS", "Threshold": 0, "PeriodSeconds": 10}
+
+def recording(bytes_per_second: list[float], dns_hits: list[int] = (), period_seconds: int = 60, metric_id: str = "traffic_in") -> dict:
+    """ One value per period (None is the instance being down), and the periods someone looked up the domain. """
+    return {
+        metric_id: {
+            START + timedelta(seconds=period_seconds * i): value * (period_seconds if metric_id == "traffic_in" else 1)
+            for i, value in enumerate(bytes_per_second) if value is not None
+        },
+        "dns_hit": {START + timedelta(seconds=period_seconds * i): 1 for i in dns_hits},
+    }
+
+def minute(i: int) -> datetime:
+    return START + timedelta(minutes=i)
+
+
+class TestTrafficMode():
+    def test_spins_down_after_session(self):
+        ## 30 minutes of someone playing, then 20 idle:
+        replay = WatchdogReplay(recording([600] * 30 + [10] * 20, dns_hits=[0]), TRAFFIC_WATCHDOG)
+        result = replay.simulate(threshold=100, minutes_without_connections=5)
+        # The 5th idle minute is the 5th datapoint under the threshold:
+        assert result.spin_downs == [minute(34)]
+        assert result.instance_hours == pytest.approx(35 / 60)
+        assert (result.sessions, result.sessions_cut_off) == (1, 0)
+
+    def test_lull_cuts_off_session(self):
+        ## Everyone stepped away for 4 minutes, then came back:
+        replay = WatchdogReplay(recording([600] * 10 + [10] * 4 + [600] * 10 + [10] * 10), TRAFFIC_WATCHDOG)
+        too_short = replay.simulate(threshold=100, minutes_without_connections=3)
+        assert too_short.spin_downs[0] == minute(12)
+        assert too_short.sessions_cut_off == 1
+        long_enough = replay.simulate(threshold=100, minutes_without_connections=5)
+        assert long_enough.spin_downs == [minute(28)]
+        assert long_enough.sessions_cut_off == 0
+
+    def test_dns_hit_spins_back_up(self):
+        ## It spun down in the lull, but the player's DNS lookup brings it back:
+        replay = WatchdogReplay(recording([600] * 5 + [10] * 5 + [600] * 5 + [10] * 5, dns_hits=[12]), TRAFFIC_WATCHDOG)
+        result = replay.simulate(threshold=100, minutes_without_connections=3)
+        assert result.spin_downs == [minute(7), minute(17)]
+        # Up for 0-7 and 12-17:
+        assert result.instance_hours == pytest.approx(14 / 60)
+        # It was all one session in the recording, and the first spin down cut it off:
+        assert (result.sessions, result.sessions_cut_off) == (1, 1)
+
+    def test_volume_reads_are_missing_data(self):
+        ## Reading the EFS back is 'traffic in' too, but it's not players. With nothing left
+        # over, there's no datapoint at all, and TreatMissingData.MISSING skips it:
+        metrics = recording([600] * 5 + [300] * 10 + [10] * 3)
+        metrics["volumes_out"] = {minute(i): 300 * 60 for i in range(5, 15)}
+        replay = WatchdogReplay(metrics, TRAFFIC_WATCHDOG)
+        result = replay.simulate(threshold=100, minutes_without_connections=3)
+        assert result.spin_downs == [minute(17)]
+
+    def test_sweep_is_every_combination(self):
+        replay = WatchdogReplay(recording([600] * 10 + [10] * 10), TRAFFIC_WATCHDOG)
+        results = replay.sweep(thresholds=[5, 100], minutes=[3, 5, 2.5])
+        # (2.5 minutes isn't a whole number of 1-minute periods)
+        assert [(result.threshold, result.minutes_without_connections) for result in results] == [
+            (5, 3), (5, 5), (100, 3), (100, 5),
+        ]
+        # Threshold 5 never sees the idle traffic as idle:
+        assert results[0].spin_downs == []
+        with pytest.raises(ValueError):
+            replay.simulate(threshold=100, minutes_without_connections=2.5)
+
+
+class TestConnectionsMode():
+    def test_ten_second_periods(self):
+        ## Two players for 2 minutes, then they leave:
+        metrics = recording([2] * 12 + [0] * 6, period_seconds=10, metric_id="connections")
+        replay = WatchdogReplay(metrics, CONNECTIONS_WATCHDOG)
+        result = replay.simulate(threshold=0, minutes_without_connections=0.5)
+        assert result.spin_downs == [START + timedelta(seconds=140)]
+        assert result.instance_hours == pytest.approx(150 / 3600)
+        assert (result.sessions, result.sessions_cut_off) == (1, 0)
+
+    def test_traffic_mode_ignores_period(self):
+        ## NetworkIn is only ever 1-minute, same as the real alarm:
+        replay = WatchdogReplay(recording([600] * 5), TRAFFIC_WATCHDOG | {"PeriodSeconds": 10})
+        assert replay.period_seconds == 60
+
+
+class TestLoadingRecordings():
+    def test_get_metric_data_json(self, tmp_path):
+        metrics_file = tmp_path / "metrics.json"
+        metrics_file.write_text(json.dumps({"MetricDataResults": [
+            {"Id": "traffic_in", "Timestamps": ["2024-01-01T00:01:00Z", "2024-01-01T00:00:00Z"], "Values": [60.0, 120.0]},
+            {"Id": "something_else", "Timestamps": ["2024-01-01T00:00:00Z"], "Values": [1.0]},
+        ]}))
+        metrics = load_metrics(str(metrics_file))
+        assert metrics["traffic_in"] == {minute(0): 120.0, minute(1): 60.0}
+        assert metrics["dns_hit"] == {}
+
+    def test_csv(self, tmp_path):
+        metrics_file = tmp_path / "metrics.csv"
+        metrics_file.write_text(
+            "Timestamp,traffic_in,dns_hit\n"
+            "2024-01-01T00:00:00,120,1\n"
+            "2024-01-01T00:01:00,,\n"
+        )
+        metrics = load_metrics(str(metrics_file))
+        # Empty cells are missing data, and no timezone is UTC:
+        assert metrics["traffic_in"] == {minute(0): 120.0}
+        assert metrics["dns_hit"] == {minute(0): 1.0}
+
+    def test_main_prints_each_combination(self, tmp_path, capsys):
+        config_file = tmp_path / "leaf.yaml"
+        config_file.write_text("Watchdog:\n  Threshold: 100\n  MinutesWithoutConnections: 5\n")
+        metrics_file = tmp_path / "metrics.csv"
+        metrics_file.write_text("Timestamp,traffic_in\n" + "".join(
+            f"{minute(i).isoformat()},{36000 if i < 10 else 600}\n" for i in range(20)
+        ))
+        watchdog_replay.main(["--config-file", str(config_file), "--metrics-file", str(metrics_file), "--minutes", "3", "5"])
+        output = capsys.readouterr().out
+        assert "Recorded: 0.33 instance hours, 1 sessions" in output
+        # The header, and one row per combination:
+        assert len(output.strip().splitlines()) == 4